@@ -1,5 +1,6 @@
 import json
 import re
+import string
 
 
 COMPARISON_SYMBOLS = {
@@ -11,10 +12,13 @@ COMPARISON_SYMBOLS = {
     "LessThanLowerThreshold": "< lower",
 }
 
+# Datapoint values CloudWatch lists in NewStateReason, e.g. "[27.3, 27.1, 26.8]"
+RECENT_VALUES_RE = re.compile(r'\[([0-9.,\s]+)\]')
+
 
 def _extract_recent_values(reason):
     """Extract recent datapoint values from the CloudWatch alarm reason string."""
-    match = re.search(r'\[([0-9.,\s]+)\]', reason)
+    match = RECENT_VALUES_RE.search(reason)
     if not match:
         return None
     return match.group(1).strip()
@@ -28,64 +32,128 @@ def _format_period(seconds):
     return f"{seconds}s"
 
 
-def format_alarm(sns_record):
-    """Parse an SNS record containing a CloudWatch alarm and return a formatted dict.
+def truncate(text, limit):
+    if limit is None or len(text) <= limit:
+        return text
+    return text[:limit - 1] + "\u2026"
+
+
+class ChannelTemplate:
+    """Title and body layout for one notification channel.
+
+    Templates are str.format strings over the fields returned by parse_alarm. The
+    field names of each body line are parsed once, when the template is built; a
+    line is left out when any field it uses is None (e.g. no recent values).
+    """
+
+    def __init__(self, title, lines, separator="\n", max_title=None, max_body=None):
+        self.title = title
+        self.lines = [(line, self._fields(line)) for line in lines]
+        self.separator = separator
+        self.max_title = max_title
+        self.max_body = max_body
+
+    @staticmethod
+    def _fields(template):
+        return tuple(field for _, field, _, _ in string.Formatter().parse(template) if field)
+
+    def render(self, fields):
+        body = self.separator.join(
+            line.format_map(fields) for line, names in self.lines
+            if all(fields[name] is not None for name in names)
+        )
+        return {
+            "title": truncate(self.title.format_map(fields), self.max_title),
+            "body": truncate(body, self.max_body),
+            "state": fields["new_state"],
+            "alarm_name": fields.get("alarm_name"),
+        }
+
+
+_DETAIL_LINES = (
+    "State:     {old_state} -> {new_state}",
+    "Time:      {state_change_time}",
+    "",
+    "Metric:    {metric_name}",
+    "Device:    {device}",
+    "Condition: {statistic} {comparison} {threshold}",
+    "Recent:    {recent_values}",
+    "Period:    {period} ({datapoints_to_alarm}/{evaluation_periods} datapoints)",
+    "Missing:   treated as {treat_missing}",
+)
+
+CHANNEL_TEMPLATES = {
+    # Pushover caps titles at 250 and messages at 1024 characters
+    "pushover": ChannelTemplate("{new_state}: {alarm_name}", _DETAIL_LINES, max_title=250, max_body=1024),
+    # SNS email subjects are limited to 100 characters
+    "email": ChannelTemplate("{new_state}: {alarm_name}", _DETAIL_LINES, max_title=100),
+    # One 160 character SMS segment
+    "sms": ChannelTemplate(
+        "{new_state}: {alarm_name}",
+        ("{new_state}: {alarm_name}", "{metric_name} {comparison} {threshold}", "Recent {recent_values}"),
+        separator=" | ", max_title=160, max_body=160,
+    ),
+}
+
+
+def parse_alarm(sns_record):
+    """Parse an SNS record containing a CloudWatch alarm into template fields.
 
     Returns:
-        dict with "title" (short summary) and "body" (detailed message).
+        dict of fields for ChannelTemplate.render, or None if the message is not alarm JSON.
     """
     sns_message = sns_record.get("Sns", {})
-    subject = sns_message.get("Subject", "")
-
     try:
         alarm = json.loads(sns_message.get("Message", "{}"))
     except (json.JSONDecodeError, TypeError):
-        return {"title": subject or "Alarm Notification", "body": str(sns_message)}
-
-    alarm_name = alarm.get("AlarmName", "Unknown")
-    new_state = alarm.get("NewStateValue", "Unknown")
-    old_state = alarm.get("OldStateValue", "Unknown")
-    reason = alarm.get("NewStateReason", "")
-    state_change_time = alarm.get("StateChangeTime", "")
+        return None
 
     trigger = alarm.get("Trigger", {})
-    metric_name = trigger.get("MetricName", "Unknown")
-    dimensions = trigger.get("Dimensions", [])
-    threshold = trigger.get("Threshold")
-    comparison = trigger.get("ComparisonOperator", "")
-    statistic = trigger.get("Statistic", "")
-    period = trigger.get("Period", 0)
-    datapoints_to_alarm = trigger.get("DatapointsToAlarm", "")
-    evaluation_periods = trigger.get("EvaluationPeriods", "")
-    treat_missing = trigger.get("TreatMissingData", "")
-
     # Format dimensions as "Value (Name)" pairs
     dims_parts = [
         f"{d.get('value', '?')} ({d.get('name', '?')})"
-        for d in dimensions
+        for d in trigger.get("Dimensions", [])
     ]
-    dims_str = ", ".join(dims_parts) if dims_parts else "None"
+    comparison = trigger.get("ComparisonOperator", "")
 
-    comp_symbol = COMPARISON_SYMBOLS.get(comparison, comparison)
-    period_str = _format_period(period)
+    return {
+        "alarm_name": alarm.get("AlarmName", "Unknown"),
+        "new_state": alarm.get("NewStateValue", "Unknown"),
+        "old_state": alarm.get("OldStateValue", "Unknown"),
+        "state_change_time": alarm.get("StateChangeTime", ""),
+        "metric_name": trigger.get("MetricName", "Unknown"),
+        "device": ", ".join(dims_parts) if dims_parts else "None",
+        "statistic": trigger.get("Statistic", ""),
+        "comparison": COMPARISON_SYMBOLS.get(comparison, comparison),
+        # str() so a missing threshold still renders (as "None") instead of dropping the line
+        "threshold": str(trigger.get("Threshold")),
+        "recent_values": _extract_recent_values(alarm.get("NewStateReason", "")),
+        "period": _format_period(trigger.get("Period", 0)),
+        "datapoints_to_alarm": trigger.get("DatapointsToAlarm", ""),
+        "evaluation_periods": trigger.get("EvaluationPeriods", ""),
+        "treat_missing": trigger.get("TreatMissingData", ""),
+    }
+
+
+def render_alarm(sns_record, channels=tuple(CHANNEL_TEMPLATES)):
+    """Parse an SNS alarm record once and render it for each of channels.
 
-    title = f"{new_state}: {alarm_name}"
+    Returns:
+        dict of channel name -> {"title", "body", "state"}. Messages that are not
+        alarm JSON render as the SNS subject and raw message, without a state.
+    """
+    fields = parse_alarm(sns_record)
+    if fields is None:
+        sns_message = sns_record.get("Sns", {})
+        fallback = {"title": sns_message.get("Subject", "") or "Alarm Notification", "body": str(sns_message)}
+        return {channel: dict(fallback) for channel in channels}
+    return {channel: CHANNEL_TEMPLATES[channel].render(fields) for channel in channels}
 
-    recent_values = _extract_recent_values(reason)
 
-    body_lines = [
-        f"State:     {old_state} -> {new_state}",
-        f"Time:      {state_change_time}",
-        f"",
-        f"Metric:    {metric_name}",
-        f"Device:    {dims_str}",
-        f"Condition: {statistic} {comp_symbol} {threshold}",
-    ]
-    if recent_values:
-        body_lines.append(f"Recent:    {recent_values}")
-    body_lines += [
-        f"Period:    {period_str} ({datapoints_to_alarm}/{evaluation_periods} datapoints)",
-        f"Missing:   treated as {treat_missing}",
-    ]
+def format_alarm(sns_record, channel="email"):
+    """Parse an SNS record containing a CloudWatch alarm and return a formatted dict.
 
-    return {"title": title, "body": "\n".join(body_lines), "state": new_state}
+    Returns:
+        dict with "title" (short summary) and "body" (detailed message).
+    """
+    return render_alarm(sns_record, (channel,))[channel]
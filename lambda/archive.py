@@ -0,0 +1,235 @@
+"""Long-term telemetry archive of compressed columnar files, partitioned by day and device.
+
+CloudWatch keeps 1-minute datapoints for 15 days only. The log puller can also
+append every parsed reading to an archive (TELEMETRY_ARCHIVE): an S3 location,
+"s3://bucket/prefix/", in production, or a local directory. An ArchiveWriter
+buffers readings per partition and writes one object per partition when flushed:
+
+    day=2024-01-15/home=nhome/meters=N.%20Meter%201/1705320000-1705320420-<id>.json.gz
+
+Each object is gzip-compressed JSON holding one list per column, using the v1
+telemetry columns (t in epoch seconds, then Valid, Temperature, ...; null is a
+missing value), so runs of similar values compress well. The first and last t
+of an object are in its name, so query_meter and query_plug only list the day
+partitions of their device and only download the objects overlapping the range.
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+from urllib.parse import quote
+
+from aws_clients import get_client
+from cloudwatch import epoch_seconds
+from telemetry import METER_COLUMNS, PLUG_COLUMNS, MeterReading, PlugReading
+
+logger = logging.getLogger(__name__)
+
+# Readings buffered before the writer flushes on its own
+ARCHIVE_MAX_BUFFERED_ROWS = 5000
+
+# section -> (reading class, {column: (reading attribute, value check)})
+SECTIONS = {
+    "meters": (MeterReading, METER_COLUMNS),
+    "plugs": (PlugReading, PLUG_COLUMNS),
+}
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class LocalArchiveStore:
+    """Archive objects as files under a directory; keys are relative paths."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, body):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+    def list(self, prefix):
+        """Return the keys under the directory prefix (ending in "/")."""
+        try:
+            names = os.listdir(os.path.join(self.root, prefix))
+        except FileNotFoundError:
+            return []
+        return [prefix + name for name in names if not name.endswith(".tmp")]
+
+    def get(self, key):
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+
+class S3ArchiveStore:
+    """Archive objects in an S3 bucket under a key prefix."""
+
+    def __init__(self, bucket, prefix=""):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, key, body):
+        get_client("s3").put_object(Bucket=self.bucket, Key=self.prefix + key, Body=body,
+                                    ContentType="application/gzip")
+
+    def list(self, prefix):
+        keys = []
+        paginator = get_client("s3").get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            keys.extend(item["Key"][len(self.prefix):] for item in page.get("Contents", ()))
+        return keys
+
+    def get(self, key):
+        return get_client("s3").get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+
+
+def open_archive_store(location):
+    """Return the store for "s3://bucket/prefix/" or a local directory; None or "" configures none."""
+    if not location:
+        return None
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return S3ArchiveStore(bucket, prefix)
+    return LocalArchiveStore(location)
+
+
+def partition_prefix(day, home, section, alias):
+    """Return the key prefix of one device's partition for a day (a datetime.date)."""
+    return "day={}/home={}/{}={}/".format(day.isoformat(), quote(home, safe=""), section, quote(alias, safe=""))
+
+
+class ArchiveWriter:
+    """Buffer readings per day and device partition and write each partition as one object.
+
+    Use as a context manager around one invocation; the buffer is written when
+    the block exits without an exception, and dropped otherwise since a failed
+    invocation is retried. Call discard() before the block ends when the
+    readings will be delivered again without it raising. Partitions flushed
+    early by a full buffer are already written. Without a store nothing is
+    buffered. A partition that fails to write is logged and dropped, so an
+    archive outage never fails metric publishing. Every invocation writes its
+    own objects, so feed it batches (SQS or replay) rather than single messages.
+
+        with ArchiveWriter(store) as writer:
+            writer.add_telemetry(telemetry)
+    """
+
+    def __init__(self, store, max_rows=ARCHIVE_MAX_BUFFERED_ROWS):
+        self.store = store
+        self.max_rows = max_rows
+        # (day, home, section, alias) -> {column: [values]}
+        self._partitions = {}
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+        return False
+
+    def append(self, home, section, reading, timestamp=None):
+        """Buffer one reading of section ("meters" or "plugs"); timestamp defaults to reading.timestamp."""
+        if self.store is None:
+            return
+        timestamp = timestamp or reading.timestamp
+        at = int(epoch_seconds(timestamp))
+        day = (_EPOCH + datetime.timedelta(seconds=at)).date()
+        columns = SECTIONS[section][1]
+        partition = self._partitions.get((day, home, section, reading.alias))
+        if partition is None:
+            partition = self._partitions[(day, home, section, reading.alias)] = {"t": []}
+            for column in columns:
+                partition[column] = []
+        partition["t"].append(at)
+        for column, (attribute, _) in columns.items():
+            partition[column].append(getattr(reading, attribute))
+        self._rows += 1
+        if self._rows >= self.max_rows:
+            self.flush()
+
+    def add_telemetry(self, telemetry, now=None):
+        """Buffer every meter and plug reading of a parsed payload; readings without a Datetime use now."""
+        for section in SECTIONS:
+            for reading in getattr(telemetry, section):
+                self.append(telemetry.home, section, reading,
+                            reading.timestamp or now or datetime.datetime.now(datetime.timezone.utc))
+
+    def flush(self):
+        """Write every buffered partition."""
+        partitions, self._partitions, self._rows = self._partitions, {}, 0
+        for (day, home, section, alias), columns in partitions.items():
+            times = columns["t"]
+            order = sorted(range(len(times)), key=times.__getitem__)
+            body = json.dumps({"columns": {column: [values[i] for i in order] for column, values in columns.items()}},
+                              separators=(",", ":"))
+            key = "{}{}-{}-{}.json.gz".format(partition_prefix(day, home, section, alias),
+                                              times[order[0]], times[order[-1]], os.urandom(6).hex())
+            try:
+                self.store.put(key, gzip.compress(body.encode(), mtime=0))
+            except Exception as e:
+                logger.error("Failed to archive %d readings to %s: %s", len(times), key, e)
+
+    def discard(self):
+        """Forget the buffered readings."""
+        self._partitions, self._rows = {}, 0
+
+
+def _object_range(key):
+    """Return the (first, last) t in an archive object's name, or None if it is not an archive object."""
+    name = key.rpartition("/")[2]
+    if not name.endswith(".json.gz"):
+        return None
+    first, _, rest = name.partition("-")
+    last = rest.partition("-")[0]
+    try:
+        return int(first), int(last)
+    except ValueError:
+        return None
+
+
+def _query(store, section, home, alias, start, end):
+    reading_class, columns = SECTIONS[section]
+    first, last = int(epoch_seconds(start)), int(epoch_seconds(end))
+    readings = {}
+    day = start.date() if start.tzinfo is None else start.astimezone(datetime.timezone.utc).date()
+    while day <= (_EPOCH + datetime.timedelta(seconds=last - 1)).date():
+        for key in store.list(partition_prefix(day, home, section, alias)):
+            span = _object_range(key)
+            if span is None or span[1] < first or span[0] >= last:
+                continue
+            data = json.loads(gzip.decompress(store.get(key)))["columns"]
+            for row, at in enumerate(data["t"]):
+                if first <= at < last:
+                    reading = reading_class(alias, None, _EPOCH + datetime.timedelta(seconds=at))
+                    for column, (attribute, _) in columns.items():
+                        values = data.get(column)
+                        if values is not None:
+                            setattr(reading, attribute, values[row])
+                    # Readings archived twice (redelivered or replayed payloads) are returned once
+                    readings[at] = reading
+        day += datetime.timedelta(days=1)
+    return [readings[at] for at in sorted(readings)]
+
+
+def query_meter(store, home, alias, start, end):
+    """Return the archived MeterReadings of one meter with start <= timestamp < end, oldest first.
+
+    Only the meter's day partitions in the range are listed, and only objects
+    whose time span overlaps it are read. Timestamps are naive UTC datetimes.
+    """
+    return _query(store, "meters", home, alias, start, end)
+
+
+def query_plug(store, home, alias, start, end):
+    """Return the archived PlugReadings of one plug with start <= timestamp < end, oldest first (see query_meter)."""
+    return _query(store, "plugs", home, alias, start, end)
@@ -0,0 +1,38 @@
+"""Lazily constructed, cached boto3 clients.
+
+Importing boto3 and building a client is a large share of a Lambda cold start.
+Handlers hold a LazyClient instead, so boto3 is imported and the client built
+on first use only, and paths that never call AWS skip the cost entirely.
+"""
+import threading
+
+_clients = {}
+# boto3's default session is not thread-safe while creating clients
+_clients_lock = threading.Lock()
+
+
+def get_client(service_name):
+    """Return the shared boto3 client for service_name, creating it on first use."""
+    client = _clients.get(service_name)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(service_name)
+        if client is None:
+            import boto3
+            client = _clients[service_name] = boto3.client(service_name)
+    return client
+
+
+class LazyClient:
+    """Stand-in for a boto3 client that creates the real one on first attribute access.
+
+        sns_client = LazyClient("sns")
+        sns_client.publish(...)  # boto3 is imported here
+    """
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(get_client(self.service_name), name)
@@ -0,0 +1,67 @@
+"""Microbenchmark of per-record alarm formatting cost.
+
+Compares rendering every channel from a single parse (render_alarm) with
+re-parsing the SNS record once per channel, as separate formatter calls do.
+The difference between the two grows with every channel added.
+
+    cd lambda && python -m benchmarks.alarm_formatter --records 20000
+"""
+import argparse
+import json
+import time
+
+from alarm_formatter import CHANNEL_TEMPLATES, format_alarm, parse_alarm, render_alarm
+
+_ALARM = {
+    "AlarmName": "N. Meter 1 Temperature High",
+    "NewStateValue": "ALARM",
+    "OldStateValue": "OK",
+    "NewStateReason": "Threshold Crossed: 3 out of the last 3 datapoints were greater than the threshold (26.0). "
+                      "The most recent datapoints which crossed the threshold: [27.3, 27.1, 26.8].",
+    "StateChangeTime": "2024-01-15T12:00:00.000+0000",
+    "Trigger": {
+        "MetricName": "Temperature",
+        "Dimensions": [{"name": "Home", "value": "nhome"}, {"name": "Meter", "value": "N. Meter 1"}],
+        "Threshold": 26.0,
+        "ComparisonOperator": "GreaterThanThreshold",
+        "Statistic": "Average",
+        "Period": 300,
+        "DatapointsToAlarm": 3,
+        "EvaluationPeriods": 3,
+        "TreatMissingData": "breaching",
+    },
+}
+
+
+def _time_per_record(fn, records):
+    start = time.perf_counter()
+    for record in records:
+        fn(record)
+    return (time.perf_counter() - start) / len(records) * 1e6
+
+
+def run(records):
+    """Return {case: microseconds per record}."""
+    sns_records = [{"Sns": {"Subject": "ALARM", "Message": json.dumps(dict(_ALARM, AlarmName="Alarm {}".format(i)))}}
+                   for i in range(records)]
+    channels = tuple(CHANNEL_TEMPLATES)
+    return {
+        "parse only": _time_per_record(parse_alarm, sns_records),
+        "one channel": _time_per_record(format_alarm, sns_records),
+        "{} channels, parse per channel".format(len(channels)): _time_per_record(
+            lambda record: [format_alarm(record, channel) for channel in channels], sns_records),
+        "{} channels, single parse".format(len(channels)): _time_per_record(render_alarm, sns_records),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    args = parser.parse_args()
+
+    for case, micros in run(args.records).items():
+        print("{:<32} {:>7.2f}us/record".format(case, micros))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Replay telemetry through nepenthes_log_puller into a MetricStore and evaluate the stack's alarms.
+
+Alarm definitions come from the synthesized CloudFormation template (npx cdk synth).
+Telemetry is a JSON Lines file with one IoT payload per line (v0 or v1), as
+published to log/nepenthes/<home>; each payload is processed at the time of its
+latest reading. Without --telemetry, --days of synthetic telemetry for the meters and
+plugs the alarms watch is generated instead, with one hot hour per day.
+
+    npx cdk synth > /dev/null
+    cd lambda && python -m benchmarks.alarm_replay --template ../cdk.out/NepenthesCDKStack.template.json --days 7
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+
+os.environ.setdefault("METRIC_NAMESPACE", "NHomeZero")
+
+from cloudwatch import MetricBatch
+from metric_store import MetricStore, evaluate_alarm, load_alarms, recording
+import nepenthes_log_puller
+from telemetry import parse_payload
+
+# Interval between synthetic payloads, matching the Pi's push cadence
+SYNTHETIC_INTERVAL = datetime.timedelta(minutes=2)
+SYNTHETIC_HOT_TEMPERATURE = 35.0
+
+
+def _payload_time(payload):
+    telemetry = parse_payload(payload, require_heartbeat=False, default_home="")
+    times = [reading.timestamp for reading in telemetry.meters + telemetry.plugs if reading.timestamp is not None]
+    return max(times) if times else None
+
+
+def load_telemetry(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_telemetry(alarms, days, start):
+    """Generate payloads every SYNTHETIC_INTERVAL for the Meter and Plug dimensions the alarms watch."""
+    meters = sorted({a.dimensions["Meter"] for a in alarms if "Meter" in a.dimensions})
+    plugs = sorted({a.dimensions["Plug"] for a in alarms if "Plug" in a.dimensions})
+    payloads = []
+    now = start
+    while now < start + datetime.timedelta(days=days):
+        hot = now.hour == 14
+        reading = {"Valid": True, "Datetime": now.isoformat()}
+        payloads.append({
+            "should_heartbeat": 1,
+            "cooler_frozen": 0,
+            "meters": {"v0": {meter: dict(reading,
+                                          Temperature=SYNTHETIC_HOT_TEMPERATURE if hot else 22.0,
+                                          Humidity=75.0,
+                                          BatteryVoltage=100,
+                                          Desired={"Temperature": 22.0, "TemperatureDiff": 0.0})
+                              for meter in meters}},
+            "plugs": {"v0": {plug: dict(reading, Switch=True, Power=5.0) for plug in plugs}},
+        })
+        now += SYNTHETIC_INTERVAL
+    return payloads
+
+
+def replay(payloads, store):
+    """Process payloads through the log puller, oldest first; return the number processed."""
+    timed = sorted((item for item in ((_payload_time(p), p) for p in payloads) if item[0] is not None),
+                   key=lambda item: item[0])
+    with recording(store):
+        for now, payload in timed:
+            with MetricBatch(nepenthes_log_puller.METRIC_NAMESPACE) as batch:
+                nepenthes_log_puller.put_home_metrics(batch, payload, now=now)
+    return len(timed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template", required=True, help="synthesized CloudFormation template")
+    parser.add_argument("--telemetry", help="JSON Lines file of captured IoT payloads")
+    parser.add_argument("--days", type=float, default=7, help="days of synthetic telemetry without --telemetry")
+    args = parser.parse_args()
+
+    alarms = load_alarms(args.template)
+    if args.telemetry:
+        payloads = load_telemetry(args.telemetry)
+    else:
+        payloads = synthetic_telemetry(alarms, args.days, datetime.datetime(2024, 1, 1))
+
+    store = MetricStore()
+    started = time.perf_counter()
+    processed = replay(payloads, store)
+    replayed = time.perf_counter() - started
+    first, last = store.time_range()
+
+    started = time.perf_counter()
+    results = {alarm.name: evaluate_alarm(store, alarm, first, last) for alarm in alarms}
+    evaluated = time.perf_counter() - started
+
+    print("{} payloads, {} datapoints over {:.1f} days: replayed in {:.2f}s, {} alarms evaluated in {:.2f}s".format(
+        processed, len(store), (last - first) / 86400, replayed, len(alarms), evaluated))
+    for name, transitions in sorted(results.items()):
+        alarms_raised = sum(1 for _, _, new in transitions if new == "ALARM")
+        print("{:<45} ALARM x{}".format(name, alarms_raised))
+        for at, old, new in transitions:
+            print("    {}  {} -> {}".format(
+                datetime.datetime.fromtimestamp(at, datetime.timezone.utc).isoformat(), old, new))
+
+
+if __name__ == "__main__":
+    main()
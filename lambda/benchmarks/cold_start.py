@@ -0,0 +1,279 @@
+"""Measure the cold-start cost of every Lambda handler and enforce a budget.
+
+Each handler runs in a fresh interpreter under ``python -X importtime``: the
+handler module is imported (import time), then lambda_handler is called once
+with a representative event (first-invocation time). The log puller gets the
+environment the stack deploys it with, so its deadband state, rollups and S3
+archive run as in production; the other handlers run without their optional
+DynamoDB tables. AWS and HTTP calls are answered in-process by stubs
+installed at the transport edge, so client and session construction, and any
+imports they defer, are still measured while network round-trips are not.
+
+    cd lambda && python -m benchmarks.cold_start --repeat 5 --top 5
+
+Exits with status 1 when a handler's import + first-invocation time exceeds its
+budget (see BUDGET_MS, or --budget-ms to override every handler).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_ALARM_RECORD = {"Sns": {"Subject": "ALARM", "Message": json.dumps({
+    "AlarmName": "N. Meter 1 Temperature High",
+    "NewStateValue": "ALARM",
+    "OldStateValue": "OK",
+    "NewStateReason": "Threshold Crossed: 1 out of the last 1 datapoints [27.1 (15/01/24 12:00:00)] was greater than the threshold (26.0).",
+    "StateChangeTime": "2024-01-15T12:05:00.000+0000",
+    "Trigger": {"MetricName": "Temperature", "Period": 300, "EvaluationPeriods": 1, "Threshold": 26.0,
+                "ComparisonOperator": "GreaterThanThreshold"},
+})}}
+
+_TELEMETRY = {
+    "home": "nhome",
+    "should_heartbeat": 1,
+    "cooler_frozen": False,
+    "meters": {"v0": {
+        alias: {"Valid": True, "Temperature": 22.5, "Humidity": 75.0, "BatteryVoltage": 95,
+                "Datetime": "2024-01-15T12:00:00", "Desired": {"Temperature": 22.0, "TemperatureDiff": 0.5}}
+        for alias in ("N. Meter 1", "N. Meter 2")
+    }},
+    "plugs": {"v0": {
+        alias: {"Valid": True, "Switch": True, "Power": 3.2, "Datetime": "2024-01-15T12:00:00"}
+        for alias in ("N.Pi", "N.Fan")
+    }},
+}
+
+# The log puller's environment in lib/lambda-functions.ts and lib/nepenthes_cdk-stack.ts, so the
+# deadband, rollups and archive run (and import boto3) as they do when deployed. The stack sets
+# TELEMETRY_ARCHIVE only with sqs ingestion; it is kept here so the budget covers both modes.
+_LOG_PULLER_ENV = {
+    "METRIC_BACKEND": "emf",
+    "METRIC_AGGREGATION_PERIOD": "60",
+    "METRIC_DEADBAND": json.dumps({"Switch": 300, "Valid": 900}),
+    "HIGH_RESOLUTION_METRICS": "CoolerFrozen,Power",
+    "HOME_NAME": "nhome",
+    "METRIC_STATE_TABLE": "benchmark-metric-state",
+    "ROLLUP_TABLE": "benchmark-rollups",
+    "TELEMETRY_ARCHIVE": "s3://benchmark-archive/telemetry/",
+}
+
+# handler module -> (event, extra environment)
+HANDLERS = {
+    "nepenthes_log_puller": (_TELEMETRY, _LOG_PULLER_ENV),
+    "nepenthes_online_plug_status": ({}, {}),
+    "nepenthes_pi_plug_on": ({}, {}),
+    "nepenthes_notification_dispatcher": ({"Records": [_ALARM_RECORD]}, {}),
+}
+
+# Import + first-invocation budget per handler, in milliseconds. Generous enough
+# for a laptop or CI runner; importing boto3 alone costs more than 100 ms, and every
+# handler but the Pi plug-on one needs it on its first call when deployed.
+DEFAULT_BUDGET_MS = 600
+BUDGET_MS = {}
+
+_BASE_ENV = {
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "METRIC_NAMESPACE": "Benchmark",
+    "FORMATTED_TOPIC_ARN": "arn:aws:sns:us-west-2:123456789012:benchmark",
+    "PUSHOVER_API_KEY": "benchmark",
+    "PAGEE_USER_KEY": "benchmark",
+    "SB_TOKEN": "benchmark",
+    "SB_SECRET_KEY": "benchmark",
+}
+
+_AWS_RESPONSES = {
+    "PutMetricData": {},
+    "Publish": {"MessageId": "benchmark"},
+    "GetItem": {},
+    "PutItem": {},
+    "BatchGetItem": {"Responses": {}},
+    "TransactWriteItems": {},
+    "PutObject": {},
+}
+
+
+def _http_response(url):
+    if url.endswith("/devices"):
+        return {"statusCode": 100, "body": {"deviceList": [
+            {"deviceId": name.replace(" ", ""), "deviceName": name, "deviceType": "Plug Mini (JP)", "enableCloudService": True}
+            for name in ("N. Pi", "N. Fan")
+        ]}}
+    if url.endswith("/status"):
+        return {"statusCode": 100, "body": {"power": "on", "electricCurrent": 1.0}}
+    if url.endswith("/commands"):
+        return {"statusCode": 100, "body": {}}
+    return {"status": 1, "request": "benchmark"}
+
+
+def _stub_requests():
+    import requests
+
+    def send(adapter, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response._content = json.dumps(_http_response(request.url)).encode()
+        return response
+
+    requests.adapters.HTTPAdapter.send = send
+
+
+def _stub_aws_client(client):
+    from types import SimpleNamespace
+
+    def before_call(model, **kwargs):
+        parsed = dict(_AWS_RESPONSES[model.name], ResponseMetadata={"HTTPStatusCode": 200})
+        return SimpleNamespace(status_code=200, headers={}), parsed
+
+    client.meta.events.register("before-call.*.*", before_call)
+
+
+def _stub_session(client_class):
+    build_session = client_class._build_session
+
+    def stubbed_build_session(self):
+        session = build_session(self)
+        _stub_requests()
+        return session
+
+    client_class._build_session = stubbed_build_session
+
+
+def _install_stubs():
+    """Answer network calls locally without importing anything the handler has not.
+
+    requests and boto3 are stubbed right after the handler's own code imports them,
+    so their import cost still counts towards the first invocation.
+    """
+    if "requests" in sys.modules:
+        _stub_requests()
+    # Clients that import requests lazily, when they build their session
+    for module, client in (("switchbot", "SwitchBotClient"), ("pushover", "PushoverClient")):
+        if module in sys.modules:
+            _stub_session(getattr(sys.modules[module], client))
+    if "aws_clients" in sys.modules:
+        # Stub every client as get_client caches it, however the calling module imported get_client
+        class StubbingClients(dict):
+            def __setitem__(self, service_name, client):
+                _stub_aws_client(client)
+                super().__setitem__(service_name, client)
+
+        sys.modules["aws_clients"]._clients = StubbingClients()
+
+
+def _child(handler):
+    event, _ = HANDLERS[handler]
+    start = time.perf_counter()
+    # __import__ rather than importlib.import_module, which -X importtime does not report
+    module = __import__(handler)
+    imported = time.perf_counter()
+    _install_stubs()
+    with contextlib.redirect_stdout(io.StringIO()):
+        invoke_start = time.perf_counter()
+        module.lambda_handler(event, None)
+        invoked = time.perf_counter()
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "first_call_ms": (invoked - invoke_start) * 1000,
+        "boto3": "boto3" in sys.modules,
+        "requests": "requests" in sys.modules,
+    }))
+
+
+def parse_importtime(stderr, module):
+    """Return [(cumulative_us, name)] of the imports made while importing module.
+
+    Parses ``python -X importtime`` output, where a module's line is printed after
+    the lines of everything it imported, indented by nesting depth.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, int(cumulative_us), name.strip()))
+    for i, (depth, _, name) in enumerate(entries):
+        if depth == 0 and name == module:
+            imports = []
+            for nested_depth, cumulative_us, nested_name in reversed(entries[:i]):
+                if nested_depth == 0:
+                    break
+                imports.append((cumulative_us, nested_name))
+            return sorted(imports, reverse=True)
+    return []
+
+
+def measure(handler):
+    """Run handler once in a fresh interpreter and return its measurements."""
+    _, env = HANDLERS[handler]
+    with tempfile.TemporaryDirectory() as tmp:
+        # A cold container starts with an empty /tmp
+        child_env = dict(os.environ, **_BASE_ENV, **env,
+                         DEVICE_ID_CACHE_FILE=os.path.join(tmp, "device_ids.json"),
+                         SWITCHBOT_USAGE_FILE=os.path.join(tmp, "usage.json"),
+                         PYTHONPATH=LAMBDA_DIR)
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "benchmarks.cold_start", "--child", handler],
+            cwd=LAMBDA_DIR, env=child_env, capture_output=True, text=True, check=True,
+        )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(proc.stderr, handler)
+    return result
+
+
+def run(handlers, repeat):
+    """Return {handler: result} with median import/first-call times over repeat runs."""
+    results = {}
+    for handler in handlers:
+        runs = [measure(handler) for _ in range(repeat)]
+        result = runs[-1]
+        for key in ("import_ms", "first_call_ms"):
+            result[key] = statistics.median(r[key] for r in runs)
+        result["total_ms"] = result["import_ms"] + result["first_call_ms"]
+        results[handler] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("handlers", nargs="*", default=list(HANDLERS), help="handler modules (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per handler; the median is reported")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to list per handler")
+    parser.add_argument("--budget-ms", type=float, help="override the budget of every handler")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child)
+        return
+
+    over_budget = []
+    for handler, result in run(args.handlers, args.repeat).items():
+        budget = args.budget_ms or BUDGET_MS.get(handler, DEFAULT_BUDGET_MS)
+        ok = result["total_ms"] <= budget
+        if not ok:
+            over_budget.append(handler)
+        print("{:<34} import={:>7.1f}ms first_call={:>7.1f}ms total={:>7.1f}ms budget={:.0f}ms boto3={} requests={} {}".format(
+            handler, result["import_ms"], result["first_call_ms"], result["total_ms"], budget,
+            "yes" if result["boto3"] else "no", "yes" if result["requests"] else "no", "ok" if ok else "OVER BUDGET"))
+        for cumulative_us, name in result["imports"][:args.top]:
+            print("    {:>8.1f}ms  {}".format(cumulative_us / 1000, name))
+
+    if over_budget:
+        print("Over cold-start budget: {}".format(", ".join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Benchmark connection reuse of PushoverClient against a local stub server.
+
+Sends a series of alerts with one-shot requests.post calls and with the pooled
+PushoverClient session, then repeats the pooled run with every other request
+failing once with a 503 to show the cost of a retried delivery.
+
+The stub speaks plain HTTP, so the savings shown are TCP handshakes only; against
+api.pushover.net every avoided connection also skips a TLS handshake.
+
+    cd lambda && python -m benchmarks.pushover_delivery --messages 50
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from pushover import PushoverClient
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; avoid Nagle/delayed-ACK stalls on keep-alive
+    disable_nagle_algorithm = True
+
+    def _respond(self, fields):
+        status, body, headers = self.server.next_response(self.command, self.path, fields)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._respond(parse_qs(self.rfile.read(length).decode()))
+
+    def do_GET(self):
+        self._respond(parse_qs(urlparse(self.path).query))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubPushoverServer(ThreadingHTTPServer):
+    """Local Pushover API stand-in that counts TCP connections and records requests.
+
+    Responses queued with enqueue() are served first, in order; after that
+    messages get {"status": 1, "receipt": ...} and receipts are reported as
+    unacknowledged unless listed in acknowledged.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.connections = 0
+        self.requests = []
+        self.acknowledged = {}
+        self._queued = []
+        self._lock = threading.Lock()
+        # Short poll interval so shutdown() (once per test) returns quickly
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.01,), daemon=True)
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}/1".format(self.server_address[1])
+
+    def enqueue(self, status, body, headers=None):
+        with self._lock:
+            self._queued.append((status, body, headers or {}))
+
+    def next_response(self, method, path, fields):
+        with self._lock:
+            self.requests.append((method, urlparse(path).path, fields))
+            if self._queued:
+                return self._queued.pop(0)
+            number = len(self.requests)
+        if method == "POST":
+            return 200, {"status": 1, "request": str(number), "receipt": "r{}".format(number)}, {}
+        receipt = urlparse(path).path.rsplit("/", 1)[-1][:-len(".json")]
+        if receipt in self.acknowledged:
+            return 200, {"status": 1, "acknowledged": 1, "acknowledged_at": self.acknowledged[receipt]}, {}
+        return 200, {"status": 1, "acknowledged": 0, "expired": 0}, {}
+
+    def get_request(self):
+        request = super().get_request()
+        self.connections += 1
+        return request
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def _message(number):
+    return {"user": "benchmark", "title": "ALARM: {}".format(number), "message": "benchmark", "priority": 2}
+
+
+def run(messages):
+    """Return {mode: (connections, seconds)} for one-shot requests vs PushoverClient."""
+    results = {}
+    with StubPushoverServer() as server:
+        url = server.base_url + "/messages.json"
+
+        start = time.perf_counter()
+        for i in range(messages):
+            requests.post(url, data=dict(_message(i), token="benchmark"), timeout=10).json()
+        results["requests.post"] = (server.connections, time.perf_counter() - start)
+
+        server.connections = 0
+        client = PushoverClient("benchmark", api_base=server.base_url)
+        start = time.perf_counter()
+        for i in range(messages):
+            client.send_message(**_message(i))
+        results["PushoverClient"] = (server.connections, time.perf_counter() - start)
+
+        server.connections = 0
+        client.backoff_base = 0.001
+        start = time.perf_counter()
+        for i in range(messages):
+            if i % 2 == 0:
+                server.enqueue(503, {"status": 0})
+            client.send_message(**_message(i))
+        results["PushoverClient+503"] = (server.connections, time.perf_counter() - start)
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50)
+    args = parser.parse_args()
+    # Keep the retry warnings of the 503 run out of the results
+    logging.basicConfig(level=logging.ERROR)
+
+    print("{} alerts".format(args.messages))
+    for mode, (connections, seconds) in run(args.messages).items():
+        print("{:<20} connections={:<5} total={:.3f}s per_alert={:.2f}ms".format(
+            mode, connections, seconds, seconds / args.messages * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark connection reuse of SwitchBotClient against a local stub server.
+
+Simulates a series of warm invocations, each making the same SwitchBot calls as
+nepenthes_online_plug_status (device list + one status call per plug), and
+compares one-shot requests.get calls with the pooled SwitchBotClient session.
+
+The stub speaks plain HTTP, so the savings shown are TCP handshakes only; against
+api.switch-bot.com every avoided connection also skips a TLS handshake.
+
+    cd lambda && python -m benchmarks.switchbot_session --invocations 50
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from switchbot import SwitchBotClient
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; avoid Nagle/delayed-ACK stalls on keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path.endswith("/status"):
+            body = {"statusCode": 100, "body": {"power": "on", "electricCurrent": 1.0}}
+        else:
+            body = {"statusCode": 100, "body": {"deviceList": []}}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSwitchBotServer(ThreadingHTTPServer):
+    """Local SwitchBot API stand-in that counts accepted TCP connections."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.connections = 0
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def get_request(self):
+        request = super().get_request()
+        self.connections += 1
+        return request
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def _invocation_urls(base_url, devices):
+    return ["{}/v1.1/devices".format(base_url)] + [
+        "{}/v1.1/devices/{}/status".format(base_url, i) for i in range(devices)
+    ]
+
+
+def run(invocations, devices):
+    """Return {mode: (connections, seconds)} for one-shot requests vs SwitchBotClient."""
+    results = {}
+    with StubSwitchBotServer() as server:
+        urls = _invocation_urls(server.base_url, devices)
+
+        start = time.perf_counter()
+        for _ in range(invocations):
+            for url in urls:
+                requests.get(url, timeout=10).json()
+        results["requests.get"] = (server.connections, time.perf_counter() - start)
+
+        server.connections = 0
+        client = SwitchBotClient()
+        start = time.perf_counter()
+        for _ in range(invocations):
+            for url in urls:
+                client.get(url, headers={})
+        results["SwitchBotClient"] = (server.connections, time.perf_counter() - start)
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invocations", type=int, default=50)
+    parser.add_argument("--devices", type=int, default=2)
+    args = parser.parse_args()
+
+    requests_per_mode = args.invocations * (args.devices + 1)
+    print("{} warm invocations x {} requests".format(args.invocations, args.devices + 1))
+    for mode, (connections, seconds) in run(args.invocations, args.devices).items():
+        print("{:<16} connections={:<5} total={:.3f}s per_request={:.2f}ms".format(
+            mode, connections, seconds, seconds / requests_per_mode * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark telemetry parsing against the handler that walked the raw payload.
+
+Builds synthetic payloads with hundreds of meters and plugs and times, per
+payload:
+
+- the previous dict-walking publisher (kept below as _legacy_put_home_metrics),
+- parse_payload alone (validation and MeterReading/PlugReading construction),
+- put_home_metrics, which parses and then publishes.
+
+Metrics go into a MetricBatch that is never flushed, so only payload handling
+is measured. A malformed payload (the last device is bad) shows the difference
+in failure mode: the legacy publisher has already added most of the payload's
+metrics when it raises, the parser adds none.
+
+    cd lambda && python -m benchmarks.telemetry_parse --devices 200 --payloads 200
+"""
+import argparse
+import datetime
+import os
+import time
+
+os.environ.setdefault("METRIC_NAMESPACE", "Benchmark")
+
+from cloudwatch import MetricBatch
+from nepenthes_log_puller import put_home_metrics
+from telemetry import parse_payload
+
+
+def _legacy_put_home_metrics(batch, event):
+    """The log puller's publisher before telemetry.parse_payload, for comparison."""
+    home_dimension = {"Name": "Home", "Value": event.get("home") or "nhome"}
+    batch.put("Heartbeat", event["should_heartbeat"], "None", dimensions=[home_dimension])
+    if event.get("cooler_frozen") is not None:
+        batch.put("CoolerFrozen", event["cooler_frozen"], "None", dimensions=[home_dimension])
+    for alias, data in event.get("meters", {}).get("v0", {}).items():
+        dimensions = [home_dimension, {"Name": "Meter", "Value": alias}]
+        timestamp = datetime.datetime.fromisoformat(data["Datetime"])
+        batch.put("Valid", data["Valid"], "None", timestamp=timestamp, dimensions=dimensions)
+        if not data["Valid"]:
+            continue
+        if timestamp.hour in [0, 6, 12, 18] and timestamp.minute < 15:
+            batch.put("Battery", data["BatteryVoltage"], "Percent", timestamp=timestamp, dimensions=dimensions)
+        batch.put("Humidity", data["Humidity"], "Percent", timestamp=timestamp, dimensions=dimensions)
+        batch.put("Temperature", data["Temperature"], "None", timestamp=timestamp, dimensions=dimensions)
+        desired = data.get("Desired", {})
+        if "Temperature" in desired:
+            batch.put("DesiredTemperature", desired["Temperature"], "None", timestamp=timestamp, dimensions=dimensions)
+        if "TemperatureDiff" in desired:
+            batch.put("TemperatureDiff", desired["TemperatureDiff"], "None", timestamp=timestamp, dimensions=dimensions)
+    for alias, data in event.get("plugs", {}).get("v0", {}).items():
+        dimensions = [home_dimension, {"Name": "Plug", "Value": alias}]
+        timestamp = datetime.datetime.fromisoformat(data["Datetime"])
+        batch.put("Valid", data["Valid"], "None", timestamp=timestamp, dimensions=dimensions)
+        if not data["Valid"]:
+            continue
+        batch.put("Switch", data["Switch"], "None", timestamp=timestamp, dimensions=dimensions)
+        batch.put("Power", data["Power"], "None", timestamp=timestamp, dimensions=dimensions)
+
+
+def synthetic_payload(devices, number=0):
+    """A payload with devices meters and devices plugs, all read at the same Datetime."""
+    at = (datetime.datetime(2024, 1, 15, 12) + datetime.timedelta(minutes=2 * number)).isoformat()
+    return {
+        "home": "nhome",
+        "should_heartbeat": 1,
+        "cooler_frozen": False,
+        "meters": {"v0": {
+            "Meter {}".format(i): {"Valid": i % 10 != 0, "Temperature": 22.0 + i % 5, "Humidity": 70.0,
+                                   "BatteryVoltage": 90, "Datetime": at,
+                                   "Desired": {"Temperature": 22.0, "TemperatureDiff": 0.5}}
+            for i in range(devices)
+        }},
+        "plugs": {"v0": {
+            "Plug {}".format(i): {"Valid": True, "Switch": i % 2 == 0, "Power": 3.5, "Datetime": at}
+            for i in range(devices)
+        }},
+    }
+
+
+def _time_per_payload(fn, payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        fn(payload)
+    return (time.perf_counter() - start) / len(payloads) * 1e3
+
+
+def _datapoints_before_failure(fn, payload):
+    batch = MetricBatch("Benchmark", backend="api")
+    try:
+        fn(batch, payload)
+    except Exception:
+        pass
+    return len(batch)
+
+
+def run(devices, payloads):
+    """Return ({case: milliseconds per payload}, {publisher: datapoints added by a malformed payload})."""
+    samples = [synthetic_payload(devices, number) for number in range(payloads)]
+    timings = {
+        "legacy put_home_metrics": _time_per_payload(
+            lambda payload: _legacy_put_home_metrics(MetricBatch("Benchmark", backend="api"), payload), samples),
+        "parse_payload": _time_per_payload(parse_payload, samples),
+        "put_home_metrics": _time_per_payload(
+            lambda payload: put_home_metrics(MetricBatch("Benchmark", backend="api"), payload), samples),
+    }
+    malformed = synthetic_payload(devices)
+    malformed["plugs"]["v0"]["Plug {}".format(devices - 1)]["Power"] = "3.5W"
+    # The legacy publisher only fails on data it cannot handle, so drop a required field instead
+    legacy_malformed = synthetic_payload(devices)
+    del legacy_malformed["plugs"]["v0"]["Plug {}".format(devices - 1)]["Power"]
+    partial = {
+        "legacy put_home_metrics": _datapoints_before_failure(_legacy_put_home_metrics, legacy_malformed),
+        "put_home_metrics": _datapoints_before_failure(put_home_metrics, malformed),
+    }
+    return timings, partial
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=200, help="meters and plugs per payload (each)")
+    parser.add_argument("--payloads", type=int, default=200)
+    args = parser.parse_args()
+
+    timings, partial = run(args.devices, args.payloads)
+    print("{} payloads of {} meters + {} plugs".format(args.payloads, args.devices, args.devices))
+    for case, milliseconds in timings.items():
+        print("{:<25} {:.3f}ms/payload".format(case, milliseconds))
+    print("Datapoints added before rejecting a payload whose last device is malformed:")
+    for case, datapoints in partial.items():
+        print("{:<25} {}".format(case, datapoints))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Compare v0 and v1 telemetry payloads: messages, bytes and ingestion time.
+
+The Pi publishes one v0 payload (one reading per device, field names repeated
+for every device) per push interval. encode_v1 packs the readings of several
+v0 payloads into one v1 payload with columnar rows (see telemetry), the
+reference for the Pi's encoder. For a window of synthetic pushes this reports
+the MQTT messages and bytes of each format and how long parse_payload takes
+per reading.
+
+AWS IoT Core limits a message to 128 KB, which bounds how many samples one
+v1 payload can carry.
+
+    cd lambda && python -m benchmarks.telemetry_v1 --devices 4 --minutes 30
+"""
+import argparse
+import calendar
+import datetime
+import json
+import time
+
+from benchmarks.telemetry_parse import synthetic_payload
+from telemetry import parse_payload
+
+IOT_MAX_MESSAGE_BYTES = 128 * 1024
+
+# v1 column -> how to read it from a v0 reading
+_V0_FIELDS = {
+    "meters": (
+        ("Valid", lambda data: data.get("Valid")),
+        ("Temperature", lambda data: data.get("Temperature")),
+        ("Humidity", lambda data: data.get("Humidity")),
+        ("BatteryVoltage", lambda data: data.get("BatteryVoltage")),
+        ("DesiredTemperature", lambda data: data.get("Desired", {}).get("Temperature")),
+        ("TemperatureDiff", lambda data: data.get("Desired", {}).get("TemperatureDiff")),
+    ),
+    "plugs": (
+        ("Valid", lambda data: data.get("Valid")),
+        ("Switch", lambda data: data.get("Switch")),
+        ("Power", lambda data: data.get("Power")),
+    ),
+}
+
+
+def _epoch(text):
+    return calendar.timegm(datetime.datetime.fromisoformat(text).utctimetuple())
+
+
+def encode_v1(payloads):
+    """Pack the timestamped readings of v0 payloads, oldest first, into one v1 payload.
+
+    The scalars (home, should_heartbeat, cooler_frozen) come from the last payload,
+    since they describe the state at send time.
+    """
+    last = payloads[-1]
+    encoded = {key: last[key] for key in ("home", "should_heartbeat", "cooler_frozen") if key in last}
+    for section, fields in _V0_FIELDS.items():
+        readings = [(alias, data) for payload in payloads
+                    for alias, data in payload.get(section, {}).get("v0", {}).items() if "Datetime" in data]
+        if not readings:
+            continue
+        base = min(_epoch(data["Datetime"]) for _, data in readings)
+        rows = {}
+        for alias, data in readings:
+            # Invalid readings carry only Valid
+            if data.get("Valid"):
+                values = [read(data) for _, read in fields]
+            else:
+                values = [data.get("Valid")] + [None] * (len(fields) - 1)
+            rows.setdefault(alias, []).append([_epoch(data["Datetime"]) - base] + values)
+        encoded[section] = {"v1": {"base": base, "columns": ["t"] + [column for column, _ in fields], "rows": rows}}
+    return encoded
+
+
+def _size(payload):
+    return len(json.dumps(payload, separators=(",", ":")).encode())
+
+
+def _parse_microseconds(payloads, readings):
+    start = time.perf_counter()
+    for payload in payloads:
+        parse_payload(payload)
+    return (time.perf_counter() - start) / readings * 1e6
+
+
+def run(devices, minutes, interval=2):
+    """Return {format: (messages, bytes, microseconds per reading parsed)} for one window of pushes."""
+    v0 = [synthetic_payload(devices, number) for number in range(minutes // interval)]
+    v1 = [encode_v1(v0)]
+    readings = sum(len(payload["meters"]["v0"]) + len(payload["plugs"]["v0"]) for payload in v0)
+    if _size(v1[0]) > IOT_MAX_MESSAGE_BYTES:
+        raise ValueError("{} minutes of {} devices exceed one IoT message".format(minutes, devices))
+    return {
+        name: (len(payloads), sum(_size(payload) for payload in payloads), _parse_microseconds(payloads, readings))
+        for name, payloads in (("v0", v0), ("v1", v1))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=4, help="meters and plugs (each)")
+    parser.add_argument("--minutes", type=int, default=30, help="window of 2-minute pushes packed into one v1 payload")
+    args = parser.parse_args()
+
+    print("{} meters + {} plugs, {} minutes of 2-minute readings".format(args.devices, args.devices, args.minutes))
+    for name, (messages, size, microseconds) in run(args.devices, args.minutes).items():
+        print("{}  messages={:<4} bytes={:<8} parse={:.2f}us/reading".format(name, messages, size, microseconds))
+
+
+if __name__ == "__main__":
+    main()
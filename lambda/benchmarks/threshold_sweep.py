@@ -0,0 +1,303 @@
+"""Sweep alarm thresholds and datapointsToAlarm over exported metric history.
+
+Loads NHomeZero metric history exported as CSV (columns Timestamp, MetricName,
+Meter, Value; Timestamp as ISO 8601 or epoch seconds; other columns ignored,
+.gz accepted) into a MetricStore. For every meter and every candidate threshold
+and datapointsToAlarm it replays the alarm and reports the trade-off between
+false positives and detection delay:
+
+- an excursion is a run of periods whose statistic breaches the candidate
+  threshold for at least --min-excursion minutes: something the alarm should catch;
+- an alarm that overlaps no excursion is a false positive (a brief spike);
+- detection delay is the time from an excursion's start to its alarm.
+
+Without NumPy, the sweep stays vectorized with the standard library. Each
+meter's period statistics are computed once. For each datapointsToAlarm M, one
+pass over a sorted sliding window yields the M-th worst value of every
+evaluation range, so an alarm at any threshold is a single comparison per period
+instead of re-evaluating M of N datapoints. Those values are then ranked against
+the sorted candidate thresholds into bytes, one per period, and every candidate's
+alarm episodes and excursions are found with bytes.translate and a regular
+expression scan, both running in C over the whole series.
+
+    cd lambda && python -m benchmarks.threshold_sweep history.csv --target temperature-high \\
+        --thresholds 24:30:0.5 --datapoints 10,20,30
+"""
+import argparse
+import bisect
+import csv
+import datetime
+import gzip
+import math
+import os
+import re
+import statistics
+import time
+
+from metric_store import COMPARISONS, MetricStore
+
+NAMESPACE = "NHomeZero"
+# Candidate thresholds are ranked into one byte per period
+MAX_THRESHOLDS = 255
+# Per level, the bytes.translate table marking the levels that breach it
+_BREACHING = [bytes(int(candidate >= level) for candidate in range(256)) for level in range(MAX_THRESHOLDS + 1)]
+CONSTANTS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "lib", "constants.ts")
+
+
+class Side:
+    """One alarm of a target: metric statistic compared against scale * candidate threshold."""
+
+    def __init__(self, metric_name, statistic, comparison, scale=1):
+        if comparison not in COMPARISONS:
+            raise ValueError("Unsupported comparison operator {}".format(comparison))
+        self.metric_name = metric_name
+        self.statistic = statistic
+        self.comparison = comparison
+        self.scale = scale
+
+    def score(self, value):
+        """Map value so the alarm breaches when score >= candidate threshold."""
+        if self.comparison.startswith("Greater"):
+            return value * self.scale
+        return -value * self.scale
+
+
+# Alarms of lib/nepenthes-alarms.ts tuned by each constant (all 30 of 30 two-minute periods)
+TARGETS = {
+    "temperature-high": ("THRESHOLD_TEMPERATURE_HIGH", [
+        Side("Temperature", "Minimum", "GreaterThanOrEqualToThreshold")]),
+    # Too hot (diff <= -offset) and too cold (diff >= offset)
+    "temperature-offset": ("THRESHOLD_TEMPERATURE_OFFSET", [
+        Side("TemperatureDiff", "Maximum", "LessThanOrEqualToThreshold", scale=-1),
+        Side("TemperatureDiff", "Minimum", "GreaterThanOrEqualToThreshold")]),
+    "humidity-low": ("THRESHOLD_HUMIDITY_LOW", [
+        Side("Humidity", "Maximum", "LessThanOrEqualToThreshold")]),
+}
+
+
+def _timestamp(text):
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.datetime.fromisoformat(text)
+
+
+def load_csv(path, store=None):
+    """Add every row of an exported CSV to store (a new MetricStore by default) and return it."""
+    store = MetricStore() if store is None else store
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="") as f:
+        rows = csv.reader(f)
+        header = next(rows)
+        columns = [header.index(name) for name in ("Timestamp", "MetricName", "Meter", "Value")]
+        for timestamp, metric_name, meter, value in (tuple(row[i] for i in columns) for row in rows):
+            store.put(NAMESPACE, metric_name, float(value), _timestamp(timestamp), {"Meter": meter})
+    return store
+
+
+def current_constants(path=CONSTANTS_PATH):
+    """Return {name: value} of the numeric constants in lib/constants.ts, or {} if it is not there."""
+    try:
+        with open(path) as f:
+            source = f.read()
+    except OSError:
+        return {}
+    return {name: float(value) for name, value in re.findall(r"export const (\w+) = (-?[\d.]+);", source)}
+
+
+def period_scores(store, meter, side, period):
+    """Return (first period start, [score or None for every period up to the last datapoint])."""
+    time_range = store.time_range()
+    if time_range is None:
+        return None, []
+    first, last = time_range
+    points = store.get_statistics(NAMESPACE, side.metric_name, {"Meter": meter}, first, last + period, period,
+                                  side.statistic)
+    if not points:
+        return None, []
+    start = points[0][0]
+    scores = [None] * (int((points[-1][0] - start) // period) + 1)
+    for at, value in points:
+        scores[int((at - start) // period)] = side.score(value)
+    return start, scores
+
+
+def worst_in_window(scores, evaluation_periods, datapoints):
+    """For each M in datapoints, the M-th highest score of every evaluation range.
+
+    Ranges with fewer than M present datapoints use the lowest one (an alarm needs
+    every present datapoint to breach); ranges with none give None.
+
+    Returns:
+        {M: [score or None per period]}
+    """
+    window = []
+    result = {m: [] for m in datapoints}
+    appends = [(-m, result[m].append) for m in datapoints]
+    leaving = [None] * evaluation_periods + scores
+    for score, left in zip(scores, leaving):
+        if score is not None:
+            bisect.insort(window, score)
+        if left is not None:
+            del window[bisect.bisect_left(window, left)]
+        present = len(window)
+        for rank, append in appends:
+            append(window[max(rank, -present)] if present else None)
+    return result
+
+
+def forward_fill(worst):
+    """Replace every None (no data in the range) with the value before it, so the state is kept."""
+    filled = []
+    last = -math.inf
+    for value in worst:
+        if value is not None:
+            last = value
+        filled.append(last)
+    return filled
+
+
+def threshold_levels(values, thresholds):
+    """Rank values against sorted thresholds: one byte per value, counting the thresholds it reaches.
+
+    A value breaches the i-th threshold (from 1) when its level is >= i, so the
+    breaching periods of any candidate are one bytes.translate away.
+    """
+    if len(thresholds) > MAX_THRESHOLDS:
+        raise ValueError("At most {} candidate thresholds are supported".format(MAX_THRESHOLDS))
+    return bytes(0 if value is None else bisect.bisect_right(thresholds, value) for value in values)
+
+
+def _runs(levels, level, min_length=1):
+    """Return [(first index, last index)] of every run of at least min_length levels >= level."""
+    breaching = levels.translate(_BREACHING[level])
+    return [(match.start(), match.end() - 1) for match in re.finditer(b"\x01{%d,}" % min_length, breaching)]
+
+
+def alarm_onsets(alarm_levels, level):
+    """Return [(first index, last index)] of every ALARM episode at a threshold level."""
+    return _runs(alarm_levels, level)
+
+
+def excursions(score_levels, level, min_periods):
+    """Return [(first index, last index)] of runs of at least min_periods breaching periods."""
+    return _runs(score_levels, level, min_periods)
+
+
+def evaluate(alarms, truth, evaluation_periods):
+    """Match one candidate's alarm episodes against the excursions at its threshold.
+
+    An alarm catches an excursion when it is raised before the excursion ends, or
+    within one evaluation range after it.
+
+    Returns:
+        dict with "alarms", "false_positives", "excursions", "detected" and
+        "delays" (periods from each detected excursion's start to its alarm).
+    """
+    alarm_lasts = [last for _, last in alarms]
+    delays = []
+    for first, last in truth:
+        number = bisect.bisect_left(alarm_lasts, first)
+        if number < len(alarms) and alarms[number][0] <= last + evaluation_periods:
+            delays.append(max(0, alarms[number][0] - first))
+    reach = [last + evaluation_periods for _, last in truth]
+    false_positives = 0
+    for first, last in alarms:
+        number = bisect.bisect_left(reach, first)
+        if number == len(truth) or truth[number][0] > last:
+            false_positives += 1
+    return {
+        "alarms": len(alarms),
+        "false_positives": false_positives,
+        "excursions": len(truth),
+        "detected": len(delays),
+        "delays": delays,
+    }
+
+
+def sweep(store, meter, sides, thresholds, datapoints, evaluation_periods=30, period=120, min_excursion=1800):
+    """Evaluate every (threshold, M) candidate for meter, summing the target's sides.
+
+    Returns:
+        {(threshold, M): evaluate() result with delays in seconds}
+    """
+    results = {}
+    thresholds = sorted(thresholds)
+    min_periods = max(1, int(min_excursion // period))
+    for side in sides:
+        _, scores = period_scores(store, meter, side, period)
+        if not scores:
+            continue
+        score_levels = threshold_levels(scores, thresholds)
+        worst = worst_in_window(scores, evaluation_periods, datapoints)
+        alarm_levels = {m: threshold_levels(forward_fill(worst[m]), thresholds) for m in datapoints}
+        for level, threshold in enumerate(thresholds, 1):
+            truth = excursions(score_levels, level, min_periods)
+            for m in datapoints:
+                result = evaluate(alarm_onsets(alarm_levels[m], level), truth, evaluation_periods)
+                total = results.setdefault((threshold, m), {
+                    "alarms": 0, "false_positives": 0, "excursions": 0, "detected": 0, "delays": []})
+                for key in ("alarms", "false_positives", "excursions", "detected"):
+                    total[key] += result[key]
+                total["delays"].extend(delay * period for delay in result["delays"])
+    return results
+
+
+def _frange(spec):
+    start, stop, step = (float(part) for part in spec.split(":"))
+    count = int(round((stop - start) / step)) + 1
+    return [round(start + i * step, 6) for i in range(count)]
+
+
+def _minutes(seconds):
+    return "{:.0f}m".format(seconds / 60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("history", nargs="+", help="exported metric history CSV file(s)")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="temperature-high")
+    parser.add_argument("--thresholds", required=True, help="candidate thresholds as start:stop:step")
+    parser.add_argument("--datapoints", default="10,20,30", help="candidate datapointsToAlarm values")
+    parser.add_argument("--evaluation-periods", type=int, default=30)
+    parser.add_argument("--period", type=int, default=120, help="alarm period in seconds")
+    parser.add_argument("--min-excursion", type=float, default=30, help="minutes a breach must last to count")
+    parser.add_argument("--meter", action="append", help="limit to these meters (default: every meter in the data)")
+    args = parser.parse_args()
+
+    constant, sides = TARGETS[args.target]
+    current = current_constants().get(constant)
+    thresholds = _frange(args.thresholds)
+    datapoints = [int(m) for m in args.datapoints.split(",")]
+
+    started = time.perf_counter()
+    store = MetricStore()
+    for path in args.history:
+        load_csv(path, store)
+    loaded = time.perf_counter() - started
+    meters = args.meter or sorted({dims["Meter"] for _, _, dims in store.metrics() if "Meter" in dims})
+
+    started = time.perf_counter()
+    results = {meter: sweep(store, meter, sides, thresholds, datapoints, args.evaluation_periods, args.period,
+                            args.min_excursion * 60) for meter in meters}
+    swept = time.perf_counter() - started
+
+    print("{} datapoints loaded in {:.2f}s; {} candidates x {} meters swept in {:.2f}s".format(
+        len(store), loaded, len(thresholds) * len(datapoints), len(meters), swept))
+    print("{} (current {}), M of {} x {}s periods, excursions >= {:.0f}m".format(
+        args.target, current, args.evaluation_periods, args.period, args.min_excursion))
+    for meter in meters:
+        print("\n{}".format(meter))
+        print("{:>10} {:>4} {:>7} {:>10} {:>9} {:>13} {:>10}".format(
+            "threshold", "M", "alarms", "false_pos", "detected", "median_delay", "max_delay"))
+        for (threshold, m), result in sorted(results[meter].items()):
+            delays = result["delays"]
+            print("{:>9}{} {:>4} {:>7} {:>10} {:>9} {:>13} {:>10}".format(
+                threshold, "*" if threshold == current else " ", m, result["alarms"], result["false_positives"],
+                "{}/{}".format(result["detected"], result["excursions"]),
+                _minutes(statistics.median(delays)) if delays else "-",
+                _minutes(max(delays)) if delays else "-"))
+
+
+if __name__ == "__main__":
+    main()
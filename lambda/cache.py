@@ -0,0 +1,220 @@
+"""Tiered key/value cache with per-entry TTL.
+
+Tiers are checked in order; a hit in a slower tier is copied into the faster
+tiers in front of it. Writes and invalidations go to every tier. Values must be
+JSON serializable. Errors from a tier are logged and treated as a miss so a
+cache outage never fails the caller.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from aws_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+
+class CacheTier:
+    """Base class for cache tiers. Entries are (value, expires_at) with expires_at in epoch seconds."""
+
+    def get_entry(self, key):
+        raise NotImplementedError
+
+    def set_entry(self, key, value, expires_at):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def keys(self, prefix):
+        """Return the keys starting with prefix, expired or not."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryTier(CacheTier):
+    """Process-local tier; lives as long as the warm Lambda container."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def get_entry(self, key):
+        return self._entries.get(key)
+
+    def set_entry(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def keys(self, prefix):
+        return [key for key in self._entries if key.startswith(prefix)]
+
+    def clear(self):
+        self._entries.clear()
+
+
+class FileTier(CacheTier):
+    """JSON file tier, e.g. under /tmp, shared by every execution of a container."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _store(self, entries):
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def get_entry(self, key):
+        with self._lock:
+            entry = self._load().get(key)
+        return tuple(entry) if entry else None
+
+    def set_entry(self, key, value, expires_at):
+        with self._lock:
+            entries = self._load()
+            entries[key] = [value, expires_at]
+            self._store(entries)
+
+    def delete(self, key):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                self._store(entries)
+
+    def keys(self, prefix):
+        with self._lock:
+            return [key for key in self._load() if key.startswith(prefix)]
+
+    def clear(self):
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class DynamoDBTier(CacheTier):
+    """DynamoDB tier shared across containers, so it also survives cold starts.
+
+    The table needs a string partition key "CacheKey"; "ExpiresAt" can be enabled
+    as the table's TTL attribute to let DynamoDB purge expired entries.
+    """
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client("dynamodb")
+        return self._client
+
+    def get_entry(self, key):
+        item = self.client.get_item(TableName=self.table_name, Key={"CacheKey": {"S": key}}).get("Item")
+        if not item:
+            return None
+        return json.loads(item["Value"]["S"]), float(item["ExpiresAt"]["N"])
+
+    def set_entry(self, key, value, expires_at):
+        self.client.put_item(TableName=self.table_name, Item={
+            "CacheKey": {"S": key},
+            "Value": {"S": json.dumps(value)},
+            "ExpiresAt": {"N": str(int(expires_at))},
+        })
+
+    def delete(self, key):
+        self.client.delete_item(TableName=self.table_name, Key={"CacheKey": {"S": key}})
+
+    def keys(self, prefix):
+        """Scan the table for the keys; meant for small tables such as notification state."""
+        keys = []
+        paginator = self.client.get_paginator("scan")
+        for page in paginator.paginate(TableName=self.table_name, ProjectionExpression="CacheKey",
+                                       FilterExpression="begins_with(CacheKey, :prefix)",
+                                       ExpressionAttributeValues={":prefix": {"S": prefix}}):
+            keys.extend(item["CacheKey"]["S"] for item in page["Items"])
+        return keys
+
+    def clear(self):
+        raise NotImplementedError("DynamoDBTier does not support clear; delete keys individually")
+
+
+class TieredCache:
+    def __init__(self, tiers, ttl):
+        self.tiers = tiers
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        now = time.time()
+        for i, tier in enumerate(self.tiers):
+            try:
+                entry = tier.get_entry(key)
+            except Exception as e:
+                logger.warning("Cache tier %s get failed for %s: %s", type(tier).__name__, key, e)
+                continue
+            if entry is None:
+                continue
+            value, expires_at = entry
+            if expires_at <= now:
+                continue
+            for faster in self.tiers[:i]:
+                self._call(faster, "set_entry", key, value, expires_at)
+            return value
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        for tier in self.tiers:
+            self._call(tier, "set_entry", key, value, expires_at)
+
+    def invalidate(self, key):
+        for tier in self.tiers:
+            self._call(tier, "delete", key)
+
+    def keys(self, prefix=""):
+        """Return the keys starting with prefix in any tier, sorted; some may have expired."""
+        keys = set()
+        for tier in self.tiers:
+            try:
+                keys.update(tier.keys(prefix))
+            except Exception as e:
+                logger.warning("Cache tier %s keys failed: %s", type(tier).__name__, e)
+        return sorted(keys)
+
+    def clear(self):
+        for tier in self.tiers:
+            self._call(tier, "clear")
+
+    def _call(self, tier, method, *args):
+        try:
+            getattr(tier, method)(*args)
+        except Exception as e:
+            logger.warning("Cache tier %s %s failed: %s", type(tier).__name__, method, e)
+
+
+def build_cache(file_path=None, table_name=None, ttl=3600):
+    """Build a TieredCache with a memory tier plus optional file and DynamoDB tiers."""
+    tiers = [MemoryTier()]
+    if file_path:
+        tiers.append(FileTier(file_path))
+    if table_name:
+        tiers.append(DynamoDBTier(table_name))
+    return TieredCache(tiers, ttl)
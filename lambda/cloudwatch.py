@@ -1,29 +1,335 @@
-import boto3
 import datetime
+import json
 import logging
+import os
+
+from aws_clients import LazyClient
 
 logger = logging.getLogger(__name__)
 
-cloud_watch = boto3.client('cloudwatch')
+cloud_watch = LazyClient('cloudwatch')
+
+# Metric publishing backends, selected with the METRIC_BACKEND environment variable.
+# "api" calls PutMetricData; "emf" writes Embedded Metric Format documents to stdout,
+# which CloudWatch Logs extracts into the same metrics without a blocking API call.
+METRIC_BACKEND_API = "api"
+METRIC_BACKEND_EMF = "emf"
+METRIC_BACKENDS = (METRIC_BACKEND_API, METRIC_BACKEND_EMF)
+
+# PutMetricData request limits
+MAX_METRIC_DATA_PER_CALL = 1000
+MAX_REQUEST_BYTES = 1024 * 1024
+# Headroom for request encoding overhead not captured by the JSON size estimate
+REQUEST_BYTES_HEADROOM = 64 * 1024
+# Embedded Metric Format limit on metrics per document
+EMF_MAX_METRICS_PER_DOCUMENT = 100
+# Embedded Metric Format limit on values per metric in one document
+EMF_MAX_VALUES_PER_METRIC = 100
+# StorageResolution of high-resolution metrics, which alarms can evaluate over 10 or 30 second periods
+STORAGE_RESOLUTION_HIGH = 1
+# CloudWatch rejects datapoints older than two weeks or more than two hours in the future
+MAX_TIMESTAMP_AGE = datetime.timedelta(days=14)
+MAX_TIMESTAMP_LEAD = datetime.timedelta(hours=2)
+
+
+class MetricPublishError(Exception):
+    """Raised when one or more PutMetricData calls of a MetricBatch fail.
+
+    Attributes:
+        failures: list of (metric_data, exception) tuples, one per failed call.
+        published: number of datapoints that were published successfully.
+    """
+
+    def __init__(self, failures, published):
+        self.failures = failures
+        self.published = published
+        failed = sum(len(metric_data) for metric_data, _ in failures)
+        super().__init__("Failed to put {} of {} metric datapoints in {} call(s): {}".format(
+            failed, failed + published, len(failures), "; ".join(str(e) for _, e in failures)))
 
-def put_cloudwatch(metricNamespace, metricName, value, unit, timestamp=None, dimensions=None):
+
+def _build_metric_datum(metricName, value, unit, timestamp=None, dimensions=None, storage_resolution=None):
     metricName = metricName.replace(" ", "")
     value = (1 if value else 0) if type(value) == bool else value
     if not timestamp:
         timestamp = datetime.datetime.now()
+    data = {
+        "MetricName" : metricName,
+        "Timestamp"  : timestamp,
+        "Value"      : value,
+        "Unit"       : unit
+    }
+    if dimensions:
+        data["Dimensions"] = dimensions
+    if storage_resolution == STORAGE_RESOLUTION_HIGH:
+        data["StorageResolution"] = STORAGE_RESOLUTION_HIGH
+    return data
+
+
+def _statistic_set(value):
+    return {"SampleCount": 1, "Sum": value, "Minimum": value, "Maximum": value}
+
+
+def _estimate_size(datum):
+    return len(json.dumps(datum, default=str))
+
+
+def get_metric_backend():
+    backend = os.environ.get("METRIC_BACKEND", METRIC_BACKEND_API).lower()
+    if backend not in METRIC_BACKENDS:
+        raise ValueError("Unknown METRIC_BACKEND {}, expected one of {}".format(backend, METRIC_BACKENDS))
+    return backend
+
+
+def get_high_resolution_metrics():
+    """Return the metric names in HIGH_RESOLUTION_METRICS (comma separated) to publish at 1-second resolution."""
+    return frozenset(name.strip() for name in os.environ.get("HIGH_RESOLUTION_METRICS", "").split(",") if name.strip())
+
+
+def _storage_resolution(metricName, storage_resolution, high_resolution_metrics):
+    if storage_resolution is None and metricName.replace(" ", "") in high_resolution_metrics:
+        return STORAGE_RESOLUTION_HIGH
+    return storage_resolution
+
+
+def get_aggregation_period():
+    """Return the METRIC_AGGREGATION_PERIOD in seconds; 0 (the default) publishes every datapoint."""
+    period = int(os.environ.get("METRIC_AGGREGATION_PERIOD", "0"))
+    if period < 0:
+        raise ValueError("METRIC_AGGREGATION_PERIOD must not be negative, got {}".format(period))
+    return period
+
+
+def as_utc(timestamp):
+    """Return timestamp as an aware datetime; naive ones are UTC, matching botocore's serialization."""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+
+def epoch_seconds(timestamp):
+    """Return the seconds since the epoch of a naive (UTC) or aware datetime."""
+    return as_utc(timestamp).timestamp()
+
+
+def _epoch_millis(timestamp):
+    return int(epoch_seconds(timestamp) * 1000)
+
+
+def timestamp_rejection(timestamp, now=None):
+    """Return why CloudWatch would reject a datapoint at timestamp ("too_old" or "too_new"), or None."""
+    now = as_utc(now or datetime.datetime.now(datetime.timezone.utc))
+    timestamp = as_utc(timestamp)
+    if timestamp < now - MAX_TIMESTAMP_AGE:
+        return "too_old"
+    if timestamp > now + MAX_TIMESTAMP_LEAD:
+        return "too_new"
+    return None
+
+
+def to_emf_documents(metricNamespace, metric_data):
+    """Convert PutMetricData MetricData entries into Embedded Metric Format documents.
+
+    Entries sharing a timestamp and dimension set are merged into one document.
+    """
+    documents = []
+    open_documents = {}
+    for datum in metric_data:
+        dimensions = datum.get("Dimensions", [])
+        timestamp = _epoch_millis(datum["Timestamp"])
+        key = (timestamp, tuple((d["Name"], d["Value"]) for d in dimensions))
+        document = open_documents.get(key)
+        if document is None or datum["MetricName"] in document \
+                or len(document["_aws"]["CloudWatchMetrics"][0]["Metrics"]) >= EMF_MAX_METRICS_PER_DOCUMENT:
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": metricNamespace,
+                        "Dimensions": [[d["Name"] for d in dimensions]],
+                        "Metrics": [],
+                    }],
+                },
+            }
+            for d in dimensions:
+                document[d["Name"]] = d["Value"]
+            open_documents[key] = document
+            documents.append(document)
+        metric = {"Name": datum["MetricName"], "Unit": datum["Unit"]}
+        if "StorageResolution" in datum:
+            metric["StorageResolution"] = datum["StorageResolution"]
+        document["_aws"]["CloudWatchMetrics"][0]["Metrics"].append(metric)
+        # Aggregated datapoints carry a list of values, which EMF accepts in place of one value
+        document[datum["MetricName"]] = datum["Values"] if "Values" in datum else datum["Value"]
+    return documents
+
+
+def _put_emf(metricNamespace, metric_data):
+    for document in to_emf_documents(metricNamespace, metric_data):
+        print(json.dumps(document), flush=True)
+
+
+def put_cloudwatch(metricNamespace, metricName, value, unit, timestamp=None, dimensions=None, storage_resolution=None):
+    """Publish one datapoint; metrics in HIGH_RESOLUTION_METRICS default to 1-second storage resolution."""
+    storage_resolution = _storage_resolution(metricName, storage_resolution, get_high_resolution_metrics())
+    data = _build_metric_datum(metricName, value, unit, timestamp, dimensions, storage_resolution)
+    if get_metric_backend() == METRIC_BACKEND_EMF:
+        _put_emf(metricNamespace, [data])
+        return
     try:
-        data = {
-            "MetricName" : metricName,
-            "Timestamp"  : timestamp,
-            "Value"      : value,
-            "Unit"       : unit
-        }
-        if dimensions:
-            data["Dimensions"] = dimensions
         cloud_watch.put_metric_data(
             Namespace  = metricNamespace,
             MetricData = [data]
         )
     except Exception as e:
-        logger.error("Failed to put metric %s: %s", metricName, e)
+        logger.error("Failed to put metric %s: %s", data["MetricName"], e)
         raise
+
+
+class MetricBatch:
+    """Buffer metric datapoints and publish them in as few PutMetricData calls as possible.
+
+    Usable as a context manager; buffered datapoints are flushed on exit, including
+    when the block raises, so metrics recorded before a failure are not lost:
+
+        with MetricBatch("NHomeZero") as batch:
+            batch.put("Heartbeat", 1, "None")
+
+    With an aggregation period (seconds, METRIC_AGGREGATION_PERIOD by default),
+    datapoints of one metric and dimension set that fall in the same period
+    since the epoch are folded into one datum. The "api" backend publishes it as
+    StatisticValues (SampleCount, Sum, Minimum, Maximum), the "emf" backend as a
+    list of Values. The datum keeps the first datapoint's timestamp, so every
+    statistic of a period that is a multiple of the aggregation period is
+    unchanged; percentiles are not available for StatisticValues.
+
+    Metrics in HIGH_RESOLUTION_METRICS are published with StorageResolution=1
+    (unless put with another storage_resolution), in the same requests as the
+    others, and are only aggregated within each second.
+    """
+
+    def __init__(self, metricNamespace, backend=None, aggregation_period=None):
+        self.namespace = metricNamespace
+        self.backend = backend or get_metric_backend()
+        self.aggregation_period = get_aggregation_period() if aggregation_period is None else aggregation_period
+        self.high_resolution_metrics = get_high_resolution_metrics()
+        self._data = []
+        # (name, unit, dimensions, period) -> buffered datum still open for folding
+        self._open = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+            return False
+        try:
+            self.flush()
+        except MetricPublishError as e:
+            logger.error("Failed to flush metrics while handling %s: %s", exc_type.__name__, e)
+        return False
+
+    def put(self, metricName, value, unit, timestamp=None, dimensions=None, storage_resolution=None):
+        storage_resolution = _storage_resolution(metricName, storage_resolution, self.high_resolution_metrics)
+        datum = _build_metric_datum(metricName, value, unit, timestamp, dimensions, storage_resolution)
+        if self.aggregation_period:
+            self._fold(datum)
+        else:
+            self._data.append(datum)
+
+    def extend(self, other):
+        """Move all datapoints buffered in other into this batch."""
+        if self.aggregation_period:
+            for datum in other._data:
+                self._fold(datum)
+        else:
+            self._data.extend(other._data)
+        other._data = []
+        other._open = {}
+
+    def _fold(self, datum):
+        # High-resolution alarms may use periods shorter than the aggregation period
+        period = 1 if datum.get("StorageResolution") == STORAGE_RESOLUTION_HIGH else self.aggregation_period
+        key = (datum["MetricName"], datum["Unit"],
+               tuple((d["Name"], d["Value"]) for d in datum.get("Dimensions", ())),
+               int(epoch_seconds(datum["Timestamp"])) // period)
+        target = self._open.get(key)
+        if target is None:
+            self._open[key] = datum
+            self._data.append(datum)
+        elif self.backend == METRIC_BACKEND_EMF:
+            if "Value" in target:
+                target["Values"] = [target.pop("Value")]
+            for value in datum.get("Values") or [datum["Value"]]:
+                if len(target["Values"]) == EMF_MAX_VALUES_PER_METRIC:
+                    # Later values of the period go into a new datum
+                    target = {k: v for k, v in datum.items() if k not in ("Value", "Values")}
+                    target["Values"] = []
+                    self._open[key] = target
+                    self._data.append(target)
+                target["Values"].append(value)
+        else:
+            if "Value" in target:
+                target["StatisticValues"] = _statistic_set(target.pop("Value"))
+            statistics = target["StatisticValues"]
+            other = datum.get("StatisticValues") or _statistic_set(datum["Value"])
+            statistics["SampleCount"] += other["SampleCount"]
+            statistics["Sum"] += other["Sum"]
+            statistics["Minimum"] = min(statistics["Minimum"], other["Minimum"])
+            statistics["Maximum"] = max(statistics["Maximum"], other["Maximum"])
+
+    def _chunks(self):
+        chunk = []
+        chunk_bytes = 0
+        limit = MAX_REQUEST_BYTES - REQUEST_BYTES_HEADROOM
+        for datum in self._data:
+            size = _estimate_size(datum)
+            if chunk and (len(chunk) >= MAX_METRIC_DATA_PER_CALL or chunk_bytes + size > limit):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(datum)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def flush(self):
+        """Publish all buffered datapoints and clear the buffer.
+
+        With the "api" backend every chunk is attempted even if an earlier one
+        fails. With the "emf" backend all datapoints are written to stdout.
+
+        Returns:
+            number of datapoints published.
+
+        Raises:
+            MetricPublishError: if any PutMetricData call failed.
+        """
+        if self.backend == METRIC_BACKEND_EMF:
+            _put_emf(self.namespace, self._data)
+            published = len(self._data)
+            self._data = []
+            self._open = {}
+            return published
+
+        failures = []
+        published = 0
+        for chunk in self._chunks():
+            try:
+                cloud_watch.put_metric_data(
+                    Namespace  = self.namespace,
+                    MetricData = chunk
+                )
+                published += len(chunk)
+            except Exception as e:
+                logger.error("Failed to put %d metrics to %s: %s", len(chunk), self.namespace, e)
+                failures.append((chunk, e))
+        self._data = []
+        self._open = {}
+        if failures:
+            raise MetricPublishError(failures, published)
+        return published
@@ -0,0 +1,239 @@
+"""Coalesce bursts of alarm notifications into digests.
+
+The first alarm of a burst is sent right away and opens a coalescing window.
+Alarms arriving while the window is open are held in a store; once the window
+has passed they are sent together as one digest, either by the next alarm
+(which opens a new window) or by a scheduled flush. Held alarms in a digest
+that fails to send are held again rather than dropped.
+
+Window state must be shared by concurrent Lambda invocations, so production
+uses DynamoDBCoalesceStore; MemoryCoalesceStore implements the same atomic
+operations for a single process (local runs and tests).
+"""
+import json
+import logging
+import threading
+import time
+
+from aws_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Attempts to open or join a window before giving up and sending immediately
+MAX_ATTEMPTS = 3
+# Keep window items this long past their end so DynamoDB TTL can purge abandoned ones
+STATE_TTL_SECONDS = 24 * 3600
+
+
+class MemoryCoalesceStore:
+    """Process-local window state."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._window_end = None
+        self._pending = []
+
+    def open_window(self, window_end, now):
+        """Open a window unless one is open; return (opened, alarms held by the previous window)."""
+        with self._lock:
+            if self._window_end is not None and self._window_end > now:
+                return False, []
+            held, self._pending = self._pending, []
+            self._window_end = window_end
+            return True, held
+
+    def hold(self, alarm, now):
+        """Add alarm to the open window; return False if no window is open."""
+        with self._lock:
+            if self._window_end is None or self._window_end <= now:
+                return False
+            self._pending.append(alarm)
+            return True
+
+    def close_expired(self, now):
+        """Close the window if it has passed and return the alarms it held."""
+        with self._lock:
+            if self._window_end is None or self._window_end > now:
+                return []
+            held, self._pending = self._pending, []
+            self._window_end = None
+            return held
+
+    def requeue(self, alarms, now):
+        """Hold alarms again, ahead of any held since; a closed window is reopened as already passed."""
+        with self._lock:
+            self._pending = list(alarms) + self._pending
+            if self._window_end is None:
+                self._window_end = now
+
+
+class DynamoDBCoalesceStore:
+    """Window state in one DynamoDB item, updated with conditional writes.
+
+    The conditions on WindowEnd make concurrent invocations agree on whether a
+    window is open; "ExpiresAt" lets TTL purge the item a day after its window.
+    """
+
+    def __init__(self, table_name, key="coalesce#pushover", client=None):
+        self.table_name = table_name
+        self.key = key
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client("dynamodb")
+        return self._client
+
+    def _update(self, **kwargs):
+        try:
+            return self.client.update_item(TableName=self.table_name, Key={"CacheKey": {"S": self.key}}, **kwargs)
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return None
+
+    @staticmethod
+    def _held(response):
+        pending = response.get("Attributes", {}).get("Pending", {}).get("L", [])
+        return [json.loads(item["S"]) for item in pending]
+
+    def open_window(self, window_end, now):
+        response = self._update(
+            UpdateExpression="SET WindowEnd = :end, Pending = :empty, ExpiresAt = :expires",
+            ConditionExpression="attribute_not_exists(WindowEnd) OR WindowEnd <= :now",
+            ExpressionAttributeValues={
+                ":end": {"N": repr(window_end)},
+                ":now": {"N": repr(now)},
+                ":empty": {"L": []},
+                ":expires": {"N": str(int(window_end) + STATE_TTL_SECONDS)},
+            },
+            ReturnValues="ALL_OLD",
+        )
+        if response is None:
+            return False, []
+        return True, self._held(response)
+
+    def hold(self, alarm, now):
+        response = self._update(
+            UpdateExpression="SET Pending = list_append(Pending, :alarm)",
+            ConditionExpression="WindowEnd > :now",
+            ExpressionAttributeValues={
+                ":alarm": {"L": [{"S": json.dumps(alarm)}]},
+                ":now": {"N": repr(now)},
+            },
+        )
+        return response is not None
+
+    def close_expired(self, now):
+        response = self._update(
+            UpdateExpression="SET Pending = :empty REMOVE WindowEnd",
+            ConditionExpression="WindowEnd <= :now",
+            ExpressionAttributeValues={":now": {"N": repr(now)}, ":empty": {"L": []}},
+            ReturnValues="ALL_OLD",
+        )
+        if response is None:
+            return []
+        return self._held(response)
+
+    def requeue(self, alarms, now):
+        self._update(
+            UpdateExpression="SET Pending = list_append(:alarms, if_not_exists(Pending, :empty)), "
+                             "WindowEnd = if_not_exists(WindowEnd, :now), "
+                             "ExpiresAt = if_not_exists(ExpiresAt, :expires)",
+            ExpressionAttributeValues={
+                ":alarms": {"L": [{"S": json.dumps(alarm)} for alarm in alarms]},
+                ":empty": {"L": []},
+                ":now": {"N": repr(now)},
+                ":expires": {"N": str(int(now) + STATE_TTL_SECONDS)},
+            },
+        )
+
+
+def build_digest(alarms, window_seconds):
+    """Combine formatted alarms ({"title", "body", "state"}) into one notification."""
+    if len(alarms) == 1:
+        return alarms[0]
+    minutes = max(1, round(window_seconds / 60))
+    return {
+        "title": "{} alarms in {}m".format(len(alarms), minutes),
+        "body": "\n".join("- " + alarm["title"] for alarm in alarms),
+        "state": "ALARM" if any(a.get("state") == "ALARM" for a in alarms) else alarms[-1].get("state"),
+    }
+
+
+class AlarmCoalescer:
+    """Decide which formatted alarms to send now and which to hold for a digest.
+
+    A window of 0 seconds disables coalescing. If the store fails, alarms are sent
+    immediately rather than risk losing a notification.
+    """
+
+    def __init__(self, store, window_seconds):
+        self.store = store
+        self.window_seconds = window_seconds
+
+    def submit(self, alarm, post, now=None):
+        """Send alarm with post(notification) unless it is held for a digest.
+
+        Returns [post's result], or [] when alarm is held. Alarms held by a window
+        nobody flushed go out in the same digest, and are held again if post fails
+        as in flush(); alarm itself is not, since its caller sees the failure.
+        """
+        now = time.time() if now is None else now
+        held = self._open_or_hold(alarm, now)
+        if held is None:
+            return []
+        return [self._post(post, build_digest(held + [alarm], self.window_seconds), held, now)]
+
+    def _open_or_hold(self, alarm, now):
+        """Return None if alarm was held, else the alarms held by the previous window."""
+        if self.window_seconds <= 0:
+            return []
+        try:
+            for _ in range(MAX_ATTEMPTS):
+                opened, held = self.store.open_window(now + self.window_seconds, now)
+                if opened:
+                    return held
+                if self.store.hold(alarm, now):
+                    return None
+        except Exception as e:
+            logger.error("Alarm coalescing failed, sending immediately: %s", e)
+        return []
+
+    def flush(self, post, now=None):
+        """Send the digest of alarms held by a window that has passed with post(digest).
+
+        Returns [post's result], or [] when nothing is held. If post raises or its
+        result has a non-2xx "statusCode", the alarms are held again for the next
+        flush (or alarm) to send.
+        """
+        now = time.time() if now is None else now
+        held = self.store.close_expired(now)
+        if not held:
+            return []
+        return [self._post(post, build_digest(held, self.window_seconds), held, now)]
+
+    def _post(self, post, notification, held, now):
+        """Return post(notification), holding the alarms in held again if it fails."""
+        try:
+            result = post(notification)
+        except Exception:
+            self._requeue(held, now)
+            raise
+        if not 200 <= result.get("statusCode", 200) < 300:
+            self._requeue(held, now)
+        return result
+
+    def _requeue(self, held, now):
+        if not held:
+            return
+        logger.warning("Failed to send %d held alarms; holding them for the next flush", len(held))
+        try:
+            self.store.requeue(held, now)
+        except Exception as e:
+            logger.error("Failed to hold %d alarms again, they are lost: %s", len(held), e)
+
+
+def build_coalescer(window_seconds, table_name=None):
+    """Build an AlarmCoalescer backed by DynamoDB when table_name is set, else by memory."""
+    store = DynamoDBCoalesceStore(table_name) if table_name else MemoryCoalesceStore()
+    return AlarmCoalescer(store, window_seconds)
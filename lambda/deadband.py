@@ -0,0 +1,111 @@
+"""Skip publishing metric values that have not changed since they were last published.
+
+Each configured metric name has a heartbeat period in seconds. Per metric name
+and dimension set, a value is published when it differs from the last value
+published, or when it falls in a later heartbeat period (aligned to the epoch)
+than that value. Every heartbeat period that has readings therefore still gets
+its first reading, and every change is published. Over any period that is a
+whole multiple of the heartbeat, the published datapoints have the same
+Minimum and Maximum as the readings, and no period loses all of its
+datapoints, so alarms on those statistics evaluate exactly as before whatever
+their TreatMissingData. Average, Sum and SampleCount do change; do not
+configure metrics whose alarms or widgets read those.
+
+Only values that have been published are recorded, so a value is skipped only
+if it is already in CloudWatch for that period. State from another container
+that is out of date can cause extra publishes but never a wrong skip. The
+state is one entry in a TieredCache: memory in a warm container, with DynamoDB
+for cold starts when a table is configured.
+"""
+import json
+import time
+
+from cache import DynamoDBTier, MemoryTier, TieredCache
+from cloudwatch import epoch_seconds
+
+STATE_KEY = "deadband"
+# How long the last published values are kept; well beyond any heartbeat period
+STATE_TTL_SECONDS = 24 * 3600
+
+
+def load_heartbeats(heartbeats_json):
+    """Parse {metric name: heartbeat seconds} from JSON; None or "" configures no metric."""
+    heartbeats = json.loads(heartbeats_json) if heartbeats_json else {}
+    for metric_name, seconds in heartbeats.items():
+        if type(seconds) is not int or seconds <= 0:
+            raise ValueError("Heartbeat of {} must be a positive number of seconds, got {!r}".format(
+                metric_name, seconds))
+    return heartbeats
+
+
+class Deadband:
+    """Put metric values into a MetricBatch unless they are unchanged within their heartbeat period.
+
+    Use as a context manager around one invocation: the values put inside the
+    block are recorded as published when it exits without an exception. If the
+    batch fails to publish without raising, call discard() before the block ends.
+
+        with deadband, MetricBatch(METRIC_NAMESPACE) as batch:
+            deadband.put(batch, "Switch", True, "None", dimensions=dimensions)
+    """
+
+    def __init__(self, cache, heartbeats):
+        self.cache = cache
+        self.heartbeats = heartbeats
+        # Loaded on first use in each invocation: "name|dimensions" -> [value, heartbeat period number]
+        self._published = None
+        self._pending = {}
+        self.skipped = 0
+
+    def __enter__(self):
+        self._published = None
+        self._pending = {}
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+    def put(self, batch, metricName, value, unit, timestamp=None, dimensions=None):
+        """Add the datapoint to batch unless it can be skipped; return whether it was added."""
+        heartbeat = self.heartbeats.get(metricName)
+        if heartbeat:
+            key = "|".join([metricName] + ["{}={}".format(d["Name"], d["Value"]) for d in dimensions or ()])
+            at = time.time() if timestamp is None else epoch_seconds(timestamp)
+            latest = [(1 if value else 0) if type(value) == bool else value, int(at // heartbeat)]
+            last = self._pending.get(key)
+            if last is None:
+                if self._published is None:
+                    self._published = self.cache.get(STATE_KEY) or {}
+                last = self._published.get(key)
+            if last == latest:
+                self.skipped += 1
+                return False
+            self._pending[key] = latest
+        batch.put(metricName, value, unit, timestamp=timestamp, dimensions=dimensions)
+        return True
+
+    def commit(self):
+        """Record the values put since the last commit as published."""
+        if self._pending:
+            if self._published is None:
+                self._published = self.cache.get(STATE_KEY) or {}
+            # A new dict: the memory tier holds the previous one
+            self._published = dict(self._published, **self._pending)
+            self.cache.set(STATE_KEY, self._published)
+        self._pending = {}
+
+    def discard(self):
+        """Forget the values put since the last commit, e.g. when publishing them failed."""
+        self._pending = {}
+
+
+def build_deadband(heartbeats_json=None, table_name=None):
+    """Build a Deadband for the metrics in heartbeats_json, backed by DynamoDB when table_name is set."""
+    tiers = [MemoryTier()]
+    if table_name:
+        tiers.append(DynamoDBTier(table_name))
+    return Deadband(TieredCache(tiers, ttl=STATE_TTL_SECONDS), load_heartbeats(heartbeats_json))
@@ -0,0 +1,49 @@
+"""Concurrent per-record processing for handlers that receive batches of SNS records."""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on records processed in parallel
+MAX_WORKERS = 8
+
+
+class AllRecordsFailedError(RuntimeError):
+    """Raised when every record of an event failed, so Lambda retries the invocation."""
+
+    def __init__(self, results):
+        self.results = results
+        super().__init__("All {} record(s) failed: {}".format(
+            len(results), "; ".join(r["error"] for r in results)))
+
+
+def process_records(records, fn, max_workers=MAX_WORKERS):
+    """Call fn(record) for every record concurrently.
+
+    A record whose fn raises is logged and reported as {"error": ...} without
+    affecting the others. If some records succeeded the invocation does not fail,
+    so a Lambda retry cannot repeat notifications that were already delivered.
+
+    Returns:
+        list of fn results (or error dicts) in record order.
+
+    Raises:
+        AllRecordsFailedError: if there were records and every one of them failed.
+    """
+    if not records:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(records))) as executor:
+        futures = [executor.submit(fn, record) for record in records]
+
+    results = []
+    failed = 0
+    for index, future in enumerate(futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error("Failed to process record %d: %s", index, e)
+            results.append({"error": str(e)})
+            failed += 1
+    if failed == len(records):
+        raise AllRecordsFailedError(results)
+    return results
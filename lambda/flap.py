@@ -0,0 +1,107 @@
+"""Suppress notifications for alarms flapping between states.
+
+After a notification for an alarm is delivered (and recorded with mark_sent()),
+further state changes of the same alarm within the hysteresis window are
+suppressed and counted. A notification that fails to send is not recorded, so
+its retry is not suppressed. The count is
+merged into the next notification that is sent. A change into ALARM is never
+suppressed unless the last notification sent was already an ALARM, so a new
+alarm right after a recovery always gets through.
+
+The last suppressed notification is kept, and once the window has passed
+due() returns it if it left the alarm in another state than the one last
+notified (the dispatcher's scheduled flush sends it, and returns it again
+until it is recorded as sent). So a recovery suppressed
+after an alarm is delivered late rather than never.
+
+Entries live in a TieredCache keyed by channel and AlarmName and are evicted
+by TTL well after the window, so the suppressed count survives until the next
+notification.
+"""
+import time
+
+from cache import DynamoDBTier, MemoryTier, TieredCache
+
+# How long an alarm's flap state is kept after its last notification
+STATE_TTL_SECONDS = 24 * 3600
+
+
+class FlapSuppressor:
+    def __init__(self, cache, window_seconds, channel):
+        self.cache = cache
+        self.window_seconds = window_seconds
+        self.channel = channel
+
+    def _key(self, alarm_name):
+        return "flap#{}#{}".format(self.channel, alarm_name)
+
+    def check(self, alarm_name, state, now=None, notification=None):
+        """Decide whether to send a notification for alarm_name entering state.
+
+        notification is the rendered notification; if it is suppressed, it is kept
+        for due() to return once the window has passed. One that is to be sent is
+        not recorded here: call mark_sent() once it has been delivered.
+
+        Returns:
+            (send, suppressed): whether to send it, and if so how many notifications
+            for this alarm were suppressed since the last one sent.
+        """
+        if self.window_seconds <= 0 or not alarm_name:
+            return True, 0
+        now = time.time() if now is None else now
+        key = self._key(alarm_name)
+        entry = self.cache.get(key)
+        if entry is not None and now - entry["sent_at"] < self.window_seconds \
+                and (state != "ALARM" or entry["state"] == "ALARM"):
+            entry["suppressed"] += 1
+            entry["pending"] = notification
+            self.cache.set(key, entry)
+            return False, entry["suppressed"]
+        return True, entry["suppressed"] if entry else 0
+
+    def mark_sent(self, alarm_name, state, now=None):
+        """Record that a notification for alarm_name entering state was delivered; it opens a window."""
+        if self.window_seconds <= 0 or not alarm_name:
+            return
+        now = time.time() if now is None else now
+        self.cache.set(self._key(alarm_name), {"state": state, "sent_at": now, "suppressed": 0})
+
+    def due(self, now=None):
+        """Return [(notification, suppressed)] to send for alarms whose window has passed.
+
+        A suppressed notification is due when it was the last one suppressed and its
+        state differs from the last one sent; suppressed counts the notifications
+        suppressed before it. It stays due until mark_sent() records it.
+        """
+        if self.window_seconds <= 0:
+            return []
+        now = time.time() if now is None else now
+        due = []
+        for key in self.cache.keys(self._key("")):
+            entry = self.cache.get(key)
+            if entry is None or now - entry["sent_at"] < self.window_seconds:
+                continue
+            pending = entry.get("pending")
+            if not pending or pending.get("state") == entry["state"]:
+                continue
+            due.append((pending, entry["suppressed"] - 1))
+        return due
+
+
+def with_flap_note(formatted, suppressed, window_seconds):
+    """Return formatted with a line reporting the suppressed notifications."""
+    if not suppressed:
+        return formatted
+    note = "Flapping:  {} notification(s) suppressed (within {}m of the previous one)".format(
+        suppressed, max(1, round(window_seconds / 60)))
+    return dict(formatted, body=formatted["body"] + "\n" + note)
+
+
+def build_flap_suppressor(window_seconds, channel, table_name=None):
+    """Build a FlapSuppressor storing state in DynamoDB when table_name is set, else in memory.
+
+    With a table there is no memory tier in front of it: every container must see
+    the notifications sent by the others.
+    """
+    tiers = [DynamoDBTier(table_name)] if table_name else [MemoryTier()]
+    return FlapSuppressor(TieredCache(tiers, ttl=STATE_TTL_SECONDS), window_seconds, channel)
@@ -0,0 +1,332 @@
+"""In-process CloudWatch metrics store and alarm evaluator for local simulation.
+
+MetricStore answers put_metric_data like the boto3 CloudWatch client, so
+recording(store) routes put_cloudwatch and MetricBatch into it instead of
+CloudWatch. Each metric (namespace, name and exact dimension set) is kept as
+array("d") columns of epoch seconds and values, sorted lazily on read, plus
+sample count, minimum and maximum columns once it receives StatisticValues.
+
+AlarmDefinition and evaluate_alarm reproduce how CloudWatch evaluates a metric
+alarm: the period statistic, the comparison against the threshold, M out of N
+datapoints to alarm and TreatMissingData. Definitions can be loaded from the
+synthesized CloudFormation template (load_alarms), so captured telemetry can be
+replayed through nepenthes_log_puller to see which of the deployed alarms would
+fire (python -m benchmarks.alarm_replay).
+
+Not modelled: the extra lookback CloudWatch uses to fill gaps in the evaluation
+range, and evaluations between period boundaries.
+"""
+import bisect
+import contextlib
+import json
+import math
+import os
+from array import array
+
+import cloudwatch
+
+STATE_OK = "OK"
+STATE_ALARM = "ALARM"
+STATE_INSUFFICIENT_DATA = "INSUFFICIENT_DATA"
+
+TREAT_MISSING_BREACHING = "breaching"
+TREAT_MISSING_NOT_BREACHING = "notBreaching"
+TREAT_MISSING_IGNORE = "ignore"
+TREAT_MISSING_MISSING = "missing"
+
+COMPARISONS = {
+    "GreaterThanOrEqualToThreshold": lambda value, threshold: value >= threshold,
+    "GreaterThanThreshold": lambda value, threshold: value > threshold,
+    "LessThanThreshold": lambda value, threshold: value < threshold,
+    "LessThanOrEqualToThreshold": lambda value, threshold: value <= threshold,
+}
+
+
+def _epoch_seconds(timestamp):
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    return cloudwatch.epoch_seconds(timestamp)
+
+
+def _dimension_key(dimensions):
+    """Dimensions as a hashable key; CloudWatch matches the exact set, in any order."""
+    if isinstance(dimensions, dict):
+        return tuple(sorted(dimensions.items()))
+    return tuple(sorted((d["Name"], d["Value"]) for d in dimensions or []))
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of sorted values."""
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+def statistic(values, name):
+    """Compute a CloudWatch statistic (Average, Sum, Minimum, Maximum, SampleCount or pNN) of values."""
+    if name == "Average":
+        return sum(values) / len(values)
+    if name == "Sum":
+        return sum(values)
+    if name == "Minimum":
+        return min(values)
+    if name == "Maximum":
+        return max(values)
+    if name == "SampleCount":
+        return float(len(values))
+    if name.startswith("p"):
+        return _percentile(sorted(values), float(name[1:]))
+    raise ValueError("Unsupported statistic {}".format(name))
+
+
+class _Series:
+    """Datapoint columns of one metric; values hold each datapoint's Sum.
+
+    The counts, minimums and maximums columns are only kept once a datapoint
+    published as StatisticValues arrives; until then every datapoint is one sample.
+    """
+
+    __slots__ = ("times", "values", "counts", "minimums", "maximums", "_sorted")
+
+    def __init__(self):
+        self.times = array("d")
+        self.values = array("d")
+        self.counts = self.minimums = self.maximums = None
+        self._sorted = True
+
+    def append(self, time, value):
+        if self.times and time < self.times[-1]:
+            self._sorted = False
+        self.times.append(time)
+        self.values.append(value)
+        if self.counts is not None:
+            self.counts.append(1.0)
+            self.minimums.append(value)
+            self.maximums.append(value)
+
+    def append_set(self, time, count, total, minimum, maximum):
+        if self.counts is None:
+            self.counts = array("d", [1.0]) * len(self.values)
+            self.minimums = array("d", self.values)
+            self.maximums = array("d", self.values)
+        if self.times and time < self.times[-1]:
+            self._sorted = False
+        self.times.append(time)
+        self.values.append(total)
+        self.counts.append(count)
+        self.minimums.append(minimum)
+        self.maximums.append(maximum)
+
+    def statistic(self, first, last, name):
+        """Compute a statistic over datapoints [first, last)."""
+        if self.counts is None:
+            return statistic(self.values[first:last], name)
+        if name == "Sum":
+            return sum(self.values[first:last])
+        if name == "SampleCount":
+            return sum(self.counts[first:last])
+        if name == "Average":
+            return sum(self.values[first:last]) / sum(self.counts[first:last])
+        if name == "Minimum":
+            return min(self.minimums[first:last])
+        if name == "Maximum":
+            return max(self.maximums[first:last])
+        if name.startswith("p"):
+            raise ValueError("Percentiles are not available for metrics published as StatisticValues")
+        raise ValueError("Unsupported statistic {}".format(name))
+
+    def sort(self):
+        if self._sorted:
+            return
+        order = sorted(range(len(self.times)), key=self.times.__getitem__)
+        for column in self.__slots__[:-1]:
+            values = getattr(self, column)
+            if values is not None:
+                setattr(self, column, array("d", (values[i] for i in order)))
+        self._sorted = True
+
+
+class MetricStore:
+    """Time series of every datapoint put, keyed by namespace, metric name and dimensions."""
+
+    def __init__(self):
+        self._series = {}
+
+    def __len__(self):
+        return sum(len(series.times) for series in self._series.values())
+
+    def put(self, namespace, metric_name, value, timestamp, dimensions=None):
+        value = (1 if value else 0) if type(value) == bool else value
+        key = (namespace, metric_name, _dimension_key(dimensions))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        series.append(_epoch_seconds(timestamp), float(value))
+
+    def put_statistic_set(self, namespace, metric_name, statistic_values, timestamp, dimensions=None):
+        """Store a datapoint published as StatisticValues (SampleCount, Sum, Minimum, Maximum)."""
+        key = (namespace, metric_name, _dimension_key(dimensions))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        series.append_set(_epoch_seconds(timestamp), float(statistic_values["SampleCount"]),
+                          float(statistic_values["Sum"]), float(statistic_values["Minimum"]),
+                          float(statistic_values["Maximum"]))
+
+    def put_metric_data(self, Namespace, MetricData):
+        """Accept a PutMetricData request, so the store can stand in for the CloudWatch client."""
+        for datum in MetricData:
+            if "StatisticValues" in datum:
+                self.put_statistic_set(Namespace, datum["MetricName"], datum["StatisticValues"], datum["Timestamp"],
+                                       datum.get("Dimensions"))
+            else:
+                self.put(Namespace, datum["MetricName"], datum["Value"], datum["Timestamp"], datum.get("Dimensions"))
+        return {}
+
+    def metrics(self):
+        """Return [(namespace, metric name, {dimension: value})] for every stored series."""
+        return [(namespace, name, dict(dimensions)) for namespace, name, dimensions in self._series]
+
+    def time_range(self):
+        """Return (first, last) datapoint epoch seconds, or None if the store is empty."""
+        times = [t for series in self._series.values() for t in (min(series.times), max(series.times))]
+        return (min(times), max(times)) if times else None
+
+    def get_statistics(self, namespace, metric_name, dimensions, start, end, period, stat):
+        """Return [(period start, value)] for every period in [start, end) that has datapoints.
+
+        Periods are aligned to multiples of period since the epoch, like CloudWatch.
+        """
+        series = self._series.get((namespace, metric_name, _dimension_key(dimensions)))
+        if series is None:
+            return []
+        series.sort()
+        times = series.times
+        first = bisect.bisect_left(times, _epoch_seconds(start) // period * period)
+        # The period containing end is included whole
+        end = bisect.bisect_left(times, -(-_epoch_seconds(end) // period) * period)
+        datapoints = []
+        # One step per non-empty period, so long gaps cost nothing
+        while first < end:
+            period_start = times[first] // period * period
+            last = bisect.bisect_left(times, period_start + period, first, end)
+            datapoints.append((period_start, series.statistic(first, last, stat)))
+            first = last
+        return datapoints
+
+
+@contextlib.contextmanager
+def recording(store):
+    """Route put_cloudwatch and MetricBatch (api backend) into store for the duration of the block."""
+    client, backend = cloudwatch.cloud_watch, os.environ.get("METRIC_BACKEND")
+    cloudwatch.cloud_watch = store
+    os.environ["METRIC_BACKEND"] = cloudwatch.METRIC_BACKEND_API
+    try:
+        yield store
+    finally:
+        cloudwatch.cloud_watch = client
+        if backend is None:
+            os.environ.pop("METRIC_BACKEND", None)
+        else:
+            os.environ["METRIC_BACKEND"] = backend
+
+
+class AlarmDefinition:
+    """The parts of a CloudWatch metric alarm that decide its state."""
+
+    def __init__(self, name, namespace, metric_name, dimensions, period, statistic, comparison, threshold,
+                 evaluation_periods, datapoints_to_alarm=None, treat_missing_data=TREAT_MISSING_MISSING):
+        if comparison not in COMPARISONS:
+            raise ValueError("Unsupported comparison operator {}".format(comparison))
+        self.name = name
+        self.namespace = namespace
+        self.metric_name = metric_name
+        self.dimensions = dict(dimensions)
+        self.period = period
+        self.statistic = statistic
+        self.comparison = comparison
+        self.threshold = threshold
+        self.evaluation_periods = evaluation_periods
+        self.datapoints_to_alarm = datapoints_to_alarm or evaluation_periods
+        self.treat_missing_data = treat_missing_data
+
+    @classmethod
+    def from_cloudformation(cls, logical_id, properties):
+        """Build from the Properties of an AWS::CloudWatch::Alarm resource."""
+        return cls(
+            name=properties.get("AlarmName", logical_id),
+            namespace=properties["Namespace"],
+            metric_name=properties["MetricName"],
+            dimensions={d["Name"]: d["Value"] for d in properties.get("Dimensions", [])},
+            period=int(properties["Period"]),
+            statistic=properties.get("Statistic") or properties["ExtendedStatistic"],
+            comparison=properties["ComparisonOperator"],
+            threshold=float(properties["Threshold"]),
+            evaluation_periods=int(properties["EvaluationPeriods"]),
+            datapoints_to_alarm=int(properties["DatapointsToAlarm"]) if "DatapointsToAlarm" in properties else None,
+            treat_missing_data=properties.get("TreatMissingData", TREAT_MISSING_MISSING),
+        )
+
+    def breaches(self, value):
+        return COMPARISONS[self.comparison](value, self.threshold)
+
+    def state(self, datapoints, previous):
+        """Return the state for one evaluation range.
+
+        Missing datapoints count as breaching or not breaching when TreatMissingData
+        says so. Otherwise ("missing" and "ignore") a range with gaps alarms when
+        every present datapoint breaches, up to datapoints_to_alarm of them; a range
+        with no datapoints at all is INSUFFICIENT_DATA ("missing") or keeps the
+        previous state ("ignore").
+
+        Args:
+            datapoints: the evaluation_periods period values, oldest first, None where missing.
+            previous: the alarm state before this evaluation.
+        """
+        missing = sum(1 for value in datapoints if value is None)
+        present = len(datapoints) - missing
+        breaching = sum(1 for value in datapoints if value is not None and self.breaches(value))
+        required = self.datapoints_to_alarm
+        if self.treat_missing_data == TREAT_MISSING_BREACHING:
+            breaching += missing
+        elif self.treat_missing_data != TREAT_MISSING_NOT_BREACHING:
+            if present == 0:
+                return previous if self.treat_missing_data == TREAT_MISSING_IGNORE else STATE_INSUFFICIENT_DATA
+            required = min(required, present)
+        return STATE_ALARM if breaching >= required else STATE_OK
+
+
+def evaluate_alarm(store, alarm, start, end):
+    """Replay alarm over the datapoints in store, evaluating it at the end of every period.
+
+    The alarm starts in INSUFFICIENT_DATA at start, like a newly created alarm.
+
+    Returns:
+        list of (epoch seconds, old state, new state), one per state change.
+    """
+    period = alarm.period
+    first = _epoch_seconds(start) // period * period
+    end = _epoch_seconds(end)
+    values = dict(store.get_statistics(alarm.namespace, alarm.metric_name, alarm.dimensions,
+                                       first - (alarm.evaluation_periods - 1) * period, end, period, alarm.statistic))
+    transitions = []
+    state = STATE_INSUFFICIENT_DATA
+    evaluated_at = first + period
+    while evaluated_at <= end:
+        window = [values.get(evaluated_at - (i + 1) * period) for i in reversed(range(alarm.evaluation_periods))]
+        new_state = alarm.state(window, state)
+        if new_state != state:
+            transitions.append((evaluated_at, state, new_state))
+            state = new_state
+        evaluated_at += period
+    return transitions
+
+
+def load_alarms(template_path):
+    """Return an AlarmDefinition for every metric alarm in a synthesized CloudFormation template."""
+    with open(template_path) as f:
+        resources = json.load(f).get("Resources", {})
+    return [
+        AlarmDefinition.from_cloudformation(logical_id, resource["Properties"])
+        for logical_id, resource in resources.items()
+        if resource["Type"] == "AWS::CloudWatch::Alarm" and "MetricName" in resource["Properties"]
+    ]
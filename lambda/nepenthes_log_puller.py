@@ -1,59 +1,231 @@
 import datetime
+import functools
+import json
 import logging
 import os
-from cloudwatch import put_cloudwatch
+from archive import ArchiveWriter, open_archive_store
+from cloudwatch import MetricBatch, MetricPublishError, timestamp_rejection
+from deadband import build_deadband
+from rollup import build_rollups
+from telemetry import PayloadError, parse_payload
 
 logger = logging.getLogger(__name__)
 
 METRIC_NAMESPACE = os.environ["METRIC_NAMESPACE"]
+# Home used for payloads that do not carry one (the IoT rule adds it from the topic)
+DEFAULT_HOME = os.environ.get("HOME_NAME", "nhome")
+
+# Slowly varying metrics are only republished on change or once per heartbeat period
+deadband = build_deadband(os.environ.get("METRIC_DEADBAND"), os.environ.get("METRIC_STATE_TABLE"))
+# Every parsed reading is also archived here when set (s3://bucket/prefix/ or a directory)
+archive_store = open_archive_store(os.environ.get("TELEMETRY_ARCHIVE"))
+# Hourly and daily rollups of every valid reading, when ROLLUP_TABLE is set
+rollups = build_rollups(os.environ.get("ROLLUP_TABLE"))
+
+
+def _put_meter(put, dimensions, reading, timestamp):
+    put("Valid", reading.valid, "None", timestamp=timestamp, dimensions=dimensions)
+    if not reading.valid:
+        return
+    if timestamp.hour in [0, 6, 12, 18] and timestamp.minute < 15 and reading.battery is not None:
+        put("Battery", reading.battery, "Percent", timestamp=timestamp, dimensions=dimensions)
+    put("Humidity", reading.humidity, "Percent", timestamp=timestamp, dimensions=dimensions)
+    put("Temperature", reading.temperature, "None", timestamp=timestamp, dimensions=dimensions)
+    if reading.desired_temperature is not None:
+        put("DesiredTemperature", reading.desired_temperature, "None", timestamp=timestamp, dimensions=dimensions)
+    if reading.temperature_diff is not None:
+        put("TemperatureDiff", reading.temperature_diff, "None", timestamp=timestamp, dimensions=dimensions)
+
+
+def _put_plug(put, dimensions, reading, timestamp):
+    put("Valid", reading.valid, "None", timestamp=timestamp, dimensions=dimensions)
+    if not reading.valid:
+        return
+    put("Switch", reading.switch, "None", timestamp=timestamp, dimensions=dimensions)
+    put("Power", reading.power, "None", timestamp=timestamp, dimensions=dimensions)
+
+
+# (Telemetry attribute, dimension name, publisher) for each kind of device reading
+DEVICE_KINDS = (
+    ("meters", "Meter", _put_meter),
+    ("plugs", "Plug", _put_plug),
+)
+
+
+def put_telemetry(batch, telemetry, now=None, deadband=None, archive=None, rollups=None):
+    """Add the metrics of a parsed payload to batch, dimensioned by its Home.
+
+    Heartbeat, CoolerFrozen and readings without a Datetime are timestamped now
+    (the current time unless given, e.g. when simulating captured telemetry).
+    With a Deadband, unchanged values of the metrics it is configured for are skipped.
+    With an ArchiveWriter, every meter and plug reading is also archived, and
+    with a RollupUpdater, added to the hourly and daily rollups.
+    """
+    home_dimension = {"Name": "Home", "Value": telemetry.home}
+    put = batch.put if deadband is None else functools.partial(deadband.put, batch)
 
-def lambda_handler(event, context):
-    logger.info("Event: %s", event)
-    meters = event.get("meters", {}).get("v0", {})
-    plugs = event.get("plugs", {}).get("v0", {})
-    should_heartbeat = event["should_heartbeat"]
-    
     # Publish Heartbeat metric
-    put_cloudwatch(METRIC_NAMESPACE, "Heartbeat", should_heartbeat, "None")
+    put("Heartbeat", telemetry.should_heartbeat, "None", timestamp=now, dimensions=[home_dimension])
 
     # Publish Cooler Frozen metric
-    cooler_frozen = event.get("cooler_frozen")
-    if cooler_frozen is not None:
-        put_cloudwatch(METRIC_NAMESPACE, "CoolerFrozen", cooler_frozen, "None")
-
-    # Publish Meter metrics
-    for alias, data in meters.items():
-        dimensions = [{
-            "Name": "Meter",
-            "Value": alias
-        }]
-        valid = data["Valid"]
-        timestamp = datetime.datetime.fromisoformat(data["Datetime"]) if "Datetime" in data else datetime.datetime.now()
-        put_cloudwatch(METRIC_NAMESPACE, "Valid", valid, "None", timestamp=timestamp, dimensions=dimensions)
-        if not valid:
+    if telemetry.cooler_frozen is not None:
+        put("CoolerFrozen", telemetry.cooler_frozen, "None", timestamp=now, dimensions=[home_dimension])
+
+    # Publish Meter and Plug metrics
+    for attribute, dimension_name, put_reading in DEVICE_KINDS:
+        for reading in getattr(telemetry, attribute):
+            dimensions = [home_dimension, {
+                "Name": dimension_name,
+                "Value": reading.alias
+            }]
+            put_reading(put, dimensions, reading, reading.timestamp or now or datetime.datetime.now())
+
+    if archive is not None:
+        archive.add_telemetry(telemetry, now=now)
+    if rollups is not None:
+        rollups.add_telemetry(telemetry, now=now)
+
+
+def put_home_metrics(batch, event, now=None, deadband=None, archive=None, rollups=None):
+    """Validate a raw payload and add its metrics to batch (see put_telemetry).
+
+    Raises:
+        PayloadError: if the payload is malformed; nothing is added to batch.
+    """
+    put_telemetry(batch, parse_payload(event, DEFAULT_HOME), now=now, deadband=deadband, archive=archive,
+                  rollups=rollups)
+
+
+def replay_home_metrics(batch, payloads, home=None, now=None, archive=None, rollups=None):
+    """Add the meter and plug readings of buffered payloads to batch, oldest first.
+
+    Used to catch up on telemetry queued on the Pi during an outage. Readings are
+    de-duplicated by home, device and Datetime, and readings CloudWatch would reject
+    for their timestamp are skipped, as are malformed payloads. Heartbeat and
+    CoolerFrozen describe the state at send time rather than at the reading's
+    Datetime, so they are not replayed. Payloads without a home of their own use
+    home (the envelope's, added by the IoT rule). With an ArchiveWriter and a
+    RollupUpdater, every de-duplicated reading is archived and rolled up,
+    including those too old for CloudWatch.
+
+    Returns:
+        dict with the number of "accepted" readings, "datapoints" added to batch, and
+        "skipped" readings by reason ("duplicate", "no_timestamp", "too_old", "too_new")
+        plus "invalid" payloads.
+    """
+    skipped = {"duplicate": 0, "no_timestamp": 0, "too_old": 0, "too_new": 0, "invalid": 0}
+    readings = {}
+    for payload in payloads:
+        try:
+            telemetry = parse_payload(payload, home or DEFAULT_HOME, require_heartbeat=False)
+        except PayloadError as e:
+            logger.error("Skipping malformed replayed payload: %s", e)
+            skipped["invalid"] += 1
             continue
-        if timestamp.hour in [0, 6, 12, 18] and timestamp.minute < 15:
-            put_cloudwatch(METRIC_NAMESPACE, "Battery", data["BatteryVoltage"], "Percent", timestamp=timestamp, dimensions=dimensions)
-        put_cloudwatch(METRIC_NAMESPACE, "Humidity", data["Humidity"], "Percent", timestamp=timestamp, dimensions=dimensions)
-        put_cloudwatch(METRIC_NAMESPACE, "Temperature", data["Temperature"], "None", timestamp=timestamp, dimensions=dimensions)
-        desired = data.get("Desired", {})
-        if "Temperature" in desired:
-            put_cloudwatch(METRIC_NAMESPACE, "DesiredTemperature", desired["Temperature"], "None", timestamp=timestamp, dimensions=dimensions)
-        if "TemperatureDiff" in desired:
-            put_cloudwatch(METRIC_NAMESPACE, "TemperatureDiff", desired["TemperatureDiff"], "None", timestamp=timestamp, dimensions=dimensions)
-        
-    # Publish Plug metrics
-    for alias, data in plugs.items():
-        dimensions = [{
-            "Name": "Plug",
-            "Value": alias
-        }]
-        valid = data["Valid"]
-        timestamp = datetime.datetime.fromisoformat(data["Datetime"]) if "Datetime" in data else datetime.datetime.now()
-        put_cloudwatch(METRIC_NAMESPACE, "Valid", valid, "None", timestamp=timestamp, dimensions=dimensions)
-        if not valid:
+        for attribute, dimension_name, put_reading in DEVICE_KINDS:
+            for reading in getattr(telemetry, attribute):
+                if reading.timestamp is None:
+                    skipped["no_timestamp"] += 1
+                    continue
+                key = (telemetry.home, dimension_name, reading.alias, reading.timestamp)
+                if key in readings:
+                    skipped["duplicate"] += 1
+                    continue
+                readings[key] = (attribute, put_reading, reading)
+
+    accepted = 0
+    datapoints = len(batch)
+    for (home, dimension_name, alias, timestamp), (attribute, put_reading, reading) in sorted(readings.items(), key=lambda item: item[0][3]):
+        if archive is not None:
+            archive.append(home, attribute, reading)
+        if rollups is not None:
+            rollups.add(home, attribute, reading)
+        rejection = timestamp_rejection(timestamp, now)
+        if rejection:
+            skipped[rejection] += 1
             continue
-        put_cloudwatch(METRIC_NAMESPACE, "Switch", data["Switch"], "None", timestamp=timestamp, dimensions=dimensions)
-        put_cloudwatch(METRIC_NAMESPACE, "Power", data["Power"], "None", timestamp=timestamp, dimensions=dimensions)
+        dimensions = [{"Name": "Home", "Value": home}, {"Name": dimension_name, "Value": alias}]
+        put_reading(batch.put, dimensions, reading, timestamp)
+        accepted += 1
+    return {"accepted": accepted, "datapoints": len(batch) - datapoints, "skipped": skipped}
+
+
+def _is_sqs_event(event):
+    records = event.get("Records")
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+
+def _handle_sqs_batch(event):
+    """Merge the metrics of every queued payload into one batch.
+
+    A record that cannot be parsed or fails validation contributes no metrics and
+    is reported back via batchItemFailures, so SQS redelivers only that message
+    and moves it to the dead-letter queue once its receives run out. If
+    publishing fails, every record is reported so none of the metrics are lost.
+    """
+    failures = []
+    accepted = []
+    with deadband, rollups, ArchiveWriter(archive_store) as archive, MetricBatch(METRIC_NAMESPACE) as batch:
+        for record in event["Records"]:
+            staged = MetricBatch(METRIC_NAMESPACE, backend=batch.backend)
+            try:
+                put_home_metrics(staged, json.loads(record["body"]), deadband=deadband, archive=archive,
+                                 rollups=rollups)
+            except Exception as e:
+                logger.error("Rejecting message %s: %s", record["messageId"], e)
+                failures.append(record["messageId"])
+                continue
+            batch.extend(staged)
+            accepted.append(record["messageId"])
+        try:
+            batch.flush()
+        except MetricPublishError as e:
+            logger.error("Failed to publish metrics for %d messages: %s", len(accepted), e)
+            failures.extend(accepted)
+            # The redelivered messages must publish their values again, and are archived and rolled up then
+            deadband.discard()
+            rollups.discard()
+            archive.discard()
+
+    logger.info("Processed %d messages, %d failed", len(event["Records"]), len(failures))
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+
+def lambda_handler(event, context):
+    """Publish metrics for IoT telemetry.
+
+    Accepts a single payload (direct IoT rule invocation), {"homes": [payload, ...]},
+    an SQS batch of payloads when ingestion is buffered through a queue, or
+    {"replay": [payload, ...]} with a backlog of payloads buffered on the Pi.
+    Malformed payloads are logged and publish nothing. Live payloads go through
+    the deadband (METRIC_DEADBAND); a replayed backlog is published in full.
+    Every reading is also archived when TELEMETRY_ARCHIVE is set, and rolled up
+    when ROLLUP_TABLE is set, once the invocation succeeds.
+    """
+    if "replay" in event:
+        logger.info("Replaying %d payloads", len(event["replay"]))
+        with rollups, ArchiveWriter(archive_store) as archive, MetricBatch(METRIC_NAMESPACE) as batch:
+            counts = replay_home_metrics(batch, event["replay"], home=event.get("home"), archive=archive,
+                                         rollups=rollups)
+        logger.info("Replay result: %s", counts)
+        return counts
+
+    logger.info("Event: %s", event)
+    if _is_sqs_event(event):
+        return _handle_sqs_batch(event)
+
+    payloads = event["homes"] if "homes" in event else [event]
+
+    # Validate every payload before publishing any; retrying cannot fix a malformed one
+    parsed = []
+    for payload in payloads:
+        try:
+            parsed.append(parse_payload(payload, DEFAULT_HOME))
+        except PayloadError as e:
+            logger.error("Rejecting payload: %s", e)
+
+    with deadband, rollups, ArchiveWriter(archive_store) as archive, MetricBatch(METRIC_NAMESPACE) as batch:
+        for telemetry in parsed:
+            put_telemetry(batch, telemetry, deadband=deadband, archive=archive, rollups=rollups)
 
     return
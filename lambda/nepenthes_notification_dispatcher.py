@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import re
+
+from alarm_formatter import render_alarm
+from cloudwatch import MetricBatch
+from fanout import process_records
+from flap import build_flap_suppressor, with_flap_note
+from sinks import build_sinks
+
+logger = logging.getLogger(__name__)
+
+METRIC_NAMESPACE = os.environ["METRIC_NAMESPACE"]
+
+# Routing rules: each alarm goes to every sink with a matching rule. A rule may
+# restrict "states" (NewStateValue), exclude states ("exclude_states") or match
+# AlarmName against a regex ("alarm_pattern"). Override with NOTIFICATION_ROUTES (JSON).
+DEFAULT_ROUTES = [
+    # Pushover is for things that need attention now; recoveries only go to email
+    {"sink": "pushover", "exclude_states": ["OK"]},
+    {"sink": "email"},
+]
+
+# Repeated state changes of one alarm within this many seconds are suppressed per sink; 0 disables
+FLAP_WINDOW_SECONDS = int(os.environ.get("FLAP_WINDOW_SECONDS", 0))
+
+
+class Route:
+    def __init__(self, sink, states=None, exclude_states=None, alarm_pattern=None):
+        self.sink = sink
+        self.states = set(states) if states is not None else None
+        self.exclude_states = set(exclude_states or [])
+        self.alarm_pattern = re.compile(alarm_pattern) if alarm_pattern else None
+
+    def matches(self, formatted):
+        state = formatted.get("state")
+        if self.states is not None and state not in self.states:
+            return False
+        if state in self.exclude_states:
+            return False
+        if self.alarm_pattern is not None and not self.alarm_pattern.search(formatted.get("alarm_name") or ""):
+            return False
+        return True
+
+
+def load_routes(sinks, routes_json=None):
+    """Build Routes from JSON (or DEFAULT_ROUTES), dropping those for sinks that are not configured."""
+    routes = []
+    for rule in json.loads(routes_json) if routes_json else DEFAULT_ROUTES:
+        if rule["sink"] not in sinks:
+            logger.warning("Ignoring route to unconfigured sink %s", rule["sink"])
+            continue
+        routes.append(Route(**rule))
+    return routes
+
+
+sinks = build_sinks()
+routes = load_routes(sinks, os.environ.get("NOTIFICATION_ROUTES"))
+flap_suppressors = {
+    name: build_flap_suppressor(FLAP_WINDOW_SECONDS, name, os.environ.get("FLAP_TABLE"))
+    for name in sinks
+}
+
+
+def _route(record):
+    """Render record for every configured channel from one parse and pick its sinks."""
+    rendered = render_alarm(record, tuple({sink.channel for sink in sinks.values()}))
+    any_rendering = next(iter(rendered.values()), {})
+    matched = []
+    for route in routes:
+        if route.sink not in matched and route.matches(any_rendering):
+            matched.append(route.sink)
+    return [(sinks[name], rendered[sinks[name].channel]) for name in matched]
+
+
+def _send(sink, formatted, suppressed):
+    """Send formatted to sink and record it for flap suppression once it is delivered."""
+    result = sink.send(with_flap_note(formatted, suppressed, FLAP_WINDOW_SECONDS))
+    if 200 <= result.get("statusCode", 500) < 300:
+        flap_suppressors[sink.name].mark_sent(formatted.get("alarm_name"), formatted.get("state"))
+    return result
+
+
+def _deliver(task):
+    sink, formatted = task
+    send, suppressed = flap_suppressors[sink.name].check(formatted.get("alarm_name"), formatted.get("state"),
+                                                         notification=formatted)
+    if not send:
+        logger.info("Suppressing flapping %s for %s (%d suppressed)", formatted["title"], sink.name, suppressed)
+        return {"sink": sink.name, "statusCode": 200, "suppressed": True}
+    return dict(_send(sink, formatted, suppressed), sink=sink.name)
+
+
+def _send_due(sink):
+    """Send the state changes suppressed for flapping whose window has passed."""
+    results = []
+    for formatted, suppressed in flap_suppressors[sink.name].due():
+        try:
+            result = _send(sink, formatted, suppressed)
+        except Exception as e:
+            logger.error("Failed to send %s to %s: %s", formatted["title"], sink.name, e)
+            result = {"error": str(e)}
+        results.append(dict(result, sink=sink.name))
+    return results
+
+
+def _flush(_):
+    results = []
+    with MetricBatch(METRIC_NAMESPACE) as batch:
+        for sink in sinks.values():
+            results.extend(_send_due(sink))
+            results.extend(dict(result, sink=sink.name) for result in sink.flush())
+            for metric, value, unit in sink.poll():
+                batch.put(metric, value, unit, dimensions=[{"Name": "Channel", "Value": sink.name}])
+    return results
+
+
+def lambda_handler(event, _):
+    """Deliver every alarm record to the sinks its routes select, all in parallel.
+
+    Each record is parsed once; every (record, sink) delivery runs concurrently. The
+    scheduled {"flush": true} event delivers notifications sinks have held back and
+    state changes suppressed as flapping whose window has passed, and publishes the
+    sinks' delivery metrics (e.g. Pushover acknowledgements).
+
+    Returns:
+        dict with "results", one dict per delivery tagged with its "sink" (or an
+        {"error"} dict), and "statusCode", the worst of them (a delivery that raised
+        counts as 500).
+    """
+    logger.info("Event: %s", event)
+
+    if event.get("flush"):
+        results = _flush(event)
+    else:
+        tasks = [task for record in event.get("Records", []) for task in _route(record)]
+        results = process_records(tasks, _deliver)
+        with MetricBatch(METRIC_NAMESPACE) as batch:
+            for name in sinks:
+                batch.put("NotificationsSuppressed", sum(1 for r in results if r.get("sink") == name and r.get("suppressed")),
+                          "Count", dimensions=[{"Name": "Channel", "Value": name}])
+    return {
+        'statusCode': max((r.get("statusCode", 500) for r in results), default=200),
+        'results': results,
+    }
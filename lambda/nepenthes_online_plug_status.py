@@ -1,33 +1,76 @@
+import logging
 import os
-import requests
-from cloudwatch import put_cloudwatch
-from switchbot import build_headers, call_with_retry, DEVICE_STATUS_ENDPOINT_FORMAT
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudwatch import MetricBatch
+from deadband import build_deadband
+from switchbot import (
+    build_headers, call_with_retry, sb_client, request_budget,
+    DEVICE_STATUS_ENDPOINT_FORMAT, PRIORITY_LOW, BUDGET_EXHAUSTED,
+)
 
 SB_TOKEN = os.environ["SB_TOKEN"]
 SB_SECRET_KEY = os.environ["SB_SECRET_KEY"]
 METRIC_NAMESPACE = os.environ["METRIC_NAMESPACE"]
+HOME_NAME = os.environ.get("HOME_NAME", "nhome")
+
+logger = logging.getLogger(__name__)
 
 DEVICE_NAMES = ["N. Pi", "N. Fan"]
+# Upper bound on devices polled in parallel
+MAX_POLL_WORKERS = 8
+
+# Slowly varying metrics are only republished on change or once per heartbeat period
+deadband = build_deadband(os.environ.get("METRIC_DEADBAND"), os.environ.get("METRIC_STATE_TABLE"))
 
 def _get_device_status(device_id):
     device_status_endpoint = DEVICE_STATUS_ENDPOINT_FORMAT.format(device_id)
-    response = requests.get(device_status_endpoint, headers=build_headers(SB_TOKEN, SB_SECRET_KEY), timeout=10).json()
+    response = sb_client.get(device_status_endpoint, headers=build_headers(SB_TOKEN, SB_SECRET_KEY))
     if response.get("statusCode", 0) != 100:
         raise RuntimeError("Unable to status of device id: {}, response: {}".format(device_id, response))
     return response.get("body", {})
 
 def lambda_handler(event, context):
-    for device_name in DEVICE_NAMES:
-        dimensions = [{
-            "Name": "Plug",
-            "Value": device_name.replace(" ", ""),
-        }]
-        try:
-            response = call_with_retry(SB_TOKEN, SB_SECRET_KEY, device_name, _get_device_status)
-        except Exception as e:
-            put_cloudwatch(METRIC_NAMESPACE, "Valid", False, "None", dimensions=dimensions)
-            raise e
-        put_cloudwatch(METRIC_NAMESPACE, "Valid", True, "None", dimensions=dimensions)
-        put_cloudwatch(METRIC_NAMESPACE, "Switch", response["power"] == "on", "None", dimensions=dimensions)
-        put_cloudwatch(METRIC_NAMESPACE, "Power", response["electricCurrent"] if response["power"] == "on" else 0, "None", dimensions=dimensions)
-    return response
+    """Poll every device concurrently and publish its Valid/Switch/Power metrics.
+
+    A device that fails all retries only gets Valid=0; the others are still published.
+    Unchanged values of the metrics in METRIC_DEADBAND are skipped.
+    The poll is skipped when the SwitchBot request budget is down to the share
+    reserved for high-priority calls such as powering the Pi back on.
+    """
+    calls_before = request_budget.used()
+    if request_budget.state(PRIORITY_LOW) == BUDGET_EXHAUSTED:
+        logger.warning("Skipping poll, SwitchBot daily quota is reserved for high-priority calls (used %d)", calls_before)
+        with MetricBatch(METRIC_NAMESPACE) as batch:
+            batch.put("SwitchBotApiCalls", 0, "Count")
+        return {"skipped": True}
+
+    with ThreadPoolExecutor(max_workers=min(MAX_POLL_WORKERS, len(DEVICE_NAMES))) as executor:
+        futures = {
+            device_name: executor.submit(call_with_retry, SB_TOKEN, SB_SECRET_KEY, device_name, _get_device_status, priority=PRIORITY_LOW)
+            for device_name in DEVICE_NAMES
+        }
+
+    results = {}
+    with deadband, MetricBatch(METRIC_NAMESPACE) as batch:
+        batch.put("SwitchBotApiCalls", max(0, request_budget.used() - calls_before), "Count")
+        for device_name, future in futures.items():
+            dimensions = [{
+                "Name": "Home",
+                "Value": HOME_NAME,
+            }, {
+                "Name": "Plug",
+                "Value": device_name.replace(" ", ""),
+            }]
+            try:
+                response = future.result()
+            except Exception as e:
+                logger.error("Failed to get status of %s: %s", device_name, e)
+                deadband.put(batch, "Valid", False, "None", dimensions=dimensions)
+                results[device_name] = {"error": str(e)}
+                continue
+            deadband.put(batch, "Valid", True, "None", dimensions=dimensions)
+            deadband.put(batch, "Switch", response["power"] == "on", "None", dimensions=dimensions)
+            deadband.put(batch, "Power", response["electricCurrent"] if response["power"] == "on" else 0, "None", dimensions=dimensions)
+            results[device_name] = response
+    return results
@@ -0,0 +1,296 @@
+"""Pushover API client with connection reuse, retries and emergency receipt tracking.
+
+Emergency-priority (2) messages are repeated by Pushover until acknowledged or
+expired, and the API returns a receipt for each. Receipts are persisted with
+ReceiptTracker so a later invocation (the dispatcher's scheduled flush) can poll
+their acknowledgement status and report it as metrics.
+"""
+import json
+import logging
+import threading
+import time
+
+from aws_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://api.pushover.net/1"
+MESSAGES_PATH = "/messages.json"
+RECEIPT_PATH_FORMAT = "/receipts/{}.json"
+
+DEFAULT_POOL_SIZE = 4
+# Per attempt; with the backoff below a send gives up within the Lambda timeout
+DEFAULT_TIMEOUT = 3
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_MAX_BACKOFF = 2.0
+
+# Keep receipts this long past their expiry before dropping them unpolled
+RECEIPT_GRACE_SECONDS = 3600
+# Keep the receipts item this long after its last update so DynamoDB TTL can purge abandoned ones
+STATE_TTL_SECONDS = 24 * 3600
+
+
+def _json_body(response):
+    try:
+        return json.loads(response.text)
+    except json.JSONDecodeError:
+        return {"raw": response.text}
+
+
+def _is_retryable(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+class PushoverClient:
+    """HTTP client for the Pushover API backed by a pooled keep-alive session.
+
+    The sink using it lives at module level, so warm invocations reuse the TLS
+    connection to api.pushover.net. 429 and 5xx responses and connection errors
+    are retried with bounded exponential backoff; a Retry-After header is
+    honoured when it fits within the backoff bound, and a 429 caused by the
+    exhausted monthly message limit (X-Limit-App-Remaining: 0) is not retried.
+    A connection error after the request was sent may duplicate an alert, which
+    is preferred to losing a critical one.
+    """
+
+    def __init__(self, token, api_base=API_BASE, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_base=DEFAULT_BACKOFF_BASE, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.token = token
+        self.api_base = api_base
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        # Monthly message limit of the application, from the X-Limit-App-* headers of the last response
+        self.app_limit = None
+        self.app_remaining = None
+        self.app_reset = None
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _update_limits(self, response):
+        headers = response.headers
+        try:
+            if "X-Limit-App-Remaining" in headers:
+                self.app_limit = int(headers["X-Limit-App-Limit"])
+                self.app_remaining = int(headers["X-Limit-App-Remaining"])
+                self.app_reset = int(headers["X-Limit-App-Reset"])
+        except (KeyError, ValueError) as e:
+            logger.warning("Ignoring malformed Pushover rate limit headers: %s", e)
+
+    def _backoff(self, attempt):
+        return min(self.backoff_base * 2 ** attempt, self.max_backoff)
+
+    def _retry_delay(self, response, attempt):
+        """Seconds to wait before retrying response, or None if retrying cannot help."""
+        if response.status_code == 429:
+            if self.app_remaining == 0:
+                logger.error("Pushover monthly message limit reached; resets at %s", self.app_reset)
+                return None
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    return self._backoff(attempt)
+                return delay if delay <= self.max_backoff else None
+        return self._backoff(attempt)
+
+    def _request(self, method, path, **kwargs):
+        import requests
+
+        url = self.api_base + path
+        for attempt in range(self.max_attempts):
+            last_attempt = attempt + 1 == self.max_attempts
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("Pushover request failed (%s); retrying in %.1fs", e, delay)
+            else:
+                self._update_limits(response)
+                if not _is_retryable(response.status_code) or last_attempt:
+                    return response
+                delay = self._retry_delay(response, attempt)
+                if delay is None:
+                    return response
+                logger.warning("Pushover returned %d; retrying in %.1fs", response.status_code, delay)
+            time.sleep(delay)
+
+    def send_message(self, **fields):
+        """POST a message (user, title, message, priority, ...) and return {"statusCode", "body"}."""
+        response = self._request("POST", MESSAGES_PATH, data=dict(fields, token=self.token))
+        return {"statusCode": response.status_code, "body": _json_body(response)}
+
+    def get_receipt(self, receipt):
+        """Return {"statusCode", "body"} with the acknowledgement status of an emergency receipt."""
+        response = self._request("GET", RECEIPT_PATH_FORMAT.format(receipt), params={"token": self.token})
+        return {"statusCode": response.status_code, "body": _json_body(response)}
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class MemoryReceiptStore:
+    """Process-local receipt state."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._receipts = {}
+
+    def add(self, receipt, entry):
+        with self._lock:
+            self._receipts[receipt] = entry
+
+    def pending(self):
+        """Return {receipt: entry} for every receipt still being tracked."""
+        with self._lock:
+            return dict(self._receipts)
+
+    def remove(self, receipt):
+        with self._lock:
+            self._receipts.pop(receipt, None)
+
+
+class DynamoDBReceiptStore:
+    """Receipts in a map attribute of one DynamoDB item.
+
+    Every receipt is its own map entry, so concurrent invocations can add and
+    remove receipts without overwriting each other. Each add pushes the item's
+    "ExpiresAt" back, so TTL only purges it once no alert has been sent for a day.
+    """
+
+    def __init__(self, table_name, key="pushover-receipts", client=None):
+        self.table_name = table_name
+        self.key = key
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client("dynamodb")
+        return self._client
+
+    def _update(self, **kwargs):
+        try:
+            self.client.update_item(TableName=self.table_name, Key={"CacheKey": {"S": self.key}}, **kwargs)
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def add(self, receipt, entry):
+        expires = {"N": str(int(time.time()) + STATE_TTL_SECONDS)}
+        value = {"S": json.dumps(entry)}
+        while True:
+            if self._update(
+                UpdateExpression="SET Receipts.#r = :entry, ExpiresAt = :expires",
+                ConditionExpression="attribute_exists(Receipts)",
+                ExpressionAttributeNames={"#r": receipt},
+                ExpressionAttributeValues={":entry": value, ":expires": expires},
+            ):
+                return
+            # First receipt: create the map, unless another invocation just did
+            if self._update(
+                UpdateExpression="SET Receipts = :receipts, ExpiresAt = :expires",
+                ConditionExpression="attribute_not_exists(Receipts)",
+                ExpressionAttributeValues={":receipts": {"M": {receipt: value}}, ":expires": expires},
+            ):
+                return
+
+    def pending(self):
+        item = self.client.get_item(
+            TableName=self.table_name, Key={"CacheKey": {"S": self.key}}, ConsistentRead=True,
+        ).get("Item", {})
+        receipts = item.get("Receipts", {}).get("M", {})
+        return {receipt: json.loads(value["S"]) for receipt, value in receipts.items()}
+
+    def remove(self, receipt):
+        self._update(
+            UpdateExpression="REMOVE Receipts.#r",
+            ConditionExpression="attribute_exists(Receipts)",
+            ExpressionAttributeNames={"#r": receipt},
+        )
+
+
+class ReceiptTracker:
+    """Persist emergency receipts and poll their acknowledgement status."""
+
+    def __init__(self, client, store):
+        self.client = client
+        self.store = store
+
+    def track(self, receipt, sent_at, expires_at):
+        """Remember receipt; a failure is logged rather than failing the delivery."""
+        try:
+            self.store.add(receipt, {"sent_at": sent_at, "expires_at": expires_at})
+        except Exception as e:
+            logger.error("Failed to persist Pushover receipt %s: %s", receipt, e)
+
+    def poll(self, now=None):
+        """Check every tracked receipt once and stop tracking those that are settled.
+
+        Returns:
+            dict with "acknowledged" (seconds from sending to acknowledgement, one per
+            receipt acknowledged since the last poll), "expired" (receipts that expired
+            unacknowledged) and "pending" (receipts still awaiting acknowledgement).
+        """
+        now = time.time() if now is None else now
+        stats = {"acknowledged": [], "expired": 0, "pending": 0}
+        try:
+            pending = self.store.pending()
+        except Exception as e:
+            logger.error("Failed to load Pushover receipts: %s", e)
+            return stats
+        for receipt, entry in pending.items():
+            try:
+                result = self.client.get_receipt(receipt)
+            except Exception as e:
+                logger.warning("Failed to poll Pushover receipt %s: %s", receipt, e)
+                result = {"statusCode": None, "body": {}}
+            status, body = result["statusCode"], result["body"]
+            if status == 200 and body.get("acknowledged"):
+                stats["acknowledged"].append(max(0, body.get("acknowledged_at", now) - entry["sent_at"]))
+            elif status == 200 and body.get("expired"):
+                stats["expired"] += 1
+            elif status is not None and 400 <= status < 500 and status != 429:
+                logger.warning("Dropping unknown Pushover receipt %s: %s", receipt, body)
+            elif now > entry["expires_at"] + RECEIPT_GRACE_SECONDS:
+                logger.warning("Dropping Pushover receipt %s that could not be polled before it expired", receipt)
+            else:
+                stats["pending"] += 1
+                continue
+            try:
+                self.store.remove(receipt)
+            except Exception as e:
+                logger.error("Failed to stop tracking Pushover receipt %s: %s", receipt, e)
+        return stats
+
+
+def build_receipt_tracker(client, table_name=None):
+    """Build a ReceiptTracker storing receipts in DynamoDB when table_name is set, else in memory."""
+    store = DynamoDBReceiptStore(table_name) if table_name else MemoryReceiptStore()
+    return ReceiptTracker(client, store)
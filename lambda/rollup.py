@@ -0,0 +1,324 @@
+"""Hourly and daily rollups of meter and plug readings for long-range queries.
+
+For each home, device (Meter or Plug dimension), metric and UTC hour or day, a
+Rollup holds the sample count, sum, minimum and maximum of the valid readings,
+plus a histogram of them quantized to the metric's step, from which any
+percentile is read to within half a step. Rollups merge exactly (counts, sums
+and bins add up), so they are updated incrementally as readings arrive, and a
+question about any longer or irregular span is answered by merging them: a
+year's nightly minimum humidity is the hourly rollups of each night merged.
+
+The log puller adds every valid reading to a RollupUpdater during an
+invocation and merges them into the stored rollups when it succeeds (ROLLUP_TABLE).
+The DynamoDB table keys each series ("nhome|Meter=N. Meter 1|Humidity|day") by
+the epoch start of its hours or days, so a year of daily rollups is one Query
+of 365 small items.
+"""
+import datetime
+import json
+import logging
+import math
+
+from aws_clients import get_client
+from cloudwatch import epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+# Rollup resolution -> seconds per rollup
+RESOLUTIONS = {"hour": 3600, "day": 86400}
+# section -> (dimension name, ((metric name, reading attribute, histogram step), ...))
+ROLLUP_METRICS = {
+    "meters": ("Meter", (
+        ("Temperature", "temperature", 0.1),
+        ("Humidity", "humidity", 0.1),
+        ("Battery", "battery", 1),
+        ("TemperatureDiff", "temperature_diff", 0.1),
+    )),
+    "plugs": ("Plug", (
+        ("Power", "power", 0.1),
+        ("Switch", "switch", 1),
+    )),
+}
+# Items per DynamoDB BatchGetItem / TransactWriteItems call
+DYNAMODB_BATCH_SIZE = 100
+# Attempts to merge a batch of rollups written concurrently by another container
+MAX_MERGE_ATTEMPTS = 3
+
+
+class Rollup:
+    """Statistics of one series over one hour or day starting at start (epoch seconds)."""
+
+    __slots__ = ("start", "step", "count", "total", "minimum", "maximum", "bins")
+
+    def __init__(self, start, step, count=0, total=0.0, minimum=math.inf, maximum=-math.inf, bins=None):
+        self.start = start
+        self.step = step
+        self.count = count
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+        # Quantized value (value / step, rounded) -> readings
+        self.bins = bins if bins is not None else {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        quantized = round(value / self.step)
+        self.bins[quantized] = self.bins.get(quantized, 0) + 1
+
+    def merge(self, other):
+        """Add the readings of other (same step) to this rollup."""
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        for quantized, count in other.bins.items():
+            self.bins[quantized] = self.bins.get(quantized, 0) + count
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """Nearest-rank percentile, to within half a step (the minimum and maximum are exact)."""
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for quantized in sorted(self.bins):
+            seen += self.bins[quantized]
+            if seen >= rank:
+                return min(max(quantized * self.step, self.minimum), self.maximum)
+        return self.maximum
+
+    def statistic(self, name):
+        """Return Average, Sum, Minimum, Maximum, SampleCount or pNN, as CloudWatch names them."""
+        if name == "Average":
+            return self.mean
+        if name == "Sum":
+            return self.total
+        if name == "Minimum":
+            return self.minimum
+        if name == "Maximum":
+            return self.maximum
+        if name == "SampleCount":
+            return float(self.count)
+        if name.startswith("p"):
+            return self.percentile(float(name[1:]))
+        raise ValueError("Unsupported statistic {}".format(name))
+
+
+def merge_rollups(rollups):
+    """Merge rollups of one series into a single Rollup starting at the first; None when there are none."""
+    merged = None
+    for rollup in rollups:
+        if merged is None:
+            merged = Rollup(rollup.start, rollup.step)
+        merged.merge(rollup)
+    return merged
+
+
+def series_key(home, section, alias, metric_name, resolution):
+    return "{}|{}={}|{}|{}".format(home, ROLLUP_METRICS[section][0], alias, metric_name, resolution)
+
+
+class MemoryRollupStore:
+    """Rollups in process memory, for tests and local analysis."""
+
+    def __init__(self):
+        # series -> {start: Rollup}
+        self._series = {}
+
+    def merge(self, updates):
+        """Merge {(series, start): Rollup} into the stored rollups."""
+        for (series, start), update in updates.items():
+            stored = self._series.setdefault(series, {}).get(start)
+            if stored is None:
+                stored = self._series[series][start] = Rollup(start, update.step)
+            stored.merge(update)
+
+    def query(self, series, start, end):
+        """Return the rollups of series starting in [start, end) epoch seconds, oldest first."""
+        rollups = self._series.get(series, {})
+        return [rollups[at] for at in sorted(rollups) if start <= at < end]
+
+
+class DynamoDBRollupStore:
+    """Rollups in a DynamoDB table shared by every container.
+
+    The table needs a string partition key "Series" and a number sort key
+    "Start". Merges read the current items and write them back in one
+    transaction, conditional on their Version, and are retried if another
+    container changed them in between.
+    """
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_client("dynamodb")
+        return self._client
+
+    @staticmethod
+    def _key(series, start):
+        return {"Series": {"S": series}, "Start": {"N": str(start)}}
+
+    @staticmethod
+    def _rollup(item):
+        return Rollup(int(item["Start"]["N"]), json.loads(item["Step"]["N"]), int(item["Count"]["N"]),
+                      float(item["Sum"]["N"]), float(item["Min"]["N"]), float(item["Max"]["N"]),
+                      {quantized: count for quantized, count in json.loads(item["Bins"]["S"])})
+
+    def _get(self, keys):
+        items = {}
+        pending = [self._key(series, start) for series, start in keys]
+        while pending:
+            response = self.client.batch_get_item(RequestItems={self.table_name: {"Keys": pending[:DYNAMODB_BATCH_SIZE]}})
+            pending = pending[DYNAMODB_BATCH_SIZE:] + response.get("UnprocessedKeys", {}).get(
+                self.table_name, {}).get("Keys", [])
+            for item in response["Responses"].get(self.table_name, ()):
+                items[(item["Series"]["S"], int(item["Start"]["N"]))] = item
+        return items
+
+    def _write(self, series, start, rollup, item):
+        condition = {"ConditionExpression": "attribute_not_exists(#series)",
+                     "ExpressionAttributeNames": {"#series": "Series"}}
+        version = 0
+        if item is not None:
+            version = int(item["Version"]["N"])
+            condition = {"ConditionExpression": "#version = :version",
+                         "ExpressionAttributeNames": {"#version": "Version"},
+                         "ExpressionAttributeValues": {":version": {"N": str(version)}}}
+        return {"Put": dict(condition, TableName=self.table_name, Item=dict(
+            self._key(series, start),
+            Step={"N": repr(rollup.step)},
+            Count={"N": str(rollup.count)},
+            Sum={"N": repr(rollup.total)},
+            Min={"N": repr(rollup.minimum)},
+            Max={"N": repr(rollup.maximum)},
+            Bins={"S": json.dumps(sorted(rollup.bins.items()), separators=(",", ":"))},
+            Version={"N": str(version + 1)},
+        ))}
+
+    def merge(self, updates):
+        """Merge {(series, start): Rollup} into the stored rollups."""
+        keys = list(updates)
+        for first in range(0, len(keys), DYNAMODB_BATCH_SIZE):
+            chunk = keys[first:first + DYNAMODB_BATCH_SIZE]
+            for attempt in range(MAX_MERGE_ATTEMPTS):
+                items = self._get(chunk)
+                writes = []
+                for series, start in chunk:
+                    item = items.get((series, start))
+                    rollup = Rollup(start, updates[(series, start)].step) if item is None else self._rollup(item)
+                    rollup.merge(updates[(series, start)])
+                    writes.append(self._write(series, start, rollup, item))
+                try:
+                    self.client.transact_write_items(TransactItems=writes)
+                    break
+                except self.client.exceptions.TransactionCanceledException:
+                    if attempt == MAX_MERGE_ATTEMPTS - 1:
+                        raise
+
+    def query(self, series, start, end):
+        """Return the rollups of series starting in [start, end) epoch seconds, oldest first."""
+        rollups = []
+        paginator = self.client.get_paginator("query")
+        for page in paginator.paginate(
+                TableName=self.table_name,
+                KeyConditionExpression="#series = :series AND #start BETWEEN :start AND :last",
+                ExpressionAttributeNames={"#series": "Series", "#start": "Start"},
+                ExpressionAttributeValues={":series": {"S": series}, ":start": {"N": str(start)},
+                                           ":last": {"N": str(end - 1)}}):
+            rollups.extend(self._rollup(item) for item in page["Items"])
+        return rollups
+
+
+class RollupUpdater:
+    """Collect the valid readings of one invocation and merge them into a rollup store.
+
+    Use as a context manager around one invocation: the readings added inside
+    the block are merged when it exits without an exception, since a failed
+    invocation is retried and would add them again. Call discard() before the
+    block ends when they will be delivered again without it raising, e.g. to a
+    redelivered SQS message. Without a store nothing is collected. A failed
+    merge is logged and never fails the invocation.
+
+        with rollups:
+            rollups.add_telemetry(telemetry)
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __enter__(self):
+        self._pending = {}
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+    def add(self, home, section, reading, timestamp=None):
+        """Add a reading of section ("meters" or "plugs"); timestamp defaults to reading.timestamp."""
+        if self.store is None or not reading.valid:
+            return
+        at = int(epoch_seconds(timestamp or reading.timestamp))
+        for metric_name, attribute, step in ROLLUP_METRICS[section][1]:
+            value = getattr(reading, attribute)
+            if value is None:
+                continue
+            # Flags are booleans or 0/1
+            value = float(value)
+            for resolution, seconds in RESOLUTIONS.items():
+                key = (series_key(home, section, reading.alias, metric_name, resolution), at // seconds * seconds)
+                rollup = self._pending.get(key)
+                if rollup is None:
+                    rollup = self._pending[key] = Rollup(key[1], step)
+                rollup.add(value)
+
+    def add_telemetry(self, telemetry, now=None):
+        """Add every meter and plug reading of a parsed payload; readings without a Datetime use now."""
+        for section in ROLLUP_METRICS:
+            for reading in getattr(telemetry, section):
+                self.add(telemetry.home, section, reading,
+                         reading.timestamp or now or datetime.datetime.now(datetime.timezone.utc))
+
+    def commit(self):
+        """Merge the readings added since the last commit into the store."""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.store.merge(pending)
+        except Exception as e:
+            logger.error("Failed to update %d rollups: %s", len(pending), e)
+
+    def discard(self):
+        """Forget the readings added since the last commit."""
+        self._pending = {}
+
+
+def build_rollups(table_name=None):
+    """Build a RollupUpdater for the DynamoDB table table_name; without one it collects nothing."""
+    return RollupUpdater(DynamoDBRollupStore(table_name) if table_name else None)
+
+
+def query_rollups(store, home, section, alias, metric_name, resolution, start, end):
+    """Return the hourly or daily (resolution) rollups of one device's metric starting in [start, end), oldest first.
+
+        days = query_rollups(store, "nhome", "meters", "N. Meter 1", "Humidity", "day", year_ago, today)
+        [(day.start, day.minimum, day.percentile(50)) for day in days]
+    """
+    return store.query(series_key(home, section, alias, metric_name, resolution),
+                       int(epoch_seconds(start)), int(epoch_seconds(end)))
@@ -0,0 +1,155 @@
+"""Notification sinks for the notification dispatcher.
+
+A sink delivers a rendered alarm ({"title", "body", "state", "alarm_name"},
+see alarm_formatter.render_alarm) to one destination. Each sink names the
+alarm_formatter channel template it is rendered with and may hold back
+notifications (coalescing) until flush() is called by the scheduled flush,
+which also calls poll() to collect delivery metrics.
+"""
+import logging
+import os
+import time
+
+from alarm_formatter import truncate
+from aws_clients import LazyClient
+from coalescer import build_coalescer
+from pushover import PushoverClient, build_receipt_tracker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+
+
+class NotificationSink:
+    """Base class for notification destinations."""
+
+    # Routing name, and the alarm_formatter channel template notifications are rendered with
+    name = None
+    channel = None
+
+    def send(self, formatted):
+        """Deliver formatted and return a result dict."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Deliver anything held back and return a list of result dicts."""
+        return []
+
+    def poll(self, now=None):
+        """Check the status of earlier deliveries and return [(metric name, value, unit)]."""
+        return []
+
+
+class PushoverSink(NotificationSink):
+    """Critical Pushover alerts, coalescing alarm storms into digests.
+
+    Emergency receipts are tracked so poll() can report how quickly alerts were
+    acknowledged and how many expired unacknowledged.
+    """
+
+    name = "pushover"
+    channel = "pushover"
+    # Pushover message limits
+    MAX_TITLE_LENGTH = 250
+    MAX_MESSAGE_LENGTH = 1024
+    # Emergency alerts repeat every RETRY seconds until acknowledged or EXPIRE seconds have passed
+    RETRY_SECONDS = 120 # 2min
+    EXPIRE_SECONDS = 900 # 15min
+
+    def __init__(self, client, user_key, coalescer=None, receipts=None):
+        self.client = client
+        self.user_key = user_key
+        self.coalescer = coalescer or build_coalescer(0)
+        self.receipts = receipts
+
+    def _post(self, formatted):
+        sent_at = time.time()
+        result = self.client.send_message(
+            user=self.user_key,
+            title=truncate(formatted["title"], self.MAX_TITLE_LENGTH),
+            message=truncate(formatted["body"], self.MAX_MESSAGE_LENGTH),
+            priority=2, # Critical Alert
+            retry=self.RETRY_SECONDS,
+            expire=self.EXPIRE_SECONDS,
+            sound="Narita",
+        )
+        receipt = result["body"].get("receipt")
+        if receipt and self.receipts is not None:
+            self.receipts.track(receipt, sent_at, sent_at + self.EXPIRE_SECONDS)
+        return result
+
+    def send(self, formatted):
+        results = self.coalescer.submit(formatted, self._post)
+        if not results:
+            logger.info("Holding %s for the next digest", formatted["title"])
+            return {"statusCode": 200, "body": "coalesced"}
+        return results[0]
+
+    def flush(self):
+        return self.coalescer.flush(self._post)
+
+    def poll(self, now=None):
+        metrics = []
+        if self.receipts is not None:
+            stats = self.receipts.poll(now)
+            metrics.append(("AlertsAcknowledged", len(stats["acknowledged"]), "Count"))
+            metrics.extend(("AlertAcknowledgeLatency", seconds, "Seconds") for seconds in stats["acknowledged"])
+            metrics.append(("AlertsExpiredUnacknowledged", stats["expired"], "Count"))
+        if self.client.app_remaining is not None:
+            metrics.append(("PushoverMessagesRemaining", self.client.app_remaining, "Count"))
+        return metrics
+
+
+class SnsEmailSink(NotificationSink):
+    """Readable alarm emails, published to the SNS topic that email subscribers follow."""
+
+    name = "email"
+    channel = "email"
+
+    def __init__(self, topic_arn, sns_client=None):
+        self.topic_arn = topic_arn
+        self.sns_client = sns_client or LazyClient("sns")
+
+    def send(self, formatted):
+        response = self.sns_client.publish(
+            TopicArn=self.topic_arn,
+            Subject=formatted["title"],  # the email template keeps it within the SNS 100 char limit
+            Message=formatted["body"],
+        )
+        return {"statusCode": 200, "MessageId": response.get("MessageId")}
+
+
+class WebhookSink(NotificationSink):
+    """POSTs the rendered notification as JSON to a URL."""
+
+    name = "webhook"
+    channel = "email"
+
+    def __init__(self, url):
+        self.url = url
+
+    def send(self, formatted):
+        import requests
+
+        response = requests.post(self.url, json=formatted, timeout=DEFAULT_TIMEOUT)
+        return {"statusCode": response.status_code}
+
+
+def build_sinks(environ=os.environ):
+    """Build the sinks configured in environ, keyed by name.
+
+    Pushover needs PUSHOVER_API_KEY and PAGEE_USER_KEY (COALESCE_WINDOW_SECONDS and
+    COALESCE_TABLE enable digests, PUSHOVER_RECEIPT_TABLE shares receipts across
+    containers), email needs FORMATTED_TOPIC_ARN and the webhook needs WEBHOOK_URL.
+    """
+    sinks = {}
+    if environ.get("PUSHOVER_API_KEY") and environ.get("PAGEE_USER_KEY"):
+        client = PushoverClient(environ["PUSHOVER_API_KEY"])
+        coalescer = build_coalescer(int(environ.get("COALESCE_WINDOW_SECONDS", 0)), environ.get("COALESCE_TABLE"))
+        receipts = build_receipt_tracker(client, environ.get("PUSHOVER_RECEIPT_TABLE"))
+        sinks["pushover"] = PushoverSink(client, environ["PAGEE_USER_KEY"], coalescer, receipts)
+    if environ.get("FORMATTED_TOPIC_ARN"):
+        sinks["email"] = SnsEmailSink(environ["FORMATTED_TOPIC_ARN"])
+    if environ.get("WEBHOOK_URL"):
+        sinks["webhook"] = WebhookSink(environ["WEBHOOK_URL"])
+    return sinks
@@ -1,11 +1,15 @@
 import logging
+import threading
 import time
 import hashlib
 import hmac
 import base64
+import json
+import os
 import uuid
 
-import requests
+from aws_clients import get_client
+from cache import build_cache
 
 logger = logging.getLogger(__name__)
 
@@ -41,36 +45,258 @@ GET_DEVICES_ENDPOINT = "https://api.switch-bot.com/v1.1/devices"
 DEVICE_STATUS_ENDPOINT_FORMAT = "https://api.switch-bot.com/v1.1/devices/{}/status"
 DEVICE_SEND_CMD_ENDPOINT_FORMAT = "https://api.switch-bot.com/v1.1/devices/{}/commands"
 
-_device_id_cache = {}
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 10
+
+# SwitchBot allows a fixed number of API calls per account per day
+DAILY_REQUEST_QUOTA = int(os.environ.get("SWITCHBOT_DAILY_QUOTA", 10000))
+# Share of the quota only high-priority callers (e.g. powering the Pi back on) may use
+HIGH_PRIORITY_RESERVE = 0.05
+# Low-priority usage may run this far ahead of an even spread over the day before conserving
+PACE_BURST = 0.02
+
+PRIORITY_HIGH = "high"
+PRIORITY_LOW = "low"
+
+BUDGET_NORMAL = "normal"
+BUDGET_CONSERVE = "conserve"
+BUDGET_EXHAUSTED = "exhausted"
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class QuotaExceededError(RuntimeError):
+    pass
+
+
+class RequestBudget:
+    """Counts SwitchBot API calls per UTC day and rations them against the daily quota.
+
+    Usage is persisted to a JSON file (per container) and, when table_name is set,
+    to an atomic DynamoDB counter shared by every Lambda using the same account.
+
+    Low-priority callers are told to conserve (no retries) once usage runs ahead of
+    an even spread of the quota over the day, and are cut off entirely when only the
+    high-priority reserve is left. High-priority callers are only cut off when the
+    quota is exhausted.
+    """
+
+    def __init__(self, quota=DAILY_REQUEST_QUOTA, path=None, table_name=None, dynamodb_client=None):
+        self.quota = quota
+        self.path = path
+        self.table_name = table_name
+        self._dynamodb_client = dynamodb_client
+        self._lock = threading.Lock()
+        self._day = None
+        self._count = 0
+
+    @property
+    def dynamodb_client(self):
+        if self._dynamodb_client is None:
+            self._dynamodb_client = get_client("dynamodb")
+        return self._dynamodb_client
+
+    @staticmethod
+    def _today(now):
+        return time.strftime("%Y-%m-%d", time.gmtime(now))
+
+    def _load(self, day):
+        if self._day == day:
+            return
+        self._day, self._count = day, 0
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if stored.get("day") == day:
+            self._count = stored.get("count", 0)
+
+    def _store(self):
+        if not self.path:
+            return
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"day": self._day, "count": self._count}, f)
+        os.replace(tmp_path, self.path)
+
+    def record(self, calls=1):
+        now = time.time()
+        with self._lock:
+            self._load(self._today(now))
+            self._count += calls
+            try:
+                self._store()
+            except OSError as e:
+                logger.warning("Failed to persist SwitchBot usage: %s", e)
+        if self.table_name:
+            try:
+                self.dynamodb_client.update_item(
+                    TableName=self.table_name,
+                    Key={"CacheKey": {"S": "switchbot-usage#" + self._today(now)}},
+                    UpdateExpression="ADD CallCount :n SET ExpiresAt = :exp",
+                    ExpressionAttributeValues={":n": {"N": str(calls)}, ":exp": {"N": str(int(now) + 2 * SECONDS_PER_DAY)}},
+                )
+            except Exception as e:
+                logger.warning("Failed to record SwitchBot usage in %s: %s", self.table_name, e)
+
+    def used(self):
+        now = time.time()
+        if self.table_name:
+            try:
+                item = self.dynamodb_client.get_item(
+                    TableName=self.table_name,
+                    Key={"CacheKey": {"S": "switchbot-usage#" + self._today(now)}},
+                ).get("Item")
+                return int(item["CallCount"]["N"]) if item else 0
+            except Exception as e:
+                logger.warning("Failed to read SwitchBot usage from %s: %s", self.table_name, e)
+        with self._lock:
+            self._load(self._today(now))
+            return self._count
+
+    def state(self, priority=PRIORITY_LOW):
+        used = self.used()
+        remaining = self.quota - used
+        if remaining <= 0:
+            return BUDGET_EXHAUSTED
+        if priority == PRIORITY_HIGH:
+            return BUDGET_NORMAL
+        if remaining <= self.quota * HIGH_PRIORITY_RESERVE:
+            return BUDGET_EXHAUSTED
+        elapsed = (time.time() % SECONDS_PER_DAY) / SECONDS_PER_DAY
+        allowance = self.quota * ((1 - HIGH_PRIORITY_RESERVE) * elapsed + PACE_BURST)
+        if used >= allowance:
+            return BUDGET_CONSERVE
+        return BUDGET_NORMAL
+
+
+class SwitchBotClient:
+    """HTTP client for the SwitchBot API backed by a pooled keep-alive session.
+
+    A module-level instance is shared by all handlers so warm Lambda invocations
+    reuse the TCP/TLS connection to api.switch-bot.com instead of handshaking on
+    every request. The session never retries on its own: call_with_retry is the
+    only retry layer, so every HTTP attempt is one call recorded in the budget.
+
+    The session (and requests itself) is created on first use to keep it out of
+    the cold-start import path.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, budget=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.budget = budget
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _send(self, method, url, **kwargs):
+        # Failed attempts count against the quota too
+        self._record(1)
+        return method(url, timeout=self.timeout, **kwargs).json()
+
+    def _record(self, calls):
+        if self.budget is not None:
+            self.budget.record(calls)
+
+    def get(self, url, headers):
+        return self._send(self.session.get, url, headers=headers)
+
+    def post(self, url, headers, json):
+        return self._send(self.session.post, url, headers=headers, json=json)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+request_budget = RequestBudget(
+    path=os.environ.get("SWITCHBOT_USAGE_FILE", "/tmp/switchbot_usage.json"),
+    table_name=os.environ.get("SWITCHBOT_USAGE_TABLE"),
+)
+sb_client = SwitchBotClient(budget=request_budget)
+
+# Device IDs rarely change and a stale ID is invalidated by call_with_retry, so cache
+# them for a day: in memory, in /tmp for the rest of the container's life, and
+# optionally in DynamoDB so cold starts can skip the device listing as well.
+DEVICE_ID_CACHE_TTL = int(os.environ.get("DEVICE_ID_CACHE_TTL", 24 * 3600))
+_device_id_cache = build_cache(
+    file_path=os.environ.get("DEVICE_ID_CACHE_FILE", "/tmp/switchbot_device_ids.json"),
+    table_name=os.environ.get("DEVICE_ID_CACHE_TABLE"),
+    ttl=DEVICE_ID_CACHE_TTL,
+)
+# Serializes device list refreshes so concurrent cache misses share one API call
+_device_id_lock = threading.Lock()
 
 def invalidate_device_id(name):
-    _device_id_cache.pop(name, None)
+    _device_id_cache.invalidate(name)
 
 def get_device_id(token, secret_key, name, type="Plug Mini (JP)"):
-    if name in _device_id_cache:
-        return _device_id_cache[name]
+    device_id = _device_id_cache.get(name)
+    if device_id is not None:
+        return device_id
+
+    with _device_id_lock:
+        device_id = _device_id_cache.get(name)
+        if device_id is not None:
+            return device_id
+        device_id = _refresh_device_ids(token, secret_key, type).get(name)
 
-    response = requests.get(GET_DEVICES_ENDPOINT, headers=build_headers(token, secret_key), timeout=10).json()
+    if device_id is None:
+        raise RuntimeError("Unable to fetch Device ID of {}".format(name))
+    return device_id
+
+
+def _refresh_device_ids(token, secret_key, type):
+    response = sb_client.get(GET_DEVICES_ENDPOINT, headers=build_headers(token, secret_key))
     if response.get("statusCode", 0) != 100:
         raise RuntimeError("Unable to fetch Device IDs. Response: {}".format(response))
+    device_ids = {}
     for d in response.get("body", {}).get("deviceList", []):
         if not d["enableCloudService"]:
             continue
         if d["deviceType"] != type:
             continue
-        _device_id_cache[d["deviceName"]] = d["deviceId"]
-
-    if name not in _device_id_cache:
-        raise RuntimeError("Unable to fetch Device ID of {}".format(name))
-    return _device_id_cache[name]
+        device_ids[d["deviceName"]] = d["deviceId"]
+        _device_id_cache.set(d["deviceName"], d["deviceId"])
+    return device_ids
 
 
-def call_with_retry(token, secret_key, device_name, operation, max_retries=2, base_delay=0.5):
+def call_with_retry(token, secret_key, device_name, operation, max_retries=2, base_delay=0.5, priority=PRIORITY_HIGH):
     """Call operation(device_id) with exponential backoff and cache invalidation on failure.
 
     First attempt uses the (possibly cached) device ID. On failure, invalidates
     the cache, waits with exponential backoff, and retries with a fresh device ID.
+    Retries are dropped while the request budget is conserving, and
+    QuotaExceededError is raised when it is exhausted for this priority.
     """
+    state = request_budget.state(priority)
+    if state == BUDGET_EXHAUSTED:
+        raise QuotaExceededError("SwitchBot daily quota exhausted for {} priority calls".format(priority))
+    if state == BUDGET_CONSERVE:
+        logger.warning("SwitchBot request budget is conserving; not retrying %s", device_name)
+        max_retries = 0
     last_exception = None
     for attempt in range(1 + max_retries):
         if attempt > 0:
@@ -0,0 +1,347 @@
+"""Parse and validate IoT telemetry payloads published by the Pi.
+
+parse_payload turns one payload into a Telemetry record holding MeterReading
+and PlugReading objects, in a single pass over its meters and plugs sections.
+The whole payload is validated before anything is returned, and every problem
+found is reported in one PayloadError, so a caller can reject a malformed
+payload without having published any of its metrics.
+
+Each section is keyed by format version, and a payload may carry several:
+
+- v0: one reading per device, {alias: {"Valid", "Datetime", "Temperature", ...,
+  "Desired": {"Temperature", "TemperatureDiff"}}}.
+- v1: any number of readings per device in columnar rows. Field names appear
+  once, in "columns", and timestamps are second offsets ("t") from "base", in
+  epoch seconds:
+
+      {"base": 1705320000,
+       "columns": ["t", "Valid", "Temperature", "Humidity"],
+       "rows": {"Meter 1": [[0, 1, 22.5, 75.0], [120, 1, 22.6, 74.8]]}}
+
+  Meter columns are t, Valid, Temperature, Humidity, BatteryVoltage,
+  DesiredTemperature and TemperatureDiff; plug columns are t, Valid, Switch and
+  Power. t and Valid are required columns; null is a missing value.
+
+Numbers must be finite ints or floats (CloudWatch rejects NaN and infinity) and
+flags must be booleans or 0/1. Readings marked invalid only need Valid.
+Timestamps are naive UTC datetimes: a v0 Datetime with a UTC offset is
+converted to UTC, and one without an offset is taken to be UTC.
+"""
+import datetime
+import math
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class PayloadError(ValueError):
+    """Raised when a telemetry payload fails validation.
+
+    Attributes:
+        errors: list of messages, one per problem found.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("Invalid telemetry payload: {}".format("; ".join(errors)))
+
+
+class MeterReading:
+    __slots__ = ("alias", "valid", "timestamp", "temperature", "humidity", "battery",
+                 "desired_temperature", "temperature_diff")
+
+    def __init__(self, alias, valid, timestamp=None, temperature=None, humidity=None, battery=None,
+                 desired_temperature=None, temperature_diff=None):
+        self.alias = alias
+        self.valid = valid
+        self.timestamp = timestamp
+        self.temperature = temperature
+        self.humidity = humidity
+        self.battery = battery
+        self.desired_temperature = desired_temperature
+        self.temperature_diff = temperature_diff
+
+
+class PlugReading:
+    __slots__ = ("alias", "valid", "timestamp", "switch", "power")
+
+    def __init__(self, alias, valid, timestamp=None, switch=None, power=None):
+        self.alias = alias
+        self.valid = valid
+        self.timestamp = timestamp
+        self.switch = switch
+        self.power = power
+
+
+class Telemetry:
+    """One validated payload; readings without a Datetime have timestamp None."""
+
+    __slots__ = ("home", "should_heartbeat", "cooler_frozen", "meters", "plugs")
+
+    def __init__(self, home, should_heartbeat, cooler_frozen=None, meters=(), plugs=()):
+        self.home = home
+        self.should_heartbeat = should_heartbeat
+        self.cooler_frozen = cooler_frozen
+        self.meters = list(meters)
+        self.plugs = list(plugs)
+
+
+def _number_problem(value):
+    # Exact type checks: bool is an int subclass but not a measurement
+    if type(value) is float:
+        return None if math.isfinite(value) else "must be a finite number, got {!r}".format(value)
+    return None if type(value) is int else "must be a finite number, got {!r}".format(value)
+
+
+def _flag_problem(value):
+    if type(value) is bool or (type(value) is int and (value == 0 or value == 1)):
+        return None
+    return "must be a boolean, got {!r}".format(value)
+
+
+# v1 column -> (reading attribute, value check), per section
+METER_COLUMNS = {
+    "Valid": ("valid", _flag_problem),
+    "Temperature": ("temperature", _number_problem),
+    "Humidity": ("humidity", _number_problem),
+    "BatteryVoltage": ("battery", _number_problem),
+    "DesiredTemperature": ("desired_temperature", _number_problem),
+    "TemperatureDiff": ("temperature_diff", _number_problem),
+}
+PLUG_COLUMNS = {
+    "Valid": ("valid", _flag_problem),
+    "Switch": ("switch", _flag_problem),
+    "Power": ("power", _number_problem),
+}
+# Columns a valid v1 reading must have a value for
+METER_REQUIRED = ("Temperature", "Humidity")
+PLUG_REQUIRED = ("Switch", "Power")
+
+
+class _Validator:
+    """Collects problems for one payload; paths are only formatted when something is wrong."""
+
+    __slots__ = ("errors", "timestamps")
+
+    def __init__(self):
+        self.errors = []
+        # v0 Datetime string or v1 epoch seconds -> datetime, shared by the readings taken at the same time
+        self.timestamps = {}
+
+    def error(self, path, key, problem):
+        if key is not None:
+            path = path + (str(key),)
+        self.errors.append("{} {}".format(".".join(path), problem))
+
+    def number(self, data, key, path, required=True):
+        value = data.get(key)
+        # Fast path for the common case: x - x is 0.0 only for finite floats
+        if type(value) is float and value - value == 0.0:
+            return value
+        if value is None:
+            if required:
+                self.error(path, key, "is required")
+            return None
+        problem = _number_problem(value)
+        if problem:
+            self.error(path, key, problem)
+            return None
+        return value
+
+    def flag(self, data, key, path, required=True):
+        value = data.get(key)
+        if value is True or value is False:
+            return value
+        if value is None:
+            if required:
+                self.error(path, key, "is required")
+            return None
+        problem = _flag_problem(value)
+        if problem:
+            self.error(path, key, problem)
+            return None
+        return value
+
+    def timestamp(self, data, path):
+        text = data.get("Datetime")
+        if text is None:
+            return None
+        if type(text) is not str:
+            # Checked first: a list or object cannot even be looked up in the cache
+            self.error(path, "Datetime", "must be an ISO 8601 string, got {!r}".format(text))
+            return None
+        timestamp = self.timestamps.get(text)
+        if timestamp is None:
+            try:
+                timestamp = datetime.datetime.fromisoformat(text)
+                # Readings sent with a UTC offset compare and de-duplicate with naive UTC ones
+                if timestamp.tzinfo is not None:
+                    timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                self.timestamps[text] = timestamp
+            except (ValueError, OverflowError):
+                self.error(path, "Datetime", "must be an ISO 8601 string, got {!r}".format(text))
+        return timestamp
+
+    def section(self, event, key):
+        """Return the readings of every format version in event[key], or [] when it is absent."""
+        versions = event.get(key)
+        if versions is None:
+            return []
+        if not isinstance(versions, dict):
+            self.error(("payload",), key, "must be an object")
+            return []
+        readings = []
+        for version, data in versions.items():
+            parse = _SECTION_PARSERS.get((key, version))
+            if parse is None:
+                self.error(("payload", key), version, "is not a supported format version")
+            elif not isinstance(data, dict):
+                self.error(("payload", key), version, "must be an object")
+            else:
+                readings.extend(parse(self, data))
+        return readings
+
+    def meter(self, alias, data):
+        path = ("meters", "v0", alias)
+        if type(data) is not dict:
+            self.error(path, None, "must be an object")
+            return None
+        reading = MeterReading(alias, self.flag(data, "Valid", path), self.timestamp(data, path))
+        if not reading.valid:
+            return reading
+        reading.temperature = self.number(data, "Temperature", path)
+        reading.humidity = self.number(data, "Humidity", path)
+        reading.battery = self.number(data, "BatteryVoltage", path, required=False)
+        desired = data.get("Desired")
+        if desired is not None:
+            if type(desired) is dict:
+                path = path + ("Desired",)
+                reading.desired_temperature = self.number(desired, "Temperature", path, required=False)
+                reading.temperature_diff = self.number(desired, "TemperatureDiff", path, required=False)
+            else:
+                self.error(path, "Desired", "must be an object")
+        return reading
+
+    def plug(self, alias, data):
+        path = ("plugs", "v0", alias)
+        if type(data) is not dict:
+            self.error(path, None, "must be an object")
+            return None
+        reading = PlugReading(alias, self.flag(data, "Valid", path), self.timestamp(data, path))
+        if not reading.valid:
+            return reading
+        reading.switch = self.flag(data, "Switch", path)
+        reading.power = self.number(data, "Power", path)
+        return reading
+
+    def _header(self, path, data, known_columns):
+        """Validate base, columns and rows of a v1 section; return (base, columns, rows) or None."""
+        base = data.get("base")
+        columns = data.get("columns")
+        rows = data.get("rows", {})
+        valid = True
+        if type(base) is not int:
+            self.error(path, "base", "must be an integer epoch time, got {!r}".format(base))
+            valid = False
+        if type(columns) is not list or "t" not in columns or "Valid" not in columns:
+            self.error(path, "columns", "must be a list including t and Valid, got {!r}".format(columns))
+            valid = False
+        else:
+            unknown = [column for column in columns if column != "t" and column not in known_columns]
+            if unknown or len(set(columns)) != len(columns):
+                self.error(path, "columns", "must be distinct known columns, got {!r}".format(columns))
+                valid = False
+        if type(rows) is not dict:
+            self.error(path, "rows", "must be an object")
+            valid = False
+        return (base, columns, rows) if valid else None
+
+    def rows(self, section, data, reading_class, known_columns, required):
+        """Parse a v1 section into one reading per row."""
+        path = (section, "v1")
+        header = self._header(path, data, known_columns)
+        if header is None:
+            return []
+        base, columns, rows = header
+        time_index = columns.index("t")
+        # (column, attribute, check) for the value columns, in row order
+        specs = [(column,) + known_columns[column] if column != "t" else None for column in columns]
+        required = [(column, known_columns[column][0]) for column in required]
+        readings = []
+        for alias, device_rows in rows.items():
+            if type(device_rows) is not list:
+                self.error(path + ("rows",), alias, "must be a list of rows")
+                continue
+            for index, row in enumerate(device_rows):
+                row_path = path + ("rows", alias, str(index))
+                if type(row) is not list or len(row) != len(columns):
+                    self.error(row_path, None, "must be a list of {} values".format(len(columns)))
+                    continue
+                offset = row[time_index]
+                if type(offset) is not int:
+                    self.error(row_path, "t", "must be an integer, got {!r}".format(offset))
+                    continue
+                at = base + offset
+                timestamp = self.timestamps.get(at)
+                if timestamp is None:
+                    try:
+                        timestamp = self.timestamps[at] = _EPOCH + datetime.timedelta(seconds=at)
+                    except OverflowError:
+                        self.error(row_path, "t", "must give a time in years 1 to 9999, got base + t = {}".format(at))
+                        continue
+                reading = reading_class(alias, None, timestamp)
+                problems = len(self.errors)
+                for spec, value in zip(specs, row):
+                    if spec is None or value is None:
+                        continue
+                    problem = spec[2](value)
+                    if problem:
+                        self.error(row_path, spec[0], problem)
+                    else:
+                        setattr(reading, spec[1], value)
+                if reading.valid is None:
+                    if len(self.errors) == problems:
+                        self.error(row_path, "Valid", "is required")
+                elif not reading.valid:
+                    # As in v0, an invalid reading carries no values
+                    reading = reading_class(alias, reading.valid, timestamp)
+                elif len(self.errors) == problems:
+                    for column, attribute in required:
+                        if getattr(reading, attribute) is None:
+                            self.error(row_path, column, "is required")
+                readings.append(reading)
+        return readings
+
+
+# (section, format version) -> parser returning the section's readings
+_SECTION_PARSERS = {
+    ("meters", "v0"): lambda validator, data: [validator.meter(alias, reading) for alias, reading in data.items()],
+    ("plugs", "v0"): lambda validator, data: [validator.plug(alias, reading) for alias, reading in data.items()],
+    ("meters", "v1"): lambda validator, data: validator.rows("meters", data, MeterReading, METER_COLUMNS,
+                                                             METER_REQUIRED),
+    ("plugs", "v1"): lambda validator, data: validator.rows("plugs", data, PlugReading, PLUG_COLUMNS, PLUG_REQUIRED),
+}
+
+
+def parse_payload(event, default_home=None, require_heartbeat=True):
+    """Validate a telemetry payload and return it as Telemetry.
+
+    Payloads without a home of their own use default_home. Buffered payloads
+    replayed after an outage may omit should_heartbeat (require_heartbeat=False).
+
+    Raises:
+        PayloadError: listing every problem found, if the payload is malformed.
+    """
+    if not isinstance(event, dict):
+        raise PayloadError(["payload must be an object, got {}".format(type(event).__name__)])
+    validator = _Validator()
+    home = event.get("home") or default_home
+    if not isinstance(home, str):
+        validator.error(("payload",), "home", "must be a string, got {!r}".format(home))
+    should_heartbeat = validator.flag(event, "should_heartbeat", ("payload",), required=require_heartbeat)
+    cooler_frozen = validator.flag(event, "cooler_frozen", ("payload",), required=False)
+
+    meters = validator.section(event, "meters")
+    plugs = validator.section(event, "plugs")
+    if validator.errors:
+        raise PayloadError(validator.errors)
+    return Telemetry(home, should_heartbeat, cooler_frozen, meters, plugs)
@@ -1,3 +1,50 @@
+import json
 import os
+import tempfile
+
+import boto3
+import pytest
+from moto import mock_aws
 
 os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+os.environ.setdefault("DEVICE_ID_CACHE_FILE", os.path.join(tempfile.mkdtemp(), "switchbot_device_ids.json"))
+os.environ.setdefault("SWITCHBOT_USAGE_FILE", os.path.join(tempfile.mkdtemp(), "switchbot_usage.json"))
+
+
+@pytest.fixture
+def dynamodb_table():
+    """DynamoDB stand-in with the cache table layout (string partition key "CacheKey")."""
+    with mock_aws():
+        client = boto3.client("dynamodb")
+        client.create_table(
+            TableName="cache",
+            KeySchema=[{"AttributeName": "CacheKey", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "CacheKey", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+@pytest.fixture(autouse=True)
+def reset_aws_clients():
+    """Drop cached boto3 clients so a client created under one moto mock is not reused by another test."""
+    import aws_clients
+    aws_clients._clients.clear()
+    yield
+    aws_clients._clients.clear()
+
+
+@pytest.fixture
+def emf_metrics(monkeypatch, capsys):
+    """Publish metrics as EMF on stdout; returns a function that reads back {metric name: [values]}."""
+    monkeypatch.setenv("METRIC_BACKEND", "emf")
+
+    def read():
+        values = {}
+        for line in capsys.readouterr().out.splitlines():
+            document = json.loads(line)
+            for metric in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]:
+                values.setdefault(metric["Name"], []).append(document[metric["Name"]])
+        return values
+
+    return read
@@ -1,6 +1,11 @@
 import json
 
-from alarm_formatter import format_alarm, _format_period, _extract_recent_values, COMPARISON_SYMBOLS
+from unittest.mock import patch
+
+from alarm_formatter import (
+    format_alarm, render_alarm, parse_alarm, ChannelTemplate, CHANNEL_TEMPLATES,
+    _format_period, _extract_recent_values, COMPARISON_SYMBOLS,
+)
 
 
 class TestFormatPeriod:
@@ -111,3 +116,63 @@ class TestFormatAlarm:
             alarm = {"Trigger": {"ComparisonOperator": operator, "Threshold": 10}}
             result = format_alarm(self._make_sns_record(alarm))
             assert symbol in result["body"]
+
+
+ALARM = {
+    "AlarmName": "N. Meter 1 Temperature High",
+    "NewStateValue": "ALARM",
+    "OldStateValue": "OK",
+    "NewStateReason": "Threshold Crossed: datapoints [27.3, 27.1].",
+    "StateChangeTime": "2024-01-15T12:00:00Z",
+    "Trigger": {
+        "MetricName": "Temperature",
+        "Dimensions": [{"name": "Meter", "value": "N. Meter 1"}],
+        "Threshold": 26.0,
+        "ComparisonOperator": "GreaterThanThreshold",
+        "Statistic": "Average",
+        "Period": 300,
+    },
+}
+
+
+class TestChannelTemplate:
+    def test_lines_with_none_fields_are_dropped(self):
+        template = ChannelTemplate("{a}", ("A={a}", "B={b}"), separator=",")
+        assert template.render({"a": 1, "b": None, "new_state": "OK"}) == {"title": "1", "body": "A=1", "state": "OK", "alarm_name": None}
+
+    def test_truncates_to_limits(self):
+        template = ChannelTemplate("{a}", ("{a}",), max_title=3, max_body=4)
+        result = template.render({"a": "abcdef", "new_state": "OK"})
+        assert result["title"] == "ab\u2026"
+        assert result["body"] == "abc\u2026"
+
+
+class TestRenderAlarm:
+    def _record(self, alarm=ALARM):
+        return {"Sns": {"Subject": "ALARM", "Message": json.dumps(alarm)}}
+
+    def test_all_channels_from_one_parse(self):
+        with patch("alarm_formatter.json.loads", wraps=json.loads) as loads:
+            rendered = render_alarm(self._record())
+        loads.assert_called_once()
+        assert set(rendered) == set(CHANNEL_TEMPLATES)
+        assert rendered["pushover"] == rendered["email"]
+        assert all(r["state"] == "ALARM" for r in rendered.values())
+
+    def test_sms_is_one_compact_segment(self):
+        sms = render_alarm(self._record(), ("sms",))["sms"]
+        assert sms["body"] == "ALARM: N. Meter 1 Temperature High | Temperature > 26.0 | Recent 27.3, 27.1"
+        alarm = dict(ALARM, AlarmName="x" * 300)
+        assert len(render_alarm(self._record(alarm), ("sms",))["sms"]["body"]) == 160
+
+    def test_email_title_fits_sns_subject(self):
+        alarm = dict(ALARM, AlarmName="x" * 300)
+        assert len(format_alarm(self._record(alarm))["title"]) == 100
+
+    def test_invalid_json_falls_back_for_every_channel(self):
+        rendered = render_alarm({"Sns": {"Subject": "Test", "Message": "not-json"}})
+        assert [r["title"] for r in rendered.values()] == ["Test"] * len(CHANNEL_TEMPLATES)
+        assert parse_alarm({"Sns": {"Message": "not-json"}}) is None
+
+    def test_missing_threshold_still_rendered(self):
+        assert "Condition:   None" in format_alarm(self._record({}))["body"]
@@ -0,0 +1,182 @@
+import datetime
+import gzip
+import json
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from archive import (
+    ArchiveWriter, LocalArchiveStore, S3ArchiveStore, open_archive_store, partition_prefix, query_meter, query_plug,
+)
+from telemetry import MeterReading, PlugReading, parse_payload
+
+T0 = datetime.datetime(2024, 1, 15, 23, 58)
+
+
+def _meter(minutes, temperature=22.0, alias="N. Meter 1", valid=True):
+    reading = MeterReading(alias, valid, T0 + datetime.timedelta(minutes=minutes))
+    if valid:
+        reading.temperature, reading.humidity = temperature, 70.0
+    return reading
+
+
+class _CountingStore(LocalArchiveStore):
+    def __init__(self, root):
+        super().__init__(root)
+        self.listed, self.read = [], []
+
+    def list(self, prefix):
+        self.listed.append(prefix)
+        return super().list(prefix)
+
+    def get(self, key):
+        self.read.append(key)
+        return super().get(key)
+
+
+class TestArchiveWriter:
+    def test_one_object_per_day_and_device(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        with ArchiveWriter(store) as writer:
+            # Out of order, across midnight, for two meters
+            for minutes in (1, 0, 3, 2):
+                writer.append("nhome", "meters", _meter(minutes, temperature=20.0 + minutes))
+            writer.append("nhome", "meters", _meter(0, alias="N. Meter 2", valid=False))
+            assert len(writer) == 5
+
+        first_day = store.list(partition_prefix(T0.date(), "nhome", "meters", "N. Meter 1"))
+        assert [key.rpartition("/")[2].rsplit("-", 1)[0] for key in first_day] == ["1705363080-1705363140"]
+        assert first_day[0].startswith("day=2024-01-15/home=nhome/meters=N.%20Meter%201/")
+        columns = json.loads(gzip.decompress(store.get(first_day[0])))["columns"]
+        assert columns["t"] == [1705363080, 1705363140]
+        assert columns["Temperature"] == [20.0, 21.0]
+        assert columns["BatteryVoltage"] == [None, None]
+        assert len(store.list(partition_prefix(T0.date() + datetime.timedelta(days=1), "nhome", "meters",
+                                               "N. Meter 1"))) == 1
+        [invalid] = store.list(partition_prefix(T0.date(), "nhome", "meters", "N. Meter 2"))
+        assert json.loads(gzip.decompress(store.get(invalid)))["columns"]["Valid"] == [False]
+
+    def test_flushes_when_buffer_is_full(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        writer = ArchiveWriter(store, max_rows=2)
+        for minutes in range(3):
+            writer.append("nhome", "meters", _meter(minutes))
+        assert len(writer) == 1
+        assert len(store.list(partition_prefix(T0.date(), "nhome", "meters", "N. Meter 1"))) == 1
+
+    def test_write_failure_is_logged_not_raised(self, tmp_path, caplog):
+        store = LocalArchiveStore(str(tmp_path))
+        store.put = lambda key, body: (_ for _ in ()).throw(OSError("disk full"))
+        with ArchiveWriter(store) as writer:
+            writer.append("nhome", "meters", _meter(0))
+        assert "Failed to archive 1 readings" in caplog.text
+
+    def test_buffer_dropped_when_discarded_or_block_raises(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        with ArchiveWriter(store) as writer:
+            writer.append("nhome", "meters", _meter(0))
+            writer.discard()
+            assert len(writer) == 0
+        with pytest.raises(RuntimeError):
+            with ArchiveWriter(store) as writer:
+                writer.append("nhome", "meters", _meter(0))
+                raise RuntimeError("publish failed")
+        assert store.list(partition_prefix(T0.date(), "nhome", "meters", "N. Meter 1")) == []
+
+    def test_without_store_buffers_nothing(self):
+        with ArchiveWriter(None) as writer:
+            writer.append("nhome", "meters", _meter(0))
+            assert len(writer) == 0
+
+    def test_add_telemetry_timestamps_undated_readings_now(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        telemetry = parse_payload({"home": "nhome", "should_heartbeat": 1, "plugs": {"v0": {
+            "N.Fan": {"Valid": True, "Switch": True, "Power": 4.5}}}})
+        now = datetime.datetime(2024, 1, 15, 12, tzinfo=datetime.timezone.utc)
+        with ArchiveWriter(store) as writer:
+            writer.add_telemetry(telemetry, now=now)
+
+        [plug] = query_plug(store, "nhome", "N.Fan", now, now + datetime.timedelta(minutes=1))
+        assert isinstance(plug, PlugReading)
+        assert (plug.timestamp, plug.valid, plug.switch, plug.power) == (datetime.datetime(2024, 1, 15, 12), True,
+                                                                         True, 4.5)
+
+
+class TestQuery:
+    def _archive(self, store):
+        # Three invocations: two days, and a redelivered reading archived twice
+        for minutes in [(0, 1), (1, 2), (3, 4)]:
+            with ArchiveWriter(store) as writer:
+                for m in minutes:
+                    writer.append("nhome", "meters", _meter(m, temperature=20.0 + m))
+                writer.append("nhome", "meters", _meter(m, alias="N. Meter 2"))
+
+    def test_returns_readings_in_range_once(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        self._archive(store)
+
+        readings = query_meter(store, "nhome", "N. Meter 1", T0, T0 + datetime.timedelta(minutes=4))
+        assert [(r.timestamp.minute, r.temperature, r.humidity) for r in readings] == [
+            (58, 20.0, 70.0), (59, 21.0, 70.0), (0, 22.0, 70.0), (1, 23.0, 70.0)]
+        assert query_meter(store, "nhome", "N. Meter 1", T0 - datetime.timedelta(days=2), T0) == []
+
+    def test_prunes_partitions_and_objects_outside_the_range(self, tmp_path):
+        store = _CountingStore(str(tmp_path))
+        self._archive(store)
+
+        # Only the last object overlaps the first minutes of the next day
+        start = T0 + datetime.timedelta(minutes=3)
+        readings = query_meter(store, "nhome", "N. Meter 1", start, start + datetime.timedelta(minutes=1))
+        assert [r.temperature for r in readings] == [23.0]
+        assert store.listed == [partition_prefix(start.date(), "nhome", "meters", "N. Meter 1")]
+        assert len(store.read) == 1
+
+    def test_ignores_other_objects_in_a_partition(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        self._archive(store)
+        prefix = partition_prefix(T0.date(), "nhome", "meters", "N. Meter 1")
+        store.put(prefix + "README.txt", b"")
+        store.put(prefix + "compacted.json.gz", b"")
+        readings = query_meter(store, "nhome", "N. Meter 1", T0, T0 + datetime.timedelta(minutes=2))
+        assert len(readings) == 2
+
+    def test_aware_range_is_utc(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        self._archive(store)
+        tokyo = datetime.timezone(datetime.timedelta(hours=9))
+        start = T0.replace(tzinfo=datetime.timezone.utc).astimezone(tokyo)
+        readings = query_meter(store, "nhome", "N. Meter 1", start, start + datetime.timedelta(minutes=1))
+        assert [r.timestamp for r in readings] == [T0]
+
+
+@pytest.fixture
+def s3_bucket():
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="archive", CreateBucketConfiguration={"LocationConstraint": "us-west-2"})
+        yield client
+
+
+class TestStores:
+    def test_open_archive_store(self, tmp_path):
+        assert open_archive_store(None) is None
+        store = open_archive_store("s3://archive/telemetry/")
+        assert (type(store), store.bucket, store.prefix) == (S3ArchiveStore, "archive", "telemetry/")
+        assert open_archive_store(str(tmp_path)).root == str(tmp_path)
+
+    def test_s3_round_trip(self, s3_bucket):
+        store = open_archive_store("s3://archive/telemetry/")
+        with ArchiveWriter(store) as writer:
+            writer.append("nhome", "meters", _meter(0))
+        [key] = s3_bucket.list_objects_v2(Bucket="archive")["Contents"]
+        assert key["Key"].startswith("telemetry/day=2024-01-15/home=nhome/meters=N.%20Meter%201/")
+        [reading] = query_meter(store, "nhome", "N. Meter 1", T0, T0 + datetime.timedelta(minutes=1))
+        assert reading.temperature == 22.0
+
+    def test_local_store_ignores_missing_partitions_and_temporary_files(self, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        assert store.list("day=2024-01-15/") == []
+        store.put("day=2024-01-15/a.json.gz", b"")
+        (tmp_path / "day=2024-01-15" / "b.json.gz.1.tmp").write_bytes(b"")
+        assert store.list("day=2024-01-15/") == ["day=2024-01-15/a.json.gz"]
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import aws_clients
+from aws_clients import LazyClient, get_client
+from benchmarks.cold_start import parse_importtime
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestGetClient:
+    def test_client_cached_per_service(self):
+        assert get_client("sns") is get_client("sns")
+        assert get_client("sns") is not get_client("cloudwatch")
+
+    def test_lazy_client_creates_client_on_first_use(self):
+        client = LazyClient("sns")
+        assert "sns" not in aws_clients._clients
+        assert client.meta.service_model.service_name == "sns"
+        assert aws_clients._clients["sns"].meta is client.meta
+
+
+class TestColdStartImports:
+    @pytest.mark.parametrize("handler, heavy_modules", [
+        ("nepenthes_log_puller", ["boto3", "requests"]),
+        ("nepenthes_online_plug_status", ["boto3", "requests"]),
+        ("nepenthes_pi_plug_on", ["boto3", "requests"]),
+        ("nepenthes_notification_dispatcher", ["boto3", "requests"]),
+    ])
+    def test_handler_import_defers_heavy_modules(self, handler, heavy_modules):
+        env = dict(os.environ, METRIC_NAMESPACE="Test", FORMATTED_TOPIC_ARN="arn", PUSHOVER_API_KEY="k", PAGEE_USER_KEY="u", SB_TOKEN="t", SB_SECRET_KEY="s")
+        code = "import sys, {}; print(' '.join(m for m in {!r} if m in sys.modules))".format(handler, heavy_modules)
+        output = subprocess.run([sys.executable, "-c", code], cwd=LAMBDA_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        assert output.strip() == ""
+
+
+class TestParseImporttime:
+    def test_returns_nested_imports_of_module_slowest_first(self):
+        stderr = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 | json",
+            "import time:        50 |         50 |     _string",
+            "import time:       200 |        250 |   string",
+            "import time:        30 |         30 |   aws_clients",
+            "import time:       400 |        680 | cloudwatch",
+        ])
+        assert parse_importtime(stderr, "cloudwatch") == [(250, "string"), (50, "_string"), (30, "aws_clients")]
+        assert parse_importtime(stderr, "missing") == []
@@ -0,0 +1,168 @@
+import pytest
+from unittest.mock import patch, MagicMock
+
+from cache import MemoryTier, FileTier, DynamoDBTier, TieredCache, build_cache
+
+
+class TestMemoryTier:
+    def test_set_get_delete(self):
+        tier = MemoryTier()
+        tier.set_entry("k", "v", 100.0)
+        assert tier.get_entry("k") == ("v", 100.0)
+        tier.delete("k")
+        assert tier.get_entry("k") is None
+
+    def test_clear(self):
+        tier = MemoryTier()
+        tier.set_entry("k", "v", 100.0)
+        tier.clear()
+        assert tier.get_entry("k") is None
+
+    def test_keys_by_prefix(self):
+        tier = MemoryTier()
+        for key in ("flap#a", "flap#b", "coalesce"):
+            tier.set_entry(key, "v", 100.0)
+        assert sorted(tier.keys("flap#")) == ["flap#a", "flap#b"]
+
+
+class TestFileTier:
+    def test_persists_across_instances(self, tmp_path):
+        path = str(tmp_path / "cache.json")
+        FileTier(path).set_entry("k", {"a": 1}, 100.0)
+        assert FileTier(path).get_entry("k") == ({"a": 1}, 100.0)
+
+    def test_missing_file_is_a_miss(self, tmp_path):
+        assert FileTier(str(tmp_path / "missing.json")).get_entry("k") is None
+
+    def test_keys_by_prefix(self, tmp_path):
+        tier = FileTier(str(tmp_path / "cache.json"))
+        assert tier.keys("flap#") == []
+        tier.set_entry("flap#a", "v", 100.0)
+        tier.set_entry("other", "v", 100.0)
+        assert tier.keys("flap#") == ["flap#a"]
+
+    def test_delete(self, tmp_path):
+        tier = FileTier(str(tmp_path / "cache.json"))
+        tier.set_entry("k", "v", 100.0)
+        tier.delete("k")
+        tier.delete("unknown")
+        assert tier.get_entry("k") is None
+
+    def test_clear_removes_file(self, tmp_path):
+        path = tmp_path / "cache.json"
+        tier = FileTier(str(path))
+        tier.set_entry("k", "v", 100.0)
+        tier.clear()
+        tier.clear()
+        assert not path.exists()
+
+
+class TestDynamoDBTier:
+    def test_set_get_delete(self, dynamodb_table):
+        tier = DynamoDBTier("cache", client=dynamodb_table)
+        tier.set_entry("k", ["v"], 100.0)
+        assert tier.get_entry("k") == (["v"], 100.0)
+        tier.delete("k")
+        assert tier.get_entry("k") is None
+
+    def test_keys_by_prefix(self, dynamodb_table):
+        tier = DynamoDBTier("cache", client=dynamodb_table)
+        for key in ("flap#a", "flap#b", "coalesce#pushover"):
+            tier.set_entry(key, "v", 100.0)
+        assert sorted(tier.keys("flap#")) == ["flap#a", "flap#b"]
+
+    def test_client_created_lazily(self, dynamodb_table):
+        tier = DynamoDBTier("cache")
+        assert tier._client is None
+        assert tier.get_entry("k") is None
+        assert tier._client is not None
+
+    def test_clear_not_supported(self):
+        with pytest.raises(NotImplementedError):
+            DynamoDBTier("cache", client=MagicMock()).clear()
+
+
+class TestTieredCache:
+    @patch("cache.time.time", return_value=1000.0)
+    def test_set_writes_all_tiers(self, _):
+        front, back = MemoryTier(), MemoryTier()
+        cache = TieredCache([front, back], ttl=60)
+        cache.set("k", "v")
+        assert front.get_entry("k") == ("v", 1060.0)
+        assert back.get_entry("k") == ("v", 1060.0)
+
+    @patch("cache.time.time", return_value=1000.0)
+    def test_hit_in_slower_tier_backfills_faster_tiers(self, _):
+        front, back = MemoryTier(), MemoryTier()
+        back.set_entry("k", "v", 1030.0)
+        cache = TieredCache([front, back], ttl=60)
+        assert cache.get("k") == "v"
+        assert front.get_entry("k") == ("v", 1030.0)
+
+    @patch("cache.time.time", return_value=1000.0)
+    def test_expired_entries_are_misses(self, _):
+        tier = MemoryTier()
+        tier.set_entry("k", "v", 999.0)
+        cache = TieredCache([tier], ttl=60)
+        assert cache.get("k") is None
+        assert cache.get("k", "default") == "default"
+        assert "k" not in cache
+
+    @patch("cache.time.time", return_value=1000.0)
+    def test_expired_front_entry_falls_through_to_fresh_back_entry(self, _):
+        front, back = MemoryTier(), MemoryTier()
+        front.set_entry("k", "old", 900.0)
+        back.set_entry("k", "new", 1100.0)
+        assert TieredCache([front, back], ttl=60).get("k") == "new"
+
+    def test_ttl_override(self):
+        tier = MemoryTier()
+        cache = TieredCache([tier], ttl=60)
+        with patch("cache.time.time", return_value=1000.0):
+            cache.set("k", "v", ttl=5)
+        with patch("cache.time.time", return_value=1006.0):
+            assert cache.get("k") is None
+
+    def test_invalidate_removes_from_all_tiers(self):
+        front, back = MemoryTier(), MemoryTier()
+        cache = TieredCache([front, back], ttl=60)
+        cache.set("k", "v")
+        cache.invalidate("k")
+        assert front.get_entry("k") is None
+        assert back.get_entry("k") is None
+
+    def test_keys_from_every_tier(self):
+        front, back, failing = MemoryTier(), MemoryTier(), MagicMock()
+        failing.keys.side_effect = Exception("unreachable")
+        front.set_entry("flap#a", "v", 100.0)
+        back.set_entry("flap#b", "v", 100.0)
+        back.set_entry("flap#a", "v", 100.0)
+        assert TieredCache([front, failing, back], ttl=60).keys("flap#") == ["flap#a", "flap#b"]
+
+    def test_failing_tier_is_skipped(self):
+        broken = MagicMock()
+        broken.get_entry.side_effect = Exception("unreachable")
+        broken.set_entry.side_effect = Exception("unreachable")
+        tier = MemoryTier()
+        cache = TieredCache([broken, tier], ttl=60)
+        cache.set("k", "v")
+        assert cache.get("k") == "v"
+
+    def test_dynamodb_tier_serves_cold_start(self, dynamodb_table, tmp_path):
+        warm = TieredCache([MemoryTier(), FileTier(str(tmp_path / "a.json")), DynamoDBTier("cache", client=dynamodb_table)], ttl=60)
+        warm.set("N. Pi", "pi-123")
+        # A new container has an empty memory tier and its own /tmp
+        cold = TieredCache([MemoryTier(), FileTier(str(tmp_path / "b.json")), DynamoDBTier("cache", client=dynamodb_table)], ttl=60)
+        assert cold.get("N. Pi") == "pi-123"
+        assert cold.tiers[1].get_entry("N. Pi")[0] == "pi-123"
+
+
+class TestBuildCache:
+    def test_memory_only(self):
+        cache = build_cache(ttl=10)
+        assert [type(t) for t in cache.tiers] == [MemoryTier]
+        assert cache.ttl == 10
+
+    def test_all_tiers(self, tmp_path):
+        cache = build_cache(file_path=str(tmp_path / "c.json"), table_name="cache")
+        assert [type(t) for t in cache.tiers] == [MemoryTier, FileTier, DynamoDBTier]
@@ -1,6 +1,14 @@
 import datetime
+import json
+import pytest
 from unittest.mock import patch, MagicMock
-from cloudwatch import put_cloudwatch
+from cloudwatch import (
+    put_cloudwatch, MetricBatch, MetricPublishError, get_metric_backend, get_aggregation_period,
+    get_high_resolution_metrics, to_emf_documents,
+    timestamp_rejection, epoch_seconds, _epoch_millis, _estimate_size,
+    MAX_METRIC_DATA_PER_CALL, MAX_REQUEST_BYTES, EMF_MAX_METRICS_PER_DOCUMENT, EMF_MAX_VALUES_PER_METRIC,
+    METRIC_BACKEND_API, METRIC_BACKEND_EMF, STORAGE_RESOLUTION_HIGH,
+)
 
 
 class TestPutCloudwatch:
@@ -67,3 +75,353 @@ class TestPutCloudwatch:
             assert False, "Should have raised"
         except Exception as e:
             assert str(e) == "CloudWatch error"
+
+
+class TestMetricBatch:
+    @patch("cloudwatch.cloud_watch")
+    def test_flushes_all_datapoints_in_single_call(self, mock_cw):
+        with MetricBatch("NS") as batch:
+            batch.put("A", 1, "None")
+            batch.put("B", True, "None", dimensions=[{"Name": "Plug", "Value": "N.Pi"}])
+        mock_cw.put_metric_data.assert_called_once()
+        call_kwargs = mock_cw.put_metric_data.call_args.kwargs
+        assert call_kwargs["Namespace"] == "NS"
+        assert [d["MetricName"] for d in call_kwargs["MetricData"]] == ["A", "B"]
+        assert call_kwargs["MetricData"][1]["Value"] == 1
+        assert call_kwargs["MetricData"][1]["Dimensions"] == [{"Name": "Plug", "Value": "N.Pi"}]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_empty_batch_makes_no_calls(self, mock_cw):
+        with MetricBatch("NS"):
+            pass
+        mock_cw.put_metric_data.assert_not_called()
+
+    @patch("cloudwatch.cloud_watch")
+    def test_splits_on_entry_limit(self, mock_cw):
+        batch = MetricBatch("NS")
+        for i in range(MAX_METRIC_DATA_PER_CALL * 2 + 1):
+            batch.put("Metric", i, "None")
+        assert batch.flush() == MAX_METRIC_DATA_PER_CALL * 2 + 1
+        sizes = [len(c.kwargs["MetricData"]) for c in mock_cw.put_metric_data.call_args_list]
+        assert sizes == [MAX_METRIC_DATA_PER_CALL, MAX_METRIC_DATA_PER_CALL, 1]
+        assert len(batch) == 0
+
+    @patch("cloudwatch.cloud_watch")
+    def test_splits_on_request_size_limit(self, mock_cw):
+        dims = [{"Name": "Meter", "Value": "x" * 255} for _ in range(30)]
+        batch = MetricBatch("NS")
+        for i in range(500):
+            batch.put("Metric", i, "None", dimensions=dims)
+        batch.flush()
+        assert mock_cw.put_metric_data.call_count > 1
+        for c in mock_cw.put_metric_data.call_args_list:
+            assert sum(_estimate_size(d) for d in c.kwargs["MetricData"]) <= MAX_REQUEST_BYTES
+
+    @patch("cloudwatch.cloud_watch")
+    def test_partial_failure_reports_failed_chunks(self, mock_cw):
+        mock_cw.put_metric_data.side_effect = [None, Exception("Throttled"), None]
+        batch = MetricBatch("NS")
+        for i in range(MAX_METRIC_DATA_PER_CALL * 2 + 1):
+            batch.put("Metric", i, "None")
+        with pytest.raises(MetricPublishError) as excinfo:
+            batch.flush()
+        assert mock_cw.put_metric_data.call_count == 3
+        assert excinfo.value.published == MAX_METRIC_DATA_PER_CALL + 1
+        assert len(excinfo.value.failures) == 1
+        assert len(excinfo.value.failures[0][0]) == MAX_METRIC_DATA_PER_CALL
+        assert "Throttled" in str(excinfo.value)
+
+    @patch("cloudwatch.cloud_watch")
+    def test_extend_moves_datapoints(self, mock_cw):
+        staged = MetricBatch("NS", backend=METRIC_BACKEND_API)
+        staged.put("A", 1, "None")
+        with MetricBatch("NS", backend=METRIC_BACKEND_API) as batch:
+            batch.put("B", 2, "None")
+            batch.extend(staged)
+            assert len(staged) == 0
+        names = [d["MetricName"] for d in mock_cw.put_metric_data.call_args.kwargs["MetricData"]]
+        assert names == ["B", "A"]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_flushes_when_block_raises(self, mock_cw):
+        with pytest.raises(RuntimeError, match="device error"):
+            with MetricBatch("NS") as batch:
+                batch.put("Valid", False, "None")
+                raise RuntimeError("device error")
+        mock_cw.put_metric_data.assert_called_once()
+
+    @patch("cloudwatch.cloud_watch")
+    def test_block_exception_not_masked_by_flush_failure(self, mock_cw):
+        mock_cw.put_metric_data.side_effect = Exception("CloudWatch error")
+        with pytest.raises(RuntimeError, match="device error"):
+            with MetricBatch("NS") as batch:
+                batch.put("Valid", False, "None")
+                raise RuntimeError("device error")
+
+
+class TestAggregation:
+    METER = [{"Name": "Meter", "Value": "N. Meter 1"}]
+
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("METRIC_AGGREGATION_PERIOD", raising=False)
+        assert get_aggregation_period() == 0
+        monkeypatch.setenv("METRIC_AGGREGATION_PERIOD", "60")
+        assert MetricBatch("NS", backend=METRIC_BACKEND_API).aggregation_period == 60
+        monkeypatch.setenv("METRIC_AGGREGATION_PERIOD", "-1")
+        with pytest.raises(ValueError, match="must not be negative"):
+            get_aggregation_period()
+
+    @patch("cloudwatch.cloud_watch")
+    def test_folds_readings_of_a_period_into_statistic_values(self, mock_cw):
+        ts = datetime.datetime(2024, 1, 15, 12, 0, 10)
+        with MetricBatch("NS", backend=METRIC_BACKEND_API, aggregation_period=60) as batch:
+            for seconds, value in [(0, 22.5), (20, 23.5), (40, 22.0), (50, 1.0)]:
+                # The last reading is for another meter
+                dimensions = self.METER if seconds < 50 else [{"Name": "Meter", "Value": "N. Meter 2"}]
+                batch.put("Temperature", value, "None", timestamp=ts + datetime.timedelta(seconds=seconds),
+                          dimensions=dimensions)
+            batch.put("Temperature", 24.0, "None", timestamp=ts + datetime.timedelta(seconds=60), dimensions=self.METER)
+            assert len(batch) == 3
+
+        data = mock_cw.put_metric_data.call_args.kwargs["MetricData"]
+        assert data[0] == {
+            "MetricName": "Temperature", "Timestamp": ts, "Unit": "None", "Dimensions": self.METER,
+            "StatisticValues": {"SampleCount": 3, "Sum": 68.0, "Minimum": 22.0, "Maximum": 23.5},
+        }
+        # A period with one reading keeps its plain Value
+        assert [d["Value"] for d in data[1:]] == [1.0, 24.0]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_extend_folds_staged_datapoints(self, mock_cw):
+        ts = datetime.datetime(2024, 1, 15, 12)
+        staged = MetricBatch("NS", backend=METRIC_BACKEND_API, aggregation_period=60)
+        staged.put("Power", 2.0, "None", timestamp=ts)
+        staged.put("Power", 4.0, "None", timestamp=ts)
+        with MetricBatch("NS", backend=METRIC_BACKEND_API, aggregation_period=60) as batch:
+            batch.put("Power", 6.0, "None", timestamp=ts)
+            batch.extend(staged)
+            assert (len(batch), len(staged)) == (1, 0)
+
+        [datum] = mock_cw.put_metric_data.call_args.kwargs["MetricData"]
+        assert datum["StatisticValues"] == {"SampleCount": 3, "Sum": 12.0, "Minimum": 2.0, "Maximum": 6.0}
+
+    def test_emf_publishes_value_lists(self, capsys):
+        ts = datetime.datetime(2024, 1, 15, 12)
+        with MetricBatch("NS", backend=METRIC_BACKEND_EMF, aggregation_period=60) as batch:
+            for i in range(EMF_MAX_VALUES_PER_METRIC + 5):
+                batch.put("Power", i, "None", timestamp=ts + datetime.timedelta(milliseconds=i), dimensions=self.METER)
+            batch.put("Switch", True, "None", timestamp=ts, dimensions=self.METER)
+
+        documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [len(doc["Power"]) for doc in documents] == [EMF_MAX_VALUES_PER_METRIC, 5]
+        assert documents[0]["Power"][:3] == [0, 1, 2]
+        assert documents[0]["Switch"] == 1
+
+
+class TestHighResolution:
+    FAN = [{"Name": "Plug", "Value": "N.Fan"}]
+
+    def test_metrics_from_environment(self, monkeypatch):
+        monkeypatch.delenv("HIGH_RESOLUTION_METRICS", raising=False)
+        assert get_high_resolution_metrics() == frozenset()
+        monkeypatch.setenv("HIGH_RESOLUTION_METRICS", "CoolerFrozen, Power,")
+        assert get_high_resolution_metrics() == {"CoolerFrozen", "Power"}
+
+    @patch("cloudwatch.cloud_watch")
+    def test_put_cloudwatch_sets_storage_resolution(self, mock_cw, monkeypatch):
+        monkeypatch.setenv("HIGH_RESOLUTION_METRICS", "CoolerFrozen")
+        put_cloudwatch("NS", "Cooler Frozen", True, "None")
+        put_cloudwatch("NS", "Heartbeat", 1, "None")
+        put_cloudwatch("NS", "Heartbeat", 1, "None", storage_resolution=STORAGE_RESOLUTION_HIGH)
+        data = [c.kwargs["MetricData"][0] for c in mock_cw.put_metric_data.call_args_list]
+        assert [d.get("StorageResolution") for d in data] == [1, None, 1]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_high_resolution_readings_only_folded_within_a_second(self, mock_cw, monkeypatch):
+        monkeypatch.setenv("HIGH_RESOLUTION_METRICS", "Power")
+        ts = datetime.datetime(2024, 1, 15, 12)
+        with MetricBatch("NS", backend=METRIC_BACKEND_API, aggregation_period=60) as batch:
+            for milliseconds in (0, 500, 20000, 40000):
+                at = ts + datetime.timedelta(milliseconds=milliseconds)
+                batch.put("Power", milliseconds / 1000, "None", timestamp=at, dimensions=self.FAN)
+                batch.put("Switch", True, "None", timestamp=at, dimensions=self.FAN)
+
+        # Still one request: the extra datapoints share the batch
+        mock_cw.put_metric_data.assert_called_once()
+        data = mock_cw.put_metric_data.call_args.kwargs["MetricData"]
+        powers = [d for d in data if d["MetricName"] == "Power"]
+        assert [d["StorageResolution"] for d in powers] == [1, 1, 1]
+        assert powers[0]["StatisticValues"] == {"SampleCount": 2, "Sum": 0.5, "Minimum": 0.0, "Maximum": 0.5}
+        assert [d["Value"] for d in powers[1:]] == [20.0, 40.0]
+        [switch] = [d for d in data if d["MetricName"] == "Switch"]
+        assert "StorageResolution" not in switch and switch["StatisticValues"]["SampleCount"] == 4
+
+    def test_emf_declares_storage_resolution(self, monkeypatch, capsys):
+        monkeypatch.setenv("HIGH_RESOLUTION_METRICS", "Power")
+        # One timestamp, so both datapoints share an EMF document
+        ts = datetime.datetime(2024, 1, 15, 12, 0)
+        with MetricBatch("NS", backend=METRIC_BACKEND_EMF) as batch:
+            batch.put("Power", 2.5, "None", timestamp=ts, dimensions=self.FAN)
+            batch.put("Switch", True, "None", timestamp=ts, dimensions=self.FAN)
+        [document] = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert document["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [
+            {"Name": "Power", "Unit": "None", "StorageResolution": 1}, {"Name": "Switch", "Unit": "None"}]
+
+
+def _emf_datapoints(documents):
+    """Flatten EMF documents back into (namespace, name, dimensions, value, unit, timestamp) tuples."""
+    points = []
+    for doc in documents:
+        directive = doc["_aws"]["CloudWatchMetrics"][0]
+        dims = tuple((name, doc[name]) for name in directive["Dimensions"][0])
+        for metric in directive["Metrics"]:
+            points.append((directive["Namespace"], metric["Name"], dims, doc[metric["Name"]], metric["Unit"], doc["_aws"]["Timestamp"]))
+    return sorted(points)
+
+
+def _api_datapoints(put_metric_data_calls):
+    points = []
+    for c in put_metric_data_calls:
+        for d in c.kwargs["MetricData"]:
+            dims = tuple((dim["Name"], dim["Value"]) for dim in d.get("Dimensions", []))
+            points.append((c.kwargs["Namespace"], d["MetricName"], dims, d["Value"], d["Unit"], _epoch_millis(d["Timestamp"])))
+    return sorted(points)
+
+
+class TestEmfBackend:
+    def test_default_backend_is_api(self, monkeypatch):
+        monkeypatch.delenv("METRIC_BACKEND", raising=False)
+        assert get_metric_backend() == METRIC_BACKEND_API
+
+    def test_backend_from_environment(self, monkeypatch):
+        monkeypatch.setenv("METRIC_BACKEND", "EMF")
+        assert get_metric_backend() == METRIC_BACKEND_EMF
+
+    def test_unknown_backend_raises(self, monkeypatch):
+        monkeypatch.setenv("METRIC_BACKEND", "statsd")
+        with pytest.raises(ValueError, match="Unknown METRIC_BACKEND"):
+            get_metric_backend()
+
+    def test_document_structure(self):
+        ts = datetime.datetime(2024, 1, 15, 12, 0, 0)
+        data = [{
+            "MetricName": "Temperature", "Timestamp": ts, "Value": 22.5, "Unit": "None",
+            "Dimensions": [{"Name": "Meter", "Value": "N. Meter 1"}],
+        }]
+        assert to_emf_documents("NHomeZero", data) == [{
+            "_aws": {
+                "Timestamp": 1705320000000,
+                "CloudWatchMetrics": [{
+                    "Namespace": "NHomeZero",
+                    "Dimensions": [["Meter"]],
+                    "Metrics": [{"Name": "Temperature", "Unit": "None"}],
+                }],
+            },
+            "Meter": "N. Meter 1",
+            "Temperature": 22.5,
+        }]
+
+    def test_groups_by_timestamp_and_dimensions(self):
+        ts = datetime.datetime(2024, 1, 15, 12, 0, 0, tzinfo=datetime.timezone.utc)
+        meter = [{"Name": "Meter", "Value": "N. Meter 1"}]
+        plug = [{"Name": "Plug", "Value": "N.Pi"}]
+        data = [
+            {"MetricName": "Temperature", "Timestamp": ts, "Value": 22.5, "Unit": "None", "Dimensions": meter},
+            {"MetricName": "Humidity", "Timestamp": ts, "Value": 75.0, "Unit": "Percent", "Dimensions": meter},
+            {"MetricName": "Switch", "Timestamp": ts, "Value": 1, "Unit": "None", "Dimensions": plug},
+            {"MetricName": "Heartbeat", "Timestamp": ts, "Value": 1, "Unit": "None"},
+        ]
+        documents = to_emf_documents("NS", data)
+        assert len(documents) == 3
+        assert documents[2]["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [[]]
+
+    def test_repeated_metric_name_starts_new_document(self):
+        ts = datetime.datetime(2024, 1, 15, 12, 0, 0)
+        data = [{"MetricName": "Valid", "Timestamp": ts, "Value": v, "Unit": "None"} for v in (0, 1)]
+        documents = to_emf_documents("NS", data)
+        assert [d["Valid"] for d in documents] == [0, 1]
+
+    def test_splits_documents_at_metric_limit(self):
+        ts = datetime.datetime(2024, 1, 15, 12, 0, 0)
+        data = [{"MetricName": f"M{i}", "Timestamp": ts, "Value": i, "Unit": "None"} for i in range(EMF_MAX_METRICS_PER_DOCUMENT + 1)]
+        documents = to_emf_documents("NS", data)
+        assert [len(d["_aws"]["CloudWatchMetrics"][0]["Metrics"]) for d in documents] == [EMF_MAX_METRICS_PER_DOCUMENT, 1]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_put_cloudwatch_writes_emf_without_api_call(self, mock_cw, monkeypatch, capsys):
+        monkeypatch.setenv("METRIC_BACKEND", "emf")
+        put_cloudwatch("NS", "My Metric", True, "None")
+        mock_cw.put_metric_data.assert_not_called()
+        document = json.loads(capsys.readouterr().out)
+        assert document["MyMetric"] == 1
+
+    @patch("cloudwatch.cloud_watch")
+    def test_batch_writes_emf_without_api_call(self, mock_cw, capsys):
+        with MetricBatch("NS", backend=METRIC_BACKEND_EMF) as batch:
+            batch.put("A", 1, "None")
+            batch.put("B", 2, "None")
+        mock_cw.put_metric_data.assert_not_called()
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 1
+        assert len(batch) == 0
+
+    @patch("cloudwatch.cloud_watch")
+    def test_log_puller_emf_matches_put_metric_data(self, mock_cw, monkeypatch, capsys):
+        monkeypatch.setenv("METRIC_NAMESPACE", "NHomeZero")
+        import nepenthes_log_puller
+        monkeypatch.setattr(nepenthes_log_puller, "METRIC_NAMESPACE", "NHomeZero")
+        event = {
+            "should_heartbeat": 1,
+            "cooler_frozen": False,
+            "meters": {"v0": {
+                "N. Meter 1": {
+                    "Valid": True, "Temperature": 22.5, "Humidity": 75.0, "BatteryVoltage": 95,
+                    "Datetime": "2024-01-15T12:00:00",
+                    "Desired": {"Temperature": 18.0, "TemperatureDiff": -4.5},
+                },
+                "N. Meter 2": {"Valid": False, "Datetime": "2024-01-15T12:00:05"},
+            }},
+            "plugs": {"v0": {
+                "N.Pi": {"Valid": True, "Switch": True, "Power": 5.2, "Datetime": "2024-01-15T12:00:00+09:00"},
+            }},
+        }
+        # Pin the default timestamp used by Heartbeat/CoolerFrozen so both runs agree
+        fixed_now = datetime.datetime(2024, 1, 15, 12, 0, 30)
+        with patch("cloudwatch.datetime") as mock_datetime:
+            mock_datetime.datetime.now.return_value = fixed_now
+            mock_datetime.timezone = datetime.timezone
+            monkeypatch.setenv("METRIC_BACKEND", "api")
+            nepenthes_log_puller.lambda_handler(event, None)
+            monkeypatch.setenv("METRIC_BACKEND", "emf")
+            nepenthes_log_puller.lambda_handler(event, None)
+
+        documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert mock_cw.put_metric_data.call_count == 1
+        assert _emf_datapoints(documents) == _api_datapoints(mock_cw.put_metric_data.call_args_list)
+
+
+class TestTimestampRejection:
+    NOW = datetime.datetime(2024, 1, 15, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def test_within_limits(self):
+        assert timestamp_rejection(datetime.datetime(2024, 1, 2, 0, 0), now=self.NOW) is None
+        assert timestamp_rejection(datetime.datetime(2024, 1, 15, 13, 59), now=self.NOW) is None
+
+    def test_too_old(self):
+        assert timestamp_rejection(datetime.datetime(2024, 1, 1, 11, 59), now=self.NOW) == "too_old"
+
+    def test_too_new(self):
+        assert timestamp_rejection(datetime.datetime(2024, 1, 15, 14, 1), now=self.NOW) == "too_new"
+
+    def test_aware_timestamps_compared_in_utc(self):
+        jst = datetime.timezone(datetime.timedelta(hours=9))
+        assert timestamp_rejection(datetime.datetime(2024, 1, 15, 23, 0, tzinfo=jst), now=self.NOW) is None
+
+
+class TestEpochSeconds:
+    def test_naive_timestamps_are_utc(self):
+        assert epoch_seconds(datetime.datetime(2024, 1, 15, 12, 0, 30)) == 1705320030.0
+
+    def test_aware_timestamps_converted(self):
+        jst = datetime.timezone(datetime.timedelta(hours=9))
+        assert epoch_seconds(datetime.datetime(2024, 1, 15, 21, 0, 30, tzinfo=jst)) == 1705320030.0
@@ -0,0 +1,154 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from coalescer import (
+    AlarmCoalescer, DynamoDBCoalesceStore, MemoryCoalesceStore, build_coalescer, build_digest,
+)
+
+
+def _alarm(name, state="ALARM"):
+    return {"title": "{}: {}".format(state, name), "body": "details of " + name, "state": state}
+
+
+def _submit(coalescer, alarm, now=None, status_code=200):
+    """Submit alarm and return the notifications it posted."""
+    posted = []
+    coalescer.submit(alarm, lambda notification: posted.append(notification) or {"statusCode": status_code}, now=now)
+    return posted
+
+
+def _flush(coalescer, now, status_code=200):
+    """Flush coalescer and return the digests it posted."""
+    digests = []
+    coalescer.flush(lambda digest: digests.append(digest) or {"statusCode": status_code}, now=now)
+    return digests
+
+
+@pytest.fixture(params=["memory", "dynamodb"])
+def store(request):
+    if request.param == "memory":
+        return MemoryCoalesceStore()
+    return DynamoDBCoalesceStore("cache", client=request.getfixturevalue("dynamodb_table"))
+
+
+class TestAlarmCoalescer:
+    def test_first_alarm_sent_immediately_rest_held(self, store):
+        coalescer = AlarmCoalescer(store, window_seconds=300)
+        assert _submit(coalescer, _alarm("Heartbeat"), now=1000.0) == [_alarm("Heartbeat")]
+        assert _submit(coalescer, _alarm("Meter 1"), now=1010.0) == []
+        assert _submit(coalescer, _alarm("Meter 2"), now=1020.0) == []
+
+    def test_flush_sends_one_digest_after_window(self, store):
+        coalescer = AlarmCoalescer(store, window_seconds=300)
+        _submit(coalescer, _alarm("Heartbeat"), now=1000.0)
+        for i in range(10):
+            _submit(coalescer, _alarm("Meter {}".format(i)), now=1001.0 + i)
+
+        assert _flush(coalescer, now=1200.0) == []
+        digests = _flush(coalescer, now=1300.0)
+        assert len(digests) == 1
+        assert digests[0]["title"] == "10 alarms in 5m"
+        assert digests[0]["body"].splitlines()[0] == "- ALARM: Meter 0"
+        assert _flush(coalescer, now=1400.0) == []
+
+    def test_next_alarm_after_window_sends_held_alarms_with_it(self, store):
+        coalescer = AlarmCoalescer(store, window_seconds=60)
+        _submit(coalescer, _alarm("A"), now=1000.0)
+        _submit(coalescer, _alarm("B"), now=1010.0)
+        sent = _submit(coalescer, _alarm("C"), now=1100.0)
+        assert len(sent) == 1
+        assert sent[0]["body"] == "- ALARM: B\n- ALARM: C"
+        # C opened a new window
+        assert _submit(coalescer, _alarm("D"), now=1110.0) == []
+
+    def test_flush_after_window_lets_next_alarm_through(self, store):
+        coalescer = AlarmCoalescer(store, window_seconds=60)
+        _submit(coalescer, _alarm("A"), now=1000.0)
+        assert _flush(coalescer, now=1100.0) == []
+        assert _submit(coalescer, _alarm("B"), now=1101.0) == [_alarm("B")]
+
+    def test_failed_flush_holds_digest_for_next_flush(self, store):
+        coalescer = AlarmCoalescer(store, window_seconds=60)
+        _submit(coalescer, _alarm("A"), now=1000.0)
+        _submit(coalescer, _alarm("B"), now=1010.0)
+        _submit(coalescer, _alarm("C"), now=1020.0)
+
+        with pytest.raises(ConnectionError):
+            coalescer.flush(MagicMock(side_effect=ConnectionError("pushover down")), now=1100.0)
+        assert [d["title"] for d in _flush(coalescer, now=1160.0, status_code=500)] == ["2 alarms in 1m"]
+        [digest] = _flush(coalescer, now=1220.0)
+        assert digest["body"] == "- ALARM: B\n- ALARM: C"
+        assert _flush(coalescer, now=1280.0) == []
+
+    def test_requeued_alarms_go_out_with_the_next_alarm(self, store):
+        coalescer = AlarmCoalescer(store, window_seconds=60)
+        _submit(coalescer, _alarm("A"), now=1000.0)
+        _submit(coalescer, _alarm("B"), now=1010.0)
+        _flush(coalescer, now=1100.0, status_code=503)
+        assert _submit(coalescer, _alarm("C"), now=1110.0)[0]["body"] == "- ALARM: B\n- ALARM: C"
+
+    def test_failed_send_holds_alarms_it_carried(self, store):
+        coalescer = AlarmCoalescer(store, window_seconds=60)
+        _submit(coalescer, _alarm("A"), now=1000.0)
+        _submit(coalescer, _alarm("B"), now=1010.0)
+        with pytest.raises(ConnectionError):
+            coalescer.submit(_alarm("C"), MagicMock(side_effect=ConnectionError("pushover down")), now=1100.0)
+        # B waits out the window C opened; C failed in front of its caller, so only B is held again
+        assert _flush(coalescer, now=1150.0) == []
+        assert [d["title"] for d in _flush(coalescer, now=1160.0, status_code=500)] == ["ALARM: B"]
+        assert _flush(coalescer, now=1220.0) == [_alarm("B")]
+        assert _flush(coalescer, now=1280.0) == []
+
+    def test_requeue_failure_is_logged(self, caplog):
+        store = MagicMock()
+        store.close_expired.return_value = [_alarm("A")]
+        store.requeue.side_effect = Exception("table unavailable")
+        coalescer = AlarmCoalescer(store, 60)
+        assert coalescer.flush(lambda digest: {"statusCode": 500}, now=1100.0) == [{"statusCode": 500}]
+        assert "Failed to hold 1 alarms again" in caplog.text
+
+    def test_zero_window_disables_coalescing(self):
+        store = MagicMock()
+        coalescer = AlarmCoalescer(store, window_seconds=0)
+        assert _submit(coalescer, _alarm("A")) == [_alarm("A")]
+        store.open_window.assert_not_called()
+
+    def test_store_failure_sends_immediately(self):
+        store = MagicMock()
+        store.open_window.side_effect = Exception("table unavailable")
+        assert _submit(AlarmCoalescer(store, 60), _alarm("A")) == [_alarm("A")]
+
+    def test_contention_sends_immediately(self):
+        store = MagicMock()
+        store.open_window.return_value = (False, [])
+        store.hold.return_value = False
+        assert _submit(AlarmCoalescer(store, 60), _alarm("A")) == [_alarm("A")]
+        assert store.open_window.call_count == 3
+
+    def test_dynamodb_state_shared_across_containers(self, dynamodb_table):
+        first = AlarmCoalescer(DynamoDBCoalesceStore("cache", client=dynamodb_table), 300)
+        second = AlarmCoalescer(DynamoDBCoalesceStore("cache", client=dynamodb_table), 300)
+        assert _submit(first, _alarm("A"), now=1000.0) == [_alarm("A")]
+        assert _submit(second, _alarm("B"), now=1001.0) == []
+        assert _flush(first, now=1300.0)[0]["title"] == "ALARM: B"
+
+
+class TestBuildDigest:
+    def test_single_alarm_unchanged(self):
+        assert build_digest([_alarm("A")], 300) == _alarm("A")
+
+    def test_state_is_alarm_if_any_alarm(self):
+        digest = build_digest([_alarm("A", "OK"), _alarm("B")], 30)
+        assert digest["state"] == "ALARM"
+        assert digest["title"] == "2 alarms in 1m"
+
+
+class TestBuildCoalescer:
+    def test_memory_store_without_table(self):
+        assert isinstance(build_coalescer(60).store, MemoryCoalesceStore)
+
+    def test_dynamodb_store_with_table(self, dynamodb_table):
+        store = build_coalescer(60, table_name="cache").store
+        assert isinstance(store, DynamoDBCoalesceStore)
+        assert store.close_expired(now=1000.0) == []
@@ -0,0 +1,139 @@
+import datetime
+import itertools
+
+import pytest
+
+from cache import MemoryTier, TieredCache
+from cloudwatch import MetricBatch, METRIC_BACKEND_API
+from deadband import Deadband, build_deadband, load_heartbeats
+from metric_store import AlarmDefinition, MetricStore, evaluate_alarm, recording
+
+PLUG = [{"Name": "Home", "Value": "nhome"}, {"Name": "Plug", "Value": "N.Pi"}]
+T0 = datetime.datetime(2024, 1, 15, 12, 0)
+
+
+class _Batch:
+    def __init__(self):
+        self.calls = []
+
+    def put(self, metricName, value, unit, timestamp=None, dimensions=None):
+        self.calls.append((metricName, value, timestamp))
+
+
+def _deadband(heartbeats=None):
+    return Deadband(TieredCache([MemoryTier()], ttl=3600), heartbeats or {"Switch": 300})
+
+
+def _minutes(minutes):
+    return T0 + datetime.timedelta(minutes=minutes)
+
+
+class TestDeadband:
+    def test_skips_unchanged_values_within_heartbeat_period(self):
+        deadband = _deadband()
+        batch = _Batch()
+        for minutes, value in [(0, True), (2, True), (3, False), (4, True), (5, True), (9, True)]:
+            with deadband:
+                deadband.put(batch, "Switch", value, "None", timestamp=_minutes(minutes), dimensions=PLUG)
+
+        # The change at 3 and back at 4 are published, then once per 5-minute period
+        assert [(value, timestamp.minute) for _, value, timestamp in batch.calls] == [
+            (True, 0), (False, 3), (True, 4), (True, 5)]
+        assert deadband.skipped == 2
+
+    def test_dimensions_and_unconfigured_metrics(self):
+        deadband = _deadband()
+        batch = _Batch()
+        with deadband:
+            for _ in range(2):
+                deadband.put(batch, "Switch", 1, "None", timestamp=T0, dimensions=PLUG)
+                deadband.put(batch, "Switch", 1, "None", timestamp=T0, dimensions=PLUG[:1])
+                deadband.put(batch, "Power", 1.5, "None", timestamp=T0, dimensions=PLUG)
+        assert [name for name, _, _ in batch.calls] == ["Switch", "Switch", "Power", "Power"]
+
+    def test_failed_invocation_records_nothing(self):
+        deadband = _deadband()
+        batch = _Batch()
+        with pytest.raises(RuntimeError):
+            with deadband:
+                deadband.put(batch, "Switch", 1, "None", timestamp=T0, dimensions=PLUG)
+                raise RuntimeError("publish failed")
+        with deadband:
+            deadband.put(batch, "Switch", 1, "None", timestamp=T0, dimensions=PLUG)
+            deadband.discard()
+        with deadband:
+            deadband.put(batch, "Switch", 1, "None", timestamp=T0, dimensions=PLUG)
+        assert len(batch.calls) == 3
+
+    def test_state_survives_cold_start_in_dynamodb(self, dynamodb_table):
+        batch = _Batch()
+        with build_deadband('{"Switch": 300}', table_name="cache") as deadband:
+            deadband.put(batch, "Switch", True, "None", timestamp=T0, dimensions=PLUG)
+        with build_deadband('{"Switch": 300}', table_name="cache") as deadband:
+            assert not deadband.put(batch, "Switch", 1, "None", timestamp=_minutes(4), dimensions=PLUG)
+        assert len(batch.calls) == 1
+
+    def test_load_heartbeats(self):
+        assert load_heartbeats(None) == {}
+        assert load_heartbeats('{"Switch": 300}') == {"Switch": 300}
+        with pytest.raises(ValueError, match="Heartbeat of Switch"):
+            load_heartbeats('{"Switch": 0}')
+
+
+# The alarms on metrics the stack publishes through the deadband (lib/nepenthes-alarms.ts)
+ALARMS = {
+    "PiInvalidHighSev": dict(metric_name="Switch", comparison="LessThanOrEqualToThreshold", threshold=0,
+                             evaluation_periods=3, datapoints_to_alarm=3, treat_missing_data="breaching"),
+    "PiInvalidLowSev": dict(metric_name="Switch", comparison="LessThanOrEqualToThreshold", threshold=0,
+                            evaluation_periods=1, datapoints_to_alarm=1, treat_missing_data="breaching"),
+}
+HEARTBEATS = {"Switch": 300}
+
+# value at a minute since the start, or None when nothing is reported
+SCENARIOS = {
+    "steady_on": lambda minute: 1,
+    "steady_off": lambda minute: 0,
+    "on_off_cycles": lambda minute: int(minute % 60 < 40),
+    "brief_drop": lambda minute: 0 if 61 <= minute < 63 else 1,
+    "flapping": lambda minute: int(minute) % 2,
+    "outage": lambda minute: None if 60 <= minute < 95 else 1,
+    "stuck_after_outage": lambda minute: None if 60 <= minute < 95 else int(minute < 60),
+}
+# Seconds between readings: Pi pushes, plug status polls, and an irregular sender
+CADENCES = (60, 120, 300, 37)
+
+
+def _publish(store, alarm_name, scenario, cadence, deadband=None):
+    metric_name = ALARMS[alarm_name]["metric_name"]
+    # Offset from the period boundaries, like a real sender
+    at = T0 + datetime.timedelta(seconds=7)
+    with recording(store):
+        while at < T0 + datetime.timedelta(hours=3):
+            value = SCENARIOS[scenario]((at - T0).total_seconds() / 60)
+            if value is not None:
+                with MetricBatch("NHomeZero", backend=METRIC_BACKEND_API) as batch:
+                    if deadband is None:
+                        batch.put(metric_name, value, "None", timestamp=at, dimensions=PLUG)
+                    else:
+                        with deadband:
+                            deadband.put(batch, metric_name, value, "None", timestamp=at, dimensions=PLUG)
+            at += datetime.timedelta(seconds=cadence)
+
+
+@pytest.mark.parametrize("alarm_name, scenario, cadence", list(itertools.product(ALARMS, SCENARIOS, CADENCES)))
+def test_alarms_unchanged_by_deadband(alarm_name, scenario, cadence):
+    alarm = AlarmDefinition(name=alarm_name, namespace="NHomeZero", dimensions={"Home": "nhome", "Plug": "N.Pi"},
+                            period=300, statistic="Maximum", **ALARMS[alarm_name])
+    raw, deadbanded = MetricStore(), MetricStore()
+    deadband = _deadband(HEARTBEATS)
+    _publish(raw, alarm_name, scenario, cadence)
+    _publish(deadbanded, alarm_name, scenario, cadence, deadband)
+
+    start = T0.replace(tzinfo=datetime.timezone.utc).timestamp()
+    end = start + 4 * 3600
+    assert evaluate_alarm(deadbanded, alarm, start, end) == evaluate_alarm(raw, alarm, start, end)
+    for stat in ("Minimum", "Maximum"):
+        assert deadbanded.get_statistics("NHomeZero", alarm.metric_name, PLUG, start, end, 300, stat) == \
+            raw.get_statistics("NHomeZero", alarm.metric_name, PLUG, start, end, 300, stat)
+    if cadence < 300 and scenario != "flapping":
+        assert len(deadbanded) < len(raw)
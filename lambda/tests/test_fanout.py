@@ -0,0 +1,25 @@
+import pytest
+
+from fanout import AllRecordsFailedError, process_records
+
+
+def _double(record):
+    if record < 0:
+        raise ValueError("negative {}".format(record))
+    return record * 2
+
+
+class TestProcessRecords:
+    def test_results_in_record_order(self):
+        assert process_records(list(range(20)), _double, max_workers=4) == [i * 2 for i in range(20)]
+
+    def test_no_records(self):
+        assert process_records([], _double) == []
+
+    def test_partial_failure_reported_per_record(self):
+        assert process_records([1, -1], _double) == [2, {"error": "negative -1"}]
+
+    def test_all_failed_raises(self):
+        with pytest.raises(AllRecordsFailedError) as exc_info:
+            process_records([-1, -2], _double)
+        assert exc_info.value.results == [{"error": "negative -1"}, {"error": "negative -2"}]
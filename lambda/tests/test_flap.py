@@ -0,0 +1,111 @@
+from cache import DynamoDBTier, MemoryTier
+from flap import FlapSuppressor, build_flap_suppressor, with_flap_note
+
+
+def _suppressor(window=600):
+    return build_flap_suppressor(window, "pushover")
+
+
+def _deliver(suppressor, alarm_name, state, now, notification=None):
+    """Check a notification and record it as sent if it is not suppressed, as a successful delivery does."""
+    send, suppressed = suppressor.check(alarm_name, state, now=now, notification=notification)
+    if send:
+        suppressor.mark_sent(alarm_name, state, now=now)
+    return send, suppressed
+
+
+class TestFlapSuppressor:
+    def test_first_notification_sent(self):
+        assert _suppressor().check("NFanNotDrawingPower", "ALARM", now=1000.0) == (True, 0)
+
+    def test_repeat_within_window_suppressed_and_counted(self):
+        suppressor = _suppressor()
+        _deliver(suppressor, "NFanNotDrawingPower", "ALARM", now=1000.0)
+        assert _deliver(suppressor, "NFanNotDrawingPower", "OK", now=1100.0) == (False, 1)
+        assert _deliver(suppressor, "NFanNotDrawingPower", "ALARM", now=1200.0) == (False, 2)
+
+    def test_next_notification_after_window_reports_suppressed(self):
+        suppressor = _suppressor()
+        _deliver(suppressor, "NFanNotDrawingPower", "ALARM", now=1000.0)
+        _deliver(suppressor, "NFanNotDrawingPower", "OK", now=1100.0)
+        assert _deliver(suppressor, "NFanNotDrawingPower", "OK", now=1700.0) == (True, 1)
+        # The count restarts after a notification is sent
+        assert _deliver(suppressor, "NFanNotDrawingPower", "ALARM", now=2400.0) == (True, 0)
+
+    def test_new_alarm_after_recovery_never_suppressed(self):
+        suppressor = _suppressor()
+        _deliver(suppressor, "NPiInvalidLowSev", "OK", now=1000.0)
+        assert _deliver(suppressor, "NPiInvalidLowSev", "ALARM", now=1010.0) == (True, 0)
+
+    def test_suppressed_recovery_due_after_window(self):
+        suppressor = _suppressor()
+        _deliver(suppressor, "NFanNotDrawingPower", "ALARM", now=1000.0)
+        recovery = {"title": "OK: NFanNotDrawingPower", "state": "OK"}
+        assert _deliver(suppressor, "NFanNotDrawingPower", "OK", now=1100.0, notification=recovery) == (False, 1)
+
+        assert suppressor.due(now=1500.0) == []
+        assert suppressor.due(now=1600.0) == [(recovery, 0)]
+        # Due until it is delivered, which opens a new window
+        assert suppressor.due(now=1650.0) == [(recovery, 0)]
+        suppressor.mark_sent("NFanNotDrawingPower", "OK", now=1650.0)
+        assert suppressor.due(now=1700.0) == []
+        assert _deliver(suppressor, "NFanNotDrawingPower", "OK", now=1700.0) == (False, 1)
+
+    def test_nothing_due_when_flapping_ends_in_the_notified_state(self, dynamodb_table):
+        suppressor = build_flap_suppressor(600, "pushover", "cache")
+        _deliver(suppressor, "A", "ALARM", now=1000.0)
+        _deliver(suppressor, "A", "OK", now=1100.0, notification={"state": "OK"})
+        _deliver(suppressor, "A", "ALARM", now=1200.0, notification={"state": "ALARM"})
+        _deliver(suppressor, "B", "OK", now=1000.0)
+        assert suppressor.due(now=1700.0) == []
+        # The count still goes out with the next notification
+        assert _deliver(suppressor, "A", "OK", now=1800.0) == (True, 2)
+
+    def test_due_from_shared_table_counts_earlier_suppressions(self, dynamodb_table):
+        suppressor = build_flap_suppressor(600, "email", "cache")
+        _deliver(suppressor, "A", "ALARM", now=1000.0)
+        for now, state in ((1100.0, "OK"), (1200.0, "ALARM"), (1300.0, "OK")):
+            _deliver(suppressor, "A", state, now=now, notification={"state": state})
+        other_container = build_flap_suppressor(600, "email", "cache")
+        assert other_container.due(now=1600.0) == [({"state": "OK"}, 2)]
+        assert _suppressor(window=0).due() == []
+
+    def test_failed_send_not_suppressed_on_retry(self):
+        suppressor = _suppressor()
+        assert suppressor.check("NFanNotDrawingPower", "ALARM", now=1000.0) == (True, 0)
+        # Not marked as sent, so the retry goes out too
+        assert suppressor.check("NFanNotDrawingPower", "ALARM", now=1010.0) == (True, 0)
+
+    def test_alarms_tracked_independently(self):
+        suppressor = _suppressor()
+        _deliver(suppressor, "A", "ALARM", now=1000.0)
+        assert _deliver(suppressor, "B", "ALARM", now=1001.0) == (True, 0)
+
+    def test_channels_tracked_independently(self, dynamodb_table):
+        pushover = build_flap_suppressor(600, "pushover", "cache")
+        email = FlapSuppressor(pushover.cache, 600, "email")
+        _deliver(pushover, "A", "ALARM", now=1000.0)
+        assert _deliver(email, "A", "ALARM", now=1001.0) == (True, 0)
+        assert _deliver(pushover, "A", "ALARM", now=1002.0) == (False, 1)
+
+    def test_disabled_or_unnamed(self):
+        assert _suppressor(window=0).check("A", "ALARM") == (True, 0)
+        assert _suppressor().check(None, "ALARM") == (True, 0)
+
+
+class TestWithFlapNote:
+    def test_note_appended(self):
+        formatted = with_flap_note({"title": "t", "body": "b"}, 3, 900)
+        assert formatted["body"] == "b\nFlapping:  3 notification(s) suppressed (within 15m of the previous one)"
+
+    def test_unchanged_without_suppressions(self):
+        formatted = {"title": "t", "body": "b"}
+        assert with_flap_note(formatted, 0, 900) is formatted
+
+
+class TestBuildFlapSuppressor:
+    def test_memory_without_table(self):
+        assert [type(t) for t in _suppressor().cache.tiers] == [MemoryTier]
+
+    def test_only_dynamodb_with_table(self):
+        assert [type(t) for t in build_flap_suppressor(60, "email", "cache").cache.tiers] == [DynamoDBTier]
@@ -1,21 +1,34 @@
 import os
 import datetime
+import json
 from unittest.mock import patch, call
 
+import pytest
+
 os.environ["METRIC_NAMESPACE"] = "TestNamespace"
 
-from nepenthes_log_puller import lambda_handler
+from nepenthes_log_puller import lambda_handler, put_home_metrics, replay_home_metrics
+from archive import LocalArchiveStore, partition_prefix, query_meter, query_plug
+from cloudwatch import MetricBatch
+from deadband import build_deadband
+from rollup import MemoryRollupStore, RollupUpdater, query_rollups
+from metric_store import AlarmDefinition, MetricStore, STATE_ALARM, evaluate_alarm, recording
+
+
+def _batch(mock_batch):
+    return mock_batch.return_value.__enter__.return_value
 
 
 class TestLogPullerHandler:
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_heartbeat_published(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_heartbeat_published(self, mock_batch):
         event = {"should_heartbeat": 1, "meters": {"v0": {}}, "plugs": {"v0": {}}}
         lambda_handler(event, None)
-        mock_cw.assert_any_call("TestNamespace", "Heartbeat", 1, "None")
+        mock_batch.assert_called_once_with("TestNamespace")
+        _batch(mock_batch).put.assert_any_call("Heartbeat", 1, "None", timestamp=None, dimensions=[{"Name": "Home", "Value": "nhome"}])
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_valid_meter_publishes_all_metrics(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_valid_meter_publishes_all_metrics(self, mock_batch):
         event = {
             "should_heartbeat": 1,
             "meters": {
@@ -34,16 +47,16 @@ class TestLogPullerHandler:
         lambda_handler(event, None)
 
         # Should publish Valid, Humidity, Temperature (not Battery since hour 12, minute 0 < 15)
-        call_args_list = [c.args for c in mock_cw.call_args_list]
-        metric_names = [args[1] for args in call_args_list]
+        call_args_list = [c.args for c in _batch(mock_batch).put.call_args_list]
+        metric_names = [args[0] for args in call_args_list]
         assert "Heartbeat" in metric_names
         assert "Valid" in metric_names
         assert "Temperature" in metric_names
         assert "Humidity" in metric_names
         assert "Battery" in metric_names  # hour 12, minute 0 < 15
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_invalid_meter_only_publishes_valid(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_invalid_meter_only_publishes_valid(self, mock_batch):
         event = {
             "should_heartbeat": 0,
             "meters": {
@@ -58,14 +71,14 @@ class TestLogPullerHandler:
         }
         lambda_handler(event, None)
 
-        call_args_list = [c.args for c in mock_cw.call_args_list]
-        metric_names = [args[1] for args in call_args_list]
+        call_args_list = [c.args for c in _batch(mock_batch).put.call_args_list]
+        metric_names = [args[0] for args in call_args_list]
         assert "Valid" in metric_names
         assert "Temperature" not in metric_names
         assert "Humidity" not in metric_names
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_valid_plug_publishes_switch_and_power(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_valid_plug_publishes_switch_and_power(self, mock_batch):
         event = {
             "should_heartbeat": 0,
             "meters": {"v0": {}},
@@ -82,14 +95,14 @@ class TestLogPullerHandler:
         }
         lambda_handler(event, None)
 
-        call_args_list = [c.args for c in mock_cw.call_args_list]
-        metric_names = [args[1] for args in call_args_list]
+        call_args_list = [c.args for c in _batch(mock_batch).put.call_args_list]
+        metric_names = [args[0] for args in call_args_list]
         assert "Valid" in metric_names
         assert "Switch" in metric_names
         assert "Power" in metric_names
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_invalid_plug_only_publishes_valid(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_invalid_plug_only_publishes_valid(self, mock_batch):
         event = {
             "should_heartbeat": 0,
             "meters": {"v0": {}},
@@ -104,34 +117,34 @@ class TestLogPullerHandler:
         }
         lambda_handler(event, None)
 
-        call_args_list = [c.args for c in mock_cw.call_args_list]
-        metric_names = [args[1] for args in call_args_list]
+        call_args_list = [c.args for c in _batch(mock_batch).put.call_args_list]
+        metric_names = [args[0] for args in call_args_list]
         assert "Valid" in metric_names
         assert "Switch" not in metric_names
         assert "Power" not in metric_names
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_cooler_frozen_published_when_true(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_cooler_frozen_published_when_true(self, mock_batch):
         event = {"should_heartbeat": 1, "cooler_frozen": True, "meters": {"v0": {}}, "plugs": {"v0": {}}}
         lambda_handler(event, None)
-        mock_cw.assert_any_call("TestNamespace", "CoolerFrozen", True, "None")
+        _batch(mock_batch).put.assert_any_call("CoolerFrozen", True, "None", timestamp=None, dimensions=[{"Name": "Home", "Value": "nhome"}])
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_cooler_frozen_published_when_false(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_cooler_frozen_published_when_false(self, mock_batch):
         event = {"should_heartbeat": 1, "cooler_frozen": False, "meters": {"v0": {}}, "plugs": {"v0": {}}}
         lambda_handler(event, None)
-        mock_cw.assert_any_call("TestNamespace", "CoolerFrozen", False, "None")
+        _batch(mock_batch).put.assert_any_call("CoolerFrozen", False, "None", timestamp=None, dimensions=[{"Name": "Home", "Value": "nhome"}])
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_cooler_frozen_not_published_when_absent(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_cooler_frozen_not_published_when_absent(self, mock_batch):
         event = {"should_heartbeat": 1, "meters": {"v0": {}}, "plugs": {"v0": {}}}
         lambda_handler(event, None)
-        call_args_list = [c.args for c in mock_cw.call_args_list]
-        metric_names = [args[1] for args in call_args_list]
+        call_args_list = [c.args for c in _batch(mock_batch).put.call_args_list]
+        metric_names = [args[0] for args in call_args_list]
         assert "CoolerFrozen" not in metric_names
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_desired_metrics_published_from_meter_desired_field(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_desired_metrics_published_from_meter_desired_field(self, mock_batch):
         event = {
             "should_heartbeat": 1,
             "meters": {
@@ -152,13 +165,13 @@ class TestLogPullerHandler:
             "plugs": {"v0": {}},
         }
         lambda_handler(event, None)
-        dims = [{"Name": "Meter", "Value": "Meter 1"}]
+        dims = [{"Name": "Home", "Value": "nhome"}, {"Name": "Meter", "Value": "Meter 1"}]
         ts = datetime.datetime.fromisoformat("2024-01-15T12:00:00")
-        mock_cw.assert_any_call("TestNamespace", "DesiredTemperature", 18.0, "None", timestamp=ts, dimensions=dims)
-        mock_cw.assert_any_call("TestNamespace", "TemperatureDiff", -4.5, "None", timestamp=ts, dimensions=dims)
+        _batch(mock_batch).put.assert_any_call("DesiredTemperature", 18.0, "None", timestamp=ts, dimensions=dims)
+        _batch(mock_batch).put.assert_any_call("TemperatureDiff", -4.5, "None", timestamp=ts, dimensions=dims)
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_desired_metrics_not_published_when_absent(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_desired_metrics_not_published_when_absent(self, mock_batch):
         event = {
             "should_heartbeat": 1,
             "meters": {
@@ -175,13 +188,13 @@ class TestLogPullerHandler:
             "plugs": {"v0": {}},
         }
         lambda_handler(event, None)
-        call_args_list = [c.args for c in mock_cw.call_args_list]
-        metric_names = [args[1] for args in call_args_list]
+        call_args_list = [c.args for c in _batch(mock_batch).put.call_args_list]
+        metric_names = [args[0] for args in call_args_list]
         assert "DesiredTemperature" not in metric_names
         assert "TemperatureDiff" not in metric_names
 
-    @patch("nepenthes_log_puller.put_cloudwatch")
-    def test_battery_not_published_outside_schedule(self, mock_cw):
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_battery_not_published_outside_schedule(self, mock_batch):
         event = {
             "should_heartbeat": 0,
             "meters": {
@@ -199,6 +212,398 @@ class TestLogPullerHandler:
         }
         lambda_handler(event, None)
 
-        call_args_list = [c.args for c in mock_cw.call_args_list]
-        metric_names = [args[1] for args in call_args_list]
+        call_args_list = [c.args for c in _batch(mock_batch).put.call_args_list]
+        metric_names = [args[0] for args in call_args_list]
         assert "Battery" not in metric_names
+
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_home_dimension_from_topic(self, mock_batch):
+        event = {
+            "home": "nhome2",
+            "should_heartbeat": 1,
+            "meters": {"v0": {"Meter 1": {"Valid": False, "Datetime": "2024-01-15T14:30:00"}}},
+            "plugs": {"v0": {}},
+        }
+        lambda_handler(event, None)
+        home = {"Name": "Home", "Value": "nhome2"}
+        ts = datetime.datetime.fromisoformat("2024-01-15T14:30:00")
+        _batch(mock_batch).put.assert_any_call("Heartbeat", 1, "None", timestamp=None, dimensions=[home])
+        _batch(mock_batch).put.assert_any_call("Valid", False, "None", timestamp=ts, dimensions=[home, {"Name": "Meter", "Value": "Meter 1"}])
+
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_multiple_homes_share_one_batch(self, mock_batch):
+        event = {"homes": [
+            {"home": "a", "should_heartbeat": 1, "meters": {"v0": {}}, "plugs": {"v0": {}}},
+            {"home": "b", "should_heartbeat": 0, "meters": {"v0": {}}, "plugs": {"v0": {}}},
+        ]}
+        lambda_handler(event, None)
+        mock_batch.assert_called_once_with("TestNamespace")
+        heartbeats = [c for c in _batch(mock_batch).put.call_args_list if c.args[0] == "Heartbeat"]
+        assert [c.kwargs["dimensions"][0]["Value"] for c in heartbeats] == ["a", "b"]
+
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_malformed_payload_publishes_nothing(self, mock_batch):
+        event = {"homes": [
+            {"home": "a", "should_heartbeat": 1},
+            # The bad Humidity comes after metrics that would otherwise have been put already
+            {"home": "b", "should_heartbeat": 1, "meters": {"v0": {
+                "Meter 1": {"Valid": True, "Temperature": 22.5, "Humidity": "75", "Datetime": "2024-01-15T12:00:00"},
+            }}},
+        ]}
+        lambda_handler(event, None)
+        assert [c.kwargs["dimensions"][0]["Value"] for c in _batch(mock_batch).put.call_args_list] == ["a"]
+
+    @patch("nepenthes_log_puller.MetricBatch")
+    def test_v1_payload_publishes_every_reading(self, mock_batch):
+        event = {"should_heartbeat": 1, "meters": {"v1": {
+            "base": 1705320000,
+            "columns": ["t", "Valid", "Temperature", "Humidity"],
+            "rows": {"Meter 1": [[0, 1, 22.5, 75.0], [120, 1, 22.7, 74.0], [240, 0, None, None]]},
+        }}}
+        lambda_handler(event, None)
+        temperatures = [(c.args[1], c.kwargs["timestamp"]) for c in _batch(mock_batch).put.call_args_list
+                        if c.args[0] == "Temperature"]
+        assert temperatures == [(22.5, datetime.datetime(2024, 1, 15, 12, 0)),
+                                (22.7, datetime.datetime(2024, 1, 15, 12, 2))]
+        valid = [c.args[1] for c in _batch(mock_batch).put.call_args_list if c.args[0] == "Valid"]
+        assert valid == [1, 1, 0]
+
+
+def _plug_payload(minute, switch=True):
+    return {"should_heartbeat": 1, "plugs": {"v0": {"N.Pi": {
+        "Valid": True, "Switch": switch, "Power": 3.0, "Datetime": "2024-01-15T12:{:02d}:00".format(minute)}}}}
+
+
+@patch.dict(os.environ, {"METRIC_BACKEND": "api"})
+class TestLogPullerDeadband:
+    @patch("cloudwatch.cloud_watch")
+    def test_unchanged_switch_published_once_per_heartbeat_period(self, mock_cw):
+        with patch("nepenthes_log_puller.deadband", build_deadband('{"Switch": 300}')):
+            for minute, switch in [(0, True), (2, True), (4, False), (6, False), (8, False)]:
+                lambda_handler(_plug_payload(minute, switch), None)
+        switches = [(d["Value"], d["Timestamp"].minute) for c in mock_cw.put_metric_data.call_args_list
+                    for d in c.kwargs["MetricData"] if d["MetricName"] == "Switch"]
+        assert switches == [(1, 0), (0, 4), (0, 6)]
+        powers = [d for c in mock_cw.put_metric_data.call_args_list for d in c.kwargs["MetricData"]
+                  if d["MetricName"] == "Power"]
+        assert len(powers) == 5
+
+    @patch("cloudwatch.cloud_watch")
+    def test_failed_sqs_publish_is_published_again_on_redelivery(self, mock_cw):
+        mock_cw.put_metric_data.side_effect = [Exception("Throttled"), None]
+        event = _sqs_event(_plug_payload(0))
+        with patch("nepenthes_log_puller.deadband", build_deadband('{"Switch": 300}')):
+            assert lambda_handler(event, None) == {"batchItemFailures": [{"itemIdentifier": "m0"}]}
+            assert lambda_handler(event, None) == {"batchItemFailures": []}
+        names = [d["MetricName"] for d in mock_cw.put_metric_data.call_args.kwargs["MetricData"]]
+        assert "Switch" in names
+
+    @patch("cloudwatch.cloud_watch")
+    def test_replay_bypasses_deadband(self, mock_cw):
+        now = datetime.datetime.now(datetime.timezone.utc).replace(second=0, microsecond=0, tzinfo=None)
+        payloads = [{"plugs": {"v0": {"N.Pi": {"Valid": True, "Switch": True, "Power": 3.0,
+                                               "Datetime": (now - datetime.timedelta(seconds=s)).isoformat()}}}}
+                    for s in (0, 10)]
+        with patch("nepenthes_log_puller.deadband", build_deadband('{"Switch": 300}')):
+            lambda_handler({"replay": payloads}, None)
+        names = [d["MetricName"] for d in mock_cw.put_metric_data.call_args.kwargs["MetricData"]]
+        assert names.count("Switch") == 2
+
+
+@patch.dict(os.environ, {"METRIC_BACKEND": "api"})
+class TestLogPullerArchive:
+    @patch("cloudwatch.cloud_watch")
+    def test_live_and_sqs_readings_archived(self, mock_cw, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        with patch("nepenthes_log_puller.archive_store", store):
+            lambda_handler(_plug_payload(0), None)
+            lambda_handler(_sqs_event(_plug_payload(1), "not json"), None)
+        start = datetime.datetime(2024, 1, 15, 12)
+        plugs = query_plug(store, "nhome", "N.Pi", start, start + datetime.timedelta(minutes=5))
+        assert [(p.timestamp.minute, p.power) for p in plugs] == [(0, 3.0), (1, 3.0)]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_replay_archives_readings_too_old_for_cloudwatch(self, mock_cw, tmp_path):
+        store = LocalArchiveStore(str(tmp_path))
+        with patch("nepenthes_log_puller.archive_store", store):
+            payload = {"meters": {"v0": {"N. Meter 1": _meter("2020-01-01T00:00:00")}}}
+            counts = lambda_handler({"replay": [payload, payload], "home": "nhome"}, None)
+        assert (counts["accepted"], counts["skipped"]["too_old"], counts["skipped"]["duplicate"]) == (0, 1, 1)
+        start = datetime.datetime(2020, 1, 1)
+        [meter] = query_meter(store, "nhome", "N. Meter 1", start, start + datetime.timedelta(days=1))
+        assert meter.temperature == 22.0
+
+    @patch("cloudwatch.cloud_watch")
+    def test_failed_publish_is_archived_once_on_redelivery(self, mock_cw, tmp_path):
+        mock_cw.put_metric_data.side_effect = [Exception("Throttled"), None, Exception("Throttled"), None]
+        store = LocalArchiveStore(str(tmp_path))
+        with patch("nepenthes_log_puller.archive_store", store):
+            lambda_handler(_sqs_event(_plug_payload(0)), None)
+            lambda_handler(_sqs_event(_plug_payload(0)), None)
+            with pytest.raises(Exception, match="Throttled"):
+                lambda_handler(_plug_payload(1), None)
+            lambda_handler(_plug_payload(1), None)
+        # One object per successful invocation
+        assert len(store.list(partition_prefix(datetime.date(2024, 1, 15), "nhome", "plugs", "N.Pi"))) == 2
+
+    @patch("cloudwatch.cloud_watch")
+    def test_disabled_by_default(self, mock_cw, tmp_path):
+        with patch("nepenthes_log_puller.archive_store", None):
+            lambda_handler(_plug_payload(0), None)
+        mock_cw.put_metric_data.assert_called_once()
+
+
+@patch.dict(os.environ, {"METRIC_BACKEND": "api"})
+class TestLogPullerRollups:
+    START = datetime.datetime(2024, 1, 15)
+
+    def _power(self, store):
+        return query_rollups(store, "nhome", "plugs", "N.Pi", "Power", "hour", self.START,
+                             self.START + datetime.timedelta(days=1))
+
+    @patch("cloudwatch.cloud_watch")
+    def test_live_readings_rolled_up(self, mock_cw):
+        store = MemoryRollupStore()
+        with patch("nepenthes_log_puller.rollups", RollupUpdater(store)):
+            lambda_handler(_plug_payload(0), None)
+            lambda_handler(_sqs_event(_plug_payload(1)), None)
+        [hour] = self._power(store)
+        assert (hour.count, hour.mean) == (2, 3.0)
+
+    @patch("cloudwatch.cloud_watch")
+    def test_failed_sqs_publish_is_rolled_up_once_on_redelivery(self, mock_cw):
+        mock_cw.put_metric_data.side_effect = [Exception("Throttled"), None]
+        store = MemoryRollupStore()
+        event = _sqs_event(_plug_payload(0))
+        with patch("nepenthes_log_puller.rollups", RollupUpdater(store)):
+            lambda_handler(event, None)
+            assert self._power(store) == []
+            lambda_handler(event, None)
+        assert [hour.count for hour in self._power(store)] == [1]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_failed_direct_invocation_is_rolled_up_once_on_retry(self, mock_cw):
+        mock_cw.put_metric_data.side_effect = [Exception("Throttled"), None]
+        store = MemoryRollupStore()
+        with patch("nepenthes_log_puller.rollups", RollupUpdater(store)):
+            with pytest.raises(Exception, match="Throttled"):
+                lambda_handler(_plug_payload(0), None)
+            assert self._power(store) == []
+            lambda_handler(_plug_payload(0), None)
+        assert [hour.count for hour in self._power(store)] == [1]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_replayed_readings_rolled_up(self, mock_cw):
+        store = MemoryRollupStore()
+        with patch("nepenthes_log_puller.rollups", RollupUpdater(store)):
+            lambda_handler({"replay": [_plug_payload(0), _plug_payload(0), _plug_payload(30)], "home": "nhome"}, None)
+        [hour] = self._power(store)
+        assert hour.count == 2
+
+
+# Fault alarms in lib/nepenthes-alarms.ts: metric, dimensions, and their fields before and with high resolution
+FAULT_ALARMS = {
+    "NCoolerFrozenAlarm": ("CoolerFrozen", {"Home": "nhome"}, [
+        dict(period=300, comparison="GreaterThanOrEqualToThreshold", threshold=1, evaluation_periods=1,
+             treat_missing_data="ignore"),
+        dict(period=30, comparison="GreaterThanOrEqualToThreshold", threshold=1, evaluation_periods=1,
+             treat_missing_data="ignore"),
+    ]),
+    "NFanNotDrawingPower": ("Power", {"Home": "nhome", "Plug": "N.Fan"}, [
+        dict(period=300, comparison="LessThanOrEqualToThreshold", threshold=0, evaluation_periods=3,
+             datapoints_to_alarm=3, treat_missing_data="breaching"),
+        dict(period=30, comparison="LessThanOrEqualToThreshold", threshold=0, evaluation_periods=6,
+             datapoints_to_alarm=3, treat_missing_data="notBreaching"),
+    ]),
+}
+
+
+class TestHighResolutionFaults:
+    @pytest.mark.parametrize("name", FAULT_ALARMS)
+    def test_fault_alarm_fires_within_minutes_of_the_fault(self, name, monkeypatch):
+        monkeypatch.setenv("METRIC_AGGREGATION_PERIOD", "60")
+        monkeypatch.setenv("HIGH_RESOLUTION_METRICS", "CoolerFrozen,Power")
+        start = datetime.datetime(2024, 1, 15, 12, tzinfo=datetime.timezone.utc)
+        fault = start + datetime.timedelta(minutes=30)
+        store = MetricStore()
+        with recording(store):
+            # The Pi reports every minute, a few seconds past it; the cooler freezes and the fan stops at fault
+            for minute in range(60):
+                at = start + datetime.timedelta(minutes=minute, seconds=7)
+                failed = at >= fault
+                with MetricBatch("NHomeZero") as batch:
+                    put_home_metrics(batch, {"home": "nhome", "should_heartbeat": 1, "cooler_frozen": failed,
+                                             "plugs": {"v0": {"N.Fan": {
+                                                 "Valid": True, "Switch": True, "Power": 0.0 if failed else 4.0,
+                                                 "Datetime": at.replace(tzinfo=None).isoformat()}}}},
+                                     now=at)
+
+        metric_name, dimensions, definitions = FAULT_ALARMS[name]
+        delays = []
+        for fields in definitions:
+            alarm = AlarmDefinition(name=name, namespace="NHomeZero", metric_name=metric_name,
+                                    dimensions=dimensions, statistic="Maximum", **fields)
+            transitions = evaluate_alarm(store, alarm, start, start + datetime.timedelta(hours=1))
+            [alarmed_at] = [at for at, _, state in transitions if state == STATE_ALARM]
+            delays.append(alarmed_at - fault.timestamp())
+        before, after = delays
+        assert after <= 3 * 60
+        assert before - after >= 4 * 60
+
+def _sqs_event(*bodies):
+    return {"Records": [
+        {"messageId": "m{}".format(i), "eventSource": "aws:sqs", "body": body if isinstance(body, str) else json.dumps(body)}
+        for i, body in enumerate(bodies)
+    ]}
+
+
+@patch.dict(os.environ, {"METRIC_BACKEND": "api"})
+class TestLogPullerSqsBatch:
+    @patch("cloudwatch.cloud_watch")
+    def test_all_messages_published_in_one_call(self, mock_cw):
+        event = _sqs_event(
+            {"home": "a", "should_heartbeat": 1},
+            {"home": "b", "should_heartbeat": 0, "cooler_frozen": False},
+        )
+        result = lambda_handler(event, None)
+        assert result == {"batchItemFailures": []}
+        mock_cw.put_metric_data.assert_called_once()
+        metric_data = mock_cw.put_metric_data.call_args.kwargs["MetricData"]
+        assert [(d["MetricName"], d["Dimensions"][0]["Value"]) for d in metric_data] == [
+            ("Heartbeat", "a"), ("Heartbeat", "b"), ("CoolerFrozen", "b")]
+
+    @patch.dict(os.environ, {"METRIC_AGGREGATION_PERIOD": "60"})
+    @patch("cloudwatch.cloud_watch")
+    def test_readings_aggregated_across_messages(self, mock_cw):
+        # Two messages with readings every 20 seconds of the same minute
+        event = _sqs_event(*({"home": "a", "should_heartbeat": 1, "plugs": {"v1": {
+            "base": 1705320000 + start, "columns": ["t", "Valid", "Switch", "Power"],
+            "rows": {"P": [[0, 1, 1, 2.0], [20, 1, 1, 4.0]]},
+        }}} for start in (0, 30)))
+        assert lambda_handler(event, None) == {"batchItemFailures": []}
+        metric_data = {d["MetricName"]: d for d in mock_cw.put_metric_data.call_args.kwargs["MetricData"]}
+        assert metric_data["Power"]["StatisticValues"] == {"SampleCount": 4, "Sum": 12.0, "Minimum": 2.0, "Maximum": 4.0}
+        assert metric_data["Valid"]["StatisticValues"]["SampleCount"] == 4
+
+    @patch("cloudwatch.cloud_watch")
+    def test_bad_message_reported_without_dropping_others(self, mock_cw):
+        event = _sqs_event({"home": "a", "should_heartbeat": 1}, "not json", {"home": "c"})
+        result = lambda_handler(event, None)
+        assert result == {"batchItemFailures": [{"itemIdentifier": "m1"}, {"itemIdentifier": "m2"}]}
+        metric_data = mock_cw.put_metric_data.call_args.kwargs["MetricData"]
+        assert [d["MetricName"] for d in metric_data] == ["Heartbeat"]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_invalid_message_reported_for_dead_letter_queue(self, mock_cw):
+        event = _sqs_event({"home": "a", "should_heartbeat": 1, "plugs": {"v0": {"P": {"Valid": True, "Switch": 1}}}})
+        result = lambda_handler(event, None)
+        assert result == {"batchItemFailures": [{"itemIdentifier": "m0"}]}
+        mock_cw.put_metric_data.assert_not_called()
+
+    @patch("cloudwatch.cloud_watch")
+    def test_publish_failure_reports_every_accepted_message(self, mock_cw):
+        mock_cw.put_metric_data.side_effect = Exception("throttled")
+        event = _sqs_event({"should_heartbeat": 1}, "{", {"should_heartbeat": 0})
+        result = lambda_handler(event, None)
+        assert sorted(f["itemIdentifier"] for f in result["batchItemFailures"]) == ["m0", "m1", "m2"]
+
+    @patch("cloudwatch.cloud_watch")
+    def test_non_sqs_records_use_direct_shape(self, mock_cw):
+        event = {"Records": [], "should_heartbeat": 1}
+        assert lambda_handler(event, None) is None
+        mock_cw.put_metric_data.assert_called_once()
+
+
+def _meter(datetime_str, temperature=22.0):
+    return {"Valid": True, "Temperature": temperature, "Humidity": 70.0, "BatteryVoltage": 90, "Datetime": datetime_str}
+
+
+class TestReplay:
+    NOW = datetime.datetime(2024, 1, 15, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def _replay(self, payloads, home=None):
+        batch = MetricBatch("TestNamespace", backend="api")
+        counts = replay_home_metrics(batch, payloads, home=home, now=self.NOW)
+        return batch, counts
+
+    def test_readings_deduplicated_and_sorted(self):
+        payloads = [
+            {"should_heartbeat": 1, "meters": {"v0": {"M": _meter("2024-01-15T10:20:00")}}},
+            {"should_heartbeat": 1, "meters": {"v0": {"M": _meter("2024-01-15T10:10:00")}},
+             "plugs": {"v0": {"P": {"Valid": True, "Switch": True, "Power": 3.0, "Datetime": "2024-01-15T10:15:00"}}}},
+            {"should_heartbeat": 1, "meters": {"v0": {"M": _meter("2024-01-15T10:20:00", temperature=99.0)}}},
+        ]
+        batch, counts = self._replay(payloads)
+        assert counts == {"accepted": 3, "datapoints": 9, "skipped": {"duplicate": 1, "no_timestamp": 0, "too_old": 0, "too_new": 0, "invalid": 0}}
+        timestamps = [d["Timestamp"] for d in batch._data]
+        assert timestamps == sorted(timestamps)
+        assert "Heartbeat" not in [d["MetricName"] for d in batch._data]
+        # First payload wins for duplicated readings
+        assert [d["Value"] for d in batch._data if d["MetricName"] == "Temperature"] == [22.0, 22.0]
+
+    def test_out_of_range_and_untimestamped_readings_skipped(self):
+        payloads = [{"meters": {"v0": {
+            "Old": _meter("2023-12-01T00:00:00"),
+            "Future": _meter("2024-01-16T00:00:00"),
+            "NoTime": {"Valid": False},
+            "Ok": {"Valid": False, "Datetime": "2024-01-15T11:00:00"},
+        }}}]
+        batch, counts = self._replay(payloads)
+        assert counts == {"accepted": 1, "datapoints": 1, "skipped": {"duplicate": 0, "no_timestamp": 1, "too_old": 1, "too_new": 1, "invalid": 0}}
+        assert batch._data[0]["Dimensions"] == [{"Name": "Home", "Value": "nhome"}, {"Name": "Meter", "Value": "Ok"}]
+
+    def test_malformed_payloads_skipped(self):
+        payloads = [
+            {"plugs": {"v0": {"P": {"Valid": "yes", "Datetime": "2024-01-15T11:00:00"}}}},
+            {"plugs": {"v0": {"P": {"Valid": False, "Datetime": "2024-01-15T11:00:00"}}}},
+        ]
+        batch, counts = self._replay(payloads)
+        assert (counts["accepted"], counts["skipped"]["invalid"]) == (1, 1)
+
+    def test_v0_and_v1_readings_deduplicated_together(self):
+        payloads = [
+            {"meters": {"v0": {"M": _meter("2024-01-15T10:10:00")}}},
+            {"meters": {"v1": {"base": 1705313400, "columns": ["t", "Valid", "Temperature", "Humidity"],
+                               "rows": {"M": [[0, 1, 99.0, 70.0], [600, 1, 23.0, 70.0]]}}}},
+        ]
+        batch, counts = self._replay(payloads)
+        assert (counts["accepted"], counts["skipped"]["duplicate"]) == (2, 1)
+        assert [d["Value"] for d in batch._data if d["MetricName"] == "Temperature"] == [22.0, 23.0]
+
+    def test_offset_and_naive_utc_timestamps_deduplicated_together(self):
+        payloads = [
+            {"meters": {"v0": {"M": _meter("2024-01-15T19:10:00+09:00")}}},
+            {"meters": {"v0": {"M": _meter("2024-01-15T10:10:00", temperature=99.0)}}},
+            {"meters": {"v0": {"M": _meter("2024-01-15T10:05:00")}}},
+            {"meters": {"v0": {"M": _meter("2024-01-15T10:15:00Z")}}},
+        ]
+        batch, counts = self._replay(payloads)
+        assert (counts["accepted"], counts["skipped"]["duplicate"]) == (3, 1)
+        temperatures = [d for d in batch._data if d["MetricName"] == "Temperature"]
+        assert [d["Timestamp"] for d in temperatures] == [
+            datetime.datetime(2024, 1, 15, 10, minute) for minute in (5, 10, 15)]
+        assert [d["Value"] for d in temperatures] == [22.0, 22.0, 22.0]
+
+    def test_envelope_home_used_for_payloads_without_one(self):
+        payloads = [
+            {"plugs": {"v0": {"P": {"Valid": False, "Datetime": "2024-01-15T11:00:00"}}}},
+            {"home": "other", "plugs": {"v0": {"P": {"Valid": False, "Datetime": "2024-01-15T11:00:00"}}}},
+        ]
+        batch, counts = self._replay(payloads, home="nhome2")
+        assert counts["accepted"] == 2
+        assert [d["Dimensions"][0]["Value"] for d in batch._data] == ["nhome2", "other"]
+
+    @patch.dict(os.environ, {"METRIC_BACKEND": "api"})
+    @patch("cloudwatch.cloud_watch")
+    def test_handler_publishes_backlog_in_one_call(self, mock_cw):
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0, tzinfo=None)
+        payloads = [
+            {"should_heartbeat": 1, "plugs": {"v0": {"P": {"Valid": True, "Switch": True, "Power": 1.0,
+                                                            "Datetime": (now - datetime.timedelta(minutes=m)).isoformat()}}}}
+            for m in range(100)
+        ]
+        counts = lambda_handler({"home": "nhome", "replay": payloads + payloads}, None)
+        assert counts["accepted"] == 100
+        assert counts["skipped"]["duplicate"] == 100
+        mock_cw.put_metric_data.assert_called_once()
+        assert len(mock_cw.put_metric_data.call_args.kwargs["MetricData"]) == 300
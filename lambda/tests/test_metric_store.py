@@ -0,0 +1,220 @@
+import datetime
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("METRIC_NAMESPACE", "TestNamespace")
+
+import cloudwatch
+from benchmarks.alarm_replay import replay, synthetic_telemetry
+from metric_store import (
+    AlarmDefinition, MetricStore, STATE_ALARM, STATE_INSUFFICIENT_DATA, STATE_OK, evaluate_alarm, load_alarms,
+    recording, statistic,
+)
+
+HOME = [{"Name": "Home", "Value": "nhome"}]
+# 2024-01-15 00:00:00 UTC
+T0 = 1705276800.0
+
+
+def _datetime(epoch_seconds):
+    return datetime.datetime.fromtimestamp(epoch_seconds, datetime.timezone.utc)
+
+
+def _alarm(**overrides):
+    definition = dict(
+        name="TemperatureHigh", namespace="NHomeZero", metric_name="Temperature", dimensions={"Home": "nhome"},
+        period=120, statistic="Minimum", comparison="GreaterThanOrEqualToThreshold", threshold=26.0,
+        evaluation_periods=3, datapoints_to_alarm=3, treat_missing_data="ignore",
+    )
+    definition.update(overrides)
+    return AlarmDefinition(**definition)
+
+
+def _store(values, period=120, metric_name="Temperature"):
+    """Store with one datapoint per period starting at T0; None leaves the period empty."""
+    store = MetricStore()
+    for i, value in enumerate(values):
+        if value is not None:
+            store.put("NHomeZero", metric_name, value, T0 + i * period + 1, HOME)
+    return store
+
+
+class TestMetricStore:
+    def test_statistics_per_aligned_period(self):
+        store = MetricStore()
+        for offset, value in [(130, 3), (10, 1), (50, 2), (125, 5)]:
+            store.put("NHomeZero", "Temperature", value, T0 + offset, HOME)
+
+        assert store.get_statistics("NHomeZero", "Temperature", {"Home": "nhome"}, T0, T0 + 360, 120, "Maximum") == [
+            (T0, 2.0), (T0 + 120, 5.0)]
+        assert store.get_statistics("NHomeZero", "Temperature", HOME, T0 + 60, T0 + 240, 120, "SampleCount") == [
+            (T0, 2.0), (T0 + 120, 2.0)]
+
+    def test_dimensions_must_match_exactly(self):
+        store = MetricStore()
+        store.put("NHomeZero", "Temperature", 1, T0, [{"Name": "Meter", "Value": "m"}, HOME[0]])
+
+        assert store.get_statistics("NHomeZero", "Temperature", {"Home": "nhome", "Meter": "m"}, T0, T0 + 60, 60, "Sum")
+        assert store.get_statistics("NHomeZero", "Temperature", {"Home": "nhome"}, T0, T0 + 60, 60, "Sum") == []
+
+    def test_accepts_datetimes_and_booleans(self):
+        store = MetricStore()
+        store.put("NHomeZero", "Switch", True, datetime.datetime(2024, 1, 15), HOME)
+
+        assert store.get_statistics("NHomeZero", "Switch", HOME, T0, T0 + 60, 60, "Maximum") == [(T0, 1.0)]
+        assert store.metrics() == [("NHomeZero", "Switch", {"Home": "nhome"})]
+        assert store.time_range() == (T0, T0)
+        assert MetricStore().time_range() is None
+
+    @pytest.mark.parametrize("name, expected", [
+        ("Average", 2.5), ("Sum", 10), ("Minimum", 1), ("Maximum", 4), ("SampleCount", 4), ("p50", 2), ("p99", 4),
+    ])
+    def test_statistic(self, name, expected):
+        assert statistic([4, 1, 3, 2], name) == expected
+
+    def test_unknown_statistic(self):
+        with pytest.raises(ValueError):
+            statistic([1], "Median")
+
+    def test_records_put_cloudwatch_and_metric_batch(self, monkeypatch):
+        monkeypatch.setenv("METRIC_BACKEND", "emf")
+        store = MetricStore()
+        with recording(store):
+            cloudwatch.put_cloudwatch("NHomeZero", "Heartbeat", 1, "None", datetime.datetime(2024, 1, 15), HOME)
+            with cloudwatch.MetricBatch("NHomeZero") as batch:
+                batch.put("Heartbeat", 0, "None", timestamp=datetime.datetime(2024, 1, 15, 0, 1), dimensions=HOME)
+
+        assert store.get_statistics("NHomeZero", "Heartbeat", HOME, T0, T0 + 120, 60, "Sum") == [(T0, 1.0), (T0 + 60, 0.0)]
+        assert cloudwatch.cloud_watch is not store
+        assert os.environ["METRIC_BACKEND"] == "emf"
+
+    def test_statistic_sets_give_the_statistics_of_their_readings(self):
+        readings = [(T0 + 7 * i, 20 + (i * 37 % 23) / 4) for i in range(2000)]
+        raw, aggregated = MetricStore(), MetricStore()
+        with recording(raw):
+            with cloudwatch.MetricBatch("NHomeZero", aggregation_period=0) as batch:
+                for at, value in readings:
+                    batch.put("Temperature", value, "None", timestamp=_datetime(at), dimensions=HOME)
+        with recording(aggregated):
+            with cloudwatch.MetricBatch("NHomeZero", aggregation_period=60) as batch:
+                for at, value in readings:
+                    batch.put("Temperature", value, "None", timestamp=_datetime(at), dimensions=HOME)
+
+        assert len(aggregated) < len(raw) / 8
+        for period in (60, 120, 300, 900, 3600):
+            for stat in ("Average", "Sum", "Minimum", "Maximum", "SampleCount"):
+                expected = raw.get_statistics("NHomeZero", "Temperature", HOME, T0, T0 + 14000, period, stat)
+                actual = aggregated.get_statistics("NHomeZero", "Temperature", HOME, T0, T0 + 14000, period, stat)
+                assert [t for t, _ in actual] == [t for t, _ in expected]
+                assert [v for _, v in actual] == pytest.approx([v for _, v in expected])
+        alarm = _alarm(namespace="NHomeZero", statistic="Maximum", threshold=25.0, evaluation_periods=2,
+                       datapoints_to_alarm=2)
+        assert evaluate_alarm(aggregated, alarm, T0, T0 + 14000) == evaluate_alarm(raw, alarm, T0, T0 + 14000)
+        with pytest.raises(ValueError, match="Percentiles"):
+            aggregated.get_statistics("NHomeZero", "Temperature", HOME, T0, T0 + 60, 60, "p90")
+
+    def test_statistic_set_after_raw_datapoints(self):
+        store = MetricStore()
+        store.put("NHomeZero", "Power", 3.0, T0 + 30, HOME)
+        store.put_statistic_set("NHomeZero", "Power", {"SampleCount": 2, "Sum": 3.0, "Minimum": 1.0, "Maximum": 2.0},
+                                T0 + 10, HOME)
+        store.put("NHomeZero", "Power", 9.0, T0 + 70, HOME)
+
+        assert store.get_statistics("NHomeZero", "Power", HOME, T0, T0 + 120, 60, "Average") == [(T0, 2.0), (T0 + 60, 9.0)]
+        assert store.get_statistics("NHomeZero", "Power", HOME, T0, T0 + 120, 120, "Minimum") == [(T0, 1.0)]
+
+
+class TestAlarmEvaluation:
+    def test_m_of_n_breaching_raises_alarm(self):
+        transitions = evaluate_alarm(_store([20, 27, 27, 27, 20]), _alarm(), T0, T0 + 600)
+
+        assert transitions == [
+            (T0 + 120, STATE_INSUFFICIENT_DATA, STATE_OK),
+            (T0 + 480, STATE_OK, STATE_ALARM),
+            (T0 + 600, STATE_ALARM, STATE_OK),
+        ]
+
+    def test_fewer_than_m_breaching_stays_ok(self):
+        transitions = evaluate_alarm(_store([27, 20, 27, 20, 27]), _alarm(datapoints_to_alarm=3, evaluation_periods=4),
+                                     T0 + 360, T0 + 600)
+        assert transitions == [(T0 + 480, STATE_INSUFFICIENT_DATA, STATE_OK)]
+
+    def test_partial_range_alarms_when_every_present_datapoint_breaches(self):
+        alarm = _alarm(treat_missing_data="missing")
+        assert alarm.state([None, None, 27], STATE_OK) == STATE_ALARM
+        assert alarm.state([20, None, 27], STATE_OK) == STATE_OK
+        assert _alarm(treat_missing_data="notBreaching").state([None, 27, 27], STATE_OK) == STATE_OK
+
+    def test_missing_data_ignored_keeps_state(self):
+        store = _store([27, 27, 27, None, None, None])
+        # Stays in ALARM through the gap instead of becoming INSUFFICIENT_DATA
+        assert evaluate_alarm(store, _alarm(), T0, T0 + 720) == [(T0 + 120, STATE_INSUFFICIENT_DATA, STATE_ALARM)]
+
+    def test_missing_data_missing_becomes_insufficient(self):
+        store = _store([27, 27, 27, None, None, None])
+        transitions = evaluate_alarm(store, _alarm(treat_missing_data="missing"), T0, T0 + 720)
+        assert transitions[-1] == (T0 + 720, STATE_ALARM, STATE_INSUFFICIENT_DATA)
+
+    def test_missing_data_breaching(self):
+        heartbeat = _alarm(metric_name="Heartbeat", period=900, statistic="Maximum", comparison="LessThanOrEqualToThreshold",
+                           threshold=0, evaluation_periods=1, datapoints_to_alarm=1, treat_missing_data="breaching")
+        store = _store([1, None], period=900, metric_name="Heartbeat")
+
+        assert evaluate_alarm(store, heartbeat, T0, T0 + 1800) == [
+            (T0 + 900, STATE_INSUFFICIENT_DATA, STATE_OK),
+            (T0 + 1800, STATE_OK, STATE_ALARM),
+        ]
+
+    def test_missing_data_not_breaching(self):
+        transitions = evaluate_alarm(_store([None]), _alarm(treat_missing_data="notBreaching"), T0, T0 + 120)
+        assert transitions == [(T0 + 120, STATE_INSUFFICIENT_DATA, STATE_OK)]
+
+    def test_unknown_comparison(self):
+        with pytest.raises(ValueError):
+            _alarm(comparison="EqualToThreshold")
+
+
+class TestLoadAlarms:
+    def test_reads_metric_alarms_from_template(self, tmp_path):
+        template = tmp_path / "template.json"
+        template.write_text(json.dumps({"Resources": {
+            "MeterTemperatureHighAlarm": {"Type": "AWS::CloudWatch::Alarm", "Properties": {
+                "Namespace": "NHomeZero", "MetricName": "Temperature", "Period": 120, "Statistic": "Minimum",
+                "Dimensions": [{"Name": "Home", "Value": "nhome"}, {"Name": "Meter", "Value": "Meter 1"}],
+                "ComparisonOperator": "GreaterThanOrEqualToThreshold", "Threshold": 26,
+                "EvaluationPeriods": 30, "DatapointsToAlarm": 30, "TreatMissingData": "ignore",
+            }},
+            "Composite": {"Type": "AWS::CloudWatch::Alarm", "Properties": {"Metrics": []}},
+            "Topic": {"Type": "AWS::SNS::Topic", "Properties": {}},
+        }}))
+
+        [alarm] = load_alarms(template)
+
+        assert alarm.name == "MeterTemperatureHighAlarm"
+        assert alarm.dimensions == {"Home": "nhome", "Meter": "Meter 1"}
+        assert (alarm.period, alarm.evaluation_periods, alarm.datapoints_to_alarm) == (120, 30, 30)
+        assert alarm.treat_missing_data == "ignore"
+
+    def test_defaults(self):
+        alarm = AlarmDefinition.from_cloudformation("A", {
+            "Namespace": "N", "MetricName": "M", "Period": 60, "ExtendedStatistic": "p90",
+            "ComparisonOperator": "LessThanThreshold", "Threshold": 1, "EvaluationPeriods": 2,
+        })
+        assert (alarm.statistic, alarm.datapoints_to_alarm, alarm.treat_missing_data) == ("p90", 2, "missing")
+
+
+class TestReplay:
+    def test_synthetic_hot_hour_fires_temperature_alarm_through_log_puller(self):
+        alarm = _alarm(namespace="TestNamespace", dimensions={"Home": "nhome", "Meter": "Meter 1"},
+                       evaluation_periods=30, datapoints_to_alarm=30)
+        store = MetricStore()
+        payloads = synthetic_telemetry([alarm], days=1, start=datetime.datetime(2024, 1, 15))
+
+        assert replay(payloads, store) == 720
+        transitions = evaluate_alarm(store, alarm, *store.time_range())
+
+        # The hot hour (14:00-15:00 UTC) is 30 two-minute periods
+        assert [(new, datetime.datetime.fromtimestamp(at, datetime.timezone.utc).hour)
+                for at, _, new in transitions] == [(STATE_OK, 0), (STATE_ALARM, 15), (STATE_OK, 15)]
@@ -0,0 +1,205 @@
+import os
+import json
+import threading
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+os.environ["PUSHOVER_API_KEY"] = "test-api-key"
+os.environ["PAGEE_USER_KEY"] = "test-user-key"
+os.environ["FORMATTED_TOPIC_ARN"] = "arn:aws:sns:us-west-2:123456789:test-topic"
+os.environ.setdefault("METRIC_NAMESPACE", "TestNamespace")
+
+import alarm_formatter
+import nepenthes_notification_dispatcher
+from fanout import AllRecordsFailedError
+from flap import build_flap_suppressor
+from nepenthes_notification_dispatcher import Route, lambda_handler, load_routes
+
+
+@pytest.fixture(autouse=True)
+def metrics(emf_metrics):
+    return emf_metrics
+
+
+@pytest.fixture(autouse=True)
+def sns():
+    sns = MagicMock()
+    sns.publish.side_effect = lambda **kwargs: {"MessageId": kwargs["Subject"]}
+    with patch.object(nepenthes_notification_dispatcher.sinks["email"], "sns_client", sns):
+        yield sns
+
+
+@pytest.fixture
+def mock_post():
+    """Pushover sends; called with the message fields, returns {"statusCode", "body"}."""
+    client = nepenthes_notification_dispatcher.sinks["pushover"].client
+    with patch.object(client, "send_message") as mock_post:
+        mock_post.return_value = {"statusCode": 200, "body": {"status": 1}}
+        yield mock_post
+
+
+def _make_record(state="ALARM", name="TestAlarm"):
+    alarm = {"NewStateValue": state, "AlarmName": name, "Trigger": {}}
+    return {"Sns": {"Subject": state, "Message": json.dumps(alarm)}}
+
+
+def _make_event(state="ALARM"):
+    return {"Records": [_make_record(state)]}
+
+
+class TestLambdaHandler:
+    def test_alarm_sent_to_pushover_and_email(self, mock_post, sns):
+        result = lambda_handler(_make_event("ALARM"), None)
+
+        mock_post.assert_called_once()
+        assert mock_post.call_args.kwargs["title"] == "ALARM: TestAlarm"
+        sns.publish.assert_called_once()
+        assert sns.publish.call_args.kwargs["TopicArn"] == "arn:aws:sns:us-west-2:123456789:test-topic"
+        assert result["statusCode"] == 200
+        assert [r["sink"] for r in result["results"]] == ["pushover", "email"]
+
+    def test_ok_state_only_sent_to_email(self, mock_post, sns):
+        result = lambda_handler(_make_event("OK"), None)
+
+        mock_post.assert_not_called()
+        sns.publish.assert_called_once()
+        assert result["results"] == [{"sink": "email", "statusCode": 200, "MessageId": "OK: TestAlarm"}]
+
+    def test_parses_each_record_once(self, mock_post):
+        with patch("alarm_formatter.parse_alarm", wraps=alarm_formatter.parse_alarm) as parse_alarm:
+            lambda_handler(_make_event("ALARM"), None)
+        assert parse_alarm.call_count == 1
+
+    def test_worst_status_reported(self, mock_post):
+        mock_post.return_value = {"statusCode": 500, "body": {"raw": "Internal Server Error"}}
+
+        result = lambda_handler(_make_event("ALARM"), None)
+        assert result["statusCode"] == 500
+        assert result["results"][0]["body"] == {"raw": "Internal Server Error"}
+
+    def test_deliveries_run_concurrently(self, mock_post, sns):
+        barrier = threading.Barrier(4, timeout=5)
+
+        def deliver(*args, **kwargs):
+            barrier.wait()
+            return {"statusCode": 200, "body": {"status": 1}}
+
+        mock_post.side_effect = deliver
+        sns.publish.side_effect = lambda **kwargs: deliver() and {"MessageId": "abc123"}
+        event = {"Records": [_make_record(name="Alarm {}".format(i)) for i in range(2)]}
+
+        result = lambda_handler(event, None)
+        assert result["statusCode"] == 200
+        assert len(result["results"]) == 4
+
+    def test_failed_delivery_reported_without_dropping_others(self, mock_post, sns):
+        sns.publish.side_effect = Exception("throttled")
+
+        result = lambda_handler(_make_event("ALARM"), None)
+        assert result["statusCode"] == 500
+        assert result["results"] == [
+            {"sink": "pushover", "statusCode": 200, "body": {"status": 1}},
+            {"error": "throttled"},
+        ]
+
+    def test_raises_when_every_delivery_failed(self, mock_post, sns):
+        mock_post.side_effect = ConnectionError("down")
+        sns.publish.side_effect = Exception("throttled")
+        with pytest.raises(AllRecordsFailedError):
+            lambda_handler(_make_event("ALARM"), None)
+
+    def test_flush_without_held_alarms(self, mock_post):
+        assert lambda_handler({"flush": True}, None) == {"statusCode": 200, "results": []}
+        mock_post.assert_not_called()
+
+    def test_flush_publishes_acknowledgement_metrics(self, mock_post, metrics):
+        mock_post.return_value = {"statusCode": 200, "body": {"status": 1, "receipt": "r1"}}
+        client = nepenthes_notification_dispatcher.sinks["pushover"].client
+        lambda_handler(_make_event("ALARM"), None)
+        metrics()
+
+        with patch.object(client, "get_receipt", return_value={"statusCode": 200, "body": {"expired": 1}}):
+            lambda_handler({"flush": True}, None)
+
+        published = metrics()
+        assert published["AlertsAcknowledged"] == [0]
+        assert published["AlertsExpiredUnacknowledged"] == [1]
+
+
+class TestRoutes:
+    def test_state_filters(self):
+        route = Route("pushover", states=["ALARM", "INSUFFICIENT_DATA"], exclude_states=["INSUFFICIENT_DATA"])
+        assert route.matches({"state": "ALARM"})
+        assert not route.matches({"state": "INSUFFICIENT_DATA"})
+        assert not route.matches({"state": "OK"})
+
+    def test_alarm_pattern(self):
+        route = Route("pushover", alarm_pattern="^NFan")
+        assert route.matches({"state": "ALARM", "alarm_name": "NFanNotDrawingPower"})
+        assert not route.matches({"state": "ALARM", "alarm_name": "NHumidityLow"})
+        assert not route.matches({"state": "ALARM", "alarm_name": None})
+
+    def test_routes_to_unconfigured_sinks_ignored(self):
+        routes = load_routes({"email": object()}, json.dumps([{"sink": "email"}, {"sink": "webhook"}]))
+        assert [route.sink for route in routes] == ["email"]
+
+    def test_custom_routes(self, mock_post, sns):
+        routes = load_routes(nepenthes_notification_dispatcher.sinks, json.dumps([{"sink": "pushover", "alarm_pattern": "^NFan"}]))
+        with patch.object(nepenthes_notification_dispatcher, "routes", routes):
+            lambda_handler(_make_event("ALARM"), None)
+            lambda_handler({"Records": [_make_record(name="NFanNotDrawingPower")]}, None)
+
+        mock_post.assert_called_once()
+        sns.publish.assert_not_called()
+
+
+class TestFlapSuppression:
+    def test_flapping_alarm_suppressed_per_sink_and_counted(self, mock_post, sns, metrics):
+        suppressors = {name: build_flap_suppressor(600, name) for name in ("pushover", "email")}
+        with patch.object(nepenthes_notification_dispatcher, "flap_suppressors", suppressors):
+            for state in ("ALARM", "OK", "ALARM"):
+                lambda_handler(_make_event(state), None)
+
+        mock_post.assert_called_once()
+        sns.publish.assert_called_once()
+        # OK is not routed to Pushover, so only email counts it
+        assert metrics()["NotificationsSuppressed"] == [0, 0, 0, 1, 1, 1]
+
+    def test_suppressed_recovery_sent_by_flush_after_window(self, mock_post, sns):
+        suppressors = {name: build_flap_suppressor(600, name) for name in ("pushover", "email")}
+        with patch.object(nepenthes_notification_dispatcher, "flap_suppressors", suppressors), \
+                patch.object(nepenthes_notification_dispatcher, "FLAP_WINDOW_SECONDS", 600):
+            with patch("flap.time.time", return_value=1000.0):
+                lambda_handler(_make_event("ALARM"), None)
+            with patch("flap.time.time", return_value=1100.0):
+                lambda_handler(_make_event("OK"), None)
+                assert lambda_handler({"flush": True}, None)["results"] == []
+            with patch("flap.time.time", return_value=1700.0):
+                results = lambda_handler({"flush": True}, None)["results"]
+
+        assert results == [{"sink": "email", "statusCode": 200, "MessageId": "OK: TestAlarm"}]
+        assert [c.kwargs["Subject"] for c in sns.publish.call_args_list] == ["ALARM: TestAlarm", "OK: TestAlarm"]
+        assert "suppressed" not in sns.publish.call_args.kwargs["Message"]
+        mock_post.assert_called_once()
+
+    def test_alarm_that_failed_on_every_sink_is_not_suppressed_on_retry(self, mock_post, sns):
+        suppressors = {name: build_flap_suppressor(600, name) for name in ("pushover", "email")}
+        mock_post.side_effect = [ConnectionError("pushover down"), {"statusCode": 200, "body": {"status": 1}}]
+        sns.publish.side_effect = [Exception("throttled"), {"MessageId": "m1"}]
+        with patch.object(nepenthes_notification_dispatcher, "flap_suppressors", suppressors):
+            with pytest.raises(AllRecordsFailedError):
+                lambda_handler(_make_event("ALARM"), None)
+            result = lambda_handler(_make_event("ALARM"), None)
+
+        assert [r.get("suppressed") for r in result["results"]] == [None, None]
+        assert (mock_post.call_count, sns.publish.call_count) == (2, 2)
+
+    def test_failed_flush_delivery_reported(self, mock_post, sns):
+        suppressor = MagicMock()
+        suppressor.due.return_value = [({"title": "OK: TestAlarm", "body": "b", "state": "OK"}, 0)]
+        suppressors = {"pushover": build_flap_suppressor(0, "pushover"), "email": suppressor}
+        sns.publish.side_effect = Exception("throttled")
+        with patch.object(nepenthes_notification_dispatcher, "flap_suppressors", suppressors):
+            result = lambda_handler({"flush": True}, None)
+        assert result == {"statusCode": 500, "results": [{"sink": "email", "error": "throttled"}]}
@@ -1,4 +1,5 @@
 import os
+import threading
 import pytest
 from unittest.mock import patch, MagicMock
 
@@ -7,34 +8,39 @@ os.environ["SB_SECRET_KEY"] = "test-secret"
 os.environ["METRIC_NAMESPACE"] = "TestNamespace"
 
 from nepenthes_online_plug_status import lambda_handler, _get_device_status
+from switchbot import request_budget, PRIORITY_LOW, BUDGET_EXHAUSTED
+
+
+def _batch(mock_batch):
+    return mock_batch.return_value.__enter__.return_value
 
 
 class TestLambdaHandler:
-    @patch("nepenthes_online_plug_status.put_cloudwatch")
+    @patch("nepenthes_online_plug_status.MetricBatch")
     @patch("nepenthes_online_plug_status.call_with_retry")
-    def test_publishes_metrics_for_online_plug(self, mock_retry, mock_cw):
+    def test_publishes_metrics_for_online_plug(self, mock_retry, mock_batch):
         mock_retry.return_value = {"power": "on", "electricCurrent": 5.2}
 
         lambda_handler({}, None)
 
-        metric_names = [c.args[1] for c in mock_cw.call_args_list]
+        metric_names = [c.args[0] for c in _batch(mock_batch).put.call_args_list]
         assert "Valid" in metric_names
         assert "Switch" in metric_names
         assert "Power" in metric_names
 
-    @patch("nepenthes_online_plug_status.put_cloudwatch")
+    @patch("nepenthes_online_plug_status.MetricBatch")
     @patch("nepenthes_online_plug_status.call_with_retry")
-    def test_publishes_zero_power_when_off(self, mock_retry, mock_cw):
+    def test_publishes_zero_power_when_off(self, mock_retry, mock_batch):
         mock_retry.return_value = {"power": "off", "electricCurrent": 0}
 
         lambda_handler({}, None)
 
-        power_calls = [c for c in mock_cw.call_args_list if c.args[1] == "Power"]
-        assert power_calls[0].args[2] == 0
+        power_calls = [c for c in _batch(mock_batch).put.call_args_list if c.args[0] == "Power"]
+        assert power_calls[0].args[1] == 0
 
-    @patch("nepenthes_online_plug_status.put_cloudwatch")
+    @patch("nepenthes_online_plug_status.MetricBatch")
     @patch("nepenthes_online_plug_status.call_with_retry")
-    def test_calls_retry_for_each_device(self, mock_retry, mock_cw):
+    def test_calls_retry_for_each_device(self, mock_retry, mock_batch):
         mock_retry.return_value = {"power": "on", "electricCurrent": 1}
 
         lambda_handler({}, None)
@@ -43,9 +49,9 @@ class TestLambdaHandler:
         assert "N. Pi" in device_names
         assert "N. Fan" in device_names
 
-    @patch("nepenthes_online_plug_status.put_cloudwatch")
+    @patch("nepenthes_online_plug_status.MetricBatch")
     @patch("nepenthes_online_plug_status.call_with_retry")
-    def test_publishes_valid_false_on_failure(self, mock_retry, mock_cw):
+    def test_publishes_valid_false_on_failure(self, mock_retry, mock_batch):
         mock_retry.side_effect = RuntimeError("Cannot find device")
 
         try:
@@ -53,16 +59,95 @@ class TestLambdaHandler:
         except RuntimeError:
             pass
 
-        valid_calls = [c for c in mock_cw.call_args_list if c.args[1] == "Valid"]
-        assert any(c.args[2] is False for c in valid_calls)
+        valid_calls = [c for c in _batch(mock_batch).put.call_args_list if c.args[0] == "Valid"]
+        assert any(c.args[1] is False for c in valid_calls)
+
+    @patch("nepenthes_online_plug_status.MetricBatch")
+    @patch("nepenthes_online_plug_status.call_with_retry")
+    def test_failed_device_does_not_hide_healthy_devices(self, mock_retry, mock_batch):
+        def status(token, secret, device_name, operation, **kwargs):
+            if device_name == "N. Pi":
+                raise RuntimeError("Cannot find device")
+            return {"power": "on", "electricCurrent": 1.5}
+        mock_retry.side_effect = status
+
+        result = lambda_handler({}, None)
+
+        puts = {(c.args[0], c.kwargs["dimensions"][1]["Value"]): c.args[1] for c in _batch(mock_batch).put.call_args_list if "dimensions" in c.kwargs}
+        assert puts[("Valid", "N.Pi")] is False
+        assert ("Switch", "N.Pi") not in puts
+        assert puts[("Valid", "N.Fan")] is True
+        assert puts[("Switch", "N.Fan")] is True
+        assert puts[("Power", "N.Fan")] == 1.5
+        assert result["N. Pi"] == {"error": "Cannot find device"}
+        assert result["N. Fan"] == {"power": "on", "electricCurrent": 1.5}
+
+    @patch("nepenthes_online_plug_status.MetricBatch")
+    @patch("nepenthes_online_plug_status.call_with_retry")
+    def test_polls_devices_concurrently(self, mock_retry, mock_batch):
+        # Each poll waits for the other; a sequential handler would time out the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        def status(token, secret, device_name, operation, **kwargs):
+            barrier.wait()
+            return {"power": "on", "electricCurrent": 1}
+        mock_retry.side_effect = status
+
+        result = lambda_handler({}, None)
+
+        assert all("error" not in r for r in result.values())
+
+
+    @patch("nepenthes_online_plug_status.MetricBatch")
+    @patch("nepenthes_online_plug_status.call_with_retry")
+    def test_plug_metrics_have_home_dimension(self, mock_retry, mock_batch):
+        mock_retry.return_value = {"power": "on", "electricCurrent": 1}
+
+        lambda_handler({}, None)
+
+        _batch(mock_batch).put.assert_any_call("Switch", True, "None", timestamp=None, dimensions=[
+            {"Name": "Home", "Value": "nhome"},
+            {"Name": "Plug", "Value": "N.Pi"},
+        ])
+
+    @patch("nepenthes_online_plug_status.MetricBatch")
+    @patch("nepenthes_online_plug_status.call_with_retry")
+    def test_polls_with_low_priority(self, mock_retry, mock_batch):
+        mock_retry.return_value = {"power": "on", "electricCurrent": 1}
+
+        lambda_handler({}, None)
+
+        assert all(c.kwargs["priority"] == PRIORITY_LOW for c in mock_retry.call_args_list)
+
+    @patch("nepenthes_online_plug_status.MetricBatch")
+    @patch("nepenthes_online_plug_status.call_with_retry")
+    def test_publishes_api_call_count(self, mock_retry, mock_batch):
+        def status(*args, **kwargs):
+            request_budget.record(1)
+            return {"power": "on", "electricCurrent": 1}
+        mock_retry.side_effect = status
+
+        lambda_handler({}, None)
+
+        _batch(mock_batch).put.assert_any_call("SwitchBotApiCalls", 2, "Count")
+
+    @patch("nepenthes_online_plug_status.MetricBatch")
+    @patch("nepenthes_online_plug_status.call_with_retry")
+    @patch.object(request_budget, "state", return_value=BUDGET_EXHAUSTED)
+    def test_skips_poll_when_budget_reserved(self, mock_state, mock_retry, mock_batch):
+        result = lambda_handler({}, None)
+
+        assert result == {"skipped": True}
+        mock_retry.assert_not_called()
+        mock_state.assert_called_once_with(PRIORITY_LOW)
+        _batch(mock_batch).put.assert_called_once_with("SwitchBotApiCalls", 0, "Count")
 
 
 class TestGetDeviceStatus:
     @patch("nepenthes_online_plug_status.build_headers")
-    @patch("nepenthes_online_plug_status.requests.get")
+    @patch("nepenthes_online_plug_status.sb_client.get")
     def test_returns_response_body(self, mock_get, mock_headers):
         mock_headers.return_value = {"Authorization": "tok"}
-        mock_get.return_value.json.return_value = {
+        mock_get.return_value = {
             "statusCode": 100,
             "body": {"power": "on", "electricCurrent": 5.2},
         }
@@ -71,10 +156,10 @@ class TestGetDeviceStatus:
         assert result == {"power": "on", "electricCurrent": 5.2}
 
     @patch("nepenthes_online_plug_status.build_headers")
-    @patch("nepenthes_online_plug_status.requests.get")
+    @patch("nepenthes_online_plug_status.sb_client.get")
     def test_raises_on_api_error(self, mock_get, mock_headers):
         mock_headers.return_value = {"Authorization": "tok"}
-        mock_get.return_value.json.return_value = {
+        mock_get.return_value = {
             "statusCode": 190,
             "body": {},
         }
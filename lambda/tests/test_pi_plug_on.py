@@ -45,10 +45,10 @@ class TestLambdaHandler:
 
 class TestTurnPlugOn:
     @patch("nepenthes_pi_plug_on.build_headers")
-    @patch("nepenthes_pi_plug_on.requests.post")
+    @patch("nepenthes_pi_plug_on.sb_client.post")
     def test_sends_turn_on_command(self, mock_post, mock_headers):
         mock_headers.return_value = {"Authorization": "tok"}
-        mock_post.return_value.json.return_value = {
+        mock_post.return_value = {
             "statusCode": 100,
             "body": {"items": []},
         }
@@ -61,10 +61,10 @@ class TestTurnPlugOn:
         assert result == {"items": []}
 
     @patch("nepenthes_pi_plug_on.build_headers")
-    @patch("nepenthes_pi_plug_on.requests.post")
+    @patch("nepenthes_pi_plug_on.sb_client.post")
     def test_raises_on_api_error(self, mock_post, mock_headers):
         mock_headers.return_value = {"Authorization": "tok"}
-        mock_post.return_value.json.return_value = {
+        mock_post.return_value = {
             "statusCode": 190,
             "body": {},
         }
@@ -1,64 +1,210 @@
-import os
 import json
-from unittest.mock import patch, MagicMock
+import time
+from unittest.mock import patch
 
-os.environ["PUSHOVER_API_KEY"] = "test-api-key"
-os.environ["PAGEE_USER_KEY"] = "test-user-key"
+import pytest
+import requests
 
-from nepenthes_pushover import lambda_handler
+from benchmarks.pushover_delivery import StubPushoverServer
+from pushover import (
+    DynamoDBReceiptStore, MemoryReceiptStore, PushoverClient, RECEIPT_GRACE_SECONDS, ReceiptTracker,
+    build_receipt_tracker,
+)
 
 
-def _make_event(state="ALARM"):
-    alarm = {"NewStateValue": state, "AlarmName": "TestAlarm", "Trigger": {}}
-    return {"Records": [{"Sns": {"Subject": state, "Message": json.dumps(alarm)}}]}
+@pytest.fixture
+def server():
+    with StubPushoverServer() as server:
+        yield server
 
 
-class TestLambdaHandler:
-    @patch("nepenthes_pushover.requests.post")
-    def test_sends_pushover_request(self, mock_post):
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.text = '{"status": 1}'
-        mock_post.return_value = mock_response
+@pytest.fixture
+def client(server):
+    client = PushoverClient("app-token", api_base=server.base_url, backoff_base=0.001, max_backoff=0.01)
+    yield client
+    client.close()
 
-        lambda_handler(_make_event("ALARM"), None)
 
-        mock_post.assert_called_once()
-        call_args = mock_post.call_args
-        assert call_args.args[0] == "https://api.pushover.net/1/messages.json"
-        data = call_args.kwargs["data"]
-        assert data["token"] == "test-api-key"
-        assert data["user"] == "test-user-key"
-        assert data["priority"] == 2
-        assert data["retry"] == 120
-        assert data["expire"] == 900
+class TestPushoverClient:
+    def test_sends_message_with_token(self, client, server):
+        result = client.send_message(user="user-key", title="ALARM: Test", priority=2)
 
-    @patch("nepenthes_pushover.requests.post")
-    def test_returns_status_and_body(self, mock_post):
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.text = '{"status": 1}'
-        mock_post.return_value = mock_response
-
-        result = lambda_handler(_make_event("ALARM"), None)
         assert result["statusCode"] == 200
-        assert result["body"]["status"] == 1
+        assert result["body"]["receipt"] == "r1"
+        method, path, fields = server.requests[0]
+        assert (method, path) == ("POST", "/1/messages.json")
+        assert fields["token"] == ["app-token"]
+        assert fields["title"] == ["ALARM: Test"]
 
-    @patch("nepenthes_pushover.requests.post")
-    def test_handles_non_json_response(self, mock_post):
-        mock_response = MagicMock()
-        mock_response.status_code = 500
-        mock_response.text = "Internal Server Error"
-        mock_post.return_value = mock_response
+    def test_reuses_connection_across_messages(self, client, server):
+        for _ in range(5):
+            client.send_message(user="user-key", title="t")
+        assert server.connections == 1
 
-        result = lambda_handler(_make_event("ALARM"), None)
-        assert result["statusCode"] == 500
-        assert result["body"] == {"raw": "Internal Server Error"}
+    def test_retries_server_errors(self, client, server):
+        server.enqueue(503, {"status": 0})
+        server.enqueue(500, {"status": 0})
 
-    @patch("nepenthes_pushover.requests.post")
-    def test_skips_ok_state(self, mock_post):
-        result = lambda_handler(_make_event("OK"), None)
+        result = client.send_message(user="user-key", title="t")
 
-        mock_post.assert_not_called()
         assert result["statusCode"] == 200
-        assert result["body"] == "skipped OK state"
+        assert len(server.requests) == 3
+
+    def test_gives_up_after_max_attempts(self, client, server):
+        for _ in range(3):
+            server.enqueue(503, {"status": 0})
+        server.enqueue(200, {"status": 1})
+
+        result = client.send_message(user="user-key", title="t")
+
+        assert result == {"statusCode": 503, "body": {"status": 0}}
+        assert len(server.requests) == 3
+
+    def test_does_not_retry_client_errors(self, client, server):
+        server.enqueue(400, {"status": 0, "errors": ["user identifier is invalid"]})
+
+        result = client.send_message(user="bad", title="t")
+
+        assert result["statusCode"] == 400
+        assert len(server.requests) == 1
+
+    def test_honours_short_retry_after(self, client, server):
+        server.enqueue(429, {"status": 0}, {"Retry-After": "0"})
+
+        with patch("pushover.time.sleep") as sleep:
+            assert client.send_message(user="user-key", title="t")["statusCode"] == 200
+        sleep.assert_called_once_with(0.0)
+
+    def test_long_retry_after_not_waited_for(self, client, server):
+        server.enqueue(429, {"status": 0}, {"Retry-After": "60"})
+
+        assert client.send_message(user="user-key", title="t")["statusCode"] == 429
+        assert len(server.requests) == 1
+
+    def test_exhausted_monthly_limit_not_retried(self, client, server):
+        server.enqueue(429, {"status": 0}, {
+            "X-Limit-App-Limit": "10000", "X-Limit-App-Remaining": "0", "X-Limit-App-Reset": "1793000000"})
+
+        assert client.send_message(user="user-key", title="t")["statusCode"] == 429
+        assert len(server.requests) == 1
+        assert (client.app_limit, client.app_remaining, client.app_reset) == (10000, 0, 1793000000)
+
+    def test_tracks_rate_limit_headers(self, client, server):
+        server.enqueue(200, {"status": 1}, {
+            "X-Limit-App-Limit": "10000", "X-Limit-App-Remaining": "7496", "X-Limit-App-Reset": "1793000000"})
+
+        client.send_message(user="user-key", title="t")
+
+        assert client.app_remaining == 7496
+
+    def test_retries_connection_errors(self, client):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"status": 1}'
+        with patch.object(client.session, "request", side_effect=[requests.ConnectionError("reset"), response]):
+            assert client.send_message(user="user-key", title="t")["statusCode"] == 200
+
+    def test_raises_when_connection_keeps_failing(self, client):
+        with patch.object(client.session, "request", side_effect=requests.ConnectionError("down")) as request:
+            with pytest.raises(requests.ConnectionError):
+                client.send_message(user="user-key", title="t")
+        assert request.call_count == 3
+
+    def test_non_json_response(self, client):
+        response = requests.Response()
+        response.status_code = 502
+        response._content = b"Bad Gateway"
+        with patch.object(client.session, "request", return_value=response):
+            assert client.send_message(user="user-key", title="t") == {"statusCode": 502, "body": {"raw": "Bad Gateway"}}
+
+    def test_gets_receipt(self, client, server):
+        server.acknowledged["r7"] = 1000
+
+        result = client.get_receipt("r7")
+
+        assert result["body"]["acknowledged_at"] == 1000
+        method, path, fields = server.requests[0]
+        assert (method, path, fields) == ("GET", "/1/receipts/r7.json", {"token": ["app-token"]})
+
+
+class TestReceiptTracker:
+    def _tracker(self, client):
+        tracker = ReceiptTracker(client, MemoryReceiptStore())
+        tracker.track("r1", sent_at=1000, expires_at=1900)
+        return tracker
+
+    def test_acknowledged_receipt_reported_once(self, client, server):
+        server.acknowledged["r1"] = 1090
+        tracker = self._tracker(client)
+
+        assert tracker.poll(now=1100) == {"acknowledged": [90], "expired": 0, "pending": 0}
+        assert tracker.poll(now=1160) == {"acknowledged": [], "expired": 0, "pending": 0}
+
+    def test_unacknowledged_receipt_kept(self, client):
+        tracker = self._tracker(client)
+
+        assert tracker.poll(now=1100) == {"acknowledged": [], "expired": 0, "pending": 1}
+        assert list(tracker.store.pending()) == ["r1"]
+
+    def test_expired_receipt_counted(self, client, server):
+        server.enqueue(200, {"status": 1, "acknowledged": 0, "expired": 1})
+        tracker = self._tracker(client)
+
+        assert tracker.poll(now=2000)["expired"] == 1
+        assert tracker.store.pending() == {}
+
+    def test_unknown_receipt_dropped(self, client, server):
+        server.enqueue(404, {"status": 0, "errors": ["receipt not found"]})
+        tracker = self._tracker(client)
+
+        assert tracker.poll(now=1100) == {"acknowledged": [], "expired": 0, "pending": 0}
+        assert tracker.store.pending() == {}
+
+    def test_unreachable_receipt_dropped_after_grace(self, client):
+        tracker = self._tracker(client)
+        with patch.object(client, "get_receipt", side_effect=requests.ConnectionError("down")):
+            assert tracker.poll(now=1100)["pending"] == 1
+            assert tracker.poll(now=1900 + RECEIPT_GRACE_SECONDS + 1)["pending"] == 0
+        assert tracker.store.pending() == {}
+
+    def test_store_failure_does_not_fail_delivery_or_poll(self, client):
+        tracker = ReceiptTracker(client, MemoryReceiptStore())
+        with patch.object(tracker.store, "add", side_effect=RuntimeError("down")):
+            tracker.track("r1", 1000, 1900)
+        with patch.object(tracker.store, "pending", side_effect=RuntimeError("down")):
+            assert tracker.poll() == {"acknowledged": [], "expired": 0, "pending": 0}
+
+    def test_remove_failure_logged(self, client, server):
+        server.acknowledged["r1"] = 1090
+        tracker = self._tracker(client)
+        with patch.object(tracker.store, "remove", side_effect=RuntimeError("down")):
+            assert tracker.poll(now=1100)["acknowledged"] == [90]
+
+
+class TestDynamoDBReceiptStore:
+    def test_add_pending_remove(self, dynamodb_table):
+        store = DynamoDBReceiptStore("cache", client=dynamodb_table)
+        store.add("r1", {"sent_at": 1000, "expires_at": 1900})
+        store.add("r2", {"sent_at": 1010, "expires_at": 1910})
+
+        assert store.pending() == {
+            "r1": {"sent_at": 1000, "expires_at": 1900},
+            "r2": {"sent_at": 1010, "expires_at": 1910},
+        }
+        store.remove("r1")
+        assert list(store.pending()) == ["r2"]
+
+    def test_empty_and_missing_item(self, dynamodb_table):
+        store = DynamoDBReceiptStore("cache", client=dynamodb_table)
+        assert store.pending() == {}
+        store.remove("r1")
+
+    def test_item_expires(self, dynamodb_table):
+        DynamoDBReceiptStore("cache", client=dynamodb_table).add("r1", {"sent_at": 1000, "expires_at": 1900})
+        item = dynamodb_table.get_item(TableName="cache", Key={"CacheKey": {"S": "pushover-receipts"}})["Item"]
+        assert int(item["ExpiresAt"]["N"]) > time.time()
+        assert json.loads(item["Receipts"]["M"]["r1"]["S"]) == {"sent_at": 1000, "expires_at": 1900}
+
+    def test_build_receipt_tracker(self, dynamodb_table):
+        assert isinstance(build_receipt_tracker(None, "cache").store, DynamoDBReceiptStore)
+        assert isinstance(build_receipt_tracker(None).store, MemoryReceiptStore)
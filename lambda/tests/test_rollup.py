@@ -0,0 +1,196 @@
+import datetime
+from unittest.mock import patch
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from metric_store import statistic
+from rollup import (
+    DynamoDBRollupStore, MemoryRollupStore, Rollup, RollupUpdater, build_rollups, merge_rollups, query_rollups,
+    series_key,
+)
+from telemetry import MeterReading, PlugReading, parse_payload
+
+T0 = datetime.datetime(2024, 1, 15, 22, 30)
+
+
+def _meter(minutes, humidity, valid=True):
+    reading = MeterReading("N. Meter 1", valid, T0 + datetime.timedelta(minutes=minutes))
+    if valid:
+        reading.temperature, reading.humidity = 22.0, humidity
+    return reading
+
+
+def _humidity(store, resolution, start=T0 - datetime.timedelta(days=1), end=T0 + datetime.timedelta(days=2)):
+    return query_rollups(store, "nhome", "meters", "N. Meter 1", "Humidity", resolution, start, end)
+
+
+class TestRollup:
+    VALUES = [71.3, 70.0, 72.5, 70.0, 69.9, 75.2, 71.1]
+
+    def test_statistics_match_the_readings(self):
+        rollup = Rollup(0, 0.1)
+        for value in self.VALUES:
+            rollup.add(value)
+        for name in ("Average", "Sum", "Minimum", "Maximum", "SampleCount", "p10", "p50", "p90", "p99"):
+            assert rollup.statistic(name) == pytest.approx(statistic(self.VALUES, name)), name
+        with pytest.raises(ValueError, match="Unsupported statistic"):
+            rollup.statistic("IQM")
+
+    def test_merged_rollups_equal_one_rollup_of_all_readings(self):
+        parts = [Rollup(start, 0.1) for start in (0, 3600, 7200)]
+        whole = Rollup(0, 0.1)
+        for i, value in enumerate(self.VALUES):
+            parts[i % 3].add(value)
+            whole.add(value)
+        merged = merge_rollups(parts)
+        assert (merged.start, merged.count, merged.bins) == (0, whole.count, whole.bins)
+        assert merged.statistic("p50") == whole.statistic("p50")
+        assert merge_rollups([]) is None
+
+    def test_percentile_within_half_a_step(self):
+        rollup = Rollup(0, 1)
+        for value in (1.2, 1.4, 3.0):
+            rollup.add(value)
+        # Both low readings fall in bin 1; the median is reported as 1.2, clamped to the minimum
+        assert rollup.percentile(50) == 1.2
+        assert rollup.percentile(100) == 3.0
+
+
+class TestRollupUpdater:
+    def test_hourly_and_daily_rollups_per_device_and_metric(self):
+        store = MemoryRollupStore()
+        with RollupUpdater(store) as rollups:
+            # 22:30 to 00:30, across an hour and a day boundary
+            for minutes, humidity in [(0, 70.0), (20, 72.0), (40, 68.0), (90, 66.0)]:
+                rollups.add("nhome", "meters", _meter(minutes, humidity))
+            rollups.add("nhome", "meters", _meter(50, None, valid=False))
+            rollups.add("nhome", "plugs", PlugReading("N.Fan", True, T0, switch=True, power=4.5))
+
+        hours = _humidity(store, "hour")
+        assert [(datetime.datetime.utcfromtimestamp(h.start).hour, h.count, h.minimum) for h in hours] == [
+            (22, 2, 70.0), (23, 1, 68.0), (0, 1, 66.0)]
+        days = _humidity(store, "day")
+        assert [(d.count, d.maximum) for d in days] == [(3, 72.0), (1, 66.0)]
+        [switch] = query_rollups(store, "nhome", "plugs", "N.Fan", "Switch", "day", T0 - datetime.timedelta(days=1), T0)
+        assert switch.mean == 1.0
+
+    def test_incremental_updates_accumulate(self):
+        store = MemoryRollupStore()
+        rollups = RollupUpdater(store)
+        for minutes in range(3):
+            with rollups:
+                rollups.add("nhome", "meters", _meter(minutes, 70.0 + minutes))
+        [hour] = _humidity(store, "hour")
+        assert (hour.count, hour.mean) == (3, 71.0)
+
+    def test_discarded_readings_are_not_rolled_up(self):
+        store = MemoryRollupStore()
+        with RollupUpdater(store) as rollups:
+            rollups.add("nhome", "meters", _meter(0, 70.0))
+            rollups.discard()
+        assert _humidity(store, "hour") == []
+
+    def test_readings_of_a_failed_invocation_are_not_rolled_up(self):
+        store = MemoryRollupStore()
+        rollups = RollupUpdater(store)
+        with pytest.raises(RuntimeError):
+            with rollups:
+                rollups.add("nhome", "meters", _meter(0, 70.0))
+                raise RuntimeError("publish failed")
+        assert len(rollups) == 0
+        assert _humidity(store, "hour") == []
+
+    def test_add_telemetry_timestamps_undated_readings_now(self):
+        store = MemoryRollupStore()
+        telemetry = parse_payload({"home": "nhome", "should_heartbeat": 1, "meters": {"v0": {
+            "N. Meter 1": {"Valid": True, "Temperature": 22.0, "Humidity": 65.0}}}})
+        with RollupUpdater(store) as rollups:
+            rollups.add_telemetry(telemetry, now=T0.replace(tzinfo=datetime.timezone.utc))
+        [hour] = _humidity(store, "hour")
+        assert hour.start == T0.replace(minute=0, tzinfo=datetime.timezone.utc).timestamp()
+
+    def test_without_store_collects_nothing(self):
+        rollups = build_rollups(None)
+        with rollups:
+            rollups.add("nhome", "meters", _meter(0, 70.0))
+            assert len(rollups) == 0
+
+    def test_failed_merge_is_logged_not_raised(self, caplog):
+        store = MemoryRollupStore()
+        with patch.object(store, "merge", side_effect=RuntimeError("throttled")):
+            with RollupUpdater(store) as rollups:
+                rollups.add("nhome", "meters", _meter(0, 70.0))
+        assert "Failed to update 4 rollups" in caplog.text
+
+
+@pytest.fixture
+def rollup_table():
+    """DynamoDB stand-in with the rollup table layout (Series partition key, Start sort key)."""
+    with mock_aws():
+        client = boto3.client("dynamodb")
+        client.create_table(
+            TableName="rollups",
+            KeySchema=[{"AttributeName": "Series", "KeyType": "HASH"},
+                       {"AttributeName": "Start", "KeyType": "RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "Series", "AttributeType": "S"},
+                                  {"AttributeName": "Start", "AttributeType": "N"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+class TestDynamoDBRollupStore:
+    def test_merges_and_queries(self, rollup_table):
+        store = DynamoDBRollupStore("rollups")
+        for minutes, humidity in [(0, 70.0), (40, 68.5), (90, 66.0)]:
+            with RollupUpdater(store) as rollups:
+                rollups.add("nhome", "meters", _meter(minutes, humidity))
+                rollups.add("nhome", "plugs", PlugReading("N.Fan", True, T0, switch=False, power=0.0))
+
+        assert [(h.count, h.minimum, h.step) for h in _humidity(store, "hour")] == [
+            (1, 70.0, 0.1), (1, 68.5, 0.1), (1, 66.0, 0.1)]
+        [first_day, _] = _humidity(store, "day")
+        assert (first_day.count, first_day.mean, first_day.percentile(50)) == (2, 69.25, 68.5)
+        item = rollup_table.get_item(TableName="rollups", Key={
+            "Series": {"S": series_key("nhome", "meters", "N. Meter 1", "Humidity", "day")},
+            "Start": {"N": str(first_day.start)}})["Item"]
+        assert item["Version"] == {"N": "2"}
+
+    def test_concurrent_update_is_retried(self, rollup_table):
+        store = DynamoDBRollupStore("rollups")
+        other = DynamoDBRollupStore("rollups", client=boto3.client("dynamodb"))
+        transact = store.client.transact_write_items
+        calls = []
+
+        def transact_after_other_container(**kwargs):
+            if not calls:
+                # Another container merges between this one's read and write
+                with RollupUpdater(other) as rollups:
+                    rollups.add("nhome", "meters", _meter(1, 80.0))
+            calls.append(kwargs)
+            return transact(**kwargs)
+
+        with patch.object(store.client, "transact_write_items", side_effect=transact_after_other_container):
+            with RollupUpdater(store) as rollups:
+                rollups.add("nhome", "meters", _meter(0, 60.0))
+
+        assert len(calls) == 2
+        [hour] = _humidity(store, "hour")
+        assert (hour.count, hour.minimum, hour.maximum) == (2, 60.0, 80.0)
+
+    def test_year_of_daily_rollups_in_one_query(self, rollup_table):
+        store = DynamoDBRollupStore("rollups")
+        start = datetime.datetime(2023, 1, 1)
+        series = series_key("nhome", "meters", "N. Meter 1", "Humidity", "day")
+        updates = {}
+        for day in range(365):
+            rollup = updates[(series, 1672531200 + day * 86400)] = Rollup(1672531200 + day * 86400, 0.1)
+            rollup.add(60.0 + day % 10)
+        store.merge(updates)
+
+        days = query_rollups(store, "nhome", "meters", "N. Meter 1", "Humidity", "day", start,
+                             start + datetime.timedelta(days=365))
+        assert [d.start for d in days] == sorted(start for _, start in updates)
+        assert merge_rollups(days).minimum == 60.0
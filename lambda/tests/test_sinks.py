@@ -0,0 +1,148 @@
+import time
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from coalescer import AlarmCoalescer, MemoryCoalesceStore
+from pushover import MemoryReceiptStore, PushoverClient, ReceiptTracker
+from sinks import PushoverSink, SnsEmailSink, WebhookSink, build_sinks
+
+
+def _formatted(title="ALARM: TestAlarm", body="body", state="ALARM"):
+    return {"title": title, "body": body, "state": state, "alarm_name": "TestAlarm"}
+
+
+def _pushover_client(body=None):
+    client = MagicMock(app_remaining=None)
+    client.send_message.return_value = {"statusCode": 200, "body": body or {"status": 1}}
+    return client
+
+
+class TestPushoverSink:
+    def test_sends_critical_alert(self):
+        client = _pushover_client()
+
+        result = PushoverSink(client, "user-key").send(_formatted())
+
+        assert result == {"statusCode": 200, "body": {"status": 1}}
+        fields = client.send_message.call_args.kwargs
+        assert fields["user"] == "user-key"
+        assert fields["title"] == "ALARM: TestAlarm"
+        assert fields["priority"] == 2
+        assert fields["retry"] == 120
+        assert fields["expire"] == 900
+
+    def test_message_truncated_to_pushover_limit(self):
+        client = _pushover_client()
+
+        PushoverSink(client, "user-key").send(_formatted(title="t" * 300, body="b" * 2000))
+
+        fields = client.send_message.call_args.kwargs
+        assert len(fields["title"]) == 250
+        assert len(fields["message"]) == 1024
+
+    def test_storm_sends_first_alert_then_one_digest(self):
+        client = _pushover_client()
+        sink = PushoverSink(client, "user-key", AlarmCoalescer(MemoryCoalesceStore(), 300))
+
+        results = [sink.send(_formatted(title="ALARM: Alarm {}".format(i))) for i in range(5)]
+        assert client.send_message.call_count == 1
+        assert [r["body"] for r in results[1:]] == ["coalesced"] * 4
+
+        assert sink.flush() == []
+        with patch("coalescer.time.time", return_value=time.time() + 301):
+            flushed = sink.flush()
+
+        assert flushed == [{"statusCode": 200, "body": {"status": 1}}]
+        assert client.send_message.call_args.kwargs["title"] == "4 alarms in 5m"
+
+    def test_failed_digest_is_sent_by_the_next_flush(self):
+        client = _pushover_client()
+        sink = PushoverSink(client, "user-key", AlarmCoalescer(MemoryCoalesceStore(), 300))
+        for i in range(3):
+            sink.send(_formatted(title="ALARM: Alarm {}".format(i)))
+
+        later = time.time() + 301
+        client.send_message.side_effect = ConnectionError("pushover down")
+        with patch("coalescer.time.time", return_value=later):
+            with pytest.raises(ConnectionError):
+                sink.flush()
+        client.send_message.side_effect = None
+        with patch("coalescer.time.time", return_value=later + 60):
+            assert sink.flush() == [{"statusCode": 200, "body": {"status": 1}}]
+        assert client.send_message.call_args.kwargs["title"] == "2 alarms in 5m"
+
+    def test_held_alarms_survive_a_failed_send(self):
+        client = _pushover_client()
+        sink = PushoverSink(client, "user-key", AlarmCoalescer(MemoryCoalesceStore(), 300))
+        for i in range(2):
+            sink.send(_formatted(title="ALARM: Alarm {}".format(i)))
+
+        later = time.time() + 301
+        client.send_message.return_value = {"statusCode": 500, "body": {"status": 0}}
+        with patch("coalescer.time.time", return_value=later):
+            assert sink.send(_formatted(title="ALARM: Alarm 2"))["statusCode"] == 500
+        client.send_message.return_value = {"statusCode": 200, "body": {"status": 1}}
+        with patch("coalescer.time.time", return_value=later + 301):
+            assert sink.flush() == [{"statusCode": 200, "body": {"status": 1}}]
+        assert client.send_message.call_args.kwargs["title"] == "ALARM: Alarm 1"
+
+    def test_tracks_receipts_and_reports_acknowledgements(self):
+        client = _pushover_client({"status": 1, "receipt": "r1"})
+        client.get_receipt.return_value = {"statusCode": 200, "body": {"acknowledged": 1, "acknowledged_at": 1000}}
+        client.app_remaining = 9000
+        sink = PushoverSink(client, "user-key", receipts=ReceiptTracker(client, MemoryReceiptStore()))
+
+        with patch("sinks.time.time", return_value=940):
+            sink.send(_formatted())
+
+        assert sink.receipts.store.pending() == {"r1": {"sent_at": 940, "expires_at": 1840}}
+        assert sink.poll(now=1000) == [
+            ("AlertsAcknowledged", 1, "Count"),
+            ("AlertAcknowledgeLatency", 60, "Seconds"),
+            ("AlertsExpiredUnacknowledged", 0, "Count"),
+            ("PushoverMessagesRemaining", 9000, "Count"),
+        ]
+        assert sink.receipts.store.pending() == {}
+
+    def test_poll_without_tracking(self):
+        assert PushoverSink(_pushover_client(), "user-key").poll() == []
+
+
+class TestSnsEmailSink:
+    def test_publishes_to_topic(self):
+        sns = MagicMock()
+        sns.publish.return_value = {"MessageId": "abc123"}
+
+        result = SnsEmailSink("arn:aws:sns:us-west-2:123456789:topic", sns).send(_formatted())
+
+        assert result == {"statusCode": 200, "MessageId": "abc123"}
+        sns.publish.assert_called_once_with(
+            TopicArn="arn:aws:sns:us-west-2:123456789:topic", Subject="ALARM: TestAlarm", Message="body")
+
+
+class TestWebhookSink:
+    @patch("requests.post")
+    def test_posts_json(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=204)
+
+        result = WebhookSink("https://example.com/hook").send(_formatted())
+
+        assert result == {"statusCode": 204}
+        assert mock_post.call_args.kwargs["json"] == _formatted()
+
+
+class TestBuildSinks:
+    def test_builds_configured_sinks(self):
+        sinks = build_sinks({
+            "PUSHOVER_API_KEY": "api-key",
+            "PAGEE_USER_KEY": "user-key",
+            "FORMATTED_TOPIC_ARN": "arn:aws:sns:us-west-2:123456789:topic",
+            "WEBHOOK_URL": "https://example.com/hook",
+        })
+        assert list(sinks) == ["pushover", "email", "webhook"]
+        assert isinstance(sinks["pushover"].client, PushoverClient)
+        assert isinstance(sinks["email"], SnsEmailSink)
+
+    def test_skips_unconfigured_sinks(self):
+        assert list(build_sinks({"PUSHOVER_API_KEY": "api-key"})) == []
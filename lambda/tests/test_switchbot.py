@@ -1,9 +1,16 @@
 import base64
 import hashlib
 import hmac
+import threading
+import time
 import pytest
 from unittest.mock import patch, MagicMock
-from switchbot import build_headers, get_device_id, invalidate_device_id, call_with_retry, _device_id_cache, GET_DEVICES_ENDPOINT, DEVICE_STATUS_ENDPOINT_FORMAT, DEVICE_SEND_CMD_ENDPOINT_FORMAT
+from benchmarks.switchbot_session import StubSwitchBotServer
+from switchbot import (
+    RequestBudget, QuotaExceededError, request_budget,
+    PRIORITY_HIGH, PRIORITY_LOW, BUDGET_NORMAL, BUDGET_CONSERVE, BUDGET_EXHAUSTED, SECONDS_PER_DAY,
+)
+from switchbot import SwitchBotClient, build_headers, get_device_id, invalidate_device_id, call_with_retry, _device_id_cache, DEVICE_ID_CACHE_TTL, GET_DEVICES_ENDPOINT, DEVICE_STATUS_ENDPOINT_FORMAT, DEVICE_SEND_CMD_ENDPOINT_FORMAT
 
 
 class TestBuildHeaders:
@@ -44,10 +51,10 @@ class TestBuildHeaders:
 
 
 def _make_api_response(devices):
-    return MagicMock(json=MagicMock(return_value={
+    return {
         "statusCode": 100,
         "body": {"deviceList": devices},
-    }))
+    }
 
 FAKE_DEVICE_LIST = [
     {"deviceName": "N. Pi", "deviceId": "pi-123", "deviceType": "Plug Mini (JP)", "enableCloudService": True},
@@ -59,14 +66,14 @@ class TestGetDeviceId:
     def setup_method(self):
         _device_id_cache.clear()
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_fetches_from_api_and_returns_id(self, mock_get):
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         result = get_device_id("tok", "sec", "N. Pi")
         assert result == "pi-123"
         mock_get.assert_called_once()
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_caches_all_matching_devices_in_single_call(self, mock_get):
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         get_device_id("tok", "sec", "N. Pi")
@@ -74,14 +81,30 @@ class TestGetDeviceId:
         assert result == "fan-456"
         mock_get.assert_called_once()
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_returns_cached_id_without_api_call(self, mock_get):
-        _device_id_cache["N. Pi"] = "cached-id"
+        _device_id_cache.set("N. Pi", "cached-id")
         result = get_device_id("tok", "sec", "N. Pi")
         assert result == "cached-id"
         mock_get.assert_not_called()
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
+    def test_persistent_tier_survives_memory_loss(self, mock_get):
+        mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
+        get_device_id("tok", "sec", "N. Pi")
+        _device_id_cache.tiers[0].clear()
+        assert get_device_id("tok", "sec", "N. Fan") == "fan-456"
+        mock_get.assert_called_once()
+
+    @patch("switchbot.sb_client.get")
+    def test_refetches_after_ttl_expiry(self, mock_get):
+        mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
+        get_device_id("tok", "sec", "N. Pi")
+        with patch("cache.time.time", return_value=time.time() + DEVICE_ID_CACHE_TTL + 1):
+            get_device_id("tok", "sec", "N. Pi")
+        assert mock_get.call_count == 2
+
+    @patch("switchbot.sb_client.get")
     def test_skips_devices_with_cloud_service_disabled(self, mock_get):
         devices = [
             {"deviceName": "N. Pi", "deviceId": "pi-123", "deviceType": "Plug Mini (JP)", "enableCloudService": False},
@@ -90,7 +113,7 @@ class TestGetDeviceId:
         with pytest.raises(RuntimeError, match="Unable to fetch Device ID of N. Pi"):
             get_device_id("tok", "sec", "N. Pi")
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_skips_devices_with_wrong_type(self, mock_get):
         devices = [
             {"deviceName": "N. Pi", "deviceId": "pi-123", "deviceType": "Bot", "enableCloudService": True},
@@ -99,34 +122,49 @@ class TestGetDeviceId:
         with pytest.raises(RuntimeError, match="Unable to fetch Device ID of N. Pi"):
             get_device_id("tok", "sec", "N. Pi")
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_raises_on_api_error(self, mock_get):
-        mock_get.return_value = MagicMock(json=MagicMock(return_value={"statusCode": 500}))
+        mock_get.return_value = {"statusCode": 500}
         with pytest.raises(RuntimeError, match="Unable to fetch Device IDs"):
             get_device_id("tok", "sec", "N. Pi")
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_raises_when_device_not_found(self, mock_get):
         mock_get.return_value = _make_api_response([])
         with pytest.raises(RuntimeError, match="Unable to fetch Device ID of N. Pi"):
             get_device_id("tok", "sec", "N. Pi")
 
+    @patch("switchbot.sb_client.get")
+    def test_concurrent_cache_misses_fetch_once(self, mock_get):
+        # Hold the first refresh long enough for the second lookup to queue on the lock
+        mock_get.side_effect = lambda *args, **kwargs: time.sleep(0.1) or _make_api_response(FAKE_DEVICE_LIST)
+        results = {}
+        def lookup(name):
+            results[name] = get_device_id("tok", "sec", name)
+        threads = [threading.Thread(target=lookup, args=(name,)) for name in ("N. Pi", "N. Fan")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == {"N. Pi": "pi-123", "N. Fan": "fan-456"}
+        mock_get.assert_called_once()
+
 
 class TestInvalidateDeviceId:
     def setup_method(self):
         _device_id_cache.clear()
 
     def test_removes_cached_entry(self):
-        _device_id_cache["N. Pi"] = "pi-123"
+        _device_id_cache.set("N. Pi", "pi-123")
         invalidate_device_id("N. Pi")
         assert "N. Pi" not in _device_id_cache
 
     def test_no_error_when_name_not_cached(self):
         invalidate_device_id("nonexistent")
 
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_forces_refetch_on_next_get(self, mock_get):
-        _device_id_cache["N. Pi"] = "old-id"
+        _device_id_cache.set("N. Pi", "old-id")
         invalidate_device_id("N. Pi")
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         result = get_device_id("tok", "sec", "N. Pi")
@@ -139,7 +177,7 @@ class TestCallWithRetry:
         _device_id_cache.clear()
 
     @patch("switchbot.time.sleep")
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_succeeds_on_first_attempt(self, mock_get, mock_sleep):
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         operation = MagicMock(return_value="result")
@@ -151,7 +189,7 @@ class TestCallWithRetry:
         mock_sleep.assert_not_called()
 
     @patch("switchbot.time.sleep")
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_retries_on_failure_and_succeeds(self, mock_get, mock_sleep):
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         operation = MagicMock(side_effect=[RuntimeError("fail"), "result"])
@@ -163,7 +201,7 @@ class TestCallWithRetry:
         mock_sleep.assert_called_once_with(0.5)
 
     @patch("switchbot.time.sleep")
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_raises_after_all_retries_exhausted(self, mock_get, mock_sleep):
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         operation = MagicMock(side_effect=RuntimeError("persistent failure"))
@@ -174,7 +212,7 @@ class TestCallWithRetry:
         assert operation.call_count == 3  # 1 initial + 2 retries
 
     @patch("switchbot.time.sleep")
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_exponential_backoff_delays(self, mock_get, mock_sleep):
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         operation = MagicMock(side_effect=RuntimeError("fail"))
@@ -186,11 +224,11 @@ class TestCallWithRetry:
         assert mock_sleep.call_args_list[1].args[0] == 1.0
 
     @patch("switchbot.time.sleep")
-    @patch("switchbot.requests.get")
+    @patch("switchbot.sb_client.get")
     def test_invalidates_cache_before_retry(self, mock_get, mock_sleep):
         mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
         operation = MagicMock(side_effect=[RuntimeError("fail"), "result"])
-        _device_id_cache["N. Pi"] = "stale-id"
+        _device_id_cache.set("N. Pi", "stale-id")
 
         result = call_with_retry("tok", "sec", "N. Pi", operation)
 
@@ -200,6 +238,205 @@ class TestCallWithRetry:
         assert operation.call_args_list[1].args[0] == "pi-123"
 
 
+class TestSwitchBotClient:
+    def test_pool_size_configured_without_adapter_retries(self):
+        client = SwitchBotClient(pool_size=3)
+        adapter = client.session.get_adapter("https://api.switch-bot.com/v1.1/devices")
+        assert adapter._pool_maxsize == 3
+        assert adapter.max_retries.total == 0
+
+    def test_get_passes_timeout_and_returns_json(self):
+        client = SwitchBotClient(timeout=3)
+        with patch.object(client.session, "get") as mock_get:
+            mock_get.return_value.json.return_value = {"statusCode": 100}
+            assert client.get("https://example", headers={"a": "b"}) == {"statusCode": 100}
+        mock_get.assert_called_once_with("https://example", headers={"a": "b"}, timeout=3)
+
+    def test_post_passes_timeout_and_body(self):
+        client = SwitchBotClient(timeout=3)
+        with patch.object(client.session, "post") as mock_post:
+            mock_post.return_value.json.return_value = {"statusCode": 100}
+            assert client.post("https://example", headers={}, json={"command": "turnOn"}) == {"statusCode": 100}
+        mock_post.assert_called_once_with("https://example", headers={}, json={"command": "turnOn"}, timeout=3)
+
+    def test_records_each_request_in_budget(self):
+        budget = RequestBudget(quota=100)
+        client = SwitchBotClient(budget=budget)
+        with patch.object(client.session, "get") as mock_get:
+            client.get("https://example", headers={})
+            client.get("https://example", headers={})
+        assert budget.used() == 2
+
+    def test_records_failed_request_in_budget(self):
+        budget = RequestBudget(quota=100)
+        client = SwitchBotClient(budget=budget)
+        with patch.object(client.session, "post", side_effect=ConnectionError("down")):
+            with pytest.raises(ConnectionError):
+                client.post("https://example", headers={}, json={})
+        assert budget.used() == 1
+
+    def test_counts_one_call_per_request_against_stub_server(self):
+        budget = RequestBudget(quota=100)
+        with StubSwitchBotServer() as server:
+            client = SwitchBotClient(budget=budget)
+            client.get(server.base_url + "/v1.1/devices", headers={})
+            client.close()
+        assert budget.used() == 1
+
+    def test_reuses_connection_across_requests(self):
+        with StubSwitchBotServer() as server:
+            client = SwitchBotClient()
+            for _ in range(5):
+                assert client.get(server.base_url + "/v1.1/devices", headers={})["statusCode"] == 100
+                assert client.get(server.base_url + "/v1.1/devices/x/status", headers={})["statusCode"] == 100
+            client.close()
+        assert server.connections == 1
+
+
+# 2024-01-15 00:00:00 UTC
+MIDNIGHT = 1705276800.0
+
+
+class TestRequestBudget:
+    def test_counts_and_persists_usage(self, tmp_path):
+        path = str(tmp_path / "usage.json")
+        with patch("switchbot.time.time", return_value=MIDNIGHT + 60):
+            RequestBudget(quota=100, path=path).record(3)
+            budget = RequestBudget(quota=100, path=path)
+            budget.record()
+            assert budget.used() == 4
+
+    def test_usage_resets_on_new_utc_day(self, tmp_path):
+        budget = RequestBudget(quota=100, path=str(tmp_path / "usage.json"))
+        with patch("switchbot.time.time", return_value=MIDNIGHT - 60):
+            budget.record(50)
+        with patch("switchbot.time.time", return_value=MIDNIGHT + 60):
+            assert budget.used() == 0
+            assert RequestBudget(quota=100, path=budget.path).used() == 0
+
+    def test_without_path_counts_in_memory(self):
+        budget = RequestBudget(quota=100)
+        budget.record(2)
+        assert budget.used() == 2
+
+    def test_unreadable_file_starts_from_zero(self, tmp_path):
+        path = tmp_path / "usage.json"
+        path.write_text("not-json")
+        assert RequestBudget(quota=100, path=str(path)).used() == 0
+
+    def test_persist_failure_is_logged(self, tmp_path):
+        budget = RequestBudget(quota=100, path=str(tmp_path / "missing-dir" / "usage.json"))
+        budget.record()
+        assert budget.used() == 1
+
+    def test_normal_while_on_pace(self):
+        budget = RequestBudget(quota=1000)
+        with patch("switchbot.time.time", return_value=MIDNIGHT + SECONDS_PER_DAY / 2):
+            budget.record(400)
+            assert budget.state(PRIORITY_LOW) == BUDGET_NORMAL
+
+    def test_conserves_low_priority_when_ahead_of_pace(self):
+        budget = RequestBudget(quota=1000)
+        with patch("switchbot.time.time", return_value=MIDNIGHT + SECONDS_PER_DAY / 4):
+            budget.record(500)
+            assert budget.state(PRIORITY_LOW) == BUDGET_CONSERVE
+            assert budget.state(PRIORITY_HIGH) == BUDGET_NORMAL
+
+    def test_reserve_is_kept_for_high_priority(self):
+        budget = RequestBudget(quota=1000)
+        with patch("switchbot.time.time", return_value=MIDNIGHT + SECONDS_PER_DAY - 60):
+            budget.record(960)
+            assert budget.state(PRIORITY_LOW) == BUDGET_EXHAUSTED
+            assert budget.state(PRIORITY_HIGH) == BUDGET_NORMAL
+
+    def test_exhausted_for_all_priorities_at_quota(self):
+        budget = RequestBudget(quota=10)
+        budget.record(10)
+        assert budget.state(PRIORITY_HIGH) == BUDGET_EXHAUSTED
+
+    def test_shared_dynamodb_counter(self, dynamodb_table):
+        with patch("switchbot.time.time", return_value=MIDNIGHT + 60):
+            RequestBudget(quota=100, table_name="cache", dynamodb_client=dynamodb_table).record(2)
+            other_container = RequestBudget(quota=100, table_name="cache", dynamodb_client=dynamodb_table)
+            other_container.record(3)
+            assert other_container.used() == 5
+
+    def test_dynamodb_failure_falls_back_to_local_count(self):
+        client = MagicMock()
+        client.update_item.side_effect = Exception("unreachable")
+        client.get_item.side_effect = Exception("unreachable")
+        budget = RequestBudget(quota=100, table_name="cache", dynamodb_client=client)
+        budget.record(2)
+        assert budget.used() == 2
+
+    def test_dynamodb_client_created_lazily(self, dynamodb_table):
+        budget = RequestBudget(quota=100, table_name="cache")
+        assert budget.used() == 0
+        assert budget._dynamodb_client is not None
+
+
+class TestCallWithRetryBudget:
+    def setup_method(self):
+        _device_id_cache.clear()
+
+    @patch.object(request_budget, "state", return_value=BUDGET_EXHAUSTED)
+    def test_raises_when_exhausted(self, mock_state):
+        operation = MagicMock()
+        with pytest.raises(QuotaExceededError):
+            call_with_retry("tok", "sec", "N. Pi", operation, priority=PRIORITY_LOW)
+        operation.assert_not_called()
+        mock_state.assert_called_once_with(PRIORITY_LOW)
+
+    @patch("switchbot.time.sleep")
+    @patch("switchbot.sb_client.get")
+    @patch.object(request_budget, "state", return_value=BUDGET_CONSERVE)
+    def test_no_retries_when_conserving(self, mock_state, mock_get, mock_sleep):
+        mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
+        operation = MagicMock(side_effect=RuntimeError("fail"))
+        with pytest.raises(RuntimeError, match="fail"):
+            call_with_retry("tok", "sec", "N. Pi", operation, priority=PRIORITY_LOW)
+        operation.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch("switchbot.sb_client.get")
+    def test_defaults_to_high_priority(self, mock_get):
+        mock_get.return_value = _make_api_response(FAKE_DEVICE_LIST)
+        with patch.object(request_budget, "state", return_value=BUDGET_NORMAL) as mock_state:
+            call_with_retry("tok", "sec", "N. Pi", MagicMock())
+        mock_state.assert_called_once_with(PRIORITY_HIGH)
+
+
+class TestCallWithRetryCounting:
+    def setup_method(self):
+        _device_id_cache.clear()
+
+    @patch("switchbot.time.sleep")
+    def test_every_http_attempt_is_counted_once(self, mock_sleep):
+        budget = RequestBudget(quota=100)
+        client = SwitchBotClient(budget=budget)
+        _device_id_cache.set("N. Pi", "pi-123")
+
+        def status(device_id):
+            response = client.get(DEVICE_STATUS_ENDPOINT_FORMAT.format(device_id), headers={})
+            if response["statusCode"] != 100:
+                raise RuntimeError("status failed")
+
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.json.return_value = _make_api_response(FAKE_DEVICE_LIST) if url == GET_DEVICES_ENDPOINT else {
+                "statusCode": 500}
+            return response
+
+        with patch("switchbot.sb_client", client), patch("switchbot.request_budget", budget), \
+                patch.object(client.session, "get", side_effect=get) as mock_get:
+            with pytest.raises(RuntimeError, match="status failed"):
+                call_with_retry("tok", "sec", "N. Pi", status)
+
+        # 3 status attempts, plus a device list refresh before each retry
+        assert mock_get.call_count == 5
+        assert budget.used() == 5
+
+
 class TestEndpoints:
     def test_get_devices_endpoint(self):
         assert GET_DEVICES_ENDPOINT == "https://api.switch-bot.com/v1.1/devices"
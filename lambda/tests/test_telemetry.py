@@ -0,0 +1,187 @@
+import datetime
+import math
+
+import pytest
+
+from benchmarks.telemetry_parse import synthetic_payload
+from benchmarks.telemetry_v1 import encode_v1
+from telemetry import MeterReading, PayloadError, PlugReading, parse_payload
+
+
+def _payload(**overrides):
+    payload = {
+        "home": "nhome",
+        "should_heartbeat": 1,
+        "cooler_frozen": False,
+        "meters": {"v0": {"Meter 1": {
+            "Valid": True, "Temperature": 22.5, "Humidity": 75.0, "BatteryVoltage": 95,
+            "Datetime": "2024-01-15T12:00:00", "Desired": {"Temperature": 22.0, "TemperatureDiff": -0.5},
+        }}},
+        "plugs": {"v0": {"N.Pi": {"Valid": True, "Switch": True, "Power": 5.2, "Datetime": "2024-01-15T12:00:00"}}},
+    }
+    payload.update(overrides)
+    return payload
+
+
+class TestParsePayload:
+    def test_parses_meters_and_plugs(self):
+        telemetry = parse_payload(_payload())
+
+        assert (telemetry.home, telemetry.should_heartbeat, telemetry.cooler_frozen) == ("nhome", 1, False)
+        [meter] = telemetry.meters
+        assert isinstance(meter, MeterReading)
+        assert (meter.alias, meter.valid, meter.temperature, meter.humidity, meter.battery) == (
+            "Meter 1", True, 22.5, 75.0, 95)
+        assert (meter.desired_temperature, meter.temperature_diff) == (22.0, -0.5)
+        assert meter.timestamp == datetime.datetime(2024, 1, 15, 12)
+        [plug] = telemetry.plugs
+        assert isinstance(plug, PlugReading)
+        assert (plug.alias, plug.valid, plug.switch, plug.power) == ("N.Pi", True, True, 5.2)
+        # Readings taken at the same time share one parsed datetime
+        assert plug.timestamp is meter.timestamp
+
+    def test_offset_datetimes_converted_to_naive_utc(self):
+        payload = _payload()
+        payload["meters"]["v0"]["Meter 1"]["Datetime"] = "2024-01-15T21:00:00+09:00"
+        payload["plugs"]["v0"]["N.Pi"]["Datetime"] = "2024-01-15T12:00:00Z"
+        telemetry = parse_payload(payload)
+        assert [r.timestamp for r in telemetry.meters + telemetry.plugs] == [datetime.datetime(2024, 1, 15, 12)] * 2
+        assert telemetry.meters[0].timestamp.tzinfo is None
+
+    def test_readings_use_slots(self):
+        reading = parse_payload(_payload()).meters[0]
+        with pytest.raises(AttributeError):
+            reading.extra = 1
+
+    def test_optional_fields(self):
+        telemetry = parse_payload({"should_heartbeat": 0, "meters": {"v0": {
+            "Meter 1": {"Valid": True, "Temperature": 20, "Humidity": 60},
+            "Meter 2": {"Valid": False},
+        }}}, default_home="nhome2")
+
+        assert (telemetry.home, telemetry.cooler_frozen, telemetry.plugs) == ("nhome2", None, [])
+        first, second = telemetry.meters
+        assert (first.timestamp, first.battery, first.desired_temperature) == (None, None, None)
+        assert (second.valid, second.temperature) == (False, None)
+
+    def test_heartbeat_optional_for_replay(self):
+        with pytest.raises(PayloadError):
+            parse_payload({"home": "nhome"})
+        assert parse_payload({"home": "nhome"}, require_heartbeat=False).should_heartbeat is None
+
+    def test_reports_every_problem(self):
+        payload = _payload(should_heartbeat="yes", plugs={"v0": {"N.Pi": {"Valid": True, "Power": math.nan}}})
+        payload["meters"]["v0"]["Meter 1"].update(Temperature="22.5", Datetime="yesterday")
+        payload["meters"]["v0"]["Meter 2"] = []
+
+        with pytest.raises(PayloadError) as info:
+            parse_payload(payload)
+
+        assert info.value.errors == [
+            "payload.should_heartbeat must be a boolean, got 'yes'",
+            "meters.v0.Meter 1.Datetime must be an ISO 8601 string, got 'yesterday'",
+            "meters.v0.Meter 1.Temperature must be a finite number, got '22.5'",
+            "meters.v0.Meter 2 must be an object",
+            "plugs.v0.N.Pi.Switch is required",
+            "plugs.v0.N.Pi.Power must be a finite number, got nan",
+        ]
+
+    @pytest.mark.parametrize("payload, error", [
+        ([], "payload must be an object, got list"),
+        ({"should_heartbeat": 1}, "payload.home must be a string, got None"),
+        (_payload(meters=[]), "payload.meters must be an object"),
+        (_payload(plugs={"v0": 1}), "payload.plugs.v0 must be an object"),
+        (_payload(meters={"v0": {"M": {"Valid": True, "Temperature": 1, "Humidity": 2, "Desired": 3}}}),
+         "meters.v0.M.Desired must be an object"),
+        (_payload(plugs={"v0": {"P": 1}}), "plugs.v0.P must be an object"),
+        (_payload(plugs={"v0": {"P": {"Valid": False, "Datetime": ["2024-01-15T12:00:00"]}}}),
+         "plugs.v0.P.Datetime must be an ISO 8601 string, got ['2024-01-15T12:00:00']"),
+        (_payload(plugs={"v0": {"P": {"Valid": False, "Datetime": {}}}}),
+         "plugs.v0.P.Datetime must be an ISO 8601 string, got {}"),
+        (_payload(plugs={"v0": {"P": {"Valid": False, "Datetime": "0001-01-01T00:00:00+01:00"}}}),
+         "plugs.v0.P.Datetime must be an ISO 8601 string, got '0001-01-01T00:00:00+01:00'"),
+        (_payload(cooler_frozen=2), "payload.cooler_frozen must be a boolean, got 2"),
+        (_payload(plugs={"v0": {"P": {"Valid": True, "Switch": True, "Power": True}}}),
+         "plugs.v0.P.Power must be a finite number, got True"),
+    ])
+    def test_rejects(self, payload, error):
+        with pytest.raises(PayloadError) as info:
+            parse_payload(payload)
+        assert info.value.errors == [error]
+
+
+def _v1(section, columns, rows, base=1705320000):
+    return {section: {"v1": {"base": base, "columns": columns, "rows": rows}}}
+
+
+class TestParseV1:
+    def test_parses_several_readings_per_device(self):
+        payload = dict(_v1("meters", ["t", "Valid", "Temperature", "Humidity", "TemperatureDiff"], {
+            "Meter 1": [[0, 1, 22.5, 75.0, None], [120, 1, 22.6, 74.5, -0.5]],
+            "Meter 2": [[0, 0, None, None, None]],
+        }), should_heartbeat=1, home="nhome")
+        payload.update(_v1("plugs", ["Valid", "t", "Switch", "Power"], {"N.Pi": [[True, 60, False, 0.5]]}))
+
+        telemetry = parse_payload(payload)
+
+        assert [(m.alias, m.timestamp, m.valid, m.temperature, m.temperature_diff) for m in telemetry.meters] == [
+            ("Meter 1", datetime.datetime(2024, 1, 15, 12, 0), 1, 22.5, None),
+            ("Meter 1", datetime.datetime(2024, 1, 15, 12, 2), 1, 22.6, -0.5),
+            ("Meter 2", datetime.datetime(2024, 1, 15, 12, 0), 0, None, None),
+        ]
+        [plug] = telemetry.plugs
+        assert (plug.timestamp, plug.switch, plug.power) == (datetime.datetime(2024, 1, 15, 12, 1), False, 0.5)
+        # Rows taken at the same second share one datetime
+        assert telemetry.meters[0].timestamp is telemetry.meters[2].timestamp
+
+    def test_v0_and_v1_in_one_section(self):
+        payload = _payload()
+        payload["meters"].update(_v1("meters", ["t", "Valid"], {"Meter 2": [[0, False]]})["meters"])
+        assert [m.alias for m in parse_payload(payload).meters] == ["Meter 1", "Meter 2"]
+
+    def test_round_trip_from_v0(self):
+        v0 = [synthetic_payload(3, number) for number in range(5)]
+        readings = lambda payloads: sorted(
+            (type(r).__name__,) + tuple(getattr(r, attribute) for attribute in type(r).__slots__)
+            for payload in payloads for telemetry in [parse_payload(payload)]
+            for r in telemetry.meters + telemetry.plugs)
+
+        assert readings([encode_v1(v0)]) == readings(v0)
+
+    def test_reports_every_problem(self):
+        payload = dict(_v1("meters", ["t", "Valid", "Temperature", "Humidity"], {
+            "Meter 1": [[0, 1, "hot", 70.0], [120, 1, None, 70.0], [240, None, None, None], [1.5, 1, 1, 1], [0]],
+            "Meter 2": {},
+        }), should_heartbeat=1, home="nhome")
+
+        with pytest.raises(PayloadError) as info:
+            parse_payload(payload)
+
+        assert info.value.errors == [
+            "meters.v1.rows.Meter 1.0.Temperature must be a finite number, got 'hot'",
+            "meters.v1.rows.Meter 1.1.Temperature is required",
+            "meters.v1.rows.Meter 1.2.Valid is required",
+            "meters.v1.rows.Meter 1.3.t must be an integer, got 1.5",
+            "meters.v1.rows.Meter 1.4 must be a list of 4 values",
+            "meters.v1.rows.Meter 2 must be a list of rows",
+        ]
+
+    @pytest.mark.parametrize("section, error", [
+        ({"v2": {}}, "payload.meters.v2 is not a supported format version"),
+        ({"v1": []}, "payload.meters.v1 must be an object"),
+        ({"v1": {"base": "now", "columns": ["t", "Valid"]}}, "meters.v1.base must be an integer epoch time, got 'now'"),
+        ({"v1": {"base": 0, "columns": ["Valid"]}}, "meters.v1.columns must be a list including t and Valid, got ['Valid']"),
+        ({"v1": {"base": 0, "columns": ["t", "Valid", "Power"]}},
+         "meters.v1.columns must be distinct known columns, got ['t', 'Valid', 'Power']"),
+        ({"v1": {"base": 0, "columns": ["t", "Valid"], "rows": []}}, "meters.v1.rows must be an object"),
+        ({"v1": {"base": 10 ** 12, "columns": ["t", "Valid"], "rows": {"M": [[0, False]]}}},
+         "meters.v1.rows.M.0.t must give a time in years 1 to 9999, got base + t = 1000000000000"),
+        ({"v1": {"base": -10 ** 12, "columns": ["t", "Valid"], "rows": {"M": [[5, False]]}}},
+         "meters.v1.rows.M.0.t must give a time in years 1 to 9999, got base + t = -999999999995"),
+        ({"v1": {"base": 0, "columns": ["t", "Valid"], "rows": {"M": [[10 ** 18, False]]}}},
+         "meters.v1.rows.M.0.t must give a time in years 1 to 9999, got base + t = 1000000000000000000"),
+    ])
+    def test_rejects(self, section, error):
+        with pytest.raises(PayloadError) as info:
+            parse_payload({"home": "nhome", "should_heartbeat": 1, "meters": section})
+        assert info.value.errors == [error]
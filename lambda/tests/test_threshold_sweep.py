@@ -0,0 +1,118 @@
+import gzip
+import math
+import random
+
+import pytest
+
+from benchmarks.threshold_sweep import (
+    NAMESPACE, TARGETS, Side, alarm_onsets, current_constants, excursions, forward_fill, load_csv, period_scores, sweep,
+    threshold_levels, worst_in_window,
+)
+from metric_store import AlarmDefinition, MetricStore, STATE_ALARM, evaluate_alarm
+
+# 2024-01-15 00:00:00 UTC
+T0 = 1705276800.0
+METER = {"Meter": "Meter 1"}
+
+
+def _store(values, metric_name="Temperature", period=120):
+    """Store with one datapoint per period starting at T0; None leaves the period empty."""
+    store = MetricStore()
+    for i, value in enumerate(values):
+        if value is not None:
+            store.put(NAMESPACE, metric_name, value, T0 + i * period + 1, METER)
+    return store
+
+
+class TestLoadCsv:
+    def test_reads_iso_and_epoch_timestamps(self, tmp_path):
+        path = tmp_path / "history.csv.gz"
+        with gzip.open(path, "wt") as f:
+            f.write("Timestamp,Home,Meter,MetricName,Value\n")
+            f.write("2024-01-15T00:00:01+00:00,nhome,Meter 1,Temperature,22.5\n")
+            f.write("{},nhome,Meter 1,Temperature,23.5\n".format(T0 + 121))
+            f.write("{},nhome,Meter 2,Humidity,70\n".format(T0 + 1))
+
+        store = load_csv(str(path))
+
+        assert len(store) == 3
+        assert store.get_statistics(NAMESPACE, "Temperature", METER, T0, T0 + 240, 120, "Maximum") == [
+            (T0, 22.5), (T0 + 120, 23.5)]
+
+    def test_current_constants(self, tmp_path):
+        path = tmp_path / "constants.ts"
+        path.write_text("export const THRESHOLD_TEMPERATURE_HIGH = 26.0;\nexport const HOME_NAME = 'nhome';\n")
+        assert current_constants(str(path)) == {"THRESHOLD_TEMPERATURE_HIGH": 26.0}
+        assert current_constants(str(tmp_path / "missing.ts")) == {}
+
+
+class TestWindows:
+    def test_period_scores_fill_gaps_and_negate_less_than(self):
+        store = _store([60.0, None, 40.0], metric_name="Humidity")
+        start, scores = period_scores(store, "Meter 1", Side("Humidity", "Maximum", "LessThanOrEqualToThreshold"),
+                                      120)
+        assert (start, scores) == (T0, [-60.0, None, -40.0])
+
+    def test_unknown_comparison(self):
+        with pytest.raises(ValueError):
+            Side("Temperature", "Minimum", "Between")
+
+    def test_worst_in_window(self):
+        worst = worst_in_window([1.0, 5.0, None, 3.0, 2.0], 3, [1, 2])
+        assert worst[1] == [1.0, 5.0, 5.0, 5.0, 3.0]
+        # Two datapoints needed; a single present one must breach on its own
+        assert worst[2] == [1.0, 1.0, 1.0, 3.0, 2.0]
+
+    def test_threshold_levels(self):
+        assert threshold_levels([25.0, 26.0, None, 30.0, -math.inf], [26.0, 27.0]) == bytes([0, 1, 0, 2, 0])
+        with pytest.raises(ValueError):
+            threshold_levels([1.0], list(range(256)))
+
+    def test_excursions_need_min_periods(self):
+        levels = threshold_levels([27.0, 27.0, 20.0, 27.0, 27.0, 27.0, None, 27.0], [26.0])
+        assert excursions(levels, 1, 2) == [(0, 1), (3, 5)]
+        assert excursions(levels, 1, 3) == [(3, 5)]
+
+    @pytest.mark.parametrize("datapoints", [1, 3, 5])
+    def test_alarms_match_evaluate_alarm(self, datapoints):
+        rng = random.Random(datapoints)
+        values = [None if rng.random() < 0.1 else rng.uniform(20, 30) for _ in range(500)]
+        store = _store(values)
+        alarm = AlarmDefinition("High", NAMESPACE, "Temperature", METER, 120, "Minimum",
+                                "GreaterThanOrEqualToThreshold", 26.0, 5, datapoints, "ignore")
+        expected = [at for at, _, new in evaluate_alarm(store, alarm, T0, T0 + 500 * 120) if new == STATE_ALARM]
+
+        _, scores = period_scores(store, "Meter 1", TARGETS["temperature-high"][1][0], 120)
+        worst = worst_in_window(scores, 5, [datapoints])[datapoints]
+        onsets = alarm_onsets(threshold_levels(forward_fill(worst), [26.0]), 1)
+
+        # evaluate_alarm reports the alarm at the end of the period that raised it
+        assert [T0 + (first + 1) * 120 for first, _ in onsets] == expected
+
+
+class TestSweep:
+    def test_tradeoff_between_false_positives_and_delay(self):
+        # A 20-minute spike, then a 2-hour excursion, at 2-minute periods
+        values = [22.0] * 30 + [28.0] * 10 + [22.0] * 30 + [28.0] * 60 + [22.0] * 30
+        store = _store(values)
+        sides = TARGETS["temperature-high"][1]
+
+        results = sweep(store, "Meter 1", sides, [26.0], [5, 30], evaluation_periods=30, period=120,
+                        min_excursion=1800)
+
+        eager, strict = results[(26.0, 5)], results[(26.0, 30)]
+        assert (eager["alarms"], eager["false_positives"], eager["detected"], eager["excursions"]) == (2, 1, 1, 1)
+        assert eager["delays"] == [4 * 120]
+        assert (strict["alarms"], strict["false_positives"], strict["detected"]) == (1, 0, 1)
+        assert strict["delays"] == [29 * 120]
+
+    def test_offset_sums_both_sides(self):
+        values = [0.0] * 10 + [-6.0] * 40 + [0.0] * 10 + [6.0] * 40
+        store = _store(values, metric_name="TemperatureDiff")
+
+        results = sweep(store, "Meter 1", TARGETS["temperature-offset"][1], [5.0], [30])
+
+        assert (results[(5.0, 30)]["alarms"], results[(5.0, 30)]["detected"]) == (2, 2)
+
+    def test_unknown_meter_has_no_results(self):
+        assert sweep(_store([22.0]), "Meter 9", TARGETS["temperature-high"][1], [26.0], [30]) == {}
@@ -25,6 +25,38 @@ export const METRIC_NAME_POWER = "Power";
 export const METRIC_NAME_COOLER_FROZEN = "CoolerFrozen";
 export const METRIC_NAME_DESIRED_TEMPERATURE = "DesiredTemperature";
 export const METRIC_NAME_TEMPERATURE_DIFF = "TemperatureDiff";
+export const METRIC_NAME_SWITCHBOT_API_CALLS = "SwitchBotApiCalls";
+// Metric publishing backend for the log puller: "api" (PutMetricData) or "emf" (Embedded Metric Format via logs)
+export const LOG_PULLER_METRIC_BACKEND = "emf";
+// Seconds over which the log puller folds each metric's readings into one datapoint
+// (StatisticValues / EMF value lists); 0 publishes every reading. Must divide every
+// alarm and dashboard period so their statistics are unchanged.
+export const LOG_PULLER_METRIC_AGGREGATION_PERIOD_SECONDS = 60;
+// Metrics republished only when their value changes or once per heartbeat period (seconds),
+// by the log puller and the online plug status poll. A heartbeat must divide the period of every
+// alarm and widget reading the metric, and those may only use Minimum/Maximum: Switch backs
+// 5-minute Maximum alarms and widgets; Valid backs neither. DesiredTemperature is not deadbanded
+// because the temperature widget averages it over 2 minutes.
+export const METRIC_DEADBAND_HEARTBEAT_SECONDS: Record<string, number> = {
+    [METRIC_NAME_SWITCH]: 300,
+    [METRIC_NAME_VALID]: 900,
+};
+// Metrics published at 1-second resolution (StorageResolution=1) by the log puller and the
+// online plug status poll, so the cooler and fan fault alarms can evaluate high-resolution
+// periods. These are not deadbanded or aggregated across seconds.
+export const HIGH_RESOLUTION_METRICS = [METRIC_NAME_COOLER_FROZEN, METRIC_NAME_POWER];
+// Period of the alarms on high-resolution metrics; CloudWatch allows 10 or 30 seconds
+export const HIGH_RESOLUTION_ALARM_PERIOD_SECONDS = 30;
+// Archive every reading the log puller parses to S3 as compressed columnar files
+// (partitioned by day and device), beyond CloudWatch's 15 days of 1-minute data.
+// Only with "sqs" ingestion below, which writes one object per device per batch
+export const TELEMETRY_ARCHIVE_ENABLED = true;
+export const TELEMETRY_ARCHIVE_PREFIX = "telemetry/";
+// How IoT telemetry reaches the log puller: "direct" invokes it per message,
+// "sqs" buffers messages in a queue and processes them in batches
+export const LOG_INGESTION_MODE: "direct" | "sqs" = "direct";
+export const LOG_INGESTION_BATCH_SIZE = 10;
+export const LOG_INGESTION_BATCH_WINDOW_SECONDS = 60;
 
 // Alarm thresholds (single source of truth for alarms and dashboard annotations)
 export const THRESHOLD_TEMPERATURE_HIGH = 26.0;
@@ -33,6 +65,21 @@ export const THRESHOLD_TEMPERATURE_LOW = 10.0;
 export const THRESHOLD_TEMPERATURE_OFFSET = 5.0;
 export const THRESHOLD_HUMIDITY_LOW = 50.0;
 export const THRESHOLD_BATTERY_LOW = 5;
+// Pushover alarms arriving within this window of a sent alert are held and sent as one digest
+export const PUSHOVER_COALESCE_WINDOW_SECONDS = 300;
+// Repeated state changes of one alarm within this window of its last notification are suppressed
+export const NOTIFICATION_FLAP_WINDOW_SECONDS = 900;
+export const METRIC_NAME_NOTIFICATIONS_SUPPRESSED = "NotificationsSuppressed";
+// Pushover emergency receipts, polled by the notification dispatcher's scheduled flush
+export const METRIC_NAME_ALERT_ACKNOWLEDGE_LATENCY = "AlertAcknowledgeLatency";
+export const METRIC_NAME_ALERTS_EXPIRED_UNACKNOWLEDGED = "AlertsExpiredUnacknowledged";
+// SwitchBot API daily request quota per account
+export const SWITCHBOT_DAILY_QUOTA = 10000;
+
+// Home (growing enclosure) names; published as the "Home" metric dimension.
+// Each home publishes telemetry to log/nepenthes/<home>.
+export const HOME_NAME = "nhome";
+export const IOT_TOPIC_FILTER = "log/nepenthes/+";
 
 // Device names (single source of truth for alarms, dashboard, and Lambda config)
 export const METERS = ["N. Meter 1", "N. Meter 2"];
@@ -35,8 +35,7 @@ function createLambdaRole(scope: Construct, id: string, logGroup: logs.LogGroup)
 export class LambdaFunctions {
 
     public nepenthesLogPullerFunction: lambda.Function;
-    public nepenthesPushoverFunction: lambda.Function;
-    public nepenthesAlarmEmailFormatterFunction: lambda.Function;
+    public nepenthesNotificationDispatcherFunction: lambda.Function;
     public nepenthesOnlinePlugStatusFunction: lambda.Function;
     public nepenthesPiPlugOnFunction: lambda.Function;
 
@@ -82,42 +81,35 @@ export class LambdaFunctions {
             code: lambdaCode,
             timeout: Duration.seconds(7),
             environment: {
-                "METRIC_NAMESPACE": CONSTANTS.METRIC_NAMESPACE
+                "METRIC_NAMESPACE": CONSTANTS.METRIC_NAMESPACE,
+                "METRIC_BACKEND": CONSTANTS.LOG_PULLER_METRIC_BACKEND,
+                "METRIC_AGGREGATION_PERIOD": String(CONSTANTS.LOG_PULLER_METRIC_AGGREGATION_PERIOD_SECONDS),
+                "METRIC_DEADBAND": JSON.stringify(CONSTANTS.METRIC_DEADBAND_HEARTBEAT_SECONDS),
+                "HIGH_RESOLUTION_METRICS": CONSTANTS.HIGH_RESOLUTION_METRICS.join(","),
+                "HOME_NAME": CONSTANTS.HOME_NAME,
             },
             logGroup: logPullerLogGroup,
             role: createLambdaRole(scope, 'NLogPullerRole', logPullerLogGroup),
             retryAttempts: 0,
         });
 
-        const pushoverLogGroup = new logs.LogGroup(scope, 'NPushoverLogGroup', {
+        const notificationDispatcherLogGroup = new logs.LogGroup(scope, 'NNotificationDispatcherLogGroup', {
             retention: logs.RetentionDays.TWO_MONTHS,
             removalPolicy: RemovalPolicy.DESTROY,
         });
-        this.nepenthesPushoverFunction = new lambda.Function(scope, 'NPushoverAssetLambda', {
+        this.nepenthesNotificationDispatcherFunction = new lambda.Function(scope, 'NNotificationDispatcherLambda', {
             runtime: lambda.Runtime.PYTHON_3_14,
             architecture: lambda.Architecture.ARM_64,
-            handler: 'nepenthes_pushover.lambda_handler',
+            handler: 'nepenthes_notification_dispatcher.lambda_handler',
             code: lambdaCode,
+            // Room for Pushover retries with backoff (3 attempts of up to 3s each)
+            timeout: Duration.seconds(15),
             environment: {
                 "PUSHOVER_API_KEY": CONSTANTS.PUSHOVER_API_KEY,
                 "PAGEE_USER_KEY": CONSTANTS.PAGEE_USER_KEY,
             },
-            logGroup: pushoverLogGroup,
-            role: createLambdaRole(scope, 'NPushoverRole', pushoverLogGroup),
-            retryAttempts: 1,
-        });
-
-        const emailFormatterLogGroup = new logs.LogGroup(scope, 'NAlarmEmailFormatterLogGroup', {
-            retention: logs.RetentionDays.TWO_MONTHS,
-            removalPolicy: RemovalPolicy.DESTROY,
-        });
-        this.nepenthesAlarmEmailFormatterFunction = new lambda.Function(scope, 'NAlarmEmailFormatterLambda', {
-            runtime: lambda.Runtime.PYTHON_3_14,
-            architecture: lambda.Architecture.ARM_64,
-            handler: 'nepenthes_alarm_email_formatter.lambda_handler',
-            code: lambdaCode,
-            logGroup: emailFormatterLogGroup,
-            role: createLambdaRole(scope, 'NAlarmEmailFormatterRole', emailFormatterLogGroup),
+            logGroup: notificationDispatcherLogGroup,
+            role: createLambdaRole(scope, 'NNotificationDispatcherRole', notificationDispatcherLogGroup),
             retryAttempts: 1,
         });
 
@@ -134,7 +126,11 @@ export class LambdaFunctions {
             environment: {
                 "SB_TOKEN": CONSTANTS.SB_TOKEN,
                 "SB_SECRET_KEY": CONSTANTS.SB_SECRET_KEY,
+                "SWITCHBOT_DAILY_QUOTA": String(CONSTANTS.SWITCHBOT_DAILY_QUOTA),
                 "METRIC_NAMESPACE": CONSTANTS.METRIC_NAMESPACE,
+                "METRIC_DEADBAND": JSON.stringify(CONSTANTS.METRIC_DEADBAND_HEARTBEAT_SECONDS),
+                "HIGH_RESOLUTION_METRICS": CONSTANTS.HIGH_RESOLUTION_METRICS.join(","),
+                "HOME_NAME": CONSTANTS.HOME_NAME,
             },
             logGroup: onlinePlugStatusLogGroup,
             role: createLambdaRole(scope, 'NOnlinePlugStatusRole', onlinePlugStatusLogGroup),
@@ -154,6 +150,7 @@ export class LambdaFunctions {
             environment: {
                 "SB_TOKEN": CONSTANTS.SB_TOKEN,
                 "SB_SECRET_KEY": CONSTANTS.SB_SECRET_KEY,
+                "SWITCHBOT_DAILY_QUOTA": String(CONSTANTS.SWITCHBOT_DAILY_QUOTA),
             },
             logGroup: piPlugOnLogGroup,
             role: createLambdaRole(scope, 'NPiPlugOnRole', piPlugOnLogGroup),
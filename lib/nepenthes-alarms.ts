@@ -5,7 +5,8 @@ import { METRIC_NAMESPACE, METRIC_NAME_BATTERY, METRIC_NAME_COOLER_FROZEN, METRI
          METRIC_NAME_TEMPERATURE_DIFF,
          THRESHOLD_TEMPERATURE_HIGH, THRESHOLD_TEMPERATURE_LOW, THRESHOLD_TEMPERATURE_OFFSET,
          THRESHOLD_HUMIDITY_LOW, THRESHOLD_BATTERY_LOW,
-         METERS, PI_PLUG_NAME, FAN_PLUG_NAME } from './constants';
+         METERS, PI_PLUG_NAME, FAN_PLUG_NAME, HOME_NAME,
+         HIGH_RESOLUTION_ALARM_PERIOD_SECONDS } from './constants';
 
 
 export class NepenthesAlarms {
@@ -24,6 +25,7 @@ export class NepenthesAlarms {
             metric: new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: METRIC_NAME_HEARTBEAT,
+                dimensionsMap: { "Home": HOME_NAME },
                 period: cdk.Duration.minutes(15),
                 statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
             }),
@@ -41,7 +43,7 @@ export class NepenthesAlarms {
                 metric: new cdk.aws_cloudwatch.Metric({
                     namespace: METRIC_NAMESPACE,
                     metricName: METRIC_NAME_TEMPERATURE,
-                    dimensionsMap: { "Meter": meterAlias },
+                    dimensionsMap: { "Home": HOME_NAME, "Meter": meterAlias },
                     period: cdk.Duration.minutes(2),
                     statistic: cdk.aws_cloudwatch.Stats.MINIMUM,
                 }),
@@ -60,7 +62,7 @@ export class NepenthesAlarms {
                 metric: new cdk.aws_cloudwatch.Metric({
                     namespace: METRIC_NAMESPACE,
                     metricName: METRIC_NAME_TEMPERATURE,
-                    dimensionsMap: { "Meter": meterAlias },
+                    dimensionsMap: { "Home": HOME_NAME, "Meter": meterAlias },
                     period: cdk.Duration.minutes(2),
                     statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
                 }),
@@ -81,7 +83,7 @@ export class NepenthesAlarms {
                 metric: new cdk.aws_cloudwatch.Metric({
                     namespace: METRIC_NAMESPACE,
                     metricName: METRIC_NAME_TEMPERATURE_DIFF,
-                    dimensionsMap: { "Meter": meterAlias },
+                    dimensionsMap: { "Home": HOME_NAME, "Meter": meterAlias },
                     period: cdk.Duration.minutes(2),
                     statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
                 }),
@@ -100,7 +102,7 @@ export class NepenthesAlarms {
                 metric: new cdk.aws_cloudwatch.Metric({
                     namespace: METRIC_NAMESPACE,
                     metricName: METRIC_NAME_TEMPERATURE_DIFF,
-                    dimensionsMap: { "Meter": meterAlias },
+                    dimensionsMap: { "Home": HOME_NAME, "Meter": meterAlias },
                     period: cdk.Duration.minutes(2),
                     statistic: cdk.aws_cloudwatch.Stats.MINIMUM,
                 }),
@@ -120,6 +122,7 @@ export class NepenthesAlarms {
                     namespace: METRIC_NAMESPACE,
                     metricName: METRIC_NAME_HUMIDITY,
                     dimensionsMap: {
+                        "Home": HOME_NAME,
                         "Meter": meterAlias,
                     },
                     period: cdk.Duration.minutes(2),
@@ -141,6 +144,7 @@ export class NepenthesAlarms {
                     namespace: METRIC_NAMESPACE,
                     metricName: METRIC_NAME_BATTERY,
                     dimensionsMap: {
+                        "Home": HOME_NAME,
                         "Meter": meterAlias,
                     },
                     period: cdk.Duration.hours(1),
@@ -160,6 +164,7 @@ export class NepenthesAlarms {
                 namespace: METRIC_NAMESPACE,
                 metricName: METRIC_NAME_SWITCH,
                 dimensionsMap: {
+                    "Home": HOME_NAME,
                     "Plug": PI_PLUG_NAME,
                 },
                 period: cdk.Duration.minutes(5),
@@ -167,20 +172,23 @@ export class NepenthesAlarms {
             }),
         });
 
+        // High-resolution: 3 readings without power within 3 minutes. Missing readings are covered
+        // by NFanTurnedOff and the heartbeat alarm.
         const fanNotDrawingPower = new cdk.aws_cloudwatch.Alarm(scope, "NFanNotDrawingPower", {
             actionsEnabled: true,
             datapointsToAlarm: 3,
-            evaluationPeriods: 3,
-            treatMissingData: cdk.aws_cloudwatch.TreatMissingData.BREACHING,
+            evaluationPeriods: 6,
+            treatMissingData: cdk.aws_cloudwatch.TreatMissingData.NOT_BREACHING,
             comparisonOperator:  cdk.aws_cloudwatch.ComparisonOperator.LESS_THAN_OR_EQUAL_TO_THRESHOLD,
             threshold: 0,
             metric: new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: METRIC_NAME_POWER,
                 dimensionsMap: {
+                    "Home": HOME_NAME,
                     "Plug": FAN_PLUG_NAME,
                 },
-                period: cdk.Duration.minutes(5),
+                period: cdk.Duration.seconds(HIGH_RESOLUTION_ALARM_PERIOD_SECONDS),
                 statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
             }),
         });
@@ -196,6 +204,7 @@ export class NepenthesAlarms {
                 namespace: METRIC_NAMESPACE,
                 metricName: METRIC_NAME_SWITCH,
                 dimensionsMap: {
+                    "Home": HOME_NAME,
                     "Plug": FAN_PLUG_NAME,
                 },
                 period: cdk.Duration.minutes(5),
@@ -203,6 +212,7 @@ export class NepenthesAlarms {
             }),
         })
 
+        // High-resolution: raised within one period of the Pi reporting a frozen cooler
         const coolerFrozenAlarm = new cdk.aws_cloudwatch.Alarm(scope, "NCoolerFrozenAlarm", {
             actionsEnabled: true,
             datapointsToAlarm: 1,
@@ -213,7 +223,8 @@ export class NepenthesAlarms {
             metric: new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: METRIC_NAME_COOLER_FROZEN,
-                period: cdk.Duration.minutes(5),
+                dimensionsMap: { "Home": HOME_NAME },
+                period: cdk.Duration.seconds(HIGH_RESOLUTION_ALARM_PERIOD_SECONDS),
                 statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
             }),
         });
@@ -243,6 +254,7 @@ export class NepenthesAlarms {
                 namespace: METRIC_NAMESPACE,
                 metricName: METRIC_NAME_SWITCH,
                 dimensionsMap: {
+                    "Home": HOME_NAME,
                     "Plug": PI_PLUG_NAME,
                 },
                 period: cdk.Duration.minutes(5),
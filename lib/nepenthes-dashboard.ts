@@ -1,10 +1,13 @@
 import * as cdk from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import { METRIC_NAMESPACE, METRIC_NAME_COOLER_FROZEN,
-         METRIC_NAME_DESIRED_TEMPERATURE,
+         METRIC_NAME_DESIRED_TEMPERATURE, METRIC_NAME_SWITCHBOT_API_CALLS,
+         METRIC_NAME_NOTIFICATIONS_SUPPRESSED,
+         METRIC_NAME_ALERT_ACKNOWLEDGE_LATENCY, METRIC_NAME_ALERTS_EXPIRED_UNACKNOWLEDGED,
+         SWITCHBOT_DAILY_QUOTA,
          THRESHOLD_TEMPERATURE_HIGH, THRESHOLD_TEMPERATURE_LOW,
          THRESHOLD_HUMIDITY_LOW, THRESHOLD_BATTERY_LOW,
-         METERS, PLUGS, FAN_PLUG_NAME } from './constants';
+         METERS, PLUGS, FAN_PLUG_NAME, HOME_NAME } from './constants';
 
 export class NepenthesDashboard {
     constructor(scope: Construct, alarms: cdk.aws_cloudwatch.AlarmBase[]) {
@@ -20,7 +23,7 @@ export class NepenthesDashboard {
                     new cdk.aws_cloudwatch.Metric({
                         namespace: METRIC_NAMESPACE,
                         metricName: 'Temperature',
-                        dimensionsMap: { Meter: meter },
+                        dimensionsMap: { Home: HOME_NAME, Meter: meter },
                         period: cdk.Duration.minutes(2),
                         statistic: cdk.aws_cloudwatch.Stats.AVERAGE,
                         label: meter,
@@ -28,7 +31,7 @@ export class NepenthesDashboard {
                     new cdk.aws_cloudwatch.Metric({
                         namespace: METRIC_NAMESPACE,
                         metricName: METRIC_NAME_DESIRED_TEMPERATURE,
-                        dimensionsMap: { Meter: meter },
+                        dimensionsMap: { Home: HOME_NAME, Meter: meter },
                         period: cdk.Duration.minutes(2),
                         statistic: cdk.aws_cloudwatch.Stats.AVERAGE,
                         label: `${meter} Desired`,
@@ -49,7 +52,7 @@ export class NepenthesDashboard {
             left: METERS.map(meter => new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: 'Humidity',
-                dimensionsMap: { Meter: meter },
+                dimensionsMap: { Home: HOME_NAME, Meter: meter },
                 period: cdk.Duration.minutes(2),
                 statistic: cdk.aws_cloudwatch.Stats.AVERAGE,
                 label: meter,
@@ -67,7 +70,7 @@ export class NepenthesDashboard {
             left: METERS.map(meter => new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: 'Battery',
-                dimensionsMap: { Meter: meter },
+                dimensionsMap: { Home: HOME_NAME, Meter: meter },
                 period: cdk.Duration.hours(1),
                 statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
                 label: meter,
@@ -85,7 +88,7 @@ export class NepenthesDashboard {
             left: PLUGS.map(plug => new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: 'Switch',
-                dimensionsMap: { Plug: plug },
+                dimensionsMap: { Home: HOME_NAME, Plug: plug },
                 period: cdk.Duration.minutes(5),
                 statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
                 label: plug,
@@ -100,6 +103,7 @@ export class NepenthesDashboard {
             metrics: [new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: 'Heartbeat',
+                dimensionsMap: { Home: HOME_NAME },
                 period: cdk.Duration.minutes(15),
                 statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
             })],
@@ -113,7 +117,7 @@ export class NepenthesDashboard {
             left: [new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: 'Power',
-                dimensionsMap: { Plug: FAN_PLUG_NAME },
+                dimensionsMap: { Home: HOME_NAME, Plug: FAN_PLUG_NAME },
                 period: cdk.Duration.minutes(5),
                 statistic: cdk.aws_cloudwatch.Stats.AVERAGE,
                 label: FAN_PLUG_NAME,
@@ -128,6 +132,7 @@ export class NepenthesDashboard {
             metrics: [new cdk.aws_cloudwatch.Metric({
                 namespace: METRIC_NAMESPACE,
                 metricName: METRIC_NAME_COOLER_FROZEN,
+                dimensionsMap: { Home: HOME_NAME },
                 period: cdk.Duration.minutes(5),
                 statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
             })],
@@ -135,6 +140,60 @@ export class NepenthesDashboard {
             height: 3,
         });
 
+        // SwitchBot API usage against the daily quota (calls from the online plug status poller)
+        const switchBotApiCallsWidget = new cdk.aws_cloudwatch.GraphWidget({
+            title: 'SwitchBot API Calls (daily)',
+            left: [new cdk.aws_cloudwatch.Metric({
+                namespace: METRIC_NAMESPACE,
+                metricName: METRIC_NAME_SWITCHBOT_API_CALLS,
+                period: cdk.Duration.days(1),
+                statistic: cdk.aws_cloudwatch.Stats.SUM,
+            })],
+            leftAnnotations: [
+                { value: SWITCHBOT_DAILY_QUOTA, color: '#d62728', label: 'Daily quota' },
+            ],
+            width: 12,
+            height: 6,
+        });
+
+        // Notifications suppressed for flapping alarms, per channel
+        const notificationsSuppressedWidget = new cdk.aws_cloudwatch.GraphWidget({
+            title: 'Notifications Suppressed (flapping)',
+            left: ['pushover', 'email'].map(channel => new cdk.aws_cloudwatch.Metric({
+                namespace: METRIC_NAMESPACE,
+                metricName: METRIC_NAME_NOTIFICATIONS_SUPPRESSED,
+                dimensionsMap: { Channel: channel },
+                period: cdk.Duration.hours(1),
+                statistic: cdk.aws_cloudwatch.Stats.SUM,
+                label: channel,
+            })),
+            width: 12,
+            height: 6,
+        });
+
+        // How quickly critical Pushover alerts are acknowledged, and how many never are
+        const alertAcknowledgementWidget = new cdk.aws_cloudwatch.GraphWidget({
+            title: 'Pushover Alert Acknowledgement',
+            left: [new cdk.aws_cloudwatch.Metric({
+                namespace: METRIC_NAMESPACE,
+                metricName: METRIC_NAME_ALERT_ACKNOWLEDGE_LATENCY,
+                dimensionsMap: { Channel: 'pushover' },
+                period: cdk.Duration.hours(1),
+                statistic: cdk.aws_cloudwatch.Stats.MAXIMUM,
+                label: 'Time to acknowledge (max)',
+            })],
+            right: [new cdk.aws_cloudwatch.Metric({
+                namespace: METRIC_NAMESPACE,
+                metricName: METRIC_NAME_ALERTS_EXPIRED_UNACKNOWLEDGED,
+                dimensionsMap: { Channel: 'pushover' },
+                period: cdk.Duration.hours(1),
+                statistic: cdk.aws_cloudwatch.Stats.SUM,
+                label: 'Expired unacknowledged',
+            })],
+            width: 12,
+            height: 6,
+        });
+
         // Alarm status overview
         const alarmWidget = new cdk.aws_cloudwatch.AlarmStatusWidget({
             title: 'Alarm Status',
@@ -146,5 +205,7 @@ export class NepenthesDashboard {
         dashboard.addWidgets(temperatureWidget, humidityWidget);
         dashboard.addWidgets(batteryWidget, deviceStatusWidget);
         dashboard.addWidgets(heartbeatWidget, fanPowerWidget, coolerFrozenWidget, alarmWidget);
+        dashboard.addWidgets(switchBotApiCallsWidget, notificationsSuppressedWidget);
+        dashboard.addWidgets(alertAcknowledgementWidget);
     }
 }
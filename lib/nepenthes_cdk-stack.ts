@@ -2,39 +2,95 @@ import * as cdk from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import { NagSuppressions } from 'cdk-nag';
 import { LambdaFunctions } from './lambda-functions';
-import { EMAIL_ADDRESS, METRIC_NAMESPACE } from './constants';
+import {
+  EMAIL_ADDRESS,
+  IOT_TOPIC_FILTER,
+  LOG_INGESTION_BATCH_SIZE,
+  LOG_INGESTION_BATCH_WINDOW_SECONDS,
+  LOG_INGESTION_MODE,
+  METRIC_NAMESPACE,
+  NOTIFICATION_FLAP_WINDOW_SECONDS,
+  PUSHOVER_COALESCE_WINDOW_SECONDS,
+  TELEMETRY_ARCHIVE_ENABLED,
+  TELEMETRY_ARCHIVE_PREFIX,
+} from './constants';
 import { NepenthesAlarms } from './nepenthes-alarms';
 import { NepenthesDashboard } from './nepenthes-dashboard';
 
+export interface NepenthesCDKStackProps extends cdk.StackProps {
+  // Overrides LOG_INGESTION_MODE
+  readonly logIngestion?: 'direct' | 'sqs';
+}
+
 export class NepenthesCDKStack extends cdk.Stack {
-  constructor(scope: Construct, id: string, props?: cdk.StackProps) {
+  constructor(scope: Construct, id: string, props?: NepenthesCDKStackProps) {
     super(scope, id, props);
 
     // Create a Lambda function with code from the "src/lambda" directory
     const lambdaFunctions = new LambdaFunctions(this);
 
-    // Build Log Puller AWS IOT Topic Rule
-    const logPullerTopicRule = new cdk.aws_iot.CfnTopicRule(this, "NLogPullerPublishRule", {
-      topicRulePayload: {
-        description: "Log Puller for N.Home",
-        actions: [{
-          lambda: {
-            functionArn: lambdaFunctions.nepenthesLogPullerFunction.functionArn
-          }
-        }],
-        ruleDisabled: false,
-        sql: "SELECT * FROM 'log/nepenthes/nhome'",
-        awsIotSqlVersion: "2016-03-23",
-      }
-    });
-    // Link AWS IOT Topic Rule to log puller Lambda function
-    lambdaFunctions.nepenthesLogPullerFunction.addPermission(
-        'AddIotTopicRuleTrigger',
-        {
-          principal: new cdk.aws_iam.ServicePrincipal("iot.amazonaws.com"),
-          sourceArn: logPullerTopicRule.attrArn,
+    // Build Log Puller AWS IOT Topic Rule for every home (log/nepenthes/<home>);
+    // topic(3) adds the home name to the payload for the Home metric dimension
+    const logIngestion = props?.logIngestion ?? LOG_INGESTION_MODE;
+    const logPullerSql = `SELECT *, topic(3) AS home FROM '${IOT_TOPIC_FILTER}'`;
+    if (logIngestion === 'sqs') {
+      // Buffer telemetry in SQS so one log puller invocation publishes a batch of messages
+      const logDeadLetterQueue = new cdk.aws_sqs.Queue(this, "NLogIngestionDLQ", {
+        enforceSSL: true,
+        retentionPeriod: cdk.Duration.days(14),
+      });
+      const logQueue = new cdk.aws_sqs.Queue(this, "NLogIngestionQueue", {
+        enforceSSL: true,
+        // Must cover the batching window plus the function timeout
+        visibilityTimeout: cdk.Duration.seconds(LOG_INGESTION_BATCH_WINDOW_SECONDS + 6 * lambdaFunctions.nepenthesLogPullerFunction.timeout!.toSeconds()),
+        deadLetterQueue: { queue: logDeadLetterQueue, maxReceiveCount: 3 },
+      });
+      const logIngestionRole = new cdk.aws_iam.Role(this, "NLogIngestionRole", {
+        assumedBy: new cdk.aws_iam.ServicePrincipal("iot.amazonaws.com"),
+      });
+      logQueue.grantSendMessages(logIngestionRole);
+      new cdk.aws_iot.CfnTopicRule(this, "NLogPullerPublishRule", {
+        topicRulePayload: {
+          description: "Log Puller for N.Home (SQS buffered)",
+          actions: [{
+            sqs: {
+              queueUrl: logQueue.queueUrl,
+              roleArn: logIngestionRole.roleArn,
+            }
+          }],
+          ruleDisabled: false,
+          sql: logPullerSql,
+          awsIotSqlVersion: "2016-03-23",
         }
-    );
+      });
+      lambdaFunctions.nepenthesLogPullerFunction.addEventSource(new cdk.aws_lambda_event_sources.SqsEventSource(logQueue, {
+        batchSize: LOG_INGESTION_BATCH_SIZE,
+        maxBatchingWindow: cdk.Duration.seconds(LOG_INGESTION_BATCH_WINDOW_SECONDS),
+        reportBatchItemFailures: true,
+      }));
+    } else {
+      const logPullerTopicRule = new cdk.aws_iot.CfnTopicRule(this, "NLogPullerPublishRule", {
+        topicRulePayload: {
+          description: "Log Puller for N.Home",
+          actions: [{
+            lambda: {
+              functionArn: lambdaFunctions.nepenthesLogPullerFunction.functionArn
+            }
+          }],
+          ruleDisabled: false,
+          sql: logPullerSql,
+          awsIotSqlVersion: "2016-03-23",
+        }
+      });
+      // Link AWS IOT Topic Rule to log puller Lambda function
+      lambdaFunctions.nepenthesLogPullerFunction.addPermission(
+          'AddIotTopicRuleTrigger',
+          {
+            principal: new cdk.aws_iam.ServicePrincipal("iot.amazonaws.com"),
+            sourceArn: logPullerTopicRule.attrArn,
+          }
+      );
+    }
     // Grant CloudWatch PutMetricData scoped to our namespace
     const putMetricPolicy = new cdk.aws_iam.PolicyStatement({
       actions: ['cloudwatch:PutMetricData'],
@@ -50,15 +106,70 @@ export class NepenthesCDKStack extends cdk.Stack {
     // and cloudwatch:PutMetricData does not support resource-level permissions (scoped by namespace condition)
     NagSuppressions.addResourceSuppressionsByPath(this, [
       `/${id}/NLogPullerRole/DefaultPolicy/Resource`,
-      `/${id}/NPushoverRole/DefaultPolicy/Resource`,
-      `/${id}/NAlarmEmailFormatterRole/DefaultPolicy/Resource`,
+      `/${id}/NNotificationDispatcherRole/DefaultPolicy/Resource`,
       `/${id}/NOnlinePlugStatusRole/DefaultPolicy/Resource`,
       `/${id}/NPiPlugOnRole/DefaultPolicy/Resource`,
     ], [{
       id: 'AwsSolutions-IAM5',
-      reason: 'Log stream ARNs require logGroupArn:* suffix; PutMetricData does not support resource-level permissions (scoped by namespace condition)',
+      reason: 'Log stream ARNs require logGroupArn:* suffix; PutMetricData does not support resource-level permissions (scoped by namespace condition); archive objects are written under the telemetry archive bucket (bucketArn/*)',
     }]);
 
+    // Last published values of deadbanded metrics, so a cold container does not republish them all
+    const metricStateTable = new cdk.aws_dynamodb.Table(this, "NMetricStateTable", {
+      partitionKey: { name: "CacheKey", type: cdk.aws_dynamodb.AttributeType.STRING },
+      billingMode: cdk.aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: "ExpiresAt",
+      pointInTimeRecoverySpecification: { pointInTimeRecoveryEnabled: true },
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    for (const fn of [lambdaFunctions.nepenthesLogPullerFunction, lambdaFunctions.nepenthesOnlinePlugStatusFunction]) {
+      metricStateTable.grantReadWriteData(fn);
+      fn.addEnvironment("METRIC_STATE_TABLE", metricStateTable.tableName);
+    }
+
+    // SwitchBot API calls per UTC day, counted across containers and functions against the account's daily quota
+    const switchBotUsageTable = new cdk.aws_dynamodb.Table(this, "NSwitchBotUsageTable", {
+      partitionKey: { name: "CacheKey", type: cdk.aws_dynamodb.AttributeType.STRING },
+      billingMode: cdk.aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: "ExpiresAt",
+      pointInTimeRecoverySpecification: { pointInTimeRecoveryEnabled: true },
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    for (const fn of [lambdaFunctions.nepenthesOnlinePlugStatusFunction, lambdaFunctions.nepenthesPiPlugOnFunction]) {
+      switchBotUsageTable.grantReadWriteData(fn);
+      fn.addEnvironment("SWITCHBOT_USAGE_TABLE", switchBotUsageTable.tableName);
+    }
+
+    // Hourly and daily rollups per device and metric for long-range queries; kept when the stack is deleted
+    const rollupTable = new cdk.aws_dynamodb.Table(this, "NTelemetryRollupTable", {
+      partitionKey: { name: "Series", type: cdk.aws_dynamodb.AttributeType.STRING },
+      sortKey: { name: "Start", type: cdk.aws_dynamodb.AttributeType.NUMBER },
+      billingMode: cdk.aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+      pointInTimeRecoverySpecification: { pointInTimeRecoveryEnabled: true },
+      removalPolicy: cdk.RemovalPolicy.RETAIN,
+    });
+    rollupTable.grantReadWriteData(lambdaFunctions.nepenthesLogPullerFunction);
+    lambdaFunctions.nepenthesLogPullerFunction.addEnvironment("ROLLUP_TABLE", rollupTable.tableName);
+
+    // Each log puller invocation writes one archive object per device and day, so only batched
+    // (sqs) ingestion archives; direct ingestion would write several objects per message
+    if (TELEMETRY_ARCHIVE_ENABLED && logIngestion === 'sqs') {
+      // Long-term telemetry archive; kept when the stack is deleted
+      const telemetryArchiveBucket = new cdk.aws_s3.Bucket(this, "NTelemetryArchiveBucket", {
+        blockPublicAccess: cdk.aws_s3.BlockPublicAccess.BLOCK_ALL,
+        encryption: cdk.aws_s3.BucketEncryption.S3_MANAGED,
+        enforceSSL: true,
+        removalPolicy: cdk.RemovalPolicy.RETAIN,
+      });
+      telemetryArchiveBucket.grantPut(lambdaFunctions.nepenthesLogPullerFunction);
+      lambdaFunctions.nepenthesLogPullerFunction.addEnvironment(
+          "TELEMETRY_ARCHIVE", `s3://${telemetryArchiveBucket.bucketName}/${TELEMETRY_ARCHIVE_PREFIX}`);
+      NagSuppressions.addResourceSuppressions(telemetryArchiveBucket, [{
+        id: 'AwsSolutions-S1',
+        reason: 'Only the log puller writes to the archive; server access logs would cost more than the objects',
+      }]);
+    }
+
     // Setup Schedule to run Online Plug Status Lambda Function per cron schedule
     const onlineMetricSchedule = new cdk.aws_events.Rule(this, "NOnlineMetricRule", {schedule: cdk.aws_events.Schedule.cron({minute: "*/5"})});
     onlineMetricSchedule.addTarget(new cdk.aws_events_targets.LambdaFunction(lambdaFunctions.nepenthesOnlinePlugStatusFunction));
@@ -66,19 +177,43 @@ export class NepenthesCDKStack extends cdk.Stack {
     // Setup SNS to alarm
     const nepenthesAlams = new NepenthesAlarms(this);
     const alarmSNSTopic = new cdk.aws_sns.Topic(this, "NAlarmTopic", { enforceSSL: true });
-    alarmSNSTopic.addSubscription(new cdk.aws_sns_subscriptions.LambdaSubscription(lambdaFunctions.nepenthesPushoverFunction));
+    alarmSNSTopic.addSubscription(new cdk.aws_sns_subscriptions.LambdaSubscription(lambdaFunctions.nepenthesNotificationDispatcherFunction));
     nepenthesAlams.alarms.forEach((alarm) => alarm.addAlarmAction(new cdk.aws_cloudwatch_actions.SnsAction(alarmSNSTopic)));
 
+    // Coalesce alarm storms into Pushover digests; window (and flap) state is shared through DynamoDB
+    const notificationStateTable = new cdk.aws_dynamodb.Table(this, "NNotificationStateTable", {
+      partitionKey: { name: "CacheKey", type: cdk.aws_dynamodb.AttributeType.STRING },
+      billingMode: cdk.aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+      timeToLiveAttribute: "ExpiresAt",
+      pointInTimeRecoverySpecification: { pointInTimeRecoveryEnabled: true },
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+    });
+    const dispatcher = lambdaFunctions.nepenthesNotificationDispatcherFunction;
+    notificationStateTable.grantReadWriteData(dispatcher);
+    dispatcher.addEnvironment("COALESCE_TABLE", notificationStateTable.tableName);
+    dispatcher.addEnvironment("COALESCE_WINDOW_SECONDS", String(PUSHOVER_COALESCE_WINDOW_SECONDS));
+    // Emergency receipts are polled by the flush below to measure acknowledgement
+    dispatcher.addEnvironment("PUSHOVER_RECEIPT_TABLE", notificationStateTable.tableName);
+    // Suppress notifications for flapping alarms; suppression counts are published as EMF metrics
+    dispatcher.addEnvironment("FLAP_TABLE", notificationStateTable.tableName);
+    dispatcher.addEnvironment("FLAP_WINDOW_SECONDS", String(NOTIFICATION_FLAP_WINDOW_SECONDS));
+    dispatcher.addEnvironment("METRIC_NAMESPACE", METRIC_NAMESPACE);
+    dispatcher.addEnvironment("METRIC_BACKEND", "emf");
+    // Send the digest of a window that has passed even if no further alarm arrives, and poll receipts
+    const pushoverFlushSchedule = new cdk.aws_events.Rule(this, "NPushoverFlushRule", {schedule: cdk.aws_events.Schedule.rate(cdk.Duration.minutes(1))});
+    pushoverFlushSchedule.addTarget(new cdk.aws_events_targets.LambdaFunction(dispatcher, {
+      event: cdk.aws_events.RuleTargetInput.fromObject({ flush: true }),
+    }));
+
     // Format alarm notifications for email delivery
     const formattedAlarmSNSTopic = new cdk.aws_sns.Topic(this, "NFormattedAlarmTopic", { enforceSSL: true });
     formattedAlarmSNSTopic.addSubscription(new cdk.aws_sns_subscriptions.EmailSubscription(EMAIL_ADDRESS));
-    formattedAlarmSNSTopic.grantPublish(lambdaFunctions.nepenthesAlarmEmailFormatterFunction);
-    lambdaFunctions.nepenthesAlarmEmailFormatterFunction.addEnvironment("FORMATTED_TOPIC_ARN", formattedAlarmSNSTopic.topicArn);
-    alarmSNSTopic.addSubscription(new cdk.aws_sns_subscriptions.LambdaSubscription(lambdaFunctions.nepenthesAlarmEmailFormatterFunction));
+    formattedAlarmSNSTopic.grantPublish(dispatcher);
+    dispatcher.addEnvironment("FORMATTED_TOPIC_ARN", formattedAlarmSNSTopic.topicArn);
 
-    // Send recovery (OK) notifications via email only (not Pushover)
+    // Recovery (OK) notifications go through the same dispatcher; its routing rules send them via email only (not Pushover)
     const okActionSNSTopic = new cdk.aws_sns.Topic(this, "NOkActionTopic", { enforceSSL: true });
-    okActionSNSTopic.addSubscription(new cdk.aws_sns_subscriptions.LambdaSubscription(lambdaFunctions.nepenthesAlarmEmailFormatterFunction));
+    okActionSNSTopic.addSubscription(new cdk.aws_sns_subscriptions.LambdaSubscription(dispatcher));
     nepenthesAlams.alarms.forEach((alarm) => alarm.addOkAction(new cdk.aws_cloudwatch_actions.SnsAction(okActionSNSTopic)));
 
     // Setup trigger lambda when N.Pi is offline for 5 minutes
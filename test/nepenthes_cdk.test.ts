@@ -1,6 +1,7 @@
 import * as cdk from 'aws-cdk-lib';
-import { Template } from 'aws-cdk-lib/assertions';
+import { Match, Template } from 'aws-cdk-lib/assertions';
 import { NepenthesCDKStack } from '../lib/nepenthes_cdk-stack';
+import { METRIC_DEADBAND_HEARTBEAT_SECONDS } from '../lib/constants';
 
 let template: Template;
 
@@ -24,8 +25,8 @@ describe('Constants', () => {
 });
 
 describe('Lambda Functions', () => {
-    test('creates 5 Lambda functions with Python 3.14 runtime', () => {
-        template.resourceCountIs('AWS::Lambda::Function', 5);
+    test('creates 4 Lambda functions with Python 3.14 runtime', () => {
+        template.resourceCountIs('AWS::Lambda::Function', 4);
 
         template.hasResourceProperties('AWS::Lambda::Function', {
             Runtime: 'python3.14',
@@ -39,14 +40,38 @@ describe('Lambda Functions', () => {
         });
     });
 
-    test('pushover function has correct handler and env vars', () => {
+    test('log puller function publishes metrics via EMF', () => {
         template.hasResourceProperties('AWS::Lambda::Function', {
-            Handler: 'nepenthes_pushover.lambda_handler',
+            Handler: 'nepenthes_log_puller.lambda_handler',
             Environment: {
                 Variables: {
+                    METRIC_NAMESPACE: 'NHomeZero',
+                    METRIC_BACKEND: 'emf',
+                },
+            },
+        });
+    });
+
+    test('log puller aggregates readings per minute', () => {
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: 'nepenthes_log_puller.lambda_handler',
+            Environment: {
+                Variables: {
+                    METRIC_AGGREGATION_PERIOD: '60',
+                },
+            },
+        });
+    });
+
+    test('notification dispatcher function has correct handler and env vars', () => {
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: 'nepenthes_notification_dispatcher.lambda_handler',
+            Environment: {
+                Variables: Match.objectLike({
                     PUSHOVER_API_KEY: 'test-pushover-key',
                     PAGEE_USER_KEY: 'test-pagee-key',
-                },
+                    FORMATTED_TOPIC_ARN: Match.anyValue(),
+                }),
             },
         });
     });
@@ -64,12 +89,6 @@ describe('Lambda Functions', () => {
         });
     });
 
-    test('alarm email formatter function has correct handler', () => {
-        template.hasResourceProperties('AWS::Lambda::Function', {
-            Handler: 'nepenthes_alarm_email_formatter.lambda_handler',
-        });
-    });
-
     test('all functions use ARM64 architecture', () => {
         const functions = template.findResources('AWS::Lambda::Function');
         for (const [, resource] of Object.entries(functions)) {
@@ -88,8 +107,8 @@ describe('Lambda Functions', () => {
 });
 
 describe('Log Groups', () => {
-    test('creates 5 log groups with 60-day retention', () => {
-        template.resourceCountIs('AWS::Logs::LogGroup', 5);
+    test('creates 4 log groups with 60-day retention', () => {
+        template.resourceCountIs('AWS::Logs::LogGroup', 4);
 
         template.hasResourceProperties('AWS::Logs::LogGroup', {
             RetentionInDays: 60,
@@ -103,12 +122,34 @@ describe('IoT Rule', () => {
 
         template.hasResourceProperties('AWS::IoT::TopicRule', {
             TopicRulePayload: {
-                Sql: "SELECT * FROM 'log/nepenthes/nhome'",
+                Sql: "SELECT *, topic(3) AS home FROM 'log/nepenthes/+'",
                 AwsIotSqlVersion: '2016-03-23',
                 RuleDisabled: false,
             },
         });
     });
+
+    test('direct ingestion does not create an SQS queue', () => {
+        template.resourceCountIs('AWS::SQS::Queue', 0);
+    });
+
+    test('sqs ingestion buffers telemetry for batched log puller invocations', () => {
+        const app = new cdk.App();
+        const sqsTemplate = Template.fromStack(new NepenthesCDKStack(app, 'SqsStack', { logIngestion: 'sqs' }));
+
+        sqsTemplate.resourceCountIs('AWS::SQS::Queue', 2);
+        sqsTemplate.hasResourceProperties('AWS::IoT::TopicRule', {
+            TopicRulePayload: {
+                Sql: "SELECT *, topic(3) AS home FROM 'log/nepenthes/+'",
+                Actions: [{ Sqs: Match.objectLike({ QueueUrl: Match.anyValue() }) }],
+            },
+        });
+        sqsTemplate.hasResourceProperties('AWS::Lambda::EventSourceMapping', {
+            BatchSize: 10,
+            MaximumBatchingWindowInSeconds: 60,
+            FunctionResponseTypes: ['ReportBatchItemFailures'],
+        });
+    });
 });
 
 describe('EventBridge', () => {
@@ -117,6 +158,210 @@ describe('EventBridge', () => {
             ScheduleExpression: 'cron(*/5 * * * ? *)',
         });
     });
+
+    test('flushes Pushover digests every minute', () => {
+        template.hasResourceProperties('AWS::Events::Rule', {
+            ScheduleExpression: 'rate(1 minute)',
+            Targets: [Match.objectLike({ Input: JSON.stringify({ flush: true }) })],
+        });
+    });
+});
+
+describe('Notification flap suppression', () => {
+    test('dispatcher suppresses flapping alarms and publishes counts as EMF', () => {
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: 'nepenthes_notification_dispatcher.lambda_handler',
+            Environment: {
+                Variables: Match.objectLike({
+                    FLAP_TABLE: Match.anyValue(),
+                    FLAP_WINDOW_SECONDS: '900',
+                    METRIC_NAMESPACE: 'NHomeZero',
+                    METRIC_BACKEND: 'emf',
+                }),
+            },
+        });
+    });
+});
+
+describe('Metric deadband', () => {
+    test.each([
+        'nepenthes_log_puller.lambda_handler',
+        'nepenthes_online_plug_status.lambda_handler',
+    ])('%s skips unchanged slowly varying metrics with state in DynamoDB', (handler) => {
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: handler,
+            Environment: {
+                Variables: Match.objectLike({
+                    METRIC_DEADBAND: JSON.stringify({ Switch: 300, Valid: 900 }),
+                    METRIC_STATE_TABLE: Match.anyValue(),
+                }),
+            },
+        });
+    });
+
+    test('alarms on deadbanded metrics use Minimum/Maximum over whole heartbeat periods', () => {
+        const alarms = template.findResources('AWS::CloudWatch::Alarm');
+        for (const [, resource] of Object.entries(alarms)) {
+            const props = resource.Properties as Record<string, unknown>;
+            const heartbeat = METRIC_DEADBAND_HEARTBEAT_SECONDS[props.MetricName as string];
+            if (heartbeat === undefined) {
+                continue;
+            }
+            expect(['Minimum', 'Maximum']).toContain(props.Statistic);
+            expect((props.Period as number) % heartbeat).toBe(0);
+        }
+    });
+
+    test('dashboard widgets on deadbanded metrics use Minimum/Maximum over whole heartbeat periods', () => {
+        const [dashboard] = Object.values(template.findResources('AWS::CloudWatch::Dashboard'));
+        const body = (dashboard.Properties as Record<string, any>).DashboardBody;
+        // Tokens such as the region only appear inside JSON strings, so a placeholder keeps the body parseable
+        const json = typeof body === 'string' ? body
+            : body['Fn::Join'][1].map((part: unknown) => typeof part === 'string' ? part : 'token').join('');
+        let checked = 0;
+        for (const widget of JSON.parse(json).widgets) {
+            for (const metric of widget.properties?.metrics ?? []) {
+                const heartbeat = METRIC_DEADBAND_HEARTBEAT_SECONDS[metric[1]];
+                if (heartbeat === undefined) {
+                    continue;
+                }
+                // CDK leaves out the defaults: a 300-second period and the Average statistic
+                const last = metric[metric.length - 1];
+                const options = typeof last === 'object' ? last : {};
+                expect(['Minimum', 'Maximum']).toContain(options.stat ?? 'Average');
+                expect((options.period ?? 300) % heartbeat).toBe(0);
+                checked++;
+            }
+        }
+        expect(checked).toBeGreaterThan(0);
+    });
+});
+
+describe('SwitchBot request budget', () => {
+    test.each([
+        'nepenthes_online_plug_status.lambda_handler',
+        'nepenthes_pi_plug_on.lambda_handler',
+    ])('%s counts SwitchBot API calls in the shared usage table', (handler) => {
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: handler,
+            Environment: {
+                Variables: Match.objectLike({
+                    SWITCHBOT_DAILY_QUOTA: '10000',
+                    SWITCHBOT_USAGE_TABLE: { Ref: Match.stringLikeRegexp('^NSwitchBotUsageTable') },
+                }),
+            },
+        });
+    });
+
+    test('both SwitchBot functions can update the usage counter', () => {
+        for (const role of ['NOnlinePlugStatusRole', 'NPiPlugOnRole']) {
+            template.hasResourceProperties('AWS::IAM::Policy', {
+                Roles: [{ Ref: Match.stringLikeRegexp(`^${role}`) }],
+                PolicyDocument: {
+                    Statement: Match.arrayWith([Match.objectLike({
+                        Action: Match.arrayWith(['dynamodb:UpdateItem']),
+                        Resource: Match.arrayWith([{ 'Fn::GetAtt': [Match.stringLikeRegexp('^NSwitchBotUsageTable'), 'Arn'] }]),
+                    })]),
+                },
+            });
+        }
+    });
+});
+
+describe('High-resolution metrics', () => {
+    test.each([
+        'nepenthes_log_puller.lambda_handler',
+        'nepenthes_online_plug_status.lambda_handler',
+    ])('%s publishes CoolerFrozen and Power at 1-second resolution', (handler) => {
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: handler,
+            Environment: {
+                Variables: Match.objectLike({
+                    HIGH_RESOLUTION_METRICS: 'CoolerFrozen,Power',
+                }),
+            },
+        });
+    });
+});
+
+describe('Telemetry archive', () => {
+    test('creates a private retained bucket and points the log puller at it with sqs ingestion', () => {
+        const app = new cdk.App();
+        const sqsTemplate = Template.fromStack(new NepenthesCDKStack(app, 'SqsArchiveStack', { logIngestion: 'sqs' }));
+        sqsTemplate.hasResource('AWS::S3::Bucket', {
+            Properties: {
+                BucketEncryption: Match.anyValue(),
+                PublicAccessBlockConfiguration: {
+                    BlockPublicAcls: true,
+                    BlockPublicPolicy: true,
+                    IgnorePublicAcls: true,
+                    RestrictPublicBuckets: true,
+                },
+            },
+            DeletionPolicy: 'Retain',
+        });
+        sqsTemplate.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: 'nepenthes_log_puller.lambda_handler',
+            Environment: {
+                Variables: Match.objectLike({
+                    TELEMETRY_ARCHIVE: Match.objectLike({ 'Fn::Join': Match.anyValue() }),
+                }),
+            },
+        });
+    });
+
+    test('is not created with direct ingestion, which would write objects per message', () => {
+        const app = new cdk.App();
+        const directTemplate = Template.fromStack(new NepenthesCDKStack(app, 'DirectArchiveStack', { logIngestion: 'direct' }));
+        directTemplate.resourceCountIs('AWS::S3::Bucket', 0);
+        const [logPuller] = Object.values(directTemplate.findResources('AWS::Lambda::Function', {
+            Properties: { Handler: 'nepenthes_log_puller.lambda_handler' },
+        }));
+        expect(logPuller.Properties.Environment.Variables.TELEMETRY_ARCHIVE).toBeUndefined();
+    });
+});
+
+describe('Telemetry rollups', () => {
+    test('creates a retained table keyed by series and start and points the log puller at it', () => {
+        template.hasResource('AWS::DynamoDB::Table', {
+            Properties: {
+                KeySchema: [
+                    { AttributeName: 'Series', KeyType: 'HASH' },
+                    { AttributeName: 'Start', KeyType: 'RANGE' },
+                ],
+                BillingMode: 'PAY_PER_REQUEST',
+            },
+            DeletionPolicy: 'Retain',
+        });
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: 'nepenthes_log_puller.lambda_handler',
+            Environment: {
+                Variables: Match.objectLike({
+                    ROLLUP_TABLE: Match.anyValue(),
+                }),
+            },
+        });
+    });
+});
+
+describe('Notification coalescing', () => {
+    test('creates state table with TTL and points the dispatcher at it', () => {
+        template.hasResourceProperties('AWS::DynamoDB::Table', {
+            KeySchema: [{ AttributeName: 'CacheKey', KeyType: 'HASH' }],
+            BillingMode: 'PAY_PER_REQUEST',
+            TimeToLiveSpecification: { AttributeName: 'ExpiresAt', Enabled: true },
+        });
+        template.hasResourceProperties('AWS::Lambda::Function', {
+            Handler: 'nepenthes_notification_dispatcher.lambda_handler',
+            Environment: {
+                Variables: Match.objectLike({
+                    COALESCE_TABLE: Match.anyValue(),
+                    COALESCE_WINDOW_SECONDS: '300',
+                    PUSHOVER_RECEIPT_TABLE: Match.anyValue(),
+                }),
+            },
+        });
+    });
 });
 
 describe('SNS Topics', () => {
@@ -136,6 +381,14 @@ describe('SNS Topics', () => {
             Protocol: 'lambda',
         });
     });
+
+    test('alarm and OK topics both invoke only the notification dispatcher', () => {
+        // alarm + OK topics -> dispatcher, low-sev topic -> pi plug on
+        const subscriptions = template.findResources('AWS::SNS::Subscription', {
+            Properties: { Protocol: 'lambda' },
+        });
+        expect(Object.keys(subscriptions).length).toBe(3);
+    });
 });
 
 describe('CloudWatch Alarms', () => {
@@ -143,12 +396,22 @@ describe('CloudWatch Alarms', () => {
         template.hasResourceProperties('AWS::CloudWatch::Alarm', {
             Namespace: 'NHomeZero',
             MetricName: 'Heartbeat',
+            Dimensions: [{ Name: 'Home', Value: 'nhome' }],
             TreatMissingData: 'breaching',
             Period: 900,
             Statistic: 'Maximum',
         });
     });
 
+    test('all alarms are dimensioned by home', () => {
+        const alarms = template.findResources('AWS::CloudWatch::Alarm');
+        for (const [, resource] of Object.entries(alarms)) {
+            const props = resource.Properties as Record<string, unknown>;
+            const dims = props.Dimensions as { Name: string, Value: string }[];
+            expect(dims).toContainEqual({ Name: 'Home', Value: 'nhome' });
+        }
+    });
+
     test('creates temperature alarms for both meters', () => {
         const allAlarms = template.findResources('AWS::CloudWatch::Alarm');
         const tempAlarms = Object.entries(allAlarms).filter(([key]) =>
@@ -231,6 +494,33 @@ describe('CloudWatch Alarms', () => {
         }
     });
 
+    test('all alarm periods are whole multiples of the log puller aggregation period', () => {
+        const alarms = template.findResources('AWS::CloudWatch::Alarm');
+        for (const [, resource] of Object.entries(alarms)) {
+            const props = resource.Properties as Record<string, unknown>;
+            if (['CoolerFrozen', 'Power'].includes(props.MetricName as string)) {
+                continue;
+            }
+            expect((props.Period as number) % 60).toBe(0);
+        }
+    });
+
+    test('cooler and fan fault alarms evaluate high-resolution periods', () => {
+        template.hasResourceProperties('AWS::CloudWatch::Alarm', {
+            MetricName: 'CoolerFrozen',
+            Period: 30,
+            EvaluationPeriods: 1,
+            TreatMissingData: 'ignore',
+        });
+        template.hasResourceProperties('AWS::CloudWatch::Alarm', {
+            MetricName: 'Power',
+            Period: 30,
+            EvaluationPeriods: 6,
+            DatapointsToAlarm: 3,
+            TreatMissingData: 'notBreaching',
+        });
+    });
+
     test('high-severity alarms have OK actions for email recovery notifications', () => {
         const alarms = template.findResources('AWS::CloudWatch::Alarm');
         // All alarms in the main alarms list should have OKActions